@@ -152,6 +152,8 @@ else:
     from anuga.shallow_water.boundaries import Field_boundary
     from anuga.shallow_water.boundaries import \
                         Time_stage_zero_momentum_boundary
+    from anuga.shallow_water.boundaries import \
+                        Tabulated_time_stage_zero_momentum_boundary
     from anuga.shallow_water.boundaries import \
                         Transmissive_stage_zero_momentum_boundary
     from anuga.shallow_water.boundaries import \
@@ -171,6 +173,8 @@ else:
                                 import Dirichlet_boundary
     from anuga.abstract_2d_finite_volumes.generic_boundary_conditions \
                                 import Time_boundary
+    from anuga.abstract_2d_finite_volumes.generic_boundary_conditions \
+                                import Tabulated_time_boundary
     from anuga.abstract_2d_finite_volumes.generic_boundary_conditions \
                                 import Time_space_boundary
     from anuga.abstract_2d_finite_volumes.generic_boundary_conditions \
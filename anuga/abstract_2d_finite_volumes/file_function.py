@@ -31,7 +31,8 @@ def file_function(filename,
                   verbose=False,
                   use_cache=False,
                   boundary_polygon=None,
-                  output_centroids=False):
+                  output_centroids=False,
+                  time_window=None):
     """Read time history of spatial data from NetCDF file and return
     a callable object.
 
@@ -71,11 +72,18 @@ def file_function(filename,
 
     verbose - 
 
-    use_cache: True means that caching of intermediate result of
-               Interpolation_function is attempted
+    use_cache: True means that the interpolation matrix of the
+               interpolation points is taken from (or stored in) the
+               operator cache on disk (see anuga.fit_interpolate.operator_cache)
 
     boundary_polygon - 
 
+    time_window: Number of timesteps of spatial data kept in memory. If
+                 None, all the timesteps are read and interpolated to the
+                 interpolation points up front. Otherwise the timesteps are
+                 read from the file as the model time moves (see
+                 Interpolation_function).
+
     
     See Interpolation function in anuga.fit_interpolate.interpolation for
     further documentation
@@ -117,28 +125,15 @@ def file_function(filename,
               'time_limit': time_limit,                                 
               'verbose': verbose,
               'boundary_polygon': boundary_polygon,
-              'output_centroids': output_centroids}
+              'output_centroids': output_centroids,
+              'use_cache': use_cache,
+              'time_window': time_window}
 
-    # Call underlying engine with or without caching
-    if use_cache is True:
-        try:
-            from anuga.caching import cache
-        except:
-            msg = 'Caching was requested, but caching module'+\
-                  'could not be imported'
-            raise Exception(msg)
-
-        f, starttime = cache(_file_function,
-                             args, kwargs,
-                             dependencies=[filename],
-                             compression=False,                  
-                             verbose=verbose)
-    else:
-        f, starttime = apply(_file_function,
-                             args, kwargs)
-
-    #FIXME (Ole): Pass cache arguments, such as compression, in some sort of
-    #structure
+    # Call underlying engine. With use_cache, the interpolation matrix is
+    # cached rather than the whole Interpolation_function (whose long
+    # parameters are slow to hash and pickle)
+    f, starttime = apply(_file_function,
+                         args, kwargs)
 
     f.starttime = starttime
     f.filename = filename
@@ -169,7 +164,9 @@ def _file_function(filename,
                    time_limit=None,
                    verbose=False,
                    boundary_polygon=None,
-                   output_centroids=False):
+                   output_centroids=False,
+                   use_cache=False,
+                   time_window=None):
     """Internal function
     
     See file_function for documentatiton
@@ -203,7 +200,9 @@ def _file_function(filename,
                                         time_limit=time_limit,
                                         verbose=verbose,
                                         boundary_polygon=boundary_polygon,
-                                        output_centroids=output_centroids)
+                                        output_centroids=output_centroids,
+                                        use_cache=use_cache,
+                                        time_window=time_window)
     elif ext in [".csv"]:
         # FIXME (Ole): Could add csv file here to address Ted Rigby's
         # suggestion about reading hydrographs.
@@ -222,7 +221,9 @@ def get_netcdf_file_function(filename,
                              time_limit=None,            
                              verbose=False,
                              boundary_polygon=None,
-                             output_centroids=False):
+                             output_centroids=False,
+                             use_cache=False,
+                             time_window=None):
     """Read time history of spatial data from NetCDF sww file and
     return a callable object f(t,x,y)
     which will return interpolated values based on the input file.
@@ -443,14 +444,24 @@ def get_netcdf_file_function(filename,
         log.critical('    Start time:   %f' % starttime)
         
     
+    if not spatial or interpolation_points is None:
+        time_window = None
+
     # Produce values for desired data points at
     # each timestep for each quantity
     quantities = {}
-    for i, name in enumerate(quantity_names):
-        quantities[name] = fid.variables[name][:]
-        if boundary_polygon is not None:
-            #removes sts points that do not lie on boundary
-            quantities[name] = num.take(quantities[name], gauge_id, axis=1)
+    time_slices = None
+    if time_window is not None:
+        # Read the timesteps as they are needed
+        if boundary_polygon is None:
+            gauge_id = None
+        time_slices = Netcdf_time_slices(filename, gauge_id)
+    else:
+        for i, name in enumerate(quantity_names):
+            quantities[name] = fid.variables[name][:]
+            if boundary_polygon is not None:
+                #removes sts points that do not lie on boundary
+                quantities[name] = num.take(quantities[name], gauge_id, axis=1)
             
     # Close sww, tms or sts netcdf file         
     fid.close()
@@ -477,8 +488,43 @@ def get_netcdf_file_function(filename,
                                    time_thinning=time_thinning,
                                    verbose=verbose,
                                    gauge_neighbour_id=gauge_neighbour_id,
-                                   output_centroids=output_centroids),
+                                   output_centroids=output_centroids,
+                                   use_cache=use_cache,
+                                   time_window=time_window,
+                                   time_slices=time_slices),
             starttime)
 
     # NOTE (Ole): Caching Interpolation function is too slow as
     # the very long parameters need to be hashed.
+
+
+class Netcdf_time_slices:
+    """Timesteps of the quantities in a NetCDF sww, sts or tms file, read
+    as they are needed by an Interpolation_function with a time window.
+
+    The file is opened for each read, so that the object can be used from
+    a thread and pickled.
+    """
+
+    def __init__(self, filename, gauge_id=None):
+        """gauge_id: indices of the points of the file to keep (as with
+        a boundary polygon for sts files), None for all points
+        """
+
+        self.filename = filename
+        self.gauge_id = gauge_id
+
+    def __call__(self, name, start, stop, step):
+        """Values of quantity name at timesteps start:stop:step
+        """
+
+        fid = NetCDFFile(self.filename, netcdf_mode_r)
+        try:
+            Q = num.array(fid.variables[name][start:stop:step], num.float)
+        finally:
+            fid.close()
+
+        if self.gauge_id is not None:
+            Q = num.take(Q, self.gauge_id, axis=1)
+
+        return Q
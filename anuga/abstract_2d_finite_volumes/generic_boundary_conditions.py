@@ -87,6 +87,16 @@ class Boundary:
                 Q.boundary_values[i] = q_evol[j]
 
 
+    def get_kernel_values(self, domain, segment_edges):
+        """Values of the boundary used by the C boundary kernel of its
+        class (see the get_boundary_kernel_codes method of the domain),
+        e.g. the values at the current time, or None to evaluate the
+        boundary with evaluate_segment instead.
+        """
+
+        return None
+
+
     def get_time(self):
 
         return self.domain.get_time()
@@ -260,6 +270,12 @@ class Dirichlet_boundary(Boundary):
             Q = domain.quantities[name]
             Q.boundary_values[ids] = q_bdry[j]
 
+
+    def get_kernel_values(self, domain, segment_edges):
+
+        return self.dirichlet_values
+
+
 class Compute_fluxes_boundary(Boundary):
     """ Associate the Compute_fluxes_boundary BC
     to each boundary segment where a special calculation
@@ -361,7 +377,13 @@ class Time_boundary(Boundary):
 
     def evaluate(self, vol_id=None, edge_id=None):
 
-        return self.get_boundary_values()
+        q_bdry = self.get_boundary_values()
+
+        if isinstance(q_bdry, Boundary):
+            # Default boundary
+            return q_bdry.evaluate(vol_id, edge_id)
+
+        return q_bdry
 
 
     def evaluate_segment(self, domain, segment_edges):
@@ -371,13 +393,17 @@ class Time_boundary(Boundary):
         if domain is None:
             return
 
+        q_bdry = self.get_boundary_values()
+
+        if isinstance(q_bdry, Boundary):
+            # Default boundary
+            return q_bdry.evaluate_segment(domain, segment_edges)
+
         ids = segment_edges
 
         vol_ids  = domain.boundary_cells[ids]
         edge_ids = domain.boundary_edges[ids]
 
-        q_bdry = self.get_boundary_values()
-
         conserved_quantities = True
         if len(q_bdry) == len(domain.evolved_quantities):
             # enough dirichlet values to set evolved quantities
@@ -406,9 +432,150 @@ class Time_boundary(Boundary):
         for j, name in enumerate(quantities):
             Q = domain.quantities[name]
             Q.boundary_values[ids] = q_bdry[j]
-            
 
 
+    def get_kernel_values(self, domain, segment_edges):
+
+        q_bdry = self.get_boundary_values()
+
+        if isinstance(q_bdry, Boundary):
+            # Default boundary
+            return None
+
+        return q_bdry
+
+
+
+
+
+
+class Tabulated_time_boundary(Time_boundary):
+    """Time dependent boundary with the values of the conserved quantities
+    tabulated at a sequence of times and linearly interpolated in between.
+
+    The table is either given as values (one row of conserved quantities
+    for each time) or sampled from a function of t at the given times
+    when the boundary is created (if function has a time attribute, as
+    file_function, times defaults to it). Unlike Time_boundary the function
+    is not called during the evolve, and the shallow water domain
+    evaluates the table in C.
+
+    Example:
+      B = Tabulated_time_boundary(domain,
+                                  times=[0, 60, 3660, 3720],
+                                  values=[[0, 0, 0], [2, 0, 0],
+                                          [2, 0, 0], [0, 0, 0]])
+
+      This will produce a boundary condition with a 2m high wave
+      rising over the first minute and lasting one hour.
+
+      B = Tabulated_time_boundary(domain, function=f,
+                                  times=num.arange(0, 3600, 10))
+
+      This will sample f every 10 seconds of the first hour.
+
+    After the last time the default_boundary (if any) is used, as
+    for Time_boundary.
+    """
+
+    def __init__(self, domain=None,
+                 times=None,
+                 values=None,
+                 function=None,
+                 default_boundary=None,
+                 verbose=False):
+        Boundary.__init__(self)
+
+        self.default_boundary = default_boundary
+        self.default_boundary_invoked = False    # Flag
+        self.domain = domain
+        self.verbose = verbose
+
+        if domain is None:
+            raise Exception('You must specify a domain to Tabulated_time_boundary')
+
+        if times is None and hasattr(function, 'time'):
+            times = function.time
+
+        if times is None:
+            raise Exception('You must specify times to Tabulated_time_boundary')
+
+        times = num.array(times, num.float)
+
+        msg = 'ERROR: Times of a tabulated time boundary must be a 1d list or array'
+        assert len(times.shape) == 1 and len(times) > 0, msg
+
+        msg = 'ERROR: Times of a tabulated time boundary must be increasing'
+        assert num.all(times[1:] > times[:-1]), msg
+
+        if values is None:
+            if function is None:
+                msg = 'You must specify values or a function to '
+                msg += 'Tabulated_time_boundary'
+                raise Exception(msg)
+
+            try:
+                values = [function(t) for t in times]
+            except Exception, e:
+                msg = 'Function for tabulated time boundary could not be '
+                msg += 'executed:\n%s' %e
+                raise Exception(msg)
+
+        try:
+            values = num.array(values, num.float)
+        except:
+            msg = 'Values of tabulated time boundary could '
+            msg += 'not be converted into a numeric array of floats.\n'
+            msg += 'I got %s' %str(values)
+            raise Exception(msg)
+
+        d = len(domain.conserved_quantities)
+        msg = 'Values must be an array of %d values for each of the %d times' \
+              %(d, len(times))
+        assert values.shape == (len(times), d), msg
+
+        self.times = times
+        self.values = values
+
+        # Index i of the last interval times[i] <= t <= times[i+1], updated
+        # in place (also by the C kernel)
+        self.index = num.zeros(1, num.int)
+
+
+    def __repr__(self):
+        return 'Tabulated time boundary'
+
+
+    def function(self, t):
+        """Values at time t, linearly interpolated in the table
+        """
+
+        times = self.times
+
+        if t < times[0]:
+            msg = 'Time requested (%s) is before the first time %s of the '\
+                  'tabulated time boundary' %(t, times[0])
+            raise Modeltime_too_early(msg)
+
+        if t > times[-1]:
+            msg = 'Time requested (%s) is after the last time %s of the '\
+                  'tabulated time boundary' %(t, times[-1])
+            raise Modeltime_too_late(msg)
+
+        if len(times) == 1:
+            return self.values[0].copy()
+
+        # Move from the last interval, as t usually changes a little
+        i = self.index[0]
+        while i < len(times) - 2 and t > times[i+1]:
+            i += 1
+        while i > 0 and t < times[i]:
+            i -= 1
+        self.index[0] = i
+
+        ratio = (t - times[i])/(times[i+1] - times[i])
+
+        return self.values[i] + ratio*(self.values[i+1] - self.values[i])
 
 
 
@@ -536,6 +703,10 @@ class File_boundary(Boundary):
     an instance of class descending from class Boundary.
     This will be used in case model time exceeds that available in the 
     underlying data.
+
+    Optional keyword argument time_window is the number of timesteps of
+    the file kept in memory. By default all of them are read when the
+    boundary is created (see file_function).
        
     """
 
@@ -548,7 +719,8 @@ class File_boundary(Boundary):
                  boundary_polygon=None,    
                  default_boundary=None,
                  use_cache=False, 
-                 verbose=False): 
+                 verbose=False,
+                 time_window=None): 
 
         import time
         from anuga.config import time_format
@@ -586,6 +758,9 @@ class File_boundary(Boundary):
             # Register index of this boundary edge for use with evaluate
             self.boundary_indices[(vol_id, edge_id)] = i
 
+        # Same indices in the order of domain.boundary_cells, see get_point_ids
+        self.point_ids = None
+
             
             
         if verbose: log.critical('Initialise file_function')
@@ -597,7 +772,8 @@ class File_boundary(Boundary):
                                time_limit=time_limit,
                                use_cache=use_cache, 
                                verbose=verbose,
-                               boundary_polygon=boundary_polygon)
+                               boundary_polygon=boundary_polygon,
+                               time_window=time_window)
                              
         # Check and store default_boundary
         msg = 'Keyword argument default_boundary must be either None '
@@ -686,27 +862,7 @@ class File_boundary(Boundary):
                         self.default_boundary_invoked = True
             
             if num.any(res == NAN):
-                x,y=self.midpoint_coordinates[i,:]
-                msg = 'NAN value found in file_boundary at '
-                msg += 'point id #%d: (%.2f, %.2f).\n' %(i, x, y)
-
-                if hasattr(self.F, 'indices_outside_mesh') and\
-                       len(self.F.indices_outside_mesh) > 0:
-                    # Check if NAN point is due it being outside
-                    # boundary defined in sww file.
-
-                    if i in self.F.indices_outside_mesh:
-                        msg += 'This point refers to one outside the '
-                        msg += 'mesh defined by the file %s.\n'\
-                               %self.F.filename
-                        msg += 'Make sure that the file covers '
-                        msg += 'the boundary segment it is assigned to '
-                        msg += 'in set_boundary.'
-                    else:
-                        msg += 'This point is inside the mesh defined '
-                        msg += 'the file %s.\n' %self.F.filename
-                        msg += 'Check this file for NANs.'
-                raise Exception(msg)
+                self._raise_nan_error(i)
             
             return res 
         else:
@@ -714,6 +870,105 @@ class File_boundary(Boundary):
             msg += 'vol_id=%s, edge_id=%s' %(str(vol_id), str(edge_id))
             raise Exception(msg)
 
+
+    def evaluate_segment(self, domain, segment_edges):
+        """Set the boundary values of the edges in segment_edges to the
+        values interpolated at domain.time from the file, at all the
+        midpoints of the segment at once.
+        """
+
+        if segment_edges is None:
+            return
+        if domain is None:
+            return
+
+        if len(domain.evolved_quantities) != len(domain.conserved_quantities):
+            # The evolved quantities are computed edge by edge
+            Boundary.evaluate_segment(self, domain, segment_edges)
+            return
+
+        ids = segment_edges
+        vol_ids  = domain.boundary_cells[ids]
+        edge_ids = domain.boundary_edges[ids]
+
+        point_ids = self.get_point_ids(domain)[ids]
+
+        t = self.domain.time
+
+        try:
+            q_bdry = self.F.get_values(t, point_ids)
+        except Modeltime_too_early, e:
+            raise Modeltime_too_early(e)
+        except Modeltime_too_late, e:
+            if self.default_boundary is None:
+                raise Exception(e) # Reraise exception
+
+            # Pass control to default boundary
+            self.default_boundary.evaluate_segment(domain, segment_edges)
+
+            if self.default_boundary_invoked is False:
+                # Issue warning the first time
+                if self.verbose:
+                    msg = '%s' %str(e)
+                    msg += 'Instead I will use the default boundary: %s\n'\
+                        %str(self.default_boundary)
+                    msg += 'Note: Further warnings will be supressed'
+                    log.critical(msg)
+
+                self.default_boundary_invoked = True
+            return
+
+        nan_rows = num.any(q_bdry == NAN, axis=1)
+        if num.any(nan_rows):
+            self._raise_nan_error(point_ids[num.argmax(nan_rows)])
+
+        for j, name in enumerate(domain.conserved_quantities):
+            Q = domain.quantities[name]
+            Q.boundary_values[ids] = q_bdry[:,j]
+
+
+    def get_point_ids(self, domain):
+        """Indices of the midpoints of the file function for the
+        boundary edges of domain, in the order of domain.boundary_cells
+        and domain.boundary_edges
+        """
+
+        if self.point_ids is None or \
+               len(self.point_ids) != len(domain.boundary_cells):
+            self.point_ids = num.array([self.boundary_indices[vol_id, edge_id]
+                                        for vol_id, edge_id in
+                                        zip(domain.boundary_cells,
+                                            domain.boundary_edges)], num.int)
+
+        return self.point_ids
+
+
+    def _raise_nan_error(self, i):
+        """Raise the exception for a NAN value at point id i
+        """
+
+        x,y=self.midpoint_coordinates[i,:]
+        msg = 'NAN value found in file_boundary at '
+        msg += 'point id #%d: (%.2f, %.2f).\n' %(i, x, y)
+
+        if hasattr(self.F, 'indices_outside_mesh') and\
+               len(self.F.indices_outside_mesh) > 0:
+            # Check if NAN point is due it being outside
+            # boundary defined in sww file.
+
+            if i in self.F.indices_outside_mesh:
+                msg += 'This point refers to one outside the '
+                msg += 'mesh defined by the file %s.\n'\
+                       %self.F.filename
+                msg += 'Make sure that the file covers '
+                msg += 'the boundary segment it is assigned to '
+                msg += 'in set_boundary.'
+            else:
+                msg += 'This point is inside the mesh defined '
+                msg += 'the file %s.\n' %self.F.filename
+                msg += 'Check this file for NANs.'
+        raise Exception(msg)
+
 class AWI_boundary(Boundary):
     """The AWI_boundary reads values for the conserved
     quantities (only STAGE) from an sww NetCDF file, and returns interpolated values
@@ -184,6 +184,8 @@ class Generic_Domain:
         # Create an empty list for fractional step operators
         self.fractional_step_operators = []
         self.fractional_step_volume_integral=0.
+        self.fractional_step_batches = None
+        self.fractional_step_batches_key = None
 
 
         # by default domain is not parallel
@@ -214,16 +216,10 @@ class Generic_Domain:
         # Setup Communication Buffers
         if verbose: log.critical('Domain: Set up communication buffers ')
         self.nsys = len(self.conserved_quantities)
-        for key in self.full_send_dict:
-            buffer_shape = self.full_send_dict[key][0].shape[0]
-            self.full_send_dict[key].append(num.zeros((buffer_shape, self.nsys),
-                                                      num.float))
-
-        for key in self.ghost_recv_dict:
-            buffer_shape = self.ghost_recv_dict[key][0].shape[0]
-            self.ghost_recv_dict[key].append( \
-                                            num.zeros((buffer_shape, self.nsys),
-                                             num.float))
+        self.full_send_index, self.full_send_buffer = \
+            self._setup_communication_buffers(self.full_send_dict)
+        self.ghost_recv_index, self.ghost_recv_buffer = \
+            self._setup_communication_buffers(self.ghost_recv_dict)
 
 
         # Setup triangle full flag
@@ -323,6 +319,22 @@ class Generic_Domain:
 
         self.last_walltime = walltime()
 
+        # Shared memory threading of the compute kernels (if supported
+        # by the flow algorithm). Time spent in the threaded kernels is
+        # accumulated in kernel_walltime for reporting
+        self.omp_num_threads = 1
+        self.kernel_walltime = 0.0
+        self.report_kernel_walltime = False
+
+        # Cached C structure pointing at the domain arrays (only used by
+        # some flow algorithms). See invalidate_c_domain
+        self.c_domain = None
+
+        # Boundary segments of update_boundary, rebuilt when the boundary
+        # objects change. See get_boundary_segments
+        self.boundary_segments = None
+        self.boundary_segments_key = None
+
         # Monitoring
         self.quantities_to_be_monitored = None
         self.monitor_polygon = None
@@ -362,6 +374,33 @@ class Generic_Domain:
 
         if verbose: log.critical('Domain: Done')
 
+
+    def _setup_communication_buffers(self, commun_dict):
+        """Append a buffer to the communication list of each processor.
+
+        The buffers are consecutive blocks of rows of one contiguous
+        buffer, and the flat index array holds the matching triangle ids,
+        so that the quantities for all the processors can be packed or
+        unpacked in one call (see parallel_generic_communications).
+        """
+
+        keys = sorted(commun_dict.keys())
+
+        index = [num.zeros(0, num.int)]
+        index += [num.array(commun_dict[key][0], num.int) for key in keys]
+        index = num.concatenate(index)
+
+        buffer = num.zeros((len(index), self.nsys), num.float)
+
+        start = 0
+        for key in keys:
+            end = start + commun_dict[key][0].shape[0]
+            commun_dict[key].append(buffer[start:end])
+            start = end
+
+        return index, buffer
+
+
     ######
     # Expose underlying Mesh functionality
     ######
@@ -1114,6 +1153,11 @@ class Generic_Domain:
         msg += ' (%ds)' % (walltime() - self.last_walltime)
         self.last_walltime = walltime()
 
+        if self.report_kernel_walltime:
+            msg += ' [%d threads, %.2fs in kernels]' \
+                       % (self.omp_num_threads, self.kernel_walltime)
+        self.kernel_walltime = 0.0
+
         if track_speeds is True:
             msg += '\n'
 
@@ -1758,6 +1802,7 @@ class Generic_Domain:
                 self.number_of_steps = 0
                 self.number_of_first_order_steps = 0
                 self.max_speed = num.zeros(N, num.float)
+                self.invalidate_c_domain()
 
 
     def evolve_one_euler_step(self, yieldstep, finaltime):
@@ -1833,16 +1878,6 @@ class Generic_Domain:
         # Update time
         self.set_time(self.get_time() + self.timestep)
 
-        # Update ghosts
-        if self.ghost_layer_width < 4:
-            self.update_ghosts()
-
-        # Update vertex and edge values
-        self.distribute_to_vertices_and_edges()
-
-        # Update boundary values
-        self.update_boundary()
-
         ######
         # Second Euler step using the same timestep
         # calculated in the first step. Might lead to
@@ -1850,8 +1885,10 @@ class Generic_Domain:
         # example.
         ######
 
-        # Compute fluxes across each element edge
-        self.compute_fluxes()
+        # Update ghosts, vertex and edge values and boundary values
+        # and compute fluxes across each element edge
+        self.update_ghosts_and_compute_fluxes(
+            update_ghosts=self.ghost_layer_width < 4)
 
         # Compute forcing terms
         self.compute_forcing_terms()
@@ -1915,15 +1952,6 @@ class Generic_Domain:
         # Update time
         self.set_time(self.time + self.timestep)
 
-        # Update ghosts
-        self.update_ghosts()
-
-        # Update vertex and edge values
-        self.distribute_to_vertices_and_edges()
-
-        # Update boundary values
-        self.update_boundary()
-
         ######
         # Second Euler step using the same timestep
         # calculated in the first step. Might lead to
@@ -1931,8 +1959,9 @@ class Generic_Domain:
         # example.
         ######
 
-        # Compute fluxes across each element edge
-        self.compute_fluxes()
+        # Update ghosts, vertex and edge values and boundary values
+        # and compute fluxes across each element edge
+        self.update_ghosts_and_compute_fluxes()
 
         # Compute forcing terms
         self.compute_forcing_terms()
@@ -1954,21 +1983,13 @@ class Generic_Domain:
         # Set substep time
         self.set_time(initial_time + self.timestep*0.5)
 
-        # Update ghosts
-        self.update_ghosts()
-
-        # Update vertex and edge values
-        self.distribute_to_vertices_and_edges()
-
-        # Update boundary values
-        self.update_boundary()
-
         ######
         # Third Euler step
         ######
 
-        # Compute fluxes across each element edge
-        self.compute_fluxes()
+        # Update ghosts, vertex and edge values and boundary values
+        # and compute fluxes across each element edge
+        self.update_ghosts_and_compute_fluxes()
 
         # Compute forcing terms
         self.compute_forcing_terms()
@@ -2040,6 +2061,17 @@ class Generic_Domain:
 
         return q_evol
     
+    def invalidate_c_domain(self):
+        """Discard the cached C structure of the domain (if any).
+
+        The C structure holds pointers to the arrays of the domain and its
+        quantities, so this must be called whenever one of these arrays is
+        replaced by a new array (updating values in place is fine).
+        """
+
+        self.c_domain = None
+
+
     def update_boundary_old(self):
         """Go through list of boundary objects and update boundary values
         for all conserved quantities on boundary.
@@ -2129,21 +2161,71 @@ class Generic_Domain:
         consistent between the domain and the boundary object, i.e.
         the jth element of vector q must correspond to the jth conserved
         quantity in domain.
+
+        Boundaries with a kernel (see get_boundary_kernel_codes) are
+        evaluated by evaluate_boundary_kernels, the others by their
+        evaluate_segment method.
         """
 
-        for tag in self.tag_boundary_cells:
+        self.evaluate_boundary_kernels(self.get_boundary_segments())
 
-            #print tag
-            
+
+    def get_boundary_kernel_codes(self):
+        """Dictionary of the boundary classes which evaluate_boundary_kernels
+        evaluates without calling evaluate_segment, and their codes (> 0).
+
+        None here, domains with boundary kernels override this.
+        """
+
+        return {}
+
+
+    def get_boundary_segments(self):
+        """List of (code, segment_edges, boundary) for each boundary tag,
+        where code is that of the class of the boundary (0 if it has no
+        kernel, see get_boundary_kernel_codes). The segment_edges of
+        boundaries with a kernel are integer arrays.
+        """
+
+        # Rebuild if set_boundary has changed the boundary objects
+        key = [(tag, id(self.boundary_map[tag])) for tag in self.tag_boundary_cells]
+        if key == self.boundary_segments_key:
+            return self.boundary_segments
+
+        codes = self.get_boundary_kernel_codes()
+
+        segments = []
+        for tag in self.tag_boundary_cells:
             B = self.boundary_map[tag]
 
             if B is None:
                 continue
 
-            boundary_segment_edges = self.tag_boundary_cells[tag]
+            segment_edges = self.tag_boundary_cells[tag]
+
+            # Subclasses may evaluate differently, so only the exact class
+            code = codes.get(B.__class__, 0)
+            if code > 0:
+                segment_edges = num.array(segment_edges, num.int)
+
+            segments.append((code, segment_edges, B))
+
+        self.boundary_segments = segments
+        self.boundary_segments_key = key
+
+        return segments
+
+
+    def evaluate_boundary_kernels(self, segments):
+        """Evaluate the boundary segments of get_boundary_segments.
+
+        Here all the boundaries are evaluated by evaluate_segment,
+        domains with boundary kernels override this.
+        """
+
+        for code, segment_edges, B in segments:
+            B.evaluate_segment(self, segment_edges)
 
-            B.evaluate_segment(self, boundary_segment_edges)
-        
 
     def compute_fluxes(self):
         msg = 'Method compute_fluxes must be overridden by Domain subclass'
@@ -2152,10 +2234,50 @@ class Generic_Domain:
 
     def apply_fractional_steps(self):
 
-        for operator in self.fractional_step_operators:
+        for operator in self.get_fractional_step_batches():
             operator()
 
 
+    def get_fractional_step_batches(self):
+        """The fractional step operators, in order, with each run of
+        consecutive operators with the same batch class (see
+        Operator.get_batch_class) replaced by a single operator of that
+        class, which applies them at once.
+        """
+
+        # Rebuild if operators have been added or removed
+        key = [id(operator) for operator in self.fractional_step_operators]
+        if key == self.fractional_step_batches_key:
+            return self.fractional_step_batches
+
+        def get_batch_class(operator):
+            if hasattr(operator, 'get_batch_class'):
+                return operator.get_batch_class()
+            return None
+
+        # Runs of consecutive operators with the same batch class
+        runs = []
+        for operator in self.fractional_step_operators:
+            batch_class = get_batch_class(operator)
+            if batch_class is not None and len(runs) > 0 and \
+               runs[-1][0] is batch_class:
+                runs[-1][1].append(operator)
+            else:
+                runs.append((batch_class, [operator]))
+
+        batches = []
+        for batch_class, operators in runs:
+            if len(operators) > 1:
+                batches.append(batch_class(self, operators))
+            else:
+                batches.append(operators[0])
+
+        self.fractional_step_batches = batches
+        self.fractional_step_batches_key = key
+
+        return batches
+
+
     def log_operator_timestepping_statistics(self):
         for operator in self.fractional_step_operators:
             operator.log_timestepping_statistics()
@@ -2273,6 +2395,25 @@ class Generic_Domain:
             # Where is Q.semi_implicit_update reset?
             # It is reset in quantity_ext.c
 
+    def update_ghosts_and_compute_fluxes(self, update_ghosts=True):
+        """Update the ghost cells (if update_ghosts is True), the vertex,
+        edge and boundary values and then compute the fluxes, as done
+        within each rk2 and rk3 step.
+
+        Parallel domains can override this to overlap the ghost
+        communication with the computation.
+        """
+
+        if update_ghosts:
+            self.update_ghosts()
+
+        self.distribute_to_vertices_and_edges()
+
+        self.update_boundary()
+
+        self.compute_fluxes()
+
+
     def update_ghosts(self, quantities=None):
         # We must send the information from the full cells and
         # receive the information for the ghost cells
@@ -605,7 +605,7 @@ class Quantity:
 
         vol_id  = self.domain.boundary_cells
         edge_id = self.domain.boundary_edges
-        self.boundary_values = (self.edge_values.flat)[3*vol_id+edge_id]
+        self.boundary_values[:] = (self.edge_values.flat)[3*vol_id+edge_id]
 
     ##
     # @brief Set boundary values using a function
@@ -827,6 +827,46 @@ class Test_Domain(unittest.TestCase):
                         'set region failed')
 
                              
+    def test_communication_buffers(self):
+        """The communication buffers of all the processors are blocks of
+        one contiguous buffer, matching the flat index arrays
+        """
+
+        from anuga.abstract_2d_finite_volumes.mesh_factory import rectangular
+
+        points, vertices, boundary = rectangular(4, 4)
+
+        full_send_dict = {3: [num.array([5, 6]), num.array([15, 16])],
+                          1: [num.array([0, 1, 2]), num.array([10, 11, 12])]}
+        ghost_recv_dict = {1: [num.array([30, 31]), num.array([20, 21])]}
+
+        conserved_quantities = ['stage', 'xmomentum']
+        domain = Generic_Domain(points, vertices, boundary,
+                                conserved_quantities,
+                                full_send_dict=full_send_dict,
+                                ghost_recv_dict=ghost_recv_dict)
+
+        # Sorted by processor
+        assert num.allclose(domain.full_send_index, [0, 1, 2, 5, 6])
+        assert domain.full_send_buffer.shape == (5, 2)
+        assert num.allclose(domain.ghost_recv_index, [30, 31])
+        assert domain.ghost_recv_buffer.shape == (2, 2)
+
+        domain.full_send_buffer[:] = num.arange(10).reshape(5, 2)
+        assert num.allclose(domain.full_send_dict[1][2], [[0, 1], [2, 3], [4, 5]])
+        assert num.allclose(domain.full_send_dict[3][2], [[6, 7], [8, 9]])
+        assert domain.full_send_dict[3][2].flags['C_CONTIGUOUS']
+
+        domain.ghost_recv_dict[1][2][:] = 1.0
+        assert num.allclose(domain.ghost_recv_buffer, 1.0)
+
+        # No communication
+        domain = Generic_Domain(points, vertices, boundary,
+                                conserved_quantities)
+        assert domain.full_send_index.shape == (0,)
+        assert domain.ghost_recv_buffer.shape == (0, 2)
+
+
     def test_rectangular_periodic_and_ghosts(self):
 
         from anuga.abstract_2d_finite_volumes.mesh_factory import rectangular_periodic
@@ -751,6 +751,22 @@ class Test_Util(unittest.TestCase):
                 assert num.allclose(q, (k*q1 + (6-k)*q0)/6)
 
 
+        #Read only a window of timesteps from the file as time moves
+        F_window = file_function(filename + '.sww', domain,
+                                 quantities = domain.conserved_quantities,
+                                 interpolation_points = interpolation_points,
+                                 time_window = 3)
+        assert F_window.precomputed_values['stage'].shape == (3, 5)
+
+        times = range(0, finaltime-delta, 7) + [finaltime-delta, 100, 10]
+        for t in times:
+            for id in range(len(interpolation_points)):
+                assert num.allclose(F_window(t, point_id=id),
+                                    F(t, point_id=id))
+
+            assert F_window.precomputed_values['stage'].shape[0] <= 3
+
+
         os.remove(filename + '.sww')
 
 
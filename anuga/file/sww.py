@@ -8,6 +8,9 @@ class NewQuantity(exceptions.Exception): pass
 class DataDomainError(exceptions.Exception): pass
 class DataTimeError(exceptions.Exception): pass
 
+import atexit
+import weakref
+
 import numpy
 from anuga.coordinate_transforms.geo_reference import Geo_reference
 from anuga.config import netcdf_mode_r, netcdf_mode_w, netcdf_mode_a
@@ -27,6 +30,15 @@ from anuga.coordinate_transforms.geo_reference import \
 from anuga.utilities.file_utils import create_filename
 import numpy as num
 
+def _close_sww_file(ref):
+    """Close the file and the writer thread of an SWW_file, if still alive
+    """
+
+    sww = ref()
+    if sww is not None:
+        sww.close()
+
+
 class Data_format:
     """Generic interface to data formats
     """
@@ -68,8 +80,10 @@ class SWW_file(Data_format):
     def __init__(self, domain, 
                  mode=netcdf_mode_w, max_size=200000000000, recursion=False):
 
+        # recursion is not used anymore (see store_timestep), it is kept
+        # for backwards compatibility
+
         self.precision = netcdf_float32 # Use single precision for quantities
-        self.recursion = recursion
         self.mode = mode
         
         if hasattr(domain, 'max_size'):
@@ -81,12 +95,33 @@ class SWW_file(Data_format):
             self.store_centroids = domain.store_centroids
         else:
             self.store_centroids = False
+
+        if hasattr(domain, 'store_sync_interval'):
+            self.sync_interval = domain.store_sync_interval
+        else:
+            self.sync_interval = 1
             
         if hasattr(domain, 'minimum_storable_height'):
             self.minimum_storable_height = domain.minimum_storable_height
         else:
             self.minimum_storable_height = default_minimum_storable_height
 
+        # File kept open between timesteps (see store_timestep)
+        self.fid = None
+        self.number_of_frames = None
+        self.unsynced_frames = 0
+
+        # Asynchronous storage (see set_async)
+        self.store_async = False
+        self.queue_size = 4
+        self.thread = None
+        self.queue = None
+        self.async_error = None
+
+        # Close the file and write out the queue if the domain is not
+        # evolved to the end
+        atexit.register(_close_sww_file, weakref.ref(self))
+
         # Call parent constructor
         Data_format.__init__(self, domain, 'sww', mode)
 
@@ -113,21 +148,29 @@ class SWW_file(Data_format):
                 if self.store_centroids: dynamic_c_quantities.append(q+'_c')
                        
         
-        # NetCDF file definition
+        self.writer = Write_sww(static_quantities,
+                                dynamic_quantities,
+                                static_c_quantities,
+                                dynamic_c_quantities)
+
+        self._create_file(mode)
+
+
+    def _create_file(self, mode):
+        """NetCDF file definition
+        """
+
+        domain = self.domain
+
         fid = NetCDFFile(self.filename, mode)
         if mode[0] == 'w':
             description = 'Output from anuga.file.sww ' \
                           'suitable for plotting'
-                          
-            self.writer = Write_sww(static_quantities,
-                                    dynamic_quantities,
-                                    static_c_quantities,
-                                    dynamic_c_quantities)
-            
+
             self.writer.store_header(fid,
                                      domain.starttime,
                                      self.number_of_volumes,
-                                     self.domain.number_of_nodes,
+                                     self.number_of_nodes,
                                      description=description,
                                      smoothing=domain.smooth,
                                      order=domain.default_order,
@@ -236,12 +279,248 @@ class SWW_file(Data_format):
 
     def store_timestep(self):
         """Store time and time dependent quantities
+
+        The file is kept open between timesteps (see close), the frame
+        index is tracked in memory and the file is synced every
+        sync_interval timesteps. With asynchronous storage (see
+        set_async) the quantities are copied and queued for the writer
+        thread.
+
+        When the file would grow beyond max_size, this and the following
+        timesteps are stored in a new file named with the current time.
+        """
+
+        if self.number_of_frames is None:
+            self._read_frame_sizes()
+
+        # Check to see if the file is already too big. A file always
+        # gets at least one timestep
+        file_size = self.header_size + self.number_of_frames*self.frame_size
+        if self.number_of_frames > 0 and \
+               file_size + self.frame_size > self.max_size:
+            next_data_structure = self._start_new_file(file_size)
+            next_data_structure.store_timestep()
+            return
+
+        self._store_timestep_data(self.get_timestep_data())
+
+
+    def _store_timestep_data(self, data):
+        """Write data from get_timestep_data, or queue it for the writer
+        thread
+        """
+
+        self.number_of_frames += 1
+
+        if self.store_async:
+            if self.thread is None:
+                self._start_writer_thread()
+
+            self._check_async_error()
+            self.queue.put(data)
+        else:
+            self.write_timestep(data)
+
+
+    def _read_frame_sizes(self):
+        """Number of timesteps in the file, and the size in bytes of the
+        file without the timesteps and of each timestep
         """
 
-        #import types
-        from time import sleep
         from os import stat
 
+        fid = NetCDFFile(self.filename, netcdf_mode_r)
+
+        self.number_of_frames = len(fid.variables['time'])
+
+        self.frame_size = 0
+        for var in fid.variables.values():
+            if len(var.dimensions) > 0 and \
+                   var.dimensions[0] == 'number_of_timesteps':
+                self.frame_size += var.dtype.itemsize*num.prod(var.shape[1:])
+
+        fid.close()
+
+        self.header_size = stat(self.filename)[6] - \
+                           self.number_of_frames*self.frame_size
+
+
+    def _start_new_file(self, file_size):
+        """Close this file and set up a new file (named with the current
+        time) as the domain writer. Used when the current file has grown
+        too big.
+        """
+
+        # In order to get the file name and start time correct,
+        # I change the domain.filename and domain.starttime.
+        # This is the only way to do this without changing
+        # other modules (I think).
+
+        # Write a filename addon that won't break the anuga viewers
+        # (10.sww is bad)
+        filename_ext = '_time_%s' % self.domain.time
+        filename_ext = filename_ext.replace('.', '_')
+
+        # Remember the old filename, then give domain a
+        # name with the extension
+        old_domain_filename = self.domain.get_name()
+        self.domain.set_name(old_domain_filename + filename_ext)
+
+        # Temporarily change the domain starttime to the current time
+        old_domain_starttime = self.domain.starttime
+        self.domain.starttime = self.domain.get_time()
+
+        # Build a new data_structure. The new file is always created,
+        # even if this one was opened for append (eg after a restart from
+        # a checkpoint)
+        next_data_structure = self.__class__(self.domain, mode=netcdf_mode_w,
+                                             max_size=self.max_size)
+        next_data_structure.sync_interval = self.sync_interval
+        next_data_structure.set_async(self.store_async, self.queue_size)
+
+        log.critical('    file_size = %s' % file_size)
+        log.critical('    saving file to %s' % next_data_structure.filename)
+
+        # Set up the new data_structure
+        self.domain.writer = next_data_structure
+        next_data_structure.store_connectivity()
+
+        # Restore the old starttime and filename
+        self.domain.starttime = old_domain_starttime
+        self.domain.set_name(old_domain_filename)
+
+        self.close()
+
+        return next_data_structure
+
+
+    def get_timestep_data(self):
+        """Copy of the time dependent quantities to be stored for
+        the current time
+        """
+
+        domain = self.domain
+
+        if 'stage' in self.writer.dynamic_quantities:
+            # Select only those values for stage,
+            # xmomentum and ymomentum (if stored) where
+            # depth exceeds minimum_storable_height
+            #
+            # In this branch it is assumed that elevation
+            # is also available as a quantity
+
+
+            # Smoothing for the get_vertex_values will be obtained
+            # from the smooth setting in domain
+
+            Q = domain.quantities['stage']
+            w, _ = Q.get_vertex_values(xy=False)
+
+            Q = domain.quantities['elevation']
+            z, _ = Q.get_vertex_values(xy=False)
+
+            storable_indices = num.array(w-z >= self.minimum_storable_height)
+
+            #print numpy.sum(storable_indices), len(z), self.minimum_storable_height, numpy.min(w-z)
+        else:
+            # Very unlikely branch
+            storable_indices = None # This means take all
+
+        # Now store dynamic quantities
+        dynamic_quantities = {}
+        dynamic_quantities_centroid = {}
+
+        for name in self.writer.dynamic_quantities:
+            #netcdf_array = fid.variables[name]
+
+            Q = domain.quantities[name]
+            A, _ = Q.get_vertex_values(xy=False,
+                                       precision=self.precision)
+
+            if storable_indices is not None:
+                if name == 'stage':
+                    A = num.choose(storable_indices, (z, A))
+
+                if name in ['xmomentum', 'ymomentum']:
+                    # Get xmomentum where depth exceeds
+                    # minimum_storable_height
+
+                    # Define a zero vector of same size and type as A
+                    # for use with momenta
+                    null = num.zeros(num.size(A), A.dtype.char)
+                    A = num.choose(storable_indices, (null, A))
+
+            dynamic_quantities[name] = A
+
+        for name in self.writer.dynamic_c_quantities:
+            Q = domain.quantities[name[:-2]]
+            dynamic_quantities_centroid[name] = num.array(Q.centroid_values)
+
+        # Copy of the extrema if requested
+        extrema = None
+        if domain.quantities_to_be_monitored is not None:
+            from copy import deepcopy
+            extrema = deepcopy(domain.quantities_to_be_monitored)
+
+        return {'time': self.domain.time,
+                'quantities': dynamic_quantities,
+                'centroid_quantities': dynamic_quantities_centroid,
+                'extrema': extrema}
+
+
+    def write_timestep(self, data):
+        """Write the time dependent quantities from get_timestep_data
+        to the file, opening it if needed
+        """
+
+        if self.fid is None:
+            self.fid = self._open_file()
+
+        fid = self.fid
+        slice_index = self._get_slice_index(data['time'])
+
+        # Store dynamic quantities
+        fid.variables['time'][slice_index] = data['time']
+        self.writer.store_quantities(fid,
+                                     slice_index=slice_index,
+                                     sww_precision=self.precision,
+                                     **data['quantities'])
+
+        # Store dynamic quantities
+        if self.store_centroids:
+            self.writer.store_quantities_centroid(fid,
+                                                  slice_index= slice_index,
+                                                  sww_precision=self.precision,
+                                                  **data['centroid_quantities'])
+
+
+        # Update extrema if requested
+        if data['extrema'] is not None:
+            for q, info in data['extrema'].items():
+                if info['min'] is not None:
+                    fid.variables[q + '.extrema'][0] = info['min']
+                    fid.variables[q + '.min_location'][:] = \
+                                    info['min_location']
+                    fid.variables[q + '.min_time'][0] = info['min_time']
+
+                if info['max'] is not None:
+                    fid.variables[q + '.extrema'][1] = info['max']
+                    fid.variables[q + '.max_location'][:] = \
+                                    info['max_location']
+                    fid.variables[q + '.max_time'][0] = info['max_time']
+
+        self.unsynced_frames += 1
+        if self.unsynced_frames >= self.sync_interval:
+            fid.sync()
+            self.unsynced_frames = 0
+
+
+    def _open_file(self):
+        """Open the file for append, and read the index and time of the
+        last stored timestep
+        """
+
+        from time import sleep
 
         # Get NetCDF
         retries = 0
@@ -266,151 +545,143 @@ class SWW_file(Data_format):
             msg = 'File %s could not be opened for append' % self.filename
             raise DataFileNotOpenError, msg
 
-        # Check to see if the file is already too big:
-        time = fid.variables['time'][:]
-
-        i = len(time) + 1
-        file_size = stat(self.filename)[6]
-        file_size_increase = file_size / i
-        if file_size + file_size_increase > self.max_size * 2**self.recursion:
-            # In order to get the file name and start time correct,
-            # I change the domain.filename and domain.starttime.
-            # This is the only way to do this without changing
-            # other modules (I think).
-
-            # Write a filename addon that won't break the anuga viewers
-            # (10.sww is bad)
-            filename_ext = '_time_%s' % self.domain.time
-            filename_ext = filename_ext.replace('.', '_')
-
-            # Remember the old filename, then give domain a
-            # name with the extension
-            old_domain_filename = self.domain.get_name()
-            if not self.recursion:
-                self.domain.set_name(old_domain_filename + filename_ext)
-
-            # Temporarily change the domain starttime to the current time
-            old_domain_starttime = self.domain.starttime
-            self.domain.starttime = self.domain.get_time()
-
-            # Build a new data_structure.
-            next_data_structure = SWW_file(self.domain, mode=self.mode,
-                                           max_size=self.max_size,
-                                           recursion=self.recursion+1)
-            if not self.recursion:
-                log.critical('    file_size = %s' % file_size)
-                log.critical('    saving file to %s'
-                             % next_data_structure.filename) 
-
-            # Set up the new data_structure
-            self.domain.writer = next_data_structure
-
-            # Store connectivity and first timestep
-            next_data_structure.store_connectivity()
-            next_data_structure.store_timestep()
-            fid.sync()
-            fid.close()
+        file_time = fid.variables['time']
+        self.next_slice = len(file_time)
+        if self.next_slice > 0:
+            self.last_time = file_time[self.next_slice-1]
 
-            # Restore the old starttime and filename
-            self.domain.starttime = old_domain_starttime
-            self.domain.set_name(old_domain_filename)
-        else:
-            self.recursion = False
-            domain = self.domain
+        self.unsynced_frames = 0
 
-            # Get the variables
-            time = fid.variables['time'][:]
-            i = len(time)
-             
-            if 'stage' in self.writer.dynamic_quantities:            
-                # Select only those values for stage, 
-                # xmomentum and ymomentum (if stored) where 
-                # depth exceeds minimum_storable_height
-                #
-                # In this branch it is assumed that elevation
-                # is also available as a quantity
+        return fid
 
 
-                # Smoothing for the get_vertex_values will be obtained
-                # from the smooth setting in domain
-            
-                Q = domain.quantities['stage']
-                w, _ = Q.get_vertex_values(xy=False)
-                
-                Q = domain.quantities['elevation']
-                z, _ = Q.get_vertex_values(xy=False)                
-                
-                storable_indices = num.array(w-z >= self.minimum_storable_height)
-                
-                #print numpy.sum(storable_indices), len(z), self.minimum_storable_height, numpy.min(w-z)
-            else:
-                # Very unlikely branch
-                storable_indices = None # This means take all
-            
-            # Now store dynamic quantities
-            dynamic_quantities = {}
-            dynamic_quantities_centroid = {}
-            
-            for name in self.writer.dynamic_quantities:
-                #netcdf_array = fid.variables[name]
-                
-                Q = domain.quantities[name]
-                A, _ = Q.get_vertex_values(xy=False,
-                                           precision=self.precision)
-                
-                if storable_indices is not None:
-                    if name == 'stage':
-                        A = num.choose(storable_indices, (z, A))
-
-                    if name in ['xmomentum', 'ymomentum']:
-                        # Get xmomentum where depth exceeds 
-                        # minimum_storable_height
-                        
-                        # Define a zero vector of same size and type as A
-                        # for use with momenta
-                        null = num.zeros(num.size(A), A.dtype.char)
-                        A = num.choose(storable_indices, (null, A))
-                
-                dynamic_quantities[name] = A
-                
-            for name in self.writer.dynamic_c_quantities:
-                Q = domain.quantities[name[:-2]]
-                dynamic_quantities_centroid[name] = Q.centroid_values
-                
-                                        
-            # Store dynamic quantities
-            slice_index = self.writer.store_quantities(fid,
-                                         time=self.domain.time,
-                                         sww_precision=self.precision,
-                                         **dynamic_quantities)
-            
-            # Store dynamic quantities
-            if self.store_centroids:
-                self.writer.store_quantities_centroid(fid,
-                                                      slice_index= slice_index,
-                                                      sww_precision=self.precision,
-                                                      **dynamic_quantities_centroid)            
+    def _get_slice_index(self, time):
+        """Index of the timestep to store time in. A time which is
+        already stored, as when restarting from a checkpoint, is
+        overwritten.
+        """
 
+        if self.next_slice > 0 and time <= self.last_time:
+            file_time = self.fid.variables['time'][:]
+            check = num.where(num.abs(file_time - time) < 1.0e-14)[0]
+            if len(check) > 0:
+                return int(check[0])
 
-            # Update extrema if requested
-            domain = self.domain
-            if domain.quantities_to_be_monitored is not None:
-                for q, info in domain.quantities_to_be_monitored.items():
-                    if info['min'] is not None:
-                        fid.variables[q + '.extrema'][0] = info['min']
-                        fid.variables[q + '.min_location'][:] = \
-                                        info['min_location']
-                        fid.variables[q + '.min_time'][0] = info['min_time']
-
-                    if info['max'] is not None:
-                        fid.variables[q + '.extrema'][1] = info['max']
-                        fid.variables[q + '.max_location'][:] = \
-                                        info['max_location']
-                        fid.variables[q + '.max_time'][0] = info['max_time']
-
-            # Flush and close
-            #fid.sync()
-            fid.close()
+        slice_index = self.next_slice
+        self.next_slice += 1
+        self.last_time = time
+
+        return slice_index
+
+
+    #--------------------------------------------------------------------
+    # Asynchronous storage
+    #--------------------------------------------------------------------
+    def set_async(self, flag=True, queue_size=4):
+        """Write the timesteps from a background thread.
+
+        store_timestep copies the quantities into a queue of at most
+        queue_size timesteps, and blocks while the queue is full.
+        The thread is started on the first store_timestep. Call flush
+        to wait until the queued timesteps are written, and close to
+        also stop the thread.
+        """
+
+        if not flag:
+            self.close()
+
+        self.store_async = flag
+        self.queue_size = queue_size
+
+
+    def _start_writer_thread(self):
+
+        import Queue
+        import threading
+
+        self.queue = Queue.Queue(maxsize=self.queue_size)
+        self.async_error = None
+
+        self.thread = threading.Thread(target=self._write_queued_timesteps,
+                                       name='SWW writer %s' % self.filename)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def _write_queued_timesteps(self):
+        """Body of the writer thread. None in the queue stops the thread.
+        After an error the remaining timesteps are discarded, and the
+        error is raised in the main thread.
+        """
+
+        while True:
+            data = self.queue.get()
+            try:
+                if data is None:
+                    break
+
+                if self.async_error is None:
+                    self.write_timestep(data)
+            except Exception, e:
+                self.async_error = e
+            finally:
+                self.queue.task_done()
+
+
+    def _check_async_error(self):
+
+        if self.async_error is not None:
+            error = self.async_error
+            self.async_error = None
+            msg = 'Asynchronous write to %s failed: %s' % (self.filename, error)
+            raise DataFileNotOpenError, msg
+
+
+    def flush(self):
+        """Wait until all queued timesteps are written and sync the file
+        """
+
+        if self.thread is not None:
+            self.queue.join()
+            self._check_async_error()
+
+        if self.fid is not None:
+            self.fid.sync()
+            self.unsynced_frames = 0
+
+
+    def close(self):
+        """Write the queued timesteps, stop the writer thread and close
+        the file. They are restarted and reopened by the next
+        store_timestep.
+        """
+
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+        if self.fid is not None:
+            self.fid.close()
+            self.fid = None
+
+        self._check_async_error()
+
+
+    def __getstate__(self):
+        """Make sure the timesteps are in the file, and leave out the
+        file and the writer thread, eg when checkpointing the domain
+        """
+
+        self.flush()
+
+        state = self.__dict__.copy()
+        state['thread'] = None
+        state['queue'] = None
+        state['fid'] = None
+        state['number_of_frames'] = None
+
+        return state
 
 
 class Read_sww:
@@ -875,6 +875,161 @@ class Test_sww(unittest.TestCase):
                                            new_origin)),points_utm)
         os.remove(filename)
 
+    def test_store_async(self):
+        """Writing the sww file from a background thread gives the
+        same file as writing it from evolve
+        """
+
+        import atexit
+        import cPickle
+
+        def create_domain(name, store_async):
+            points, vertices, boundary = rectangular(10, 10)
+            domain = Domain(points, vertices, boundary)
+            domain.set_name(name)
+            domain.set_quantity('elevation', lambda x,y: -x/3)
+            domain.set_quantity('stage', lambda x,y: num.where(x < 0.5, 0.1, -x/3))
+            domain.set_quantities_to_be_monitored('stage')
+
+            Br = Reflective_boundary(domain)
+            domain.set_boundary({'left': Br, 'right': Br, 'top': Br, 'bottom': Br})
+
+            # Queue of one timestep so that evolve has to wait for the writer
+            domain.set_store_async(store_async, queue_size=1)
+
+            return domain
+
+        domain_1 = create_domain('test_store_sync', False)
+        domain_2 = create_domain('test_store_async', True)
+        assert domain_2.get_store_async()
+
+        for t in domain_1.evolve(yieldstep=0.01, finaltime=0.1):
+            pass
+
+        for t in domain_2.evolve(yieldstep=0.01, finaltime=0.05):
+            # The writer can be pickled while running, eg for checkpoints
+            cPickle.dumps(domain_2.writer)
+
+        number_of_exithandlers = len(atexit._exithandlers)
+
+        # Continue, so the writer is restarted
+        for t in domain_2.evolve(yieldstep=0.01, finaltime=0.1):
+            pass
+
+        assert domain_2.writer.thread is None
+
+        # Restarting the writer (and reopening the file) does not register
+        # more exit handlers
+        assert len(atexit._exithandlers) == number_of_exithandlers
+
+        fid_1 = NetCDFFile(domain_1.get_name() + '.sww')
+        fid_2 = NetCDFFile(domain_2.get_name() + '.sww')
+
+        assert len(fid_1.variables['time']) == 11
+        for name in fid_1.variables:
+            assert num.all(fid_1.variables[name][:] == fid_2.variables[name][:]), name
+
+        fid_1.close()
+        fid_2.close()
+
+        os.remove(domain_1.get_name() + '.sww')
+        os.remove(domain_2.get_name() + '.sww')
+
+    def test_store_rollover(self):
+        """Timesteps which would make the sww file bigger than max_size
+        are stored in new files
+        """
+
+        import glob
+
+        def create_domain(name):
+            points, vertices, boundary = rectangular(10, 10)
+            domain = Domain(points, vertices, boundary)
+            domain.set_name(name)
+            domain.set_quantity('elevation', lambda x,y: -x/3)
+            domain.set_quantity('stage', lambda x,y: num.where(x < 0.5, 0.1, -x/3))
+
+            Br = Reflective_boundary(domain)
+            domain.set_boundary({'left': Br, 'right': Br, 'top': Br, 'bottom': Br})
+
+            return domain
+
+        domain_1 = create_domain('test_store_single')
+        domain_1.set_store_sync_interval(4)
+        assert domain_1.get_store_sync_interval() == 4
+
+        for t in domain_1.evolve(yieldstep=0.01, finaltime=0.1):
+            pass
+
+        # Room for 4 timesteps in each file
+        writer = domain_1.writer
+        assert writer.number_of_frames == 11
+        assert writer.fid is None
+
+        for filename in glob.glob('test_store_rollover*.sww'):
+            os.remove(filename)
+
+        domain_2 = create_domain('test_store_rollover')
+        domain_2.max_size = writer.header_size + 4*writer.frame_size + 100
+
+        for t in domain_2.evolve(yieldstep=0.01, finaltime=0.1):
+            pass
+
+        assert domain_2.get_name() == 'test_store_rollover'
+
+        filenames = ['test_store_rollover.sww',
+                     'test_store_rollover_time_0_04.sww',
+                     'test_store_rollover_time_0_08.sww']
+        assert sorted(glob.glob('test_store_rollover*.sww')) == filenames
+
+        fid_1 = NetCDFFile('test_store_single.sww')
+        time = fid_1.variables['time'][:]
+        stage = fid_1.variables['stage'][:]
+        fid_1.close()
+
+        for i, filename in enumerate(filenames):
+            assert os.stat(filename).st_size <= domain_2.max_size
+
+            fid = NetCDFFile(filename)
+            assert num.allclose(fid.variables['time'][:] + fid.starttime,
+                                time[4*i:4*i+4] + 0.04*i)
+            assert num.all(fid.variables['stage'][:] == stage[4*i:4*i+4])
+            fid.close()
+
+            os.remove(filename)
+
+        # Restart, storing into the existing file (as from a checkpoint),
+        # and then grow the file past max_size
+        for filename in glob.glob('test_store_append*.sww'):
+            os.remove(filename)
+
+        domain_3 = create_domain('test_store_append')
+        for t in domain_3.evolve(yieldstep=0.01, finaltime=0.02):
+            pass
+
+        domain_3.max_size = domain_2.max_size
+        domain_3.initialise_storage(mode='a')
+        assert domain_3.writer.mode == 'a'
+
+        for t in domain_3.evolve(yieldstep=0.01, finaltime=0.1):
+            pass
+
+        filenames = ['test_store_append.sww',
+                     'test_store_append_time_0_04.sww',
+                     'test_store_append_time_0_08.sww']
+        assert sorted(glob.glob('test_store_append*.sww')) == filenames
+
+        for i, filename in enumerate(filenames):
+            fid = NetCDFFile(filename)
+            assert num.allclose(fid.variables['time'][:] + fid.starttime,
+                                time[4*i:4*i+4] + 0.04*i)
+            assert num.all(fid.variables['stage'][:] == stage[4*i:4*i+4])
+            fid.close()
+
+            os.remove(filename)
+
+        os.remove('test_store_single.sww')
+
 #################################################################################
 
 if __name__ == "__main__":
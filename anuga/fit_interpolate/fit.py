@@ -30,7 +30,13 @@ from anuga.abstract_2d_finite_volumes.neighbour_mesh import Mesh
 from anuga.caching import cache
 from anuga.geospatial_data.geospatial_data import Geospatial_data, \
      ensure_absolute
+from anuga.geospatial_data.geospatial_data import _read_pts_file_header, \
+     _read_pts_file_blocking
 from anuga.fit_interpolate.general_fit_interpolate import FitInterpolate
+from anuga.pmesh.mesh_quadtree import MeshQuadtree
+from anuga.file.netcdf import NetCDFFile
+from anuga.config import netcdf_mode_r
+from anuga.config import points_file_block_line_size as MAX_READ_LINES
 
 from anuga.utilities.sparse import Sparse_CSR
 from anuga.utilities.numerical_tools import ensure_numeric
@@ -266,11 +272,95 @@ class Fit(FitInterpolate):
             fitsmooth.combine_partial_AtA_Atz(self.AtA, AtA, \
                     self.Atz, Atz, zdim, self.mesh.number_of_nodes)
 
+    def _build_matrix_AtA_Atz_blocks(self, point_coordinates_or_filename,
+                                     z=None, attribute_name=None,
+                                     point_origin=None, max_read_lines=1e7,
+                                     processes=1, max_memory=None,
+                                     verbose=False):
+        """Build AtA and Atz as _build_matrix_AtA_Atz, from blocks of the
+        points streamed to processes worker processes.
+
+        Each worker accumulates the 3 x 3 block of AtA of each triangle
+        and a partial Atz over the blocks it gets, and the partials of
+        the workers are added up when all the blocks are done. The
+        blocks of .pts and .npy files are read by the workers, those of
+        other files and of points given as arrays are sent to them.
+
+        With processes == 1 the blocks are done by this process.
+        """
+
+        mesh = self.mesh
+        triangles = mesh.triangles
+        N = mesh.number_of_nodes
+
+        block_size = _get_fit_block_size(len(triangles), processes,
+                                         max_memory, max_read_lines)
+
+        if isinstance(point_coordinates_or_filename, basestring):
+            tasks, number_of_points = \
+                   _get_file_blocks(point_coordinates_or_filename,
+                                    attribute_name, block_size, verbose)
+        else:
+            if z is None:
+                msg = 'z not specified'
+                assert isinstance(point_coordinates_or_filename,
+                                  Geospatial_data), msg
+                z = point_coordinates_or_filename.get_attributes(attribute_name)
+
+            points = ensure_absolute(point_coordinates_or_filename,
+                                     geo_reference=point_origin)
+            z = ensure_numeric(z, num.float)
+
+            number_of_points = len(points)
+            tasks = (('points', points[i:i+block_size], z[i:i+block_size])
+                     for i in xrange(0, number_of_points, block_size))
+
+        if verbose:
+            log.critical('Fit: Fitting %s points in blocks of %d points '
+                         'with %d process(es)'
+                         % (number_of_points, block_size, processes))
+
+        progress = _Fit_progress(number_of_points, verbose)
+
+        if processes > 1:
+            partial = _fit_blocks_parallel(mesh, tasks, processes, progress)
+        else:
+            partial = None
+            for task in tasks:
+                points, block_z = _read_fit_block(task)
+                partial = _add_block_AtA_Atz(self.root, triangles, N,
+                                             points, block_z, partial)
+                progress(len(points))
+
+        if partial is None:
+            # No points
+            return
+
+        AtA_triangles, Atz, count = partial
+
+        AtA = fitsmooth.build_matrix_AtA_triangles(len(triangles),
+                                                   triangles, AtA_triangles)
+
+        self.point_count += count
+
+        if self.AtA is None and self.Atz is None:
+            self.AtA = AtA
+            self.Atz = Atz
+        else:
+            zdim = 1
+            if len(Atz.shape) != 1:
+                zdim = Atz.shape[1]
+
+            fitsmooth.combine_partial_AtA_Atz(self.AtA, AtA, \
+                    self.Atz, Atz, zdim, N)
+
     def fit(self, point_coordinates_or_filename=None, z=None,
             verbose=False,
             point_origin=None,
             attribute_name=None,
-            max_read_lines=1e7):
+            max_read_lines=1e7,
+            processes=1,
+            max_memory=None):
         """Fit a smooth surface to given 1d array of data points z.
 
         The smooth surface is computed at each vertex in the underlying
@@ -282,7 +372,14 @@ class Fit(FitInterpolate):
               List of coordinate pairs [x, y] of
               data points or an nx2 numeric array or a Geospatial_data object
               or points file filename
+              or a .npy file of an n x (2+a) array of the absolute x, y
+              and the a attributes of the points (read memory mapped)
           z: Single 1d vector or array of data at the point_coordinates.
+          processes: Number of worker processes building AtA and Atz
+              from blocks of the points (see _build_matrix_AtA_Atz_blocks)
+          max_memory: Approximate cap in bytes on the memory used by
+              the blocks of points and the partial AtA and Atz, which
+              sets the number of points per block (at most max_read_lines)
 
         """
         if isinstance(point_coordinates_or_filename, basestring):
@@ -296,8 +393,21 @@ class Fit(FitInterpolate):
         if verbose:
             print 'Fit.fit: Initializing'
 
+        if processes > 1 or (isinstance(point_coordinates_or_filename, basestring)
+                             and point_coordinates_or_filename[-4:] == '.npy'):
+            if isinstance(point_coordinates_or_filename, basestring):
+                msg = "Don't set a point origin when reading from a file"
+                assert point_origin is None, msg
+
+            self._build_matrix_AtA_Atz_blocks(point_coordinates_or_filename,
+                                              z, attribute_name, point_origin,
+                                              max_read_lines, processes,
+                                              max_memory, verbose)
+
+            point_coordinates = None
+
         # Use blocking to load in the point info
-        if isinstance(point_coordinates_or_filename, basestring):
+        elif isinstance(point_coordinates_or_filename, basestring):
             msg = "Don't set a point origin when reading from a file"
             assert point_origin is None, msg
             filename = point_coordinates_or_filename
@@ -371,6 +481,352 @@ class Fit(FitInterpolate):
                                   precon=self.cg_precon)
 
 
+#----------------------------------------------
+# Fitting of blocks of points by worker processes
+#----------------------------------------------
+
+# Approximate memory used per point of a block (the block, the triangles
+# and sigma of its points and temporary arrays) and per triangle (the
+# partial AtA and the quad tree of a worker) by the fit of blocks of
+# points, used to size the blocks for max_memory
+fit_bytes_per_point = 200
+fit_bytes_per_triangle = 200
+
+
+def _get_fit_block_size(number_of_triangles, processes, max_memory,
+                        max_read_lines):
+    """Number of points per block, at most max_read_lines, so that the
+    fit uses at most about max_memory bytes: each worker and the
+    reduction hold a partial AtA, and each worker holds a block being
+    done and one more waiting in the queue.
+    """
+
+    if max_read_lines is None:
+        max_read_lines = MAX_READ_LINES
+
+    block_size = int(max_read_lines)
+
+    if max_memory is not None:
+        fixed = (processes + 1)*number_of_triangles*fit_bytes_per_triangle
+        blocks = (2*processes + 1)*fit_bytes_per_point
+
+        block_size = min(block_size, int((max_memory - fixed)/blocks))
+
+        if block_size < 1:
+            msg = ('max_memory = %d bytes is too small to fit with %d '
+                   'processes on a mesh of %d triangles'
+                   % (max_memory, processes, number_of_triangles))
+            raise Exception(msg)
+
+    return block_size
+
+
+def _get_file_blocks(filename, attribute_name, block_size, verbose=False):
+    """Tasks of the blocks of block_size points of the file filename
+    (see _read_fit_block) and the number of points in the file (None if
+    it is not known before reading the file).
+
+    .pts and .npy files are read by blocks of rows by the workers. Other
+    files (.csv, .txt) can only be read through, so their blocks are
+    read here.
+    """
+
+    if filename[-4:] == '.pts':
+        fid = NetCDFFile(filename, netcdf_mode_r)
+        number_of_points = _read_pts_file_header(fid, verbose)[2]
+        fid.close()
+
+        tasks = (('pts', filename, i, min(i + block_size, number_of_points),
+                  attribute_name)
+                 for i in xrange(0, number_of_points, block_size))
+    elif filename[-4:] == '.npy':
+        data = num.load(filename, mmap_mode='r')
+
+        if len(data.shape) != 2 or data.shape[1] < 3:
+            msg = ('File %s should hold an n x (2+a) array of the x, y and '
+                   'the a attributes of the points, got shape %s'
+                   % (filename, data.shape))
+            raise Exception(msg)
+
+        number_of_points = data.shape[0]
+        del data
+
+        tasks = (('npy', filename, i, min(i + block_size, number_of_points))
+                 for i in xrange(0, number_of_points, block_size))
+    else:
+        number_of_points = None
+
+        G_data = Geospatial_data(filename,
+                                 max_read_lines=block_size,
+                                 load_file_now=False,
+                                 verbose=verbose)
+
+        tasks = (('points', G.get_data_points(absolute=True),
+                  G.get_attributes(attribute_name=attribute_name))
+                 for G in G_data)
+
+    return tasks, number_of_points
+
+
+def _read_fit_block(task):
+    """The absolute points and attributes z of the block of task
+    """
+
+    kind = task[0]
+
+    if kind == 'points':
+        points, z = task[1:]
+    elif kind == 'pts':
+        filename, start_row, fin_row, attribute_name = task[1:]
+
+        fid = NetCDFFile(filename, netcdf_mode_r)
+        geo_reference, keys, number_of_points = _read_pts_file_header(fid)
+        pointlist, att_dict = _read_pts_file_blocking(fid, start_row,
+                                                      fin_row, keys)
+        fid.close()
+
+        G = Geospatial_data(pointlist, att_dict, geo_reference)
+        points = G.get_data_points(absolute=True)
+        z = G.get_attributes(attribute_name=attribute_name)
+    elif kind == 'npy':
+        filename, start_row, fin_row = task[1:]
+
+        data = num.load(filename, mmap_mode='r')
+        block = num.array(data[start_row:fin_row], num.float)
+        del data
+
+        points = block[:,:2]
+        if block.shape[1] == 3:
+            z = block[:,2]
+        else:
+            z = block[:,2:]
+    else:
+        msg = 'Unknown kind of block of points: %s' % kind
+        raise Exception(msg)
+
+    return ensure_numeric(points, num.float), ensure_numeric(z, num.float)
+
+
+def _add_block_AtA_Atz(root, triangles, number_of_nodes, points, z,
+                       partial=None):
+    """Add the points of a block with attributes z to the partial
+    [AtA_triangles, Atz, count] (created if None) and return it, where
+    AtA_triangles holds the 3 x 3 blocks of AtA of each triangle (row by
+    row, see fitsmooth.build_matrix_AtA_triangles), Atz is as Fit.Atz and
+    count is the number of points added.
+    """
+
+    k, sigma = root.search_points(points)
+
+    found = k >= 0
+    k = k[found]
+    sigma = sigma[found]
+    z = z[found]
+
+    M = len(triangles)
+
+    if partial is None:
+        partial = [num.zeros((M, 9), num.float),
+                   num.zeros((number_of_nodes,) + z.shape[1:], num.float),
+                   0]
+
+    AtA_triangles, Atz = partial[:2]
+
+    for i in range(3):
+        for j in range(i, 3):
+            a = num.bincount(k, sigma[:,i]*sigma[:,j], minlength=M)
+            AtA_triangles[:,3*i+j] += a
+            if j != i:
+                AtA_triangles[:,3*j+i] += a
+
+        js = triangles[k,i]
+        if len(z.shape) == 1:
+            Atz += num.bincount(js, sigma[:,i]*z, minlength=number_of_nodes)
+        else:
+            for w in range(z.shape[1]):
+                Atz[:,w] += num.bincount(js, sigma[:,i]*z[:,w],
+                                         minlength=number_of_nodes)
+
+    partial[2] += len(points)
+
+    return partial
+
+
+def _add_partials(partial1, partial2):
+    """Sum of two partials of _add_block_AtA_Atz (either can be None)
+    """
+
+    if partial1 is None:
+        return partial2
+    if partial2 is None:
+        return partial1
+
+    partial1[0] += partial2[0]
+    partial1[1] += partial2[1]
+    partial1[2] += partial2[2]
+
+    return partial1
+
+
+class _Fit_progress:
+    """Count the points done by the fit of blocks of points, and report
+    every 10% (or every block if the number of points is not known)
+    if verbose.
+    """
+
+    def __init__(self, number_of_points=None, verbose=False):
+
+        self.number_of_points = number_of_points
+        self.verbose = verbose
+        self.count = 0
+        self.next_percent = 10
+
+    def __call__(self, n):
+
+        self.count += n
+
+        if not self.verbose:
+            return
+
+        if self.number_of_points:
+            percent = 100*self.count/self.number_of_points
+            if percent >= self.next_percent:
+                log.critical('Fit: Done %d of %d points (%d%%)'
+                             % (self.count, self.number_of_points, percent))
+                self.next_percent = (percent/10 + 1)*10
+        else:
+            log.critical('Fit: Done %d points' % self.count)
+
+
+def _fit_worker(mesh, tasks, results):
+    """Worker process of _fit_blocks_parallel: add the blocks of points
+    from the queue tasks (until None) to its partial AtA and Atz, put
+    ('block', n) on the queue results after each block of n points and
+    ('partial', partial) at the end, or ('error', traceback) on error.
+    """
+
+    try:
+        root = MeshQuadtree(mesh)
+
+        partial = None
+        task = tasks.get()
+        while task is not None:
+            points, z = _read_fit_block(task)
+            partial = _add_block_AtA_Atz(root, mesh.triangles,
+                                         mesh.number_of_nodes,
+                                         points, z, partial)
+            results.put(('block', len(points)))
+            task = tasks.get()
+
+        results.put(('partial', partial))
+    except:
+        import traceback
+        results.put(('error', traceback.format_exc()))
+
+
+def _fit_blocks_parallel(mesh, tasks, processes, progress, poll_interval=1.0):
+    """Sum of the partials of processes worker processes (see _fit_worker)
+    fitting the blocks of points of tasks to mesh. There are at most
+    processes blocks waiting for a worker at any time.
+
+    The workers are checked every poll_interval seconds while waiting,
+    and an exception is raised if one exits (eg killed by a signal or out
+    of memory) without putting its partial on the queue.
+    """
+
+    from multiprocessing import Process, Queue
+    from Queue import Full, Empty
+
+    task_queue = Queue(processes)
+    result_queue = Queue()
+
+    workers = [Process(target=_fit_worker,
+                       args=(mesh, task_queue, result_queue))
+               for p in range(processes)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    partial = [None]
+    finished = [0]
+
+    def get_result(timeout=None):
+        """Handle a message from the workers, waiting at most timeout
+        seconds for one (not at all if None). Return True if there was
+        a message.
+        """
+
+        try:
+            if timeout is None:
+                message = result_queue.get(False)
+            else:
+                message = result_queue.get(True, timeout)
+        except Empty:
+            return False
+
+        if message[0] == 'error':
+            msg = 'Fit: Error in worker process:\n%s' % message[1]
+            raise Exception(msg)
+        elif message[0] == 'block':
+            progress(message[1])
+        else:
+            partial[0] = _add_partials(partial[0], message[1])
+            finished[0] += 1
+
+        return True
+
+    def check_workers():
+        """Raise an exception if a worker has exited without putting its
+        partial on the queue
+        """
+
+        exited = [worker for worker in workers if not worker.is_alive()]
+        if len(exited) > finished[0]:
+            # The messages of a worker are all in the queue once it has
+            # exited
+            while get_result(0.1):
+                pass
+
+        if len(exited) > finished[0]:
+            msg = 'Fit: %d worker process(es) exited without a result ' \
+                  % (len(exited) - finished[0])
+            msg += '(exit codes %s)' % [worker.exitcode for worker in exited]
+            raise Exception(msg)
+
+    def put_task(task):
+        while True:
+            try:
+                task_queue.put(task, True, poll_interval)
+                return
+            except Full:
+                pass
+
+            # Report the progress (and errors) while the workers are busy
+            while get_result():
+                pass
+            check_workers()
+
+    try:
+        for task in tasks:
+            put_task(task)
+
+        for worker in workers:
+            put_task(None)
+
+        while finished[0] < processes:
+            if not get_result(poll_interval):
+                check_workers()
+    except:
+        for worker in workers:
+            worker.terminate()
+        raise
+
+    for worker in workers:
+        worker.join()
+
+    return partial[0]
+
+
 #poin_coordiantes can also be a points file name
 
 def fit_to_mesh(point_coordinates,
@@ -386,7 +842,9 @@ def fit_to_mesh(point_coordinates,
                 attribute_name=None,
                 use_cache=False,
                 cg_precon='Jacobi',
-                use_c_cg=True):
+                use_c_cg=True,
+                processes=1,
+                max_memory=None):
     """Wrapper around internal function _fit_to_mesh for use with caching.
     """
 
@@ -402,7 +860,9 @@ def fit_to_mesh(point_coordinates,
               'max_read_lines': max_read_lines,
               'attribute_name': attribute_name,
               'cg_precon': cg_precon,
-              'use_c_cg': use_c_cg
+              'use_c_cg': use_c_cg,
+              'processes': processes,
+              'max_memory': max_memory
               }
 
     if use_cache is True:
@@ -440,7 +900,9 @@ def _fit_to_mesh(point_coordinates,
                  max_read_lines=None,
                  attribute_name=None,
                  cg_precon='Jacobi',
-                 use_c_cg=True):
+                 use_c_cg=True,
+                 processes=1,
+                 max_memory=None):
     """
     Fit a smooth surface to a triangulation,
     given data points with attributes.
@@ -470,6 +932,12 @@ def _fit_to_mesh(point_coordinates,
           point_attributes: Vector or array of data at the
                             point_coordinates.
 
+          processes: Number of worker processes fitting blocks of the
+                     points (see Fit.fit).
+
+          max_memory: Approximate cap in bytes on the memory used by
+                      the blocks of points (see Fit.fit).
+
     """
 
     if mesh is None:
@@ -499,7 +967,9 @@ def _fit_to_mesh(point_coordinates,
                                    point_origin=data_origin,
                                    max_read_lines=max_read_lines,
                                    attribute_name=attribute_name,
-                                   verbose=verbose)
+                                   verbose=verbose,
+                                   processes=processes,
+                                   max_memory=max_memory)
 
     # Add the value checking stuff that's in least squares.
     # Maybe this stuff should get pushed down into Fit.
@@ -250,7 +250,71 @@ int _build_matrix_AtA_Atz_points(int N, long * triangles,
     return 0;
 }
 
-// Combines two sparse_dok matricies and two vectors of doubles. 
+// Searches the quad tree for the triangles containing each of the npts
+// points, storing the index of the triangle (-1 if no triangle contains
+// the point) and the sigma values of the point in the triangle (-1 if no
+// triangle contains the point).
+int _search_points(quad_tree * quadtree, int npts,
+                   double * point_coordinates,
+                   long * index, double * sigma)
+{
+    int k;
+
+    #pragma omp parallel for private(k)
+    for(k=0;k<npts;k++){
+
+        double x = point_coordinates[2*k];
+        double y = point_coordinates[2*k+1];
+        triangle * T = search(quadtree,x,y);
+
+        if(T!=NULL){
+            double * s = calculate_sigma(T,x,y);
+            sigma[3*k] = s[0];
+            sigma[3*k+1] = s[1];
+            sigma[3*k+2] = s[2];
+            free(s);
+            index[k] = (long)T->index;
+        }else{
+            sigma[3*k] = sigma[3*k+1] = sigma[3*k+2] = -1;
+            index[k] = -1;
+        }
+    }
+
+    return 0;
+}
+
+// Adds the 3 x 3 blocks AtA_triangles (stored row by row, 9 values per
+// triangle) of the N triangles to the sparse_dok AtA, at the rows and
+// columns of the vertices of the triangles. Zero blocks (triangles
+// without points) are skipped.
+int _add_AtA_triangles(int N, long * triangles,
+                       double * AtA_triangles,
+                       sparse_dok * AtA)
+{
+    int k,i,w;
+    edge_key_t key;
+
+    for(k=0;k<N;k++){
+        double * block = AtA_triangles + 9*k;
+
+        for(i=0;i<9;i++){
+            if(block[i]!=0) break;
+        }
+        if(i==9) continue;
+
+        for(i=0;i<3;i++){
+            for(w=0;w<3;w++){
+                key.i=triangles[3*k+i];
+                key.j=triangles[3*k+w];
+                add_dok_entry(AtA,key,block[3*i+w]);
+            }
+        }
+    }
+
+    return 0;
+}
+
+// Combines two sparse_dok matricies and two vectors of doubles.
 void _combine_partial_AtA_Atz(sparse_dok * dok_AtA1,sparse_dok * dok_AtA2,
                              double* Atz1,
                              double* Atz2,
@@ -620,6 +684,54 @@ PyObject *individual_tree_search(PyObject *self, PyObject *args) {
     return retlist;
 }
 
+// Searches a quad tree struct for the triangles containing each of an
+// array of points (see _search_points). The index and sigma arrays,
+// of lengths npts and 3*npts, are filled in.
+PyObject *tree_search_points(PyObject *self, PyObject *args) {
+
+    PyObject *tree;
+    PyArrayObject *point_coordinates;
+    PyArrayObject *index;
+    PyArrayObject *sigma;
+    int err;
+
+    // Convert Python arguments to C
+    if (!PyArg_ParseTuple(args, "OOOO", &tree,
+                                            &point_coordinates,
+                                            &index,
+                                            &sigma
+                                            )) {
+      PyErr_SetString(PyExc_RuntimeError,
+              "fitsmooth.c: could not parse input");
+      return NULL;
+    }
+
+    CHECK_C_CONTIG(point_coordinates);
+    CHECK_C_CONTIG(index);
+    CHECK_C_CONTIG(sigma);
+
+    #ifdef PYVERSION273
+    quad_tree * quadtree = (quad_tree*) PyCapsule_GetPointer(tree,"quad tree");
+    #else
+    quad_tree * quadtree = (quad_tree*) PyCObject_AsVoidPtr(tree);
+    #endif
+
+    int npts = point_coordinates->dimensions[0];
+
+    err = _search_points(quadtree, npts,
+                         (double*) point_coordinates->data,
+                         (long*) index->data,
+                         (double*) sigma->data);
+
+    if (err != 0) {
+      PyErr_SetString(PyExc_RuntimeError,
+              "Unknown Error");
+      return NULL;
+    }
+
+    return Py_BuildValue("");
+}
+
 // Returns the total number of triangles stored in quad_tree.
 // Takes a capsule object holding a pointer to the quad_tree as input.
 //
@@ -678,6 +790,55 @@ PyObject *nodes_in_tree(PyObject *self, PyObject *args) {
     
 }
 
+// Builds the sparse_dok AtA from the 3 x 3 blocks of AtA of each triangle
+// (see _add_AtA_triangles), as accumulated by blocks of points in
+// parallel by fit.py, and returns it as the capsule used for AtA by
+// build_matrix_AtA_Atz_points.
+PyObject *build_matrix_AtA_triangles(PyObject *self, PyObject *args) {
+
+    PyArrayObject *triangles;
+    PyArrayObject *AtA_triangles;
+    int N; // Number of triangles
+    int err;
+
+    // Convert Python arguments to C
+    if (!PyArg_ParseTuple(args, "iOO", &N,
+                                        &triangles,
+                                        &AtA_triangles
+                                            )) {
+      PyErr_SetString(PyExc_RuntimeError,
+              "fitsmooth.c: could not parse input");
+      return NULL;
+    }
+
+    CHECK_C_CONTIG(triangles);
+    CHECK_C_CONTIG(AtA_triangles);
+
+    sparse_dok * dok_AtA = make_dok();
+
+    err = _add_AtA_triangles(N, (long*) triangles->data,
+                             (double*) AtA_triangles->data,
+                             dok_AtA);
+
+    if (err != 0) {
+      delete_dok_matrix(dok_AtA);
+      PyErr_SetString(PyExc_RuntimeError,
+              "Unknown Error");
+      return NULL;
+    }
+
+    #ifdef PYVERSION273
+    PyObject * AtA_cap =  PyCapsule_New((void*) dok_AtA,
+                  "sparse dok",
+                  &delete_dok_cap);
+    #else
+    PyObject * AtA_cap =  PyCObject_FromVoidPtr((void*) dok_AtA,
+                  &delete_dok_cobj);
+    #endif
+
+    return AtA_cap;
+}
+
 // Combines two sparse_dok and two double arrays together
 // which represent partial completion of the AtA and Atz matrices, when they are build
 // in parts due to points being read in blocks in python. Result is stored in the first
@@ -865,7 +1026,9 @@ static struct PyMethodDef MethodTable[] = {
     {"build_smoothing_matrix",build_smoothing_matrix, METH_VARARGS, "Print out"},
     {"build_matrix_AtA_Atz_points",build_matrix_AtA_Atz_points, METH_VARARGS, "Print out"},
     {"combine_partial_AtA_Atz",combine_partial_AtA_Atz, METH_VARARGS, "Print out"},
+    {"build_matrix_AtA_triangles",build_matrix_AtA_triangles, METH_VARARGS, "Print out"},
     {"individual_tree_search",individual_tree_search, METH_VARARGS, "Print out"},
+    {"tree_search_points",tree_search_points, METH_VARARGS, "Print out"},
 	{NULL, NULL, 0, NULL}   // sentinel
 };
 
@@ -41,6 +41,7 @@ from anuga.geospatial_data.geospatial_data import Geospatial_data
 from anuga.geospatial_data.geospatial_data import ensure_absolute
 from anuga.pmesh.mesh_quadtree import MeshQuadtree
 from anuga.fit_interpolate.general_fit_interpolate import FitInterpolate
+from anuga.fit_interpolate.operator_cache import get_cached_interpolation_matrix
 from anuga.abstract_2d_finite_volumes.file_function import file_function
 from anuga.config import netcdf_mode_r, netcdf_mode_w, netcdf_mode_a
 from anuga.geometry.polygon import interpolate_polyline, in_and_outside_polygon
@@ -197,7 +198,8 @@ class Interpolate (FitInterpolate):
                     start_blocking_len=500000,
                     NODATA_value = NAN,
                     verbose=False,
-                    output_centroids=False):
+                    output_centroids=False,
+                    use_cache=False):
         """Interpolate mesh data f to determine values, z, at points.
 
         f is the data on the mesh vertices.
@@ -220,6 +222,9 @@ class Interpolate (FitInterpolate):
           start_blocking_len: If the # of points is more or greater than this,
               start blocking
 
+          use_cache: Take the interpolation matrix from the operator cache
+              on disk (see interpolate_block)
+
         Output:
           Interpolated values at inputted points (z).
         """
@@ -257,7 +262,8 @@ class Interpolate (FitInterpolate):
                or start_blocking_len == 0:
                 self._A_can_be_reused = True
                 z = self.interpolate_block(f, point_coordinates, NODATA_value = NODATA_value,
-                                           verbose=verbose, output_centroids=output_centroids)
+                                           verbose=verbose, output_centroids=output_centroids,
+                                           use_cache=use_cache)
             else:
                 # Handle blocking
                 self._A_can_be_reused = False
@@ -274,13 +280,15 @@ class Interpolate (FitInterpolate):
                                  len(point_coordinates),
                                  start_blocking_len):
                     t = self.interpolate_block(f, point_coordinates[start:end], NODATA_value=NODATA_value,
-                                               verbose=verbose, output_centroids=output_centroids)
+                                               verbose=verbose, output_centroids=output_centroids,
+                                               use_cache=use_cache)
                     z = num.concatenate((z, t), axis=0)    #??default#
                     start = end
 
                 end = len(point_coordinates)
                 t = self.interpolate_block(f, point_coordinates[start:end], NODATA_value=NODATA_value,
-                                           verbose=verbose, output_centroids=output_centroids)
+                                           verbose=verbose, output_centroids=output_centroids,
+                                           use_cache=use_cache)
                 z = num.concatenate((z, t), axis=0)    #??default#
         return z
 
@@ -307,36 +315,12 @@ class Interpolate (FitInterpolate):
         point_coordinates = ensure_numeric(point_coordinates, num.float)
         f = ensure_numeric(f, num.float)
 
-        from anuga.caching import myhash
-        import sys
-
         if use_cache is True:
-            if sys.platform != 'win32':
-                # FIXME (Ole): (Why doesn't this work on windoze?)
-                # Still absolutely fails on Win 24 Oct 2008
-
-                X = cache(self._build_interpolation_matrix_A,
-                          args=(point_coordinates, output_centroids),
-                          kwargs={'verbose': verbose},
-                          verbose=verbose)
-            else:
-                # FIXME
-                # Hash point_coordinates to memory location, reuse if possible
-                # This will work on Linux as well if we want to use it there.
-                key = myhash(point_coordinates)
-
-                reuse_A = False
-
-                if self.interpolation_matrices.has_key(key):
-                    X, stored_points = self.interpolation_matrices[key]
-                    if num.alltrue(stored_points == point_coordinates):
-                        reuse_A = True                # Reuse interpolation matrix
-
-                if reuse_A is False:
-                    X = self._build_interpolation_matrix_A(point_coordinates,
-                                                           output_centroids,
-                                                           verbose=verbose)
-                    self.interpolation_matrices[key] = (X, point_coordinates)
+            # The interpolation matrix of the points from the operator
+            # cache on disk, built and stored there if not found
+            X = get_cached_interpolation_matrix(self, point_coordinates,
+                                                output_centroids,
+                                                verbose=verbose)
         else:
             X = self._build_interpolation_matrix_A(point_coordinates, output_centroids,
                                                    verbose=verbose)
@@ -384,8 +368,7 @@ class Interpolate (FitInterpolate):
         z = self._A * f
 
         # Taking into account points outside the mesh.
-        for i in self.outside_poly_indices:
-            z[i] = NODATA_value
+        z[num.array(self.outside_poly_indices, num.int)] = NODATA_value
         return z
 
 
@@ -437,54 +420,58 @@ class Interpolate (FitInterpolate):
         if verbose: log.critical('Number of datapoints: %d' % n)
         if verbose: log.critical('Number of basis functions: %d' % m)
 
-        A = Sparse(n,m)
-
-        n = len(inside_boundary_indices)
-
-        centroids = []
-        inside_poly_indices = []
-        
         # Compute matrix elements for points inside the mesh
         if verbose: log.critical('Building interpolation matrix from %d points'
-                                 % n)
+                                 % len(inside_boundary_indices))
 
-        for d, i in enumerate(inside_boundary_indices):
-            # For each data_coordinate point
-            if verbose and d%((n+10)/10)==0: log.critical('Doing %d of %d'
-                                                          %(d, n))
+        inside_boundary_indices = num.array(inside_boundary_indices, num.int)
+        outside_poly_indices = num.array(outside_poly_indices, num.int)
 
-            x = point_coordinates[i]
-            element_found, sigma0, sigma1, sigma2, k = self.root.search_fast(x)         
-            # Update interpolation matrix A if necessary
-            if element_found is True:
+        # Find the triangle of each point (and its weights) in C
+        k, sigmas = \
+            self.root.search_points(point_coordinates[inside_boundary_indices])
 
-                #if verbose:
-                #    print 'Point is within mesh:', d, i
-            
-                inside_poly_indices.append(i)
-                
-                # Assign values to matrix A
-                j0 = self.mesh.triangles[k,0] # Global vertex id for sigma0
-                j1 = self.mesh.triangles[k,1] # Global vertex id for sigma1
-                j2 = self.mesh.triangles[k,2] # Global vertex id for sigma2
-                js = [j0, j1, j2]
-                
-                if output_centroids is False:
-                    # Weight each vertex according to its distance from x
-                    sigmas = {j0:sigma0, j1:sigma1, j2:sigma2}
-                    for j in js:
-                        A[i, j] = sigmas[j]
-                else:
-                    # If centroids are needed, weight all 3 vertices equally
-                    for j in js:
-                        A[i, j] = 1.0/3.0
-                    centroids.append(self.mesh.centroid_coordinates[k])                        
-            else:
-                if verbose:
-                    log.critical('Mesh has a hole - moving this point to outside list')
+        element_found = k >= 0
+
+        if verbose and not num.all(element_found):
+            log.critical('Mesh has a hole - moving %d points to outside list'
+                         % num.sum(~element_found))
+
+        inside_poly_indices = inside_boundary_indices[element_found]
+        outside_poly_indices = num.concatenate((outside_poly_indices,
+                               inside_boundary_indices[~element_found]))
+
+        k = k[element_found]
+
+        # Global vertex ids of the triangles, and their weights
+        js = self.mesh.triangles[k]
+        if output_centroids is False:
+            # Weight each vertex according to its distance from x
+            sigmas = sigmas[element_found]
+            centroids = []
+        else:
+            # If centroids are needed, weight all 3 vertices equally
+            sigmas = num.ones(js.shape, num.float)/3.0
+            centroids = self.mesh.centroid_coordinates[k]
+
+        # Build the n x m interpolation matrix A in CSR format, with three
+        # entries (sorted by column) in the rows of the points inside
+        # the mesh
+        order = num.argsort(inside_poly_indices, kind='mergesort')
+        rows = inside_poly_indices[order]
+        js = js[order]
+        sigmas = sigmas[order]
+
+        columns = num.argsort(js, axis=1, kind='mergesort')
+        points = num.arange(len(js)).reshape(-1,1)
+        js = js[points, columns]
+        sigmas = sigmas[points, columns]
+
+        row_ptr = num.zeros(n+1, num.int)
+        row_ptr[1:] = num.cumsum(3*num.bincount(rows, minlength=n))
 
-                # This is a numpy arrays, so we need to do a slow transfer
-                outside_poly_indices = num.append(outside_poly_indices, [i], axis=0)
+        A = Sparse_CSR(None, num.array(sigmas.ravel(), num.float),
+                       num.array(js.ravel(), num.int), row_ptr, n, m)
 
         return A, inside_poly_indices, outside_poly_indices, centroids
 
@@ -648,6 +635,25 @@ def interpolate_sww2csv(sww_file,
             froude_writer.writerow(froudes)
 
 
+class Array_time_slices:
+    """Timesteps of the arrays of quantities in memory, see
+    Interpolation_function
+    """
+
+    def __init__(self, quantities):
+        self.quantities = quantities
+
+    def __call__(self, name, start, stop, step):
+        Q = ensure_numeric(self.quantities[name], num.float)
+
+        if len(Q.shape) == 2:
+            return Q[start:stop:step,:]
+        else:
+            # No time dependency
+            n = len(range(start, stop, step))
+            return num.resize(Q, (n, len(Q)))
+
+
 class Interpolation_function:
     """Interpolation_interface - creates callable object f(t, id) or f(t,x,y)
     which is interpolated from time series defined at vertices of
@@ -702,12 +708,31 @@ class Interpolation_function:
                  time_thinning=1,
                  verbose=False,
                  gauge_neighbour_id=None,
-                 output_centroids=False):
+                 output_centroids=False,
+                 use_cache=False,
+                 time_window=None,
+                 time_slices=None):
         """Initialise object and build spatial interpolation if required
 
         Time_thinning_number controls how many timesteps to use. Only timesteps
         with index%time_thinning_number == 0 will used, or in other words a
         value of 3, say, will cause the algorithm to use every third time step.
+
+        With use_cache the interpolation matrix of the interpolation points
+        is taken from the operator cache (see operator_cache.py).
+
+        With time_window (a number of timesteps, at least 2) and interpolation
+        points, only a window of time_window timesteps around the model time
+        is interpolated and kept in precomputed_values. The window moves with
+        the model time, and the timesteps following it are read and
+        interpolated in a background thread, so that at most
+        2*time_window-1 timesteps are held at any time.
+
+        time_slices is an object such that time_slices(name, start, stop, step)
+        returns the values at the vertices of the quantity name at the
+        timesteps time[start:stop:step] (before thinning), e.g. a
+        Netcdf_time_slices of a file. It is used instead of quantities
+        (which may then be None) with time_window.
         """
 
         from anuga.config import time_format
@@ -724,7 +749,7 @@ class Interpolation_function:
             raise Exception(msg)
 
         # Check if quantities is a single array only
-        if not isinstance(quantities, dict):
+        if time_slices is None and not isinstance(quantities, dict):
             quantities = ensure_numeric(quantities)
             quantity_names = ['Attribute']
 
@@ -733,8 +758,23 @@ class Interpolation_function:
 
         # Use keys if no names are specified
         if quantity_names is None:
+            msg = 'quantity_names must be specified with time_slices'
+            assert time_slices is None, msg
             quantity_names = quantities.keys()
 
+        if time_window is not None and interpolation_points is not None:
+            msg = 'time_window must be at least 2. I got %s' % str(time_window)
+            assert time_window >= 2, msg
+
+            if time_slices is None:
+                # Read the timesteps from the arrays
+                time_slices = Array_time_slices(quantities)
+        else:
+            msg = 'time_slices can only be used with time_window and '
+            msg += 'interpolation_points'
+            assert time_slices is None, msg
+            time_window = None
+
         # Check spatial info
         if vertex_coordinates is None:
             self.spatial = False
@@ -755,18 +795,21 @@ class Interpolation_function:
         # Thin timesteps if needed
         # Note array() is used to make the thinned arrays contiguous in memory
         self.time = num.array(time[::time_thinning])
-        for name in quantity_names:
-            if len(quantities[name].shape) == 2:
-                quantities[name] = num.array(quantities[name][::time_thinning,:])
+        if time_window is None:
+            for name in quantity_names:
+                if len(quantities[name].shape) == 2:
+                    quantities[name] = num.array(quantities[name][::time_thinning,:])
 
         if verbose is True:
             log.critical('Interpolation_function: precomputing')
 
         # Save for use with statistics
+        # (of the timesteps read so far with time_window)
         self.quantities_range = {}
-        for name in quantity_names:
-            q = quantities[name][:].flatten()
-            self.quantities_range[name] = [min(q), max(q)]
+        if time_window is None:
+            for name in quantity_names:
+                q = quantities[name][:].flatten()
+                self.quantities_range[name] = [min(q), max(q)]
 
         self.quantity_names = quantity_names
         self.vertex_coordinates = vertex_coordinates
@@ -776,6 +819,12 @@ class Interpolation_function:
         self.precomputed_values = {}
         self.centroids = []
 
+        # Window of timesteps in precomputed_values (all of them
+        # without time_window)
+        self.time_window = time_window
+        self.window_start = 0
+        self.read_ahead = None
+
         # Precomputed spatial interpolation if requested
         if interpolation_points is not None:
             #no longer true. sts files have spatial = True but
@@ -867,14 +916,16 @@ class Interpolation_function:
             m = len(self.interpolation_points)
             p = len(self.time)
 
-            for name in quantity_names:
-                self.precomputed_values[name] = num.zeros((p, m), num.float)
+            if time_window is None:
+                for name in quantity_names:
+                    self.precomputed_values[name] = num.zeros((p, m), num.float)
 
             if verbose is True:
                 log.critical('Build interpolator')
 
 
             # Build interpolator
+            interpol = None
             if triangles is not None and vertex_coordinates is not None:
                 if verbose:
                     msg = 'Building interpolation matrix from source mesh '
@@ -894,49 +945,69 @@ class Interpolation_function:
 
 
 
-            if verbose:
-                log.critical('Interpolating (%d interpolation points, %d timesteps).'
-                             % (self.interpolation_points.shape[0], self.time.shape[0]))
+            if time_window is not None:
+                # Interpolate the first window, the others as the
+                # model time moves
+                self.time_slices = time_slices
+                self.time_thinning = time_thinning
+                self.interpolator = interpol
+                self.gauge_neighbour_id = gauge_neighbour_id
+                self.output_centroids = output_centroids
+                self.use_cache = use_cache
 
-                if time_thinning > 1:
-                    log.critical('Timesteps were thinned by a factor of %d'
-                                 % time_thinning)
-                else:
-                    log.critical()
+                if verbose:
+                    log.critical('Interpolating windows of %d timesteps '
+                                 '(%d interpolation points, %d timesteps).'
+                                 % (time_window,
+                                    self.interpolation_points.shape[0],
+                                    self.time.shape[0]))
 
-            for i, t in enumerate(self.time):
-                # Interpolate quantities at this timestep
-                #if verbose and i%((p+10)/10) == 0:
+                self._move_window(0)
+            else:
                 if verbose:
-                    log.critical('  time step %d of %d' % (i, p))
+                    log.critical('Interpolating (%d interpolation points, %d timesteps).'
+                                 % (self.interpolation_points.shape[0], self.time.shape[0]))
 
-                for name in quantity_names:
-                    if len(quantities[name].shape) == 2:
-                        Q = quantities[name][i,:] # Quantities at timestep i
+                    if time_thinning > 1:
+                        log.critical('Timesteps were thinned by a factor of %d'
+                                     % time_thinning)
                     else:
-                        Q = quantities[name][:]   # No time dependency
+                        log.critical()
 
+                for i, t in enumerate(self.time):
+                    # Interpolate quantities at this timestep
                     #if verbose and i%((p+10)/10) == 0:
                     if verbose:
-                        log.critical('    quantity %s, size=%d' % (name, len(Q)))
-
-                    # Interpolate
-                    if triangles is not None and vertex_coordinates is not None:
-                        result = interpol.interpolate(Q,
-                                                      point_coordinates=\
-                                                      self.interpolation_points,
-                                                      verbose=False,
-                                                      output_centroids=output_centroids)
-                        self.centroids = interpol.centroids                                                          
-                    elif triangles is None and vertex_coordinates is not None:
-                        result = interpolate_polyline(Q,
-                                                      vertex_coordinates,
-                                                      gauge_neighbour_id,
-                                                      interpolation_points=\
-                                                          self.interpolation_points)
-
-                    #assert len(result), len(interpolation_points)
-                    self.precomputed_values[name][i, :] = result                                    
+                        log.critical('  time step %d of %d' % (i, p))
+
+                    for name in quantity_names:
+                        if len(quantities[name].shape) == 2:
+                            Q = quantities[name][i,:] # Quantities at timestep i
+                        else:
+                            Q = quantities[name][:]   # No time dependency
+
+                        #if verbose and i%((p+10)/10) == 0:
+                        if verbose:
+                            log.critical('    quantity %s, size=%d' % (name, len(Q)))
+
+                        # Interpolate
+                        if triangles is not None and vertex_coordinates is not None:
+                            result = interpol.interpolate(Q,
+                                                          point_coordinates=\
+                                                          self.interpolation_points,
+                                                          verbose=False,
+                                                          output_centroids=output_centroids,
+                                                          use_cache=use_cache)
+                            self.centroids = interpol.centroids                                                          
+                        elif triangles is None and vertex_coordinates is not None:
+                            result = interpolate_polyline(Q,
+                                                          vertex_coordinates,
+                                                          gauge_neighbour_id,
+                                                          interpolation_points=\
+                                                              self.interpolation_points)
+
+                        #assert len(result), len(interpolation_points)
+                        self.precomputed_values[name][i, :] = result                                    
                     
             # Report
             if verbose:
@@ -983,25 +1054,7 @@ class Interpolation_function:
                           'parameter point_id can be used'
                     raise Exception(msg)
 
-        msg = 'Model time %.16f' % t
-        msg += ' is not contained in function domain [%.16f:%.16f].\n' % (self.time[0], self.time[-1])
-        if t < self.time[0]: raise Modeltime_too_early(msg)
-        if t > self.time[-1]: raise Modeltime_too_late(msg)
-
-        oldindex = self.index #Time index
-
-        # Find current time slot
-        while t > self.time[self.index]: self.index += 1
-        while t < self.time[self.index]: self.index -= 1
-
-        if t == self.time[self.index]:
-            # Protect against case where t == T[-1] (last time)
-            #  - also works in general when t == T[i]
-            ratio = 0
-        else:
-            # t is now between index and index+1
-            ratio = ((t - self.time[self.index]) /
-                         (self.time[self.index+1] - self.time[self.index]))
+        ratio = self._get_time_ratio(t)
 
         # Compute interpolated values
         q = num.zeros(len(self.quantity_names), num.float)
@@ -1020,9 +1073,10 @@ class Interpolation_function:
                     raise Exception('x,y interpolation not yet implemented')
                 else:
                     # Use precomputed point
-                    Q0 = Q[self.index, point_id]
+                    j = self.index - self.window_start
+                    Q0 = Q[j, point_id]
                     if ratio > 0:
-                        Q1 = Q[self.index+1, point_id]
+                        Q1 = Q[j+1, point_id]
 
             # Linear temporal interpolation
             if ratio > 0:
@@ -1057,6 +1111,257 @@ class Interpolation_function:
 
                 return res
 
+    def _get_time_ratio(self, t):
+        """Move self.index to the time slot containing t and return the
+        ratio of t between time[index] and time[index+1] (0 if t is
+        time[index])
+        """
+
+        msg = 'Model time %.16f' % t
+        msg += ' is not contained in function domain [%.16f:%.16f].\n' % (self.time[0], self.time[-1])
+        if t < self.time[0]: raise Modeltime_too_early(msg)
+        if t > self.time[-1]: raise Modeltime_too_late(msg)
+
+        # Find current time slot
+        while t > self.time[self.index]: self.index += 1
+        while t < self.time[self.index]: self.index -= 1
+
+        if t == self.time[self.index]:
+            # Protect against case where t == T[-1] (last time)
+            #  - also works in general when t == T[i]
+            ratio = 0
+        else:
+            # t is now between index and index+1
+            ratio = ((t - self.time[self.index]) /
+                         (self.time[self.index+1] - self.time[self.index]))
+
+        if self.time_window is not None:
+            self._move_window(ratio)
+
+        return ratio
+
+    def _move_window(self, ratio):
+        """Move the window of precomputed_values so that it contains the
+        timesteps index and (if ratio > 0) index+1, and start reading the
+        timesteps after it.
+        """
+
+        first = self.index
+        if ratio > 0:
+            last = self.index + 1
+        else:
+            last = self.index
+
+        start = self.window_start
+        stop = start + len(self.precomputed_values.get(self.quantity_names[0],
+                                                       []))
+        if start <= first and last < stop:
+            return
+
+        p = len(self.time)
+        new_start = max(min(first, p - self.time_window), 0)
+        new_stop = min(new_start + self.time_window, p)
+
+        # Timesteps from the window, the read ahead and read now
+        keep_start = max(start, new_start)
+        keep_stop = min(stop, new_stop)
+        if keep_start >= keep_stop:
+            keep_start = keep_stop = new_start
+
+        values = {}
+        for name in self.quantity_names:
+            values[name] = num.zeros((new_stop - new_start,
+                                      len(self.interpolation_points)),
+                                     num.float)
+            if keep_start < keep_stop:
+                values[name][keep_start-new_start:keep_stop-new_start] = \
+                    self.precomputed_values[name][keep_start-start:
+                                                  keep_stop-start]
+
+        for a, b in [(new_start, keep_start), (keep_stop, new_stop)]:
+            while a < b:
+                X, a_stop = self._get_read_ahead(a, b)
+                if X is None:
+                    a_stop = b
+                    X = self._interpolate_time_slices(a, b)
+
+                for name in self.quantity_names:
+                    values[name][a-new_start:a_stop-new_start] = X[name]
+                a = a_stop
+
+        self.precomputed_values = values
+        self.window_start = new_start
+
+        # Read the timesteps needed when the model time leaves the window
+        self._start_read_ahead(new_stop, min(new_stop + self.time_window - 1,
+                                             p))
+
+    def _interpolate_time_slices(self, start, stop):
+        """Dictionary of arrays of the values of the quantities at the
+        interpolation points at timesteps start to stop (of the thinned
+        time vector)
+        """
+
+        step = self.time_thinning
+
+        values = {}
+        for name in self.quantity_names:
+            Q = self.time_slices(name, start*step, (stop-1)*step + 1, step)
+            Q = num.array(Q, num.float)
+
+            q_min, q_max = num.min(Q), num.max(Q)
+            if self.quantities_range.has_key(name):
+                q_min = min(q_min, self.quantities_range[name][0])
+                q_max = max(q_max, self.quantities_range[name][1])
+            self.quantities_range[name] = [q_min, q_max]
+
+            if self.interpolator is not None:
+                # The interpolation matrix is built once
+                if self.interpolator._A_can_be_reused:
+                    point_coordinates = None
+                else:
+                    point_coordinates = self.interpolation_points
+
+                result = self.interpolator.interpolate(
+                              num.transpose(Q),
+                              point_coordinates=point_coordinates,
+                              output_centroids=self.output_centroids,
+                              use_cache=self.use_cache)
+                self.centroids = self.interpolator.centroids
+
+                values[name] = num.transpose(result)
+            else:
+                values[name] = num.zeros((stop - start,
+                                          len(self.interpolation_points)),
+                                         num.float)
+                for i in range(stop - start):
+                    values[name][i,:] = \
+                        interpolate_polyline(Q[i],
+                                             self.vertex_coordinates,
+                                             self.gauge_neighbour_id,
+                                             interpolation_points=\
+                                                 self.interpolation_points)
+
+        return values
+
+    def _start_read_ahead(self, start, stop):
+        """Interpolate timesteps start to stop in a background thread
+        """
+
+        import threading
+
+        if start >= stop:
+            return
+
+        self.read_ahead_values = None
+        self.read_ahead_error = None
+
+        thread = threading.Thread(target=self._read_ahead,
+                                  args=(start, stop),
+                                  name='Interpolation_function read ahead')
+        thread.daemon = True
+        thread.start()
+
+        self.read_ahead = (start, stop, thread)
+
+    def _read_ahead(self, start, stop):
+        """Body of the read ahead thread
+        """
+
+        try:
+            self.read_ahead_values = self._interpolate_time_slices(start, stop)
+        except Exception, e:
+            self.read_ahead_error = e
+
+    def _get_read_ahead(self, start, stop):
+        """Wait for the read ahead and return the values of the timesteps
+        from start it has read (up to stop) and the timestep after them,
+        or None and start if it has not read timestep start
+        """
+
+        if self.read_ahead is None:
+            return None, start
+
+        a, b, thread = self.read_ahead
+        thread.join()
+        self.read_ahead = None
+
+        values = self.read_ahead_values
+        self.read_ahead_values = None
+
+        if self.read_ahead_error is not None:
+            msg = 'Reading timesteps %d to %d failed: %s' \
+                  % (a, b, self.read_ahead_error)
+            raise Exception(msg)
+
+        if not a <= start < b:
+            return None, start
+
+        stop = min(stop, b)
+        X = {}
+        for name in self.quantity_names:
+            X[name] = values[name][start-a:stop-a]
+
+        return X, stop
+
+    def __getstate__(self):
+        """Wait for the read ahead thread, which cannot be pickled
+        """
+
+        if self.read_ahead is not None:
+            self.read_ahead[2].join()
+
+        state = self.__dict__.copy()
+        state['read_ahead'] = None
+        state['read_ahead_values'] = None
+
+        return state
+
+    def get_values(self, t, point_ids):
+        """Evaluate f(t, point_id) for an array of point_ids at once
+
+        Inputs:
+          t:         time - Model time. Must lie within existing timesteps
+          point_ids: indices of the preprocessed points
+
+        Returns an array of shape (len(point_ids), number of quantities)
+        with the same values as f(t, point_id) for each of the point_ids.
+        Without spatial info the values of f(t) are repeated for each
+        point.
+        """
+
+        if self.spatial is True and self.interpolation_points is None:
+            msg = 'Interpolation_function must be instantiated ' + \
+                  'with a list of interpolation points before ' + \
+                  'get_values can be used'
+            raise Exception(msg)
+
+        point_ids = num.asarray(point_ids, num.int)
+
+        ratio = self._get_time_ratio(t)
+
+        q = num.zeros((len(point_ids), len(self.quantity_names)), num.float)
+        for i, name in enumerate(self.quantity_names):
+            Q = self.precomputed_values[name]
+
+            if self.spatial is False:
+                Q0 = Q[self.index]
+                if ratio > 0: Q1 = Q[self.index+1]
+            else:
+                j = self.index - self.window_start
+                Q0 = Q[j, point_ids]
+                if ratio > 0: Q1 = Q[j+1, point_ids]
+
+            # Linear temporal interpolation, keeping NANs at both ends
+            if ratio > 0:
+                with num.errstate(invalid='ignore'):
+                    q[:,i] = num.where(num.logical_and(Q0 == NAN, Q1 == NAN),
+                                       Q0, Q0 + ratio*(Q1 - Q0))
+            else:
+                q[:,i] = Q0
+
+        return q
+
     def get_time(self):
         """Return model time as a vector of timesteps
         """
@@ -0,0 +1,204 @@
+"""Cache of interpolation operators on disk, to skip the location of the
+points in the mesh when the same points are interpolated from the same
+mesh again, within a run or in another run or process.
+
+The key of an entry is a hash of the content (rather than the average,
+as caching.myhash) of the mesh (nodes and triangles) and of the points,
+and of the kind and parameters of the operator. An entry is a directory
+of .npy files, one per array of the operator (for an interpolation
+matrix the CSR arrays and the indices of the points inside and outside
+the mesh), which are memory mapped when the entry is read, so that the
+processes using an entry share its pages.
+
+Entries are written under a temporary name and then renamed, so that
+several processes (or the processors of a parallel run) can share a cache
+directory: an entry is either complete or not there.
+
+The cache directory is options['cachedir']/operators of anuga.caching,
+unless set with set_operator_cache_dir.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+
+import numpy as num
+
+from anuga.utilities.sparse import Sparse_CSR
+
+
+# Version of the format of the cache entries, part of the key
+operator_cache_version = 1
+
+# Cache directory, see get_operator_cache_dir
+operator_cache_dir = None
+
+
+def set_operator_cache_dir(cache_dir):
+    """Set the directory of the operator cache (None for the default)
+    """
+
+    global operator_cache_dir
+
+    operator_cache_dir = cache_dir
+
+
+def get_operator_cache_dir():
+    """Directory of the operator cache
+    """
+
+    if operator_cache_dir is not None:
+        return operator_cache_dir
+
+    from anuga.caching.caching import options
+
+    return os.path.join(os.path.expanduser(options['cachedir']), 'operators')
+
+
+def get_operator_cache_key(kind, nodes, triangles, points, parameters=None):
+    """Hash of the kind of operator, the content of the mesh (absolute
+    coordinates of the nodes and the triangles) and of the points and
+    the parameters (a dictionary of values with a repr) of the operator
+    """
+
+    if parameters is None:
+        parameters = {}
+
+    h = hashlib.sha1()
+
+    h.update('version %d, kind %s, ' % (operator_cache_version, kind))
+    h.update(repr(sorted(parameters.items())))
+
+    for name, x, dtype in [('nodes', nodes, num.float),
+                           ('triangles', triangles, num.int64),
+                           ('points', points, num.float)]:
+        x = num.ascontiguousarray(x, dtype)
+        h.update(', %s %s ' % (name, x.shape))
+        h.update(x.tostring())
+
+    return h.hexdigest()
+
+
+def get_operator_cache_entry(cache_dir, key):
+    """Name of the directory of the entry key in cache_dir
+    """
+
+    return os.path.join(cache_dir, key + '.operator')
+
+
+def write_operator_cache_entry(entry, arrays, verbose=False):
+    """Write the dictionary of arrays as the cache entry
+    """
+
+    cache_dir = os.path.dirname(entry)
+    if cache_dir != '' and not os.path.exists(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Another process made it
+            pass
+
+    tmp_entry = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp_')
+
+    for name, x in arrays.items():
+        num.save(os.path.join(tmp_entry, name + '.npy'), x)
+
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Another process has written the same entry
+        shutil.rmtree(tmp_entry)
+
+    if verbose: print 'operator_cache: Wrote %s' % entry
+
+
+def read_operator_cache_entry(entry, mmap_mode='r'):
+    """The dictionary of arrays of the cache entry, memory mapped with
+    mmap_mode (None to read them)
+    """
+
+    arrays = {}
+    for filename in os.listdir(entry):
+        if filename.endswith('.npy'):
+            arrays[filename[:-4]] = num.load(os.path.join(entry, filename),
+                                             mmap_mode=mmap_mode)
+
+    return arrays
+
+
+def clear_operator_cache(cache_dir=None, verbose=False):
+    """Remove all the entries of the cache
+    """
+
+    if cache_dir is None:
+        cache_dir = get_operator_cache_dir()
+
+    if not os.path.isdir(cache_dir):
+        return
+
+    for name in os.listdir(cache_dir):
+        if name.endswith('.operator'):
+            if verbose: print 'operator_cache: Remove %s' % name
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+def get_cached_operator(key, build, cache_dir=None, verbose=False):
+    """The dictionary of arrays of the operator key, from the cache if it
+    is there, else returned by build() and written to the cache
+    """
+
+    if cache_dir is None:
+        cache_dir = get_operator_cache_dir()
+
+    entry = get_operator_cache_entry(cache_dir, key)
+
+    if os.path.isdir(entry):
+        if verbose: print 'operator_cache: Use %s' % entry
+        return read_operator_cache_entry(entry)
+
+    arrays = build()
+    write_operator_cache_entry(entry, arrays, verbose)
+
+    return arrays
+
+
+def get_cached_interpolation_matrix(interp, point_coordinates,
+                                    output_centroids=False, cache_dir=None,
+                                    verbose=False):
+    """The result of interp._build_interpolation_matrix_A(point_coordinates,
+    output_centroids), with the interpolation matrix from the operator
+    cache
+    """
+
+    mesh = interp.mesh
+    key = get_operator_cache_key('interpolation',
+                                 mesh.get_nodes(absolute=True),
+                                 mesh.triangles, point_coordinates,
+                                 {'output_centroids': bool(output_centroids)})
+
+    def build():
+        A, inside, outside, centroids = \
+           interp._build_interpolation_matrix_A(point_coordinates,
+                                                output_centroids,
+                                                verbose=verbose)
+
+        arrays = {'data': A.data,
+                  'colind': A.colind,
+                  'row_ptr': A.row_ptr,
+                  'shape': num.array(A.shape, num.int),
+                  'inside_poly_indices': num.array(inside, num.int),
+                  'outside_poly_indices': num.array(outside, num.int)}
+        if output_centroids:
+            arrays['centroids'] = num.array(centroids, num.float)
+
+        return arrays
+
+    arrays = get_cached_operator(key, build, cache_dir, verbose)
+
+    m, n = [int(x) for x in arrays['shape']]
+    A = Sparse_CSR(None, arrays['data'], arrays['colind'], arrays['row_ptr'],
+                   m, n)
+
+    return (A, arrays['inside_poly_indices'], arrays['outside_poly_indices'],
+            arrays.get('centroids', []))
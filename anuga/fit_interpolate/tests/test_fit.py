@@ -13,12 +13,14 @@ import tempfile
 import os
 
 from anuga.fit_interpolate.fit import *
+from anuga.fit_interpolate.fit import _fit_blocks_parallel
 from anuga.abstract_2d_finite_volumes.neighbour_mesh import Mesh
 from anuga.utilities.sparse import Sparse, Sparse_CSR
 from anuga.coordinate_transforms.geo_reference import Geo_reference
 from anuga.utilities.numerical_tools import ensure_numeric
 from anuga.geospatial_data.geospatial_data import Geospatial_data
 from anuga.shallow_water.shallow_water_domain import Domain
+from anuga.abstract_2d_finite_volumes.mesh_factory import rectangular_cross
 
 import numpy as num
 
@@ -31,6 +33,14 @@ def linear_function(point):
     return point[:,0]+point[:,1]
 
 
+class _Exit_task(object):
+    """Task of a fit worker process which makes it exit when unpickled
+    """
+
+    def __reduce__(self):
+        return (os._exit, (3,))
+
+
 class Test_Fit(unittest.TestCase):
 
     def setUp(self):
@@ -247,6 +257,119 @@ class Test_Fit(unittest.TestCase):
         assert num.allclose(f, answer)
         os.remove(fileName)
 
+    def test_fit_processes(self):
+        """Fitting blocks of points with worker processes gives the fit
+        of all the points at once
+        """
+
+        domain = Domain(*rectangular_cross(6, 4, len1=3.0, len2=2.0))
+
+        num.random.seed(17)
+        points = num.random.uniform(-0.5, 3.5, (1000, 2))
+        z = num.zeros((1000, 2), num.float)
+        z[:,0] = num.sin(points[:,0]) + points[:,1]
+        z[:,1] = points[:,0]*points[:,1]
+
+        interp = Fit(mesh=domain.mesh, alpha=0.01)
+        answer = interp.fit(points, z)
+
+        for processes in [1, 3]:
+            interp = Fit(mesh=domain.mesh, alpha=0.01)
+            f = interp.fit(points, z, processes=processes,
+                           max_read_lines=150)
+
+            assert interp.point_count == 1000
+            assert num.allclose(f, answer)
+
+        # One attribute
+        interp = Fit(mesh=domain.mesh, alpha=0.01)
+        answer = interp.fit(points, z[:,0])
+
+        interp = Fit(mesh=domain.mesh, alpha=0.01)
+        f = interp.fit(points, z[:,0], processes=2, max_read_lines=300)
+        assert num.allclose(f, answer)
+
+    def test_fit_processes_worker_exit(self):
+        """A worker process exiting without its result raises an
+        exception, rather than waiting for the result forever
+        """
+
+        domain = Domain(*rectangular_cross(6, 4, len1=3.0, len2=2.0))
+
+        num.random.seed(17)
+        points = num.random.uniform(-0.5, 3.5, (100, 2))
+        z = points[:,0] + points[:,1]
+
+        # Unpickled by the worker taking it from the queue, which then
+        # exits at once
+        tasks = [('points', points, z), _Exit_task(), ('points', points, z)]
+
+        try:
+            _fit_blocks_parallel(domain.mesh, iter(tasks), 2,
+                                 lambda n: None, poll_interval=0.1)
+        except Exception, e:
+            assert 'exited without a result' in str(e), str(e)
+        else:
+            raise Exception('A worker exit should have raised an exception')
+
+    def test_fit_to_mesh_npy_and_pts_processes(self):
+
+        a = [-1.0, 0.0]
+        b = [3.0, 4.0]
+        c = [4.0,1.0]
+        d = [-3.0, 2.0] #3
+        e = [-1.0,-2.0]
+        f = [1.0, -2.0] #5
+
+        vertices = [a, b, c, d,e,f]
+        triangles = [[0,1,3], [1,0,2], [0,4,5], [0,5,2]] #abd bac aef afc
+
+        points = [[-2.0, 2.0], [-1.0, 1.0], [0.0, 2.0], [1.0, 1.0],
+                  [2.0, 1.0], [0.0, 0.0], [1.0, 0.0], [0.0, -1.0],
+                  [-0.2, -0.5], [-0.9, -1.5], [0.5, -1.9], [3.0, 1.0]]
+        elevation = linear_function(points)
+
+        npy_file = tempfile.mktemp(".npy")
+        num.save(npy_file, num.column_stack([points, elevation]))
+
+        pts_file = tempfile.mktemp(".pts")
+        G = Geospatial_data(points, {'elevation': elevation})
+        G.export_points_file(pts_file)
+
+        answer = linear_function(vertices)
+
+        for filename in [npy_file, pts_file]:
+            for processes in [1, 2]:
+                f = fit_to_mesh(filename, vertices, triangles,
+                                alpha=0.0, max_read_lines=5,
+                                processes=processes)
+                assert num.allclose(f, answer)
+
+        # Not an array of x, y and attributes
+        num.save(npy_file, num.array(points))
+        self.assertRaises(Exception, fit_to_mesh, npy_file,
+                          vertices, triangles)
+
+        os.remove(npy_file)
+        os.remove(pts_file)
+
+    def test_fit_max_memory(self):
+        """The blocks of points are sized to max_memory
+        """
+
+        from anuga.fit_interpolate.fit import _get_fit_block_size, \
+             fit_bytes_per_point, fit_bytes_per_triangle
+
+        assert _get_fit_block_size(100, 2, None, 1e6) == 1000000
+
+        max_memory = 3*100*fit_bytes_per_triangle + 5*fit_bytes_per_point*1000
+        assert _get_fit_block_size(100, 2, max_memory, 1e6) == 1000
+        assert _get_fit_block_size(100, 2, max_memory, 500) == 500
+
+        # Not even room for the partials
+        self.assertRaises(Exception, _get_fit_block_size, 100, 2,
+                          3*100*fit_bytes_per_triangle, 1e6)
+
     def test_fit_to_mesh_UTM_file(self):
         #Get (enough) datapoints
         data_points = [[-21.5, 114.5],[-21.4, 114.6],[-21.45,114.65],
@@ -21,6 +21,7 @@ from anuga.fit_interpolate.interpolate import Interpolate
 from anuga.fit_interpolate.interpolate import Interpolation_function
 from anuga.fit_interpolate.interpolate import interpolate
 from anuga.fit_interpolate.interpolate import interpolate_sww2csv
+from anuga.fit_interpolate.interpolate import Modeltime_too_late
 
 from anuga.coordinate_transforms.geo_reference import Geo_reference
 from anuga.utilities.numerical_tools import mean, NAN
@@ -1500,6 +1501,24 @@ class Test_Interpolate(unittest.TestCase):
         for j in range(50): #t in [1, 6]
             self.assertTrue(I(t, 5) == NAN, 'Fail!')
             t += 0.1  
+
+        # All points at once, in any order
+        ids = [5, 0, 3, 3, 1]
+        for t in [1.0, 2.3, 5.0, 5.5, 6.0]:
+            q = I.get_values(t, ids)
+            assert q.shape == (len(ids), 1)
+            for k, id in enumerate(ids):
+                if id == 5:
+                    assert q[k,0] == NAN
+                else:
+                    assert num.allclose(q[k], I(t, id))
+
+        try:
+            I.get_values(6.5, ids)
+        except Modeltime_too_late:
+            pass
+        else:
+            raise Exception('Should raise exception')
             
         try:    
             I(1)
@@ -1509,6 +1528,59 @@ class Test_Interpolate(unittest.TestCase):
             raise Exception('Should raise exception')
 
 
+    def test_interpolation_function_time_window(self):
+        # Test that interpolating windows of timesteps as time moves
+        # gives the same values as interpolating all of them up front
+
+        import pickle
+        from anuga.abstract_2d_finite_volumes.mesh_factory \
+             import rectangular_cross
+
+        points, triangles, boundary = rectangular_cross(5, 4)
+        points = num.array(points, num.float)
+
+        time = num.arange(0.0, 20.0, 0.5)
+        Q = num.array([num.sin(t + points[:,0])*points[:,1] for t in time])
+
+        # The last point is outside the mesh
+        interpolation_points = [[0.1, 0.2], [0.5, 0.5], [0.9, 0.3], [3, 3]]
+
+        for time_thinning in [1, 3]:
+            quantities = {'stage': Q, 'elevation': points[:,0]}
+            I = Interpolation_function(time, quantities,
+                                       ['stage', 'elevation'],
+                                       points, triangles,
+                                       interpolation_points,
+                                       time_thinning=time_thinning)
+
+            quantities = {'stage': Q, 'elevation': points[:,0]}
+            I_window = Interpolation_function(time, quantities,
+                                              ['stage', 'elevation'],
+                                              points, triangles,
+                                              interpolation_points,
+                                              time_thinning=time_thinning,
+                                              time_window=3)
+
+            # Forwards, to the end and back again
+            times = list(num.linspace(0, I.time[-1], 57)) + [4.0, 1.0, 12.25]
+            for t in times:
+                for id in range(len(interpolation_points)-1):
+                    assert num.allclose(I_window(t, id), I(t, id))
+                assert num.all(I_window(t, 3) == NAN)
+
+                assert num.allclose(I_window.get_values(t, [2, 0, 1]),
+                                    I.get_values(t, [2, 0, 1]))
+                assert I_window.precomputed_values['stage'].shape[0] <= 3
+
+            assert num.allclose(I_window.quantities_range['stage'],
+                                I.quantities_range['stage'])
+
+            # The read ahead thread is not pickled
+            I_copy = pickle.loads(pickle.dumps(I_window))
+            assert num.allclose(I_copy(3.3, 1), I(3.3, 1))
+            assert num.allclose(I_copy(15.0, 2), I(15.0, 2))
+
+
     def test_interpolation_function_time(self):
         #Test a long time series with an error in it (this did cause an
         #error once)
@@ -0,0 +1,126 @@
+"""Test the cache of interpolation operators
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as num
+
+from anuga.abstract_2d_finite_volumes.mesh_factory import rectangular_cross
+from anuga.fit_interpolate.interpolate import Interpolate, Interpolation_function
+from anuga.fit_interpolate.operator_cache import get_operator_cache_key
+from anuga.fit_interpolate.operator_cache import get_operator_cache_dir
+from anuga.fit_interpolate.operator_cache import set_operator_cache_dir
+from anuga.fit_interpolate.operator_cache import clear_operator_cache
+from anuga.fit_interpolate.operator_cache import get_cached_interpolation_matrix
+
+
+class Test_Operator_Cache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        set_operator_cache_dir(self.cache_dir)
+
+        points, vertices, boundary = rectangular_cross(4, 3, len1=4.0,
+                                                       len2=3.0)
+        self.nodes = num.array(points, num.float)
+        self.triangles = num.array(vertices, num.int)
+
+        num.random.seed(3)
+        self.points = num.random.uniform(-0.5, 4.5, (50, 2))
+
+    def tearDown(self):
+        set_operator_cache_dir(None)
+        shutil.rmtree(self.cache_dir)
+
+    def test_key(self):
+
+        key = get_operator_cache_key('interpolation', self.nodes,
+                                     self.triangles, self.points)
+
+        # Of the content, not the arrays
+        assert get_operator_cache_key('interpolation', self.nodes.tolist(),
+                                      self.triangles.tolist(),
+                                      self.points.copy()) == key
+
+        # Points with the same average are different points
+        points = self.points.copy()
+        points[0,0] += 1.0
+        points[1,0] -= 1.0
+        assert get_operator_cache_key('interpolation', self.nodes,
+                                      self.triangles, points) != key
+
+        assert get_operator_cache_key('interpolation', self.nodes,
+                                      self.triangles[::-1], self.points) != key
+        assert get_operator_cache_key('fit', self.nodes,
+                                      self.triangles, self.points) != key
+        assert get_operator_cache_key('interpolation', self.nodes,
+                                      self.triangles, self.points,
+                                      {'output_centroids': True}) != key
+
+    def test_cached_interpolation_matrix(self):
+
+        assert get_operator_cache_dir() == self.cache_dir
+
+        for output_centroids in [False, True]:
+            interp = Interpolate(self.nodes, self.triangles)
+            A, inside, outside, centroids = \
+               interp._build_interpolation_matrix_A(self.points,
+                                                    output_centroids)
+
+            # Built, and then read from the cache
+            for i in range(2):
+                X = get_cached_interpolation_matrix(interp, self.points,
+                                                    output_centroids)
+
+                assert isinstance(X[0].data, num.memmap) == (i == 1)
+                assert X[0].shape == A.shape
+                assert num.allclose(X[0].todense(), A.todense())
+                assert num.all(X[1] == inside)
+                assert num.all(X[2] == outside)
+                assert num.allclose(X[3], centroids)
+
+        assert len(os.listdir(self.cache_dir)) == 2
+
+        clear_operator_cache()
+        assert os.listdir(self.cache_dir) == []
+
+    def test_interpolate_use_cache(self):
+
+        f = self.nodes[:,0] + 2*self.nodes[:,1]
+
+        interp = Interpolate(self.nodes, self.triangles)
+        z = interp.interpolate(f, self.points)
+
+        for i in range(2):
+            interp = Interpolate(self.nodes, self.triangles)
+            z_cache = interp.interpolate(f, self.points, use_cache=True)
+
+            assert num.allclose(z, z_cache, equal_nan=True)
+            assert len(os.listdir(self.cache_dir)) == 1
+
+        # Interpolation_function of the points inside the mesh
+        time = [0.0, 1.0]
+        quantities = {'stage': num.array([f, 2*f])}
+        points = self.points[num.logical_and(num.all(self.points > 0, axis=1),
+                                             num.all(self.points < 3, axis=1))]
+
+        F = Interpolation_function(time, quantities, ['stage'],
+                                   self.nodes, self.triangles, points)
+        F_cache = Interpolation_function(time, quantities, ['stage'],
+                                         self.nodes, self.triangles, points,
+                                         use_cache=True)
+
+        assert num.allclose(F.precomputed_values['stage'],
+                            F_cache.precomputed_values['stage'])
+        assert len(os.listdir(self.cache_dir)) == 2
+
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(Test_Operator_Cache, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -70,6 +70,27 @@ class Operator:
         """
         return False
 
+    def get_batch_class(self):
+        """Class of the batch operators which can apply a run of consecutive
+        fractional step operators (with the same batch class) at once,
+        instead of calling each operator (see
+        Generic_Domain.get_fractional_step_batches). By default an operator
+        is called on its own.
+        """
+        return None
+
+    def get_checkpoint_state(self):
+        """State of the operator (other than registered quantities) to be
+        stored in checkpoint files, as a dictionary of arrays. By default
+        an operator has no state.
+        """
+        return {}
+
+    def set_checkpoint_state(self, state):
+        """Restore the state returned by get_checkpoint_state
+        """
+        pass
+
     def statistics(self):
 
         message = 'You need to implement operator statistics for your operator'
@@ -67,6 +67,15 @@ class boundary_flux_integral_operator(Operator):
         """
         return True
 
+    def get_checkpoint_state(self):
+
+        return {'boundary_flux_integral' : self.boundary_flux_integral}
+
+    def set_checkpoint_state(self, state):
+
+        if 'boundary_flux_integral' in state:
+            self.boundary_flux_integral = state['boundary_flux_integral']
+
     def statistics(self):
 
         message = self.label + ': Boundary_flux_integral operator'
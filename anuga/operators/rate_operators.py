@@ -336,6 +336,16 @@ class Rate_operator(Operator,Region):
         """
         return True
 
+    def get_batch_class(self):
+        """Rate operators are applied together by Rate_operator_batch,
+        unless __call__ has been overridden
+        """
+
+        if self.__class__.__call__.im_func is not Rate_operator.__call__.im_func:
+            return None
+
+        return Rate_operator_batch
+
     def statistics(self):
 
         message = 'You need to implement operator statistics for your operator'
@@ -363,6 +373,147 @@ class Rate_operator(Operator,Region):
 
 
 
+#===============================================================================
+# Batch of rate operators
+#===============================================================================
+class Rate_operator_batch:
+    """
+    Apply a sequence of rate operators (e.g. the rainfall of hundreds of
+    subcatchments) in a single C pass, with the same result as calling
+    each operator in turn.
+
+    The triangles of all the operators are stored once as a CSR like
+    structure (triangles[op_ptr[j]:op_ptr[j+1]] are those of operator j),
+    together with their full flag and, for spatial rates, their
+    coordinates. Each step the rates of the operators are evaluated
+    (once for each operator) and the stage updates and influx accounting
+    of all the operators are done by apply_rate_operators.
+
+    The batch is built by the domain from consecutive operators with
+    get_batch_class() == Rate_operator_batch.
+    """
+
+    def __init__(self, domain, operators):
+
+        self.domain = domain
+        self.operators = operators
+
+        self.stage_c = domain.quantities['stage'].centroid_values
+        self.elev_c = domain.quantities['elevation'].centroid_values
+        self.areas = domain.areas
+
+        N = len(self.stage_c)
+
+        triangles = []
+        for operator in operators:
+            if operator.indices is None:
+                triangles.append(num.arange(N))
+            else:
+                triangles.append(num.array(operator.indices, num.int).reshape(-1))
+
+        n = len(operators)
+        self.op_ptr = num.zeros(n+1, num.int)
+        self.op_ptr[1:] = num.cumsum([len(x) for x in triangles])
+
+        self.triangles = num.zeros(self.op_ptr[-1], num.int)
+        for j, x in enumerate(triangles):
+            self.triangles[self.op_ptr[j]:self.op_ptr[j+1]] = x
+
+        self.full = num.array(domain.tri_full_flag[self.triangles] == 1, num.int)
+
+        # Coordinates of the triangles of operators with spatial rates,
+        # see get_spatial_rate
+        self.x = domain.centroid_coordinates[self.triangles,0]
+        self.y = domain.centroid_coordinates[self.triangles,1]
+
+        self.op_spatial = num.zeros(n, num.int)
+        self.op_rates = num.zeros(n, num.float)
+        self.factors = num.zeros(n, num.float)
+        self.entry_rates = num.zeros(len(self.triangles), num.float)
+        self.influx = num.zeros(n, num.float)
+
+
+    def __repr__(self):
+        return 'Rate_operator_batch(%d operators)' % len(self.operators)
+
+
+    def __call__(self):
+        """
+        Apply the rates of all the operators
+        """
+
+        if not self.set_rates():
+            # Some rates are not supported, apply the operators in turn
+            for operator in self.operators:
+                operator()
+            return
+
+        from rate_operators_ext import apply_rate_operators
+
+        timestep = self.domain.get_timestep()
+
+        self.domain.fractional_step_volume_integral = \
+            apply_rate_operators(float(timestep),
+                                 float(self.domain.fractional_step_volume_integral),
+                                 self.stage_c, self.elev_c, self.areas,
+                                 self.triangles, self.full, self.op_ptr,
+                                 self.op_spatial, self.op_rates, self.factors,
+                                 self.entry_rates, self.influx)
+
+        for operator, local_influx in zip(self.operators, self.influx):
+            operator.local_influx = local_influx
+
+
+    def set_rates(self):
+        """Evaluate the rates of all the operators at the current time into
+        op_rates (scalar rates) and entry_rates (spatial rates and rates of
+        quantities). Returns False if an operator cannot be batched this
+        step (e.g. verbose operators, or a rate of the wrong size).
+        """
+
+        times = {}
+
+        for j, operator in enumerate(self.operators):
+
+            if operator.verbose is True:
+                return False
+
+            relative_time = operator.relative_time
+            if relative_time not in times:
+                times[relative_time] = \
+                    self.domain.get_time(relative_time=relative_time)
+            t = times[relative_time]
+
+            k0 = self.op_ptr[j]
+            k1 = self.op_ptr[j+1]
+
+            if operator.rate_spatial:
+                rate = operator.get_spatial_rate(self.x[k0:k1], self.y[k0:k1], t)
+            elif operator.rate_type == 'quantity':
+                rate = operator.rate.centroid_values[self.triangles[k0:k1]]
+            else:
+                rate = operator.get_non_spatial_rate(t)
+
+            rate = num.asarray(rate, num.float)
+
+            if rate.shape == ():
+                self.op_spatial[j] = 0
+                self.op_rates[j] = rate
+            elif rate.shape == (k1 - k0,):
+                self.op_spatial[j] = 1
+                self.entry_rates[k0:k1] = rate
+            else:
+                return False
+
+            factor = num.asarray(operator.factor, num.float)
+            if factor.shape != ():
+                return False
+            self.factors[j] = factor
+
+        return True
+
+
+
 #===============================================================================
 # Specific Rate Operators for circular region.
 #===============================================================================
@@ -0,0 +1,166 @@
+// Python - C extension module for rate_operators.py
+//
+// Applies a batch of rate operators (see Rate_operator_batch) in a single
+// pass over the triangles of all the operators.
+//
+// The triangles of operator j are triangles[op_ptr[j]:op_ptr[j+1]] (as the
+// rows of a CSR matrix). The rate of operator j is op_rates[j] if
+// op_spatial[j] is 0, otherwise entry_rates[k] for each entry k.
+
+
+#include "Python.h"
+#include "numpy/arrayobject.h"
+#include "math.h"
+#include <stdio.h>
+
+// Shared code snippets
+#include "util_ext.h"
+
+
+
+double _apply_rate_operators(long number_of_operators,
+                             double timestep,
+                             double influx_sum,
+                             double* stage_c,
+                             double* elev_c,
+                             double* areas,
+                             long* triangles,
+                             long* full,
+                             long* op_ptr,
+                             long* op_spatial,
+                             double* op_rates,
+                             double* factors,
+                             double* entry_rates,
+                             double* influx) {
+  // Apply the operators in order, as Rate_operator.__call__ each of them,
+  // setting influx[j] to the local influx of operator j. Returns influx_sum
+  // plus the local influx of all the operators (as accumulated in the
+  // fractional_step_volume_integral of the domain)
+
+  long j, k, i, nonnegative;
+  double ft, rate, local_rate, depth_rate, local_influx;
+
+  for (j = 0; j < number_of_operators; j++) {
+
+    ft = factors[j]*timestep;
+
+    // Rates < 0 cannot remove more than the water there
+    if (op_spatial[j]) {
+      nonnegative = 1;
+      for (k = op_ptr[j]; k < op_ptr[j+1]; k++) {
+        if (!(entry_rates[k] >= 0.0)) {
+          nonnegative = 0;
+          break;
+        }
+      }
+    } else {
+      nonnegative = (op_rates[j] >= 0.0);
+    }
+
+    local_influx = 0.0;
+    rate = op_rates[j];
+
+    for (k = op_ptr[j]; k < op_ptr[j+1]; k++) {
+      i = triangles[k];
+
+      if (op_spatial[j]) {
+        rate = entry_rates[k];
+      }
+
+      local_rate = ft*rate;
+
+      if (!nonnegative) {
+        depth_rate = elev_c[i] - stage_c[i];
+        if (depth_rate > local_rate || isnan(depth_rate)) {
+          local_rate = depth_rate;
+        }
+      }
+
+      // Record the local flux for mass conservation tracking
+      if (full[k]) {
+        local_influx += local_rate*areas[i];
+      }
+
+      stage_c[i] += local_rate;
+    }
+
+    influx[j] = local_influx;
+    influx_sum += local_influx;
+  }
+
+  return influx_sum;
+}
+
+
+
+//========================================================================
+// Python Glue
+//========================================================================
+
+PyObject *apply_rate_operators(PyObject *self, PyObject *args) {
+  //
+  // influx_sum = apply_rate_operators(timestep, influx_sum, stage_c, elev_c,
+  //                                   areas, triangles, full, op_ptr,
+  //                                   op_spatial, op_rates, factors,
+  //                                   entry_rates, influx)
+  //
+
+  PyArrayObject *stage_c, *elev_c, *areas, *triangles, *full, *op_ptr,
+                *op_spatial, *op_rates, *factors, *entry_rates, *influx;
+
+  double timestep, influx_sum;
+
+  // Convert Python arguments to C
+  if (!PyArg_ParseTuple(args, "ddOOOOOOOOOOO",
+                        &timestep, &influx_sum,
+                        &stage_c, &elev_c, &areas,
+                        &triangles, &full, &op_ptr,
+                        &op_spatial, &op_rates, &factors,
+                        &entry_rates, &influx)) {
+    report_python_error(AT, "could not parse input arguments");
+    return NULL;
+  }
+
+  CHECK_C_CONTIG(stage_c);
+  CHECK_C_CONTIG(elev_c);
+  CHECK_C_CONTIG(areas);
+  CHECK_C_CONTIG(triangles);
+  CHECK_C_CONTIG(full);
+  CHECK_C_CONTIG(op_ptr);
+  CHECK_C_CONTIG(op_spatial);
+  CHECK_C_CONTIG(op_rates);
+  CHECK_C_CONTIG(factors);
+  CHECK_C_CONTIG(entry_rates);
+  CHECK_C_CONTIG(influx);
+
+  influx_sum = _apply_rate_operators(op_rates->dimensions[0],
+                                     timestep,
+                                     influx_sum,
+                                     (double*) stage_c->data,
+                                     (double*) elev_c->data,
+                                     (double*) areas->data,
+                                     (long*) triangles->data,
+                                     (long*) full->data,
+                                     (long*) op_ptr->data,
+                                     (long*) op_spatial->data,
+                                     (double*) op_rates->data,
+                                     (double*) factors->data,
+                                     (double*) entry_rates->data,
+                                     (double*) influx->data);
+
+  return Py_BuildValue("d", influx_sum);
+}
+
+
+// Method table for python module
+static struct PyMethodDef MethodTable[] = {
+  {"apply_rate_operators", apply_rate_operators, METH_VARARGS, "Print out"},
+  {NULL, NULL, 0, NULL}   // sentinel
+};
+
+// Module initialisation
+void initrate_operators_ext(void){
+  Py_InitModule("rate_operators_ext", MethodTable);
+
+  import_array(); // Necessary for handling of NumPY structures
+}
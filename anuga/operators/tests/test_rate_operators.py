@@ -897,6 +897,89 @@ class Test_rate_operators(unittest.TestCase):
         assert num.allclose(Q_ex, Q)
         assert num.allclose(domain.fractional_step_volume_integral, ((d-1.)*domain.areas[indices]).sum())
 
+    def test_rate_operator_batch(self):
+        """Test that consecutive rate operators applied by the domain as a
+        Rate_operator_batch give the same stage and influx as applying
+        each operator in turn
+        """
+
+        from anuga.operators.set_stage_operator import Set_stage_operator
+
+        def make_domain():
+            domain = rectangular_cross_domain(6, 4, len1=6.0, len2=4.0)
+            domain.set_quantity('elevation', lambda x, y: 0.1*x - 0.2)
+            domain.set_quantity('stage', 0.3)
+            domain.set_quantity('friction', 0)
+            domain.tri_full_flag[:5] = 0
+            domain.set_time(2.0)
+            domain.timestep = 0.5
+            return domain
+
+        def rate_quantity(domain):
+            rate_Q = anuga.Quantity(domain)
+            rate_Q.set_values(lambda x, y: 0.1*x*y)
+            return rate_Q
+
+        def add_operators(domain):
+            N = len(domain)
+            ops = [Rate_operator(domain, rate=1.0, factor=2.0),
+                   Rate_operator(domain, rate=-0.5, indices=[0, 3, 4, 10]),
+                   Rate_operator(domain, rate=lambda t: 0.1*t,
+                                 indices=range(5, 40)),
+                   Polygonal_rate_operator(domain, rate=-2.0,
+                                           polygon=[[0, 0], [3, 0], [3, 2], [0, 2]]),
+                   Rate_operator(domain, rate=lambda x, y, t: x - y + t,
+                                 indices=range(20, N)),
+                   Rate_operator(domain, rate=lambda x, y: 0.5*x, factor=0.1),
+                   Rate_operator(domain, rate=rate_quantity(domain),
+                                 indices=range(0, N, 3)),
+                   Rate_operator(domain, rate=1.0, indices=[])]
+
+            # Splits the run of rate operators
+            Set_stage_operator(domain, stage=0.4, indices=[1, 2])
+            ops.append(Circular_rate_operator(domain, rate=-1.0,
+                                              center=[2.0, 2.0], radius=1.5))
+            ops.append(Rate_operator(domain, rate=0.2, relative_time=False))
+            return ops
+
+        domain = make_domain()
+        ops = add_operators(domain)
+        for operator in domain.fractional_step_operators:
+            operator()
+        expected_stage = domain.quantities['stage'].centroid_values.copy()
+        expected_influx = [operator.local_influx for operator in ops]
+        expected_integral = domain.fractional_step_volume_integral
+
+        domain = make_domain()
+        ops = add_operators(domain)
+        # The boundary flux integral operator, the batch of the first
+        # 8 rate operators, the set stage operator and the last batch
+        batches = domain.get_fractional_step_batches()
+        assert len(batches) == 4
+        assert isinstance(batches[1], Rate_operator_batch)
+        assert isinstance(batches[3], Rate_operator_batch)
+        assert batches[1].operators == ops[:8]
+        assert batches[3].operators == ops[8:]
+        assert domain.get_fractional_step_batches() is batches
+
+        # All the rates are supported by the C pass
+        assert batches[1].set_rates() and batches[3].set_rates()
+
+        domain.apply_fractional_steps()
+
+        assert num.allclose(domain.quantities['stage'].centroid_values,
+                            expected_stage)
+        assert num.allclose([operator.local_influx for operator in ops],
+                            expected_influx)
+        assert num.allclose(domain.fractional_step_volume_integral,
+                            expected_integral)
+
+        # Rebuilt when an operator is added
+        Rate_operator(domain, rate=1.0)
+        assert len(domain.get_fractional_step_batches()) == 4
+        assert len(domain.get_fractional_step_batches()[3].operators) == 3
+
+
 if __name__ == "__main__":
     suite = unittest.makeSuite(Test_rate_operators, 'test')
     runner = unittest.TextTestRunner(verbosity=1)
@@ -0,0 +1,336 @@
+"""Benchmark the construction of the ghost layers and communication
+patterns of the submeshes (ghost_layer, ghost_bnd_layer,
+full_commun_pattern and build_local_commun) against the previous
+implementations (ghost_layer_old_2, ghost_bnd_layer_old_2,
+full_commun_pattern_old and build_local_commun_old, kept here), and time
+the whole build of the submeshes.
+
+Run as
+
+    python benchmark_distribute_mesh.py [m n numprocs]
+
+which partitions a rectangular cross mesh of 4*m*n triangles (default
+400 by 300, ie 480000 triangles) into numprocs (default 1000) submeshes.
+"""
+
+import sys
+import time
+
+import numpy as num
+import numpy.lib.arraysetops as numset
+
+import anuga
+
+from anuga.abstract_2d_finite_volumes.neighbour_mesh import Mesh
+from anuga.parallel.distribute_mesh import pmesh_divide_metis
+from anuga.parallel.distribute_mesh import build_submesh
+from anuga.parallel.distribute_mesh import extract_submesh
+from anuga.parallel.distribute_mesh import submesh_full
+from anuga.parallel.distribute_mesh import submesh_ghost
+from anuga.parallel.distribute_mesh import ghost_layer
+from anuga.parallel.distribute_mesh import ghost_bnd_layer
+from anuga.parallel.distribute_mesh import full_commun_pattern
+from anuga.parallel.distribute_mesh import build_local_commun
+
+
+#########################################################
+#
+# The previous implementations of ghost_layer,
+# ghost_bnd_layer, full_commun_pattern and
+# build_local_commun, as references for the benchmark
+# and for test_distribute_mesh.
+#
+#########################################################
+
+def ghost_layer_old_2(submesh, mesh, p, tupper, tlower, parameters = None):
+
+    ncoord = mesh.number_of_nodes
+    ntriangles = mesh.number_of_triangles
+
+    if parameters is None or 'ghost_layer_width' not in parameters:
+        layer_width  = 2
+    else:
+        layer_width = parameters['ghost_layer_width']
+
+
+    full_ids = num.arange(tlower, tupper)
+
+    n0 = mesh.neighbours[full_ids, :]
+    n0 = num.unique(n0.flat)
+    n0 = num.extract(n0>=0,n0)
+    n0 = num.extract(num.logical_or(n0<tlower, tupper<= n0), n0)
+
+    layer_cells = {}
+    layer_cells[0] = n0
+
+
+    # Find the subsequent layers of ghost triangles
+    for i in range(layer_width-1):
+
+        # use previous layer as a start
+        n0 = mesh.neighbours[n0, :]
+        n0 = num.unique(n0.flat)
+        n0 = num.extract(n0>=0,n0)
+        n0 = num.extract(num.logical_or(n0<tlower, tupper<= n0), n0)
+
+        for j in xrange(i+1):
+            n0 = numset.setdiff1d(n0,layer_cells[j])
+
+        layer_cells[i+1] = n0
+
+
+    # Build the triangle list and make note of the vertices
+    new_trianglemap = layer_cells[0]
+    for i in range(layer_width-1):
+        new_trianglemap = numset.union1d(new_trianglemap,layer_cells[i+1])
+
+    new_subtriangles = num.concatenate((num.reshape(new_trianglemap, (-1,1)), mesh.triangles[new_trianglemap]), 1)
+
+
+
+
+    fullnodes = submesh["full_nodes"][p]
+    full_nodes_ids = num.array(fullnodes[:,0],num.int)
+
+    new_nodes = num.unique(mesh.triangles[new_trianglemap].flat)
+    new_nodes = numset.setdiff1d(new_nodes,full_nodes_ids)
+
+    new_subnodes = num.concatenate((num.reshape(new_nodes, (-1,1)), mesh.nodes[new_nodes]), 1)
+
+    # Clean up before exiting
+
+    del (new_nodes)
+    del (layer_cells)
+    del (n0)
+    del (new_trianglemap)
+
+    # Return the triangles and vertices sitting on the boundary layer
+
+    return new_subnodes, new_subtriangles, layer_width
+
+
+def ghost_bnd_layer_old_2(ghosttri, tlower, tupper, mesh, p):
+
+
+    boundary = mesh.boundary
+
+    ghost_list = []
+    subboundary = {}
+
+
+    new_ghost_list = ghosttri[:,0]
+
+    #print new_ghost_list
+
+    # 0 edge boundaries
+    nghb0 = mesh.neighbours[new_ghost_list,0]
+    gl0 = num.extract(num.logical_or(nghb0 < tlower, nghb0 >= tupper), new_ghost_list)
+    nghb0 = mesh.neighbours[gl0,0]
+    flag = numset.in1d(nghb0,new_ghost_list)
+    gl0 = num.extract(num.logical_not(flag),gl0)
+    edge0 = 0*num.ones_like(gl0)
+    n0 = len(edge0)
+    values0 = ['ghost']*n0
+
+    # 1 edge boundary
+    nghb1 = mesh.neighbours[new_ghost_list,1]
+    gl1 = num.extract(num.logical_or(nghb1 < tlower, nghb1 >= tupper), new_ghost_list)
+    nghb1 = mesh.neighbours[gl1,1]
+    flag = numset.in1d(nghb1,new_ghost_list)
+    gl1 = num.extract(num.logical_not(flag),gl1)
+    edge1 = 1*num.ones_like(gl1)
+    n1 = len(edge1)
+    values1 = ['ghost']*n1
+
+    # 2 edge boundary
+    nghb2 = mesh.neighbours[new_ghost_list,2]
+    gl2 = num.extract(num.logical_or(nghb2 < tlower, nghb2 >= tupper), new_ghost_list)
+    nghb2 = mesh.neighbours[gl2,2]
+    flag = numset.in1d(nghb2,new_ghost_list)
+    gl2 = num.extract(num.logical_not(flag),gl2)
+    edge2 = 2*num.ones_like(gl2)
+    n2 = len(edge2)
+    values2 = ['ghost']*n2
+
+
+    gl = num.concatenate((gl0,gl1,gl2))
+    edge = num.concatenate((edge0,edge1,edge2))
+    values = values0 + values1 + values2
+#    print gl
+#    print edge
+#    print values
+
+    subboundary = dict(zip(zip(gl,edge),values))
+    #intersect with boundary 
+
+    # FIXME SR: these keys should be viewkeys but need python 2.7
+    subboundary.update( (k,boundary[k]) for k in set(subboundary.keys()) & set(boundary.keys()) )
+
+    #print subboundary
+
+
+    return subboundary
+
+
+def full_commun_pattern_old(submesh, tri_per_proc):
+    tlower = 0
+    nproc = len(tri_per_proc)
+    full_commun = []
+
+    # Loop over the processor
+
+    for p in xrange(nproc):
+
+        # Loop over the full triangles in the current processor
+        # and build an empty dictionary
+
+        fcommun = {}
+        tupper = tri_per_proc[p]+tlower
+        for i in xrange(tlower, tupper):
+            fcommun[i] = []
+        full_commun.append(fcommun)
+        tlower = tupper
+
+    # Loop over the processor again
+
+    for p in xrange(nproc):
+
+        # Loop over the ghost triangles in the current processor,
+        # find which processor contains the corresponding full copy
+        # and note that the processor must send updates to this
+        # processor
+
+        for g in submesh["ghost_commun"][p]:
+            neigh = g[1]
+            full_commun[neigh][g[0]].append(p)
+
+    return full_commun
+
+
+def build_local_commun_old(tri_map, ghostc, fullc, nproc):
+
+    # Initialise
+
+    full_send = {}
+    ghost_recv = {}
+
+    # Build the ghost_recv dictionary (sort the
+    # information by the global numbering)
+    
+    ghostc = num.sort(ghostc, 0)
+    
+    for c in xrange(nproc):
+        s = ghostc[:,0]
+        d = num.compress(num.equal(ghostc[:,1],c), s)
+        if len(d) > 0:
+            ghost_recv[c] = [0, 0]
+            ghost_recv[c][1] = d
+            ghost_recv[c][0] = num.take(tri_map, d)
+            
+    # Build a temporary copy of the full_send dictionary
+    # (this version allows the information to be stored
+    # by the global numbering)
+
+    tmp_send = {}
+    for global_id in fullc:
+        for i in xrange(len(fullc[global_id])):
+            neigh = fullc[global_id][i]
+            if not tmp_send.has_key(neigh):
+                tmp_send[neigh] = []
+            tmp_send[neigh].append([global_id, \
+                                    tri_map[global_id]])
+
+    # Extract the full send information and put it in the form
+    # required for the full_send dictionary
+
+    for neigh in tmp_send:
+        neigh_commun = num.sort(tmp_send[neigh], 0)
+        full_send[neigh] = [0, 0]
+        full_send[neigh][0] = neigh_commun[:,1]
+        full_send[neigh][1] = neigh_commun[:,0]
+
+    return ghost_recv, full_send
+
+
+def time_call(f):
+    """Walltime of f() in seconds
+    """
+
+    t0 = time.time()
+    f()
+    return time.time() - t0
+
+
+def benchmark(m=400, n=300, numprocs=1000):
+
+    domain = anuga.rectangular_cross_domain(m, n)
+
+    nodes, triangles, boundary, triangles_per_proc, quantities = \
+           pmesh_divide_metis(domain, numprocs)
+
+    mesh = Mesh(nodes, triangles, boundary)
+
+    submesh = submesh_full(mesh, triangles_per_proc)
+    submesh = submesh_ghost(submesh, mesh, triangles_per_proc)
+
+    bounds = [0]
+    for p in range(numprocs):
+        bounds.append(bounds[-1] + triangles_per_proc[p])
+
+    def ghost_layers(f):
+        for p in range(numprocs):
+            f(submesh, mesh, p, bounds[p+1], bounds[p])
+
+    def ghost_bnd_layers(f):
+        for p in range(numprocs):
+            f(submesh["ghost_triangles"][p], bounds[p], bounds[p+1], mesh, p)
+
+    # The global to local map of the triangles of each processor, only
+    # the triangles of the processor are set (see build_local_mesh)
+    tri_map = -1*num.ones(len(triangles), num.int)
+
+    def local_communs(f):
+        for p in range(numprocs):
+            ghost_ids = submesh["ghost_triangles"][p][:,0]
+            tri_map[bounds[p]:bounds[p+1]] = num.arange(triangles_per_proc[p])
+            tri_map[ghost_ids] = num.arange(len(ghost_ids)) + triangles_per_proc[p]
+
+            f(tri_map, submesh["ghost_commun"][p],
+              submesh["full_commun"][p], numprocs)
+
+    print 'Number of triangles: %d, processors: %d' % (len(triangles), numprocs)
+    print
+    print '%-25s %12s %12s %12s' % ('Function', 'old (s)', 'new (s)', 'speedup')
+
+    functions = [('ghost_layer', ghost_layers,
+                      ghost_layer_old_2, ghost_layer),
+                 ('ghost_bnd_layer', ghost_bnd_layers,
+                      ghost_bnd_layer_old_2, ghost_bnd_layer),
+                 ('full_commun_pattern',
+                      lambda f: f(submesh, triangles_per_proc),
+                      full_commun_pattern_old, full_commun_pattern),
+                 ('build_local_commun', local_communs,
+                      build_local_commun_old, build_local_commun)]
+
+    for name, run, old, new in functions:
+        t_old = time_call(lambda: run(old))
+        t_new = time_call(lambda: run(new))
+
+        print '%-25s %12.3f %12.3f %12.1f' % (name, t_old, t_new, t_old/t_new)
+
+    def build_submeshes():
+        submesh = build_submesh(nodes, triangles, boundary, quantities,
+                                triangles_per_proc)
+        for p in range(numprocs):
+            extract_submesh(submesh, triangles_per_proc, None, p)
+
+    print
+    print 'build_submesh and extract_submesh of all processors: %.3f s' \
+          % time_call(build_submeshes)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        benchmark(*[int(a) for a in sys.argv[1:4]])
+    else:
+        benchmark()
@@ -123,6 +123,7 @@ def reorder_new(quantities, epart_order, proc_sum):
 
 try:
     from anuga.pymetis.metis_ext import partMeshNodal
+    from anuga.pymetis.metis_ext import partGraphKway
 except ImportError:
     print "***************************************************"
     print "         Metis is probably not compiled."
@@ -130,17 +131,94 @@ except ImportError:
     print "***************************************************"
     raise ImportError
 
-def pmesh_divide_metis(domain, n_procs):
+def pmesh_divide_metis(domain, n_procs, parameters=None):
     # Wrapper for old pmesh_divide_metis which does not return tri_index or r_tri_index
-    nodes, ttriangles, boundary, triangles_per_proc, quantities, tri_index, r_tri_index = pmesh_divide_metis_helper(domain, n_procs)
+    nodes, ttriangles, boundary, triangles_per_proc, quantities, tri_index, r_tri_index = \
+           pmesh_divide_metis_helper(domain, n_procs, parameters)
 
     return nodes, ttriangles, boundary, triangles_per_proc, quantities
 
-def pmesh_divide_metis_with_map(domain, n_procs):
+def pmesh_divide_metis_with_map(domain, n_procs, parameters=None):
 
-    return pmesh_divide_metis_helper(domain, n_procs)
+    return pmesh_divide_metis_helper(domain, n_procs, parameters)
 
-def pmesh_divide_metis_helper(domain, n_procs):
+
+def dual_graph(domain):
+    """Return the dual graph of the mesh, the triangles joined through
+    their common edges, as the xadj, adjncy arrays used by metis.
+    The neighbours of triangle i are adjncy[xadj[i]:xadj[i+1]]
+    """
+
+    neighbours = domain.neighbours
+    internal = neighbours >= 0
+
+    xadj = num.zeros(len(neighbours)+1, num.int)
+    xadj[1:] = num.cumsum(num.sum(internal, axis=1))
+    adjncy = neighbours[internal]
+
+    return xadj, adjncy
+
+
+def metis_weights(weights, n_tri):
+    """Scale the (non negative) triangle weights to the integer weights
+    used by metis, at least 1 and at most 1000
+    """
+
+    weights = num.array(weights, num.float).reshape(-1)
+
+    msg = 'partition_weights should have one weight per triangle, '
+    msg += 'got %d weights for %d triangles' % (len(weights), n_tri)
+    assert len(weights) == n_tri, msg
+
+    msg = 'partition_weights should not be negative'
+    assert num.all(weights >= 0.0), msg
+
+    max_weight = num.max(weights)
+    if max_weight == 0.0:
+        return None
+
+    weights = num.round(weights*(1000.0/max_weight))
+
+    return num.maximum(weights, 1).astype(num.int32)
+
+
+def pmesh_divide_metis_dual(domain, n_procs, weights=None, objective='edgecut'):
+    """Partition the triangles of the domain by partitioning the dual
+    graph of the mesh.
+
+    weights are the (relative) cost of each triangle, say larger for
+    triangles expected to be wet or with expensive operators. The
+    partition balances the sum of the weights.
+
+    objective 'edgecut' minimises the number of edges between
+    partitions, 'ghosts' minimises the communication volume, i.e. the
+    number of ghost triangles (of the first layer).
+
+    Return the processor of each triangle.
+    """
+
+    objectives = ['edgecut', 'ghosts']
+    msg = 'partition_objective should be one of %s, got %s' % (objectives, objective)
+    assert objective in objectives, msg
+
+    xadj, adjncy = dual_graph(domain)
+
+    if weights is not None:
+        weights = metis_weights(weights, len(domain.triangles))
+
+    # metis uses 32 bit integers
+    xadj = xadj.astype(num.int32)
+    adjncy = adjncy.astype(num.int32)
+
+    objective_value, epart = partGraphKway(xadj, adjncy, weights, n_procs,
+                                           objective == 'ghosts')
+
+    if verbose: print 'pmesh_divide_metis_dual: %s = %g' % (objective, objective_value)
+
+    return epart
+
+
+def pmesh_divide_metis_helper(domain, n_procs, parameters=None):
     
     # Initialise the lists
     # List, indexed by processor of # triangles.
@@ -158,8 +236,19 @@ def pmesh_divide_metis_helper(domain, n_procs):
 
     # Prepare variables for the metis call
     
+    # Partition on the dual graph if weights or an objective are given
+    if parameters is None:
+        parameters = {}
+    weights = parameters.get('partition_weights', None)
+    objective = parameters.get('partition_objective', None)
+
     n_tri = len(domain.triangles)
-    if n_procs != 1: #Because metis chokes on it...
+    if n_procs != 1 and (weights is not None or objective is not None):
+        if objective is None:
+            objective = 'edgecut'
+        epart = pmesh_divide_metis_dual(domain, n_procs, weights, objective)
+
+    elif n_procs != 1: #Because metis chokes on it...
         n_vert = domain.get_number_of_nodes()
         t_list = domain.triangles.copy()
         t_list = num.reshape(t_list, (-1,))
@@ -173,6 +262,8 @@ def pmesh_divide_metis_helper(domain, n_procs):
         del edgecut
         del npart
 
+    if n_procs != 1:
+
         # Sometimes (usu. on x86_64), partMeshNodal returns an array of zero
         # dimensional arrays. Correct this.
         if type(epart[0]) == num.ndarray:
@@ -234,7 +325,7 @@ def pmesh_divide_metis_helper(domain, n_procs):
         triangles_per_proc = [n_tri]
         new_triangles = domain.triangles.copy()
         new_tri_index = []
-        epart_order = []
+        epart_order = num.arange(n_tri)
         
         # This is essentially the same as a chunk of code from reorder.
         
@@ -308,6 +399,14 @@ def submesh_full(mesh, triangles_per_proc):
     boundary_list = []
     submesh = {}
 
+    # The boundary edges sorted by triangle
+
+    boundary_keys = boundary.keys()
+    boundary_tri = num.array([k[0] for k in boundary_keys], num.int)
+    boundary_order = num.argsort(boundary_tri, kind='mergesort')
+    boundary_bounds = num.searchsorted(boundary_tri[boundary_order],
+                        num.concatenate(([0], num.cumsum(triangles_per_proc))))
+
 #    node_range = num.reshape(num.arange(nnodes),(nnodes,1))
 #
 #    #print node_range
@@ -328,9 +427,9 @@ def submesh_full(mesh, triangles_per_proc):
         # Find the boundary edges on processor p
 
         subboundary = {}
-        for k in boundary:
-            if (k[0] >=tlower and k[0] < tupper):
-                subboundary[k]=boundary[k]
+        for i in boundary_order[boundary_bounds[p]:boundary_bounds[p+1]]:
+            k = boundary_keys[i]
+            subboundary[k]=boundary[k]
         boundary_list.append(subboundary)
 
         # Find nodes in processor p
@@ -404,7 +503,7 @@ def ghost_layer_old(submesh, mesh, p, tupper, tlower, parameters = None):
     ncoord = mesh.number_of_nodes
     ntriangles = mesh.number_of_triangles
 
-    if parameters is None:
+    if parameters is None or 'ghost_layer_width' not in parameters:
         layer_width  = 2
     else:
         layer_width = parameters['ghost_layer_width']
@@ -494,72 +593,66 @@ def ghost_layer_old(submesh, mesh, p, tupper, tlower, parameters = None):
 
 
 
-def ghost_layer(submesh, mesh, p, tupper, tlower, parameters = None):
-
-    ncoord = mesh.number_of_nodes
-    ntriangles = mesh.number_of_triangles
-
-    if parameters is None:
-        layer_width  = 2
-    else:
-        layer_width = parameters['ghost_layer_width']
+def _in_sorted(a, b):
+    """Flag the values of a which are in the sorted array b
+    """
 
+    if len(b) == 0:
+        return num.zeros(num.shape(a), num.bool)
 
-    full_ids = num.arange(tlower, tupper)
+    i = num.searchsorted(b, a)
+    i[i == len(b)] = 0
 
-    n0 = mesh.neighbours[full_ids, :]
-    n0 = num.unique(n0.flat)
-    n0 = num.extract(n0>=0,n0)
-    n0 = num.extract(num.logical_or(n0<tlower, tupper<= n0), n0)
+    return b[i] == a
 
-    layer_cells = {}
-    layer_cells[0] = n0
 
+def ghost_layer(submesh, mesh, p, tupper, tlower, parameters = None):
 
-    # Find the subsequent layers of ghost triangles
-    for i in range(layer_width-1):
+    if parameters is None or 'ghost_layer_width' not in parameters:
+        layer_width  = 2
+    else:
+        layer_width = parameters['ghost_layer_width']
 
-        # use previous layer as a start
-        n0 = mesh.neighbours[n0, :]
-        n0 = num.unique(n0.flat)
-        n0 = num.extract(n0>=0,n0)
-        n0 = num.extract(num.logical_or(n0<tlower, tupper<= n0), n0)
+    # The neighbours are a CSR structure with three (or no, -1)
+    # neighbours per triangle, so each layer is the neighbours of the
+    # previous layer (or of the full triangles), less the full triangles
+    # and the triangles of the previous layers
 
-        for j in xrange(i+1):
-            n0 = numset.setdiff1d(n0,layer_cells[j])
+    neighbours = mesh.neighbours
 
-        layer_cells[i+1] = n0
+    n0 = neighbours[tlower:tupper].ravel()
+    n0 = num.unique(n0[num.logical_and(n0 >= 0,
+                       num.logical_or(n0 < tlower, n0 >= tupper))])
 
+    new_trianglemap = n0
 
-    # Build the triangle list and make note of the vertices
-    new_trianglemap = layer_cells[0]
     for i in range(layer_width-1):
-        new_trianglemap = numset.union1d(new_trianglemap,layer_cells[i+1])
-
-    new_subtriangles = num.concatenate((num.reshape(new_trianglemap, (-1,1)), mesh.triangles[new_trianglemap]), 1)
 
+        n0 = neighbours[n0].ravel()
+        n0 = num.unique(n0[num.logical_and(n0 >= 0,
+                           num.logical_or(n0 < tlower, n0 >= tupper))])
+        n0 = n0[num.logical_not(_in_sorted(n0, new_trianglemap))]
 
+        new_trianglemap = num.sort(num.concatenate((new_trianglemap, n0)))
 
 
-    fullnodes = submesh["full_nodes"][p]
-    full_nodes_ids = num.array(fullnodes[:,0],num.int)
-
-    new_nodes = num.unique(mesh.triangles[new_trianglemap].flat)
-    new_nodes = numset.setdiff1d(new_nodes,full_nodes_ids)
+    new_subtriangles = num.concatenate((num.reshape(new_trianglemap, (-1,1)),
+                                        mesh.triangles[new_trianglemap]), 1)
 
-    new_subnodes = num.concatenate((num.reshape(new_nodes, (-1,1)), mesh.nodes[new_nodes]), 1)
+    # The vertices of the ghost triangles which are not full nodes
+    # (the full node ids are sorted, see submesh_full)
 
-    # Clean up before exiting
+    full_nodes_ids = num.array(submesh["full_nodes"][p][:,0], num.int)
 
-    del (new_nodes)
-    del (layer_cells)
-    del (n0)
-    del (new_trianglemap)
+    new_nodes = num.unique(mesh.triangles[new_trianglemap])
+    new_nodes = new_nodes[num.logical_not(_in_sorted(new_nodes, full_nodes_ids))]
 
-    # Return the triangles and vertices sitting on the boundary layer
+    new_subnodes = num.concatenate((num.reshape(new_nodes, (-1,1)),
+                                    mesh.nodes[new_nodes]), 1)
 
     return new_subnodes, new_subtriangles, layer_width
 
+
 #########################################################
 #
 # Find the edges of the ghost trianlges that do not
@@ -637,66 +730,29 @@ def ghost_bnd_layer_old(ghosttri, tlower, tupper, mesh, p):
 
 def ghost_bnd_layer(ghosttri, tlower, tupper, mesh, p):
 
-
     boundary = mesh.boundary
 
-    ghost_list = []
-    subboundary = {}
-
-
-    new_ghost_list = ghosttri[:,0]
-
-    #print new_ghost_list
-
-    # 0 edge boundaries
-    nghb0 = mesh.neighbours[new_ghost_list,0]
-    gl0 = num.extract(num.logical_or(nghb0 < tlower, nghb0 >= tupper), new_ghost_list)
-    nghb0 = mesh.neighbours[gl0,0]
-    flag = numset.in1d(nghb0,new_ghost_list)
-    gl0 = num.extract(num.logical_not(flag),gl0)
-    edge0 = 0*num.ones_like(gl0)
-    n0 = len(edge0)
-    values0 = ['ghost']*n0
-
-    # 1 edge boundary
-    nghb1 = mesh.neighbours[new_ghost_list,1]
-    gl1 = num.extract(num.logical_or(nghb1 < tlower, nghb1 >= tupper), new_ghost_list)
-    nghb1 = mesh.neighbours[gl1,1]
-    flag = numset.in1d(nghb1,new_ghost_list)
-    gl1 = num.extract(num.logical_not(flag),gl1)
-    edge1 = 1*num.ones_like(gl1)
-    n1 = len(edge1)
-    values1 = ['ghost']*n1
-
-    # 2 edge boundary
-    nghb2 = mesh.neighbours[new_ghost_list,2]
-    gl2 = num.extract(num.logical_or(nghb2 < tlower, nghb2 >= tupper), new_ghost_list)
-    nghb2 = mesh.neighbours[gl2,2]
-    flag = numset.in1d(nghb2,new_ghost_list)
-    gl2 = num.extract(num.logical_not(flag),gl2)
-    edge2 = 2*num.ones_like(gl2)
-    n2 = len(edge2)
-    values2 = ['ghost']*n2
-
+    # The ghost triangles are sorted (see ghost_layer)
+    ghost_ids = num.array(ghosttri[:,0], num.int)
 
-    gl = num.concatenate((gl0,gl1,gl2))
-    edge = num.concatenate((edge0,edge1,edge2))
-    values = values0 + values1 + values2
-#    print gl
-#    print edge
-#    print values
+    # The edges whose neighbour is neither full nor ghost
+    nghb = mesh.neighbours[ghost_ids]
+    outside = num.logical_or(nghb < tlower, nghb >= tupper)
+    outside = num.logical_and(outside,
+                              num.logical_not(_in_sorted(nghb, ghost_ids)))
 
-    subboundary = dict(zip(zip(gl,edge),values))
-    #intersect with boundary 
+    ids, edges = num.nonzero(outside)
 
-    # FIXME SR: these keys should be viewkeys but need python 2.7
-    subboundary.update( (k,boundary[k]) for k in set(subboundary.keys()) & set(boundary.keys()) )
-
-    #print subboundary
+    # FIXME SR: For larger layers need to pass through the correct
+    # boundary tag!
 
+    subboundary = {}
+    for k in zip(ghost_ids[ids].tolist(), edges.tolist()):
+        subboundary[k] = boundary.get(k, 'ghost')
 
     return subboundary
 
+
 #########################################################
 #
 # The ghost triangles on the current processor will need
@@ -772,6 +828,39 @@ def ghost_commun_pattern(subtri, p, tri_per_proc_range):
 
     return ghost_commun
 
+#########################################################
+#
+# Distance of the triangles from the ghost triangles
+#
+#  *) The halo level of a triangle is the number of
+# triangles between it and the nearest ghost triangle,
+# capped at max_level. Ghost triangles have level 0 and
+# full triangles next to a ghost have level 1.
+#
+#  *) Used to overlap the ghost communication with the
+# computation on the triangles which do not depend on the
+# ghost values (see Parallel_domain.set_ghost_exchange_overlap)
+#
+#########################################################
+
+def ghost_halo_levels(neighbours, tri_full_flag, max_level=4):
+
+    neighbours = num.asarray(neighbours)
+    tri_full_flag = num.asarray(tri_full_flag)
+
+    levels = num.where(tri_full_flag == 1, max_level, 0)
+
+    # Boundary edges (negative neighbours) do not bring a triangle
+    # closer to the ghosts
+    internal = neighbours >= 0
+    internal_neighbours = num.where(internal, neighbours, 0)
+
+    for i in range(max_level):
+        neighbour_levels = num.where(internal, levels[internal_neighbours], max_level)
+        levels = num.minimum(levels, num.min(neighbour_levels, axis=1) + 1)
+
+    return levels.astype(num.int)
+
 #########################################################
 #
 # The full triangles in this processor must communicate
@@ -797,36 +886,57 @@ def ghost_commun_pattern(subtri, p, tri_per_proc_range):
 #########################################################
 
 def full_commun_pattern(submesh, tri_per_proc):
-    tlower = 0
+
+    import gc
+    from itertools import izip, repeat, starmap
+
     nproc = len(tri_per_proc)
-    full_commun = []
 
-    # Loop over the processor
+    # All the ghost triangles, with the processor holding the ghost
+    # copy, sorted by the global id and then the processor
 
-    for p in xrange(nproc):
+    ghost_commun = [num.reshape(g, (-1,2)) for g in submesh["ghost_commun"]]
 
-        # Loop over the full triangles in the current processor
-        # and build an empty dictionary
+    global_ids = num.concatenate([g[:,0] for g in ghost_commun])
+    procs = num.repeat(num.arange(nproc), [len(g) for g in ghost_commun])
 
-        fcommun = {}
-        tupper = tri_per_proc[p]+tlower
-        for i in xrange(tlower, tupper):
-            fcommun[i] = []
-        full_commun.append(fcommun)
-        tlower = tupper
+    order = num.lexsort((procs, global_ids))
+    global_ids = global_ids[order]
+    procs = procs[order].tolist()
 
-    # Loop over the processor again
+    # The processors with a ghost copy of each triangle
 
-    for p in xrange(nproc):
+    ghost_ids, starts, ends = _group_bounds(global_ids)
+    ghost_procs = [procs[i:j] for i, j in izip(starts, ends)]
+
+    # Each triangle is in the range of the processor with the full copy
+
+    tri_bounds = num.concatenate(([0], num.cumsum(tri_per_proc)))
+    ghost_bounds = num.searchsorted(ghost_ids, tri_bounds).tolist()
+
+    full_commun = []
+
+    # The list for each triangle would set off the cyclic garbage
+    # collector over and over, for no garbage
+    gc_enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        for p in xrange(nproc):
+            tlower = int(tri_bounds[p])
+            tupper = int(tri_bounds[p+1])
+
+            fcommun = dict(izip(xrange(tlower, tupper),
+                                starmap(list, repeat((), tupper-tlower))))
 
-        # Loop over the ghost triangles in the current processor,
-        # find which processor contains the corresponding full copy
-        # and note that the processor must send updates to this
-        # processor
+            i = ghost_bounds[p]
+            j = ghost_bounds[p+1]
+            fcommun.update(izip(ghost_ids[i:j], ghost_procs[i:j]))
 
-        for g in submesh["ghost_commun"][p]:
-            neigh = g[1]
-            full_commun[neigh][g[0]].append(p)
+            full_commun.append(fcommun)
+    finally:
+        if gc_enabled:
+            gc.enable()
 
     return full_commun
 
@@ -956,20 +1066,16 @@ def submesh_quantities(submesh, quantities, triangles_per_proc):
 
         # Find the global ID of the ghost triangles
 
-        global_id = []
-        M = len(submesh["ghost_triangles"][p])
-        for j in xrange(M):
-            global_id.append(submesh["ghost_triangles"][p][j][0])
+        global_id = num.reshape(submesh["ghost_triangles"][p], (-1,4))[:,0]
+        global_id = global_id.astype(num.int)
 
         # Use the global ID to extract the quantites information from
         # the full domain
 
         for k in quantities:
             submesh["full_quan"][k].append(quantities[k][lower:upper])
-            submesh["ghost_quan"][k].append(num.zeros( (M,3) , num.float))
-            for j in range(M):
-                submesh["ghost_quan"][k][p][j] = \
-                                               quantities[k][global_id[j]]
+            submesh["ghost_quan"][k].append(
+                num.array(quantities[k][global_id], num.float).reshape(-1,3))
 
         lower = upper
 
@@ -1067,11 +1173,10 @@ def build_local_GA(nodes, triangles, boundaries, tri_map):
     # Build a global ID to local ID mapping
 
     NGlobal = 0
-    for i in xrange(Nnodes):
-        if nodes[i][0] > NGlobal:
-            NGlobal = nodes[i][0]
+    if Nnodes > 0:
+        NGlobal = max(NGlobal, num.max(nodes[:,0]))
 
-    node_map = -1*num.ones(int(NGlobal)+1, num.int)
+    node_map = num.full(int(NGlobal)+1, -1, num.int)
 
     num.put(node_map, num.take(nodes, (0,), 1).astype(num.int), \
         num.arange(Nnodes))
@@ -1116,47 +1221,59 @@ def build_local_GA(nodes, triangles, boundaries, tri_map):
 #
 #########################################################
 
+def _group_bounds(keys):
+    """The distinct values of the sorted array keys, and the start and
+    end of the run of each
+    """
+
+    if len(keys) == 0:
+        return [], [], []
+
+    starts = num.flatnonzero(num.concatenate(([True], keys[1:] != keys[:-1])))
+    ends = num.append(starts[1:], len(keys))
+
+    return keys[starts].tolist(), starts.tolist(), ends.tolist()
+
+
 def build_local_commun(tri_map, ghostc, fullc, nproc):
 
+    from itertools import chain, imap, izip
+
     # Initialise
 
     full_send = {}
     ghost_recv = {}
 
-    # Build the ghost_recv dictionary (sort the
-    # information by the global numbering)
-    
-    ghostc = num.sort(ghostc, 0)
-    
-    for c in xrange(nproc):
-        s = ghostc[:,0]
-        d = num.compress(num.equal(ghostc[:,1],c), s)
-        if len(d) > 0:
-            ghost_recv[c] = [0, 0]
-            ghost_recv[c][1] = d
-            ghost_recv[c][0] = num.take(tri_map, d)
-            
-    # Build a temporary copy of the full_send dictionary
-    # (this version allows the information to be stored
-    # by the global numbering)
+    # Build the ghost_recv dictionary (sorted by the processor and
+    # then by the global numbering)
 
-    tmp_send = {}
-    for global_id in fullc:
-        for i in xrange(len(fullc[global_id])):
-            neigh = fullc[global_id][i]
-            if not tmp_send.has_key(neigh):
-                tmp_send[neigh] = []
-            tmp_send[neigh].append([global_id, \
-                                    tri_map[global_id]])
+    ghostc = num.reshape(ghostc, (-1,2))
+    order = num.lexsort((ghostc[:,0], ghostc[:,1]))
+    global_ids = ghostc[order,0]
 
-    # Extract the full send information and put it in the form
-    # required for the full_send dictionary
+    for c, i, j in izip(*_group_bounds(ghostc[order,1])):
+        d = global_ids[i:j]
+        ghost_recv[c] = [num.take(tri_map, d), d]
 
-    for neigh in tmp_send:
-        neigh_commun = num.sort(tmp_send[neigh], 0)
-        full_send[neigh] = [0, 0]
-        full_send[neigh][0] = neigh_commun[:,1]
-        full_send[neigh][1] = neigh_commun[:,0]
+    # Flatten the full communication pattern into the pairs
+    # [global id, neighbour] (the keys and values of a dictionary are
+    # iterated over in the same order)
+
+    counts = num.fromiter(imap(len, fullc.itervalues()), num.int, len(fullc))
+    global_ids = num.repeat(num.fromiter(fullc.iterkeys(), num.int, len(fullc)),
+                            counts)
+    neighs = num.fromiter(chain.from_iterable(fullc.itervalues()), num.int,
+                          num.sum(counts))
+
+    # Build the full_send dictionary (sorted by the neighbour and then
+    # by the global numbering)
+
+    order = num.lexsort((global_ids, neighs))
+    global_ids = global_ids[order]
+
+    for neigh, i, j in izip(*_group_bounds(neighs[order])):
+        d = global_ids[i:j]
+        full_send[neigh] = [num.take(tri_map, d), d]
 
     return ghost_recv, full_send
 
@@ -1203,16 +1320,15 @@ def build_local_mesh(submesh, lower_t, upper_t, nproc):
     # Make note of the new triangle numbers, including the ghost
     # triangles
 
+    ghost_ids = num.reshape(submesh["ghost_triangles"], (-1,4))[:,0]
+    ghost_ids = ghost_ids.astype(num.int)
+
     NGlobal = upper_t
-    for i in xrange(len(submesh["ghost_triangles"])):
-        id = submesh["ghost_triangles"][i][0]
-        if id > NGlobal:
-            NGlobal = id
-    #index = num.zeros(int(NGlobal)+1, num.int)
-    tri_map = -1*num.ones(int(NGlobal)+1, num.int)
+    if len(ghost_ids) > 0:
+        NGlobal = max(NGlobal, num.max(ghost_ids))
+    tri_map = num.full(int(NGlobal)+1, -1, num.int)
     tri_map[lower_t:upper_t]=num.arange(upper_t-lower_t)
-    for i in xrange(len(submesh["ghost_triangles"])):
-        tri_map[submesh["ghost_triangles"][i][0]] = i+upper_t-lower_t
+    tri_map[ghost_ids] = num.arange(len(ghost_ids)) + upper_t-lower_t
     
     # Change the node numbering (and update the numbering in the
     # triangles)
@@ -1240,8 +1356,10 @@ def build_local_mesh(submesh, lower_t, upper_t, nproc):
 
 
 
-    tri_l2g  = extract_l2g_map(tri_map)
-    node_l2g = extract_l2g_map(node_map)
+    # The local to global maps (the inverses of tri_map and node_map)
+
+    tri_l2g  = num.concatenate((num.arange(lower_t, upper_t), ghost_ids))
+    node_l2g = num.array(nodes[:,0], num.int)
      
     return GAnodes, GAtriangles, GAboundary, quantities, ghost_rec, \
            full_send, tri_map, node_map, tri_l2g, node_l2g, ghost_layer_width
@@ -405,184 +405,398 @@ static PyObject *sendrecv_array(PyObject *self, PyObject *args) {
 /* do multiple isends and irecv of Numpy array buffers        */
 /* of type float, double, int, or long                       */
 /*                                                           */
+/* The communication is split into a start (post the irecvs  */
+/* and isends) and a wait, so that computation can be done   */
+/* while the messages are in flight. Only one exchange can   */
+/* be pending at a time.                                     */
 /*************************************************************/
-static PyObject *send_recv_via_dicts(PyObject *self, PyObject *args) {
+#define MAX_SEND_RECV_BUFFERS 20
 
-  PyObject *send_dict;
-  PyObject *recv_dict;
+static MPI_Request send_recv_requests[2*MAX_SEND_RECV_BUFFERS];
+static MPI_Status send_recv_statuses[2*MAX_SEND_RECV_BUFFERS];
+static int send_recv_pending = -1; /* Number of pending requests, -1 if none */
 
-  //PyObject *seq;
 
-  //PyObject *list;
+int _start_send_recv_via_dicts(PyObject *send_dict, PyObject *recv_dict) {
+
   PyArrayObject *X;
-  //PyArrayObject *Id;
-  //int op, error, count, count1, myid;
-  //MPI_Datatype mpi_type, buffer_type;
-  //MPI_Op mpi_op;
   int k, lenx;
   int num_recv=0;
   int num_send=0;
 
   int ierr;
-  MPI_Request requests[40];
-  MPI_Status statuses[40];
 
   Py_ssize_t pos = 0;
 
   PyObject *key, *value;
-  //long *Iddata;
-  //double *xdata;
 
-  /* process the parameters */
-  if (!PyArg_ParseTuple(args, "OO", &send_dict, &recv_dict)) {
+  if (send_recv_pending >= 0) {
     PyErr_SetString(PyExc_RuntimeError,
-		    "mpiextras.c (sendrecv_array): could not parse input");
-    return NULL;
+		    "mpiextras.c; a send_recv communication is already pending");
+    return -1;
   }
 
-  //----------------------------------------------------------------------------
-  // Do the recv first
-  //----------------------------------------------------------------------------
   num_recv = PyDict_Size(recv_dict);
-  //printf("num_recv = %d\n",num_recv);
-  if (num_recv>20) {
+  num_send = PyDict_Size(send_dict);
+  if (num_recv > MAX_SEND_RECV_BUFFERS) {
     PyErr_SetString(PyExc_RuntimeError,
-		    "mpiextras.c; Number of recv communication buffers > 10");
-    return NULL;
+		    "mpiextras.c; Number of recv communication buffers > 20");
+    return -1;
+  }
+  if (num_send > MAX_SEND_RECV_BUFFERS) {
+    PyErr_SetString(PyExc_RuntimeError,
+		    "mpiextras.c; Number of send communication buffers > 20");
+    return -1;
   }
 
+  //----------------------------------------------------------------------------
+  // Do the recv first
+  //----------------------------------------------------------------------------
   pos = 0;
   k = 0;
   while (PyDict_Next(recv_dict, &pos, &key, &value)) {
     int i = PyInt_AS_LONG(key);
-    //printf("key %d\n",i);
 
-    //Id = (PyArrayObject *) PyList_GetItem(value, 0);
     X   = (PyArrayObject *) PyList_GetItem(value, 2);
 
     lenx = X->dimensions[0]*X->dimensions[1];
 
-
-    //printf("buf size %d by 3\n",lenx/3);
-    //xdata = (double *) X->data;
-    //Iddata = (long *) Id->data;
-
-    //printf("k = %d \n",k);
-    ierr = MPI_Irecv(X->data, lenx, MPI_DOUBLE, i, 123, MPI_COMM_WORLD, &requests[k]);
+    ierr = MPI_Irecv(X->data, lenx, MPI_DOUBLE, i, 123, MPI_COMM_WORLD, &send_recv_requests[k]);
     if (ierr>0) {
-        PyErr_SetString(PyExc_RuntimeError,
-    		    "mpiextras.c; error from MPI_Irecv");
-        return NULL;
-      }
-    //printf("ierr = %d \n",ierr);
+      PyErr_SetString(PyExc_RuntimeError,
+		      "mpiextras.c; error from MPI_Irecv");
+      return -1;
+    }
     k++;
-    //for (k=0 ; k < lenx ; k++) printf("X[%d] = %g Id[%d] = %ld \n",k,xdata[k],k,Iddata[k]);
-}
+  }
+
   //----------------------------------------------------------------------------
   // Do the sends second
   //----------------------------------------------------------------------------
-  num_send = PyDict_Size(send_dict);
-  //printf("num_send = %d\n",num_send);
-  if (num_send>20) {
-    PyErr_SetString(PyExc_RuntimeError,
-		    "mpiextras.c; Number of send communication buffers > 10");
-    return NULL;
-  }
-
   pos = 0;
   while (PyDict_Next(send_dict, &pos, &key, &value)) {
     int i = PyInt_AS_LONG(key);
-    //printf("key %d\n",i);
 
-    //Id = (PyArrayObject *) PyList_GetItem(value, 0);
     X   = (PyArrayObject *) PyList_GetItem(value, 2);
 
     lenx = X->dimensions[0]*X->dimensions[1];
 
-    //printf("buf size %d by 3 \n",lenx/3);
-    //xdata = (double *) X->data;
-    //Iddata = (long *) Id->data;
-    //for (k=0 ; k < lenx ; k++) printf("X[%d] = %g Id[%d] = %ld \n",k,xdata[k],k,Iddata[k]);
-
-    //printf("k = %d \n",k);
-    ierr = MPI_Isend(X->data, lenx, MPI_DOUBLE, i, 123, MPI_COMM_WORLD, &requests[k]);
-    //printf("ierr = %d \n",ierr);
-    
+    ierr = MPI_Isend(X->data, lenx, MPI_DOUBLE, i, 123, MPI_COMM_WORLD, &send_recv_requests[k]);
+    if (ierr>0) {
+      PyErr_SetString(PyExc_RuntimeError,
+		      "mpiextras.c; error from MPI_Isend");
+      return -1;
+    }
     k++;
+  }
+
+  send_recv_pending = k;
+
+  return 0;
 }
 
 
+int _wait_send_recv_via_dicts(void) {
 
-  //printf("k = %d\n",k);
+  int ierr;
 
+  if (send_recv_pending < 0) {
+    PyErr_SetString(PyExc_RuntimeError,
+		    "mpiextras.c; no send_recv communication is pending");
+    return -1;
+  }
 
   //----------------------------------------------------------------------------
-  // Now complete communication. We could put some computation between the 
-  // communication calls above and this call.
+  // Now complete communication.
   //----------------------------------------------------------------------------
-  ierr =  MPI_Waitall(k,requests,statuses);
+  ierr =  MPI_Waitall(send_recv_pending, send_recv_requests, send_recv_statuses);
+
+  send_recv_pending = -1;
+
+  if (ierr>0) {
+    PyErr_SetString(PyExc_RuntimeError,
+		    "mpiextras.c; error from MPI_Waitall");
+    return -1;
+  }
 
+  return 0;
+}
 
 
+static PyObject *send_recv_via_dicts(PyObject *self, PyObject *args) {
 
+  PyObject *send_dict;
+  PyObject *recv_dict;
 
-/*
-  for (i = 0; i < len; i++) {
-    x = (PyArrayObject *) PySequence_Fast_GET_ITEM(seq, i);
-    lenx = x->dimensions[0];
-    printf("buf size %d\n",len);
-    xdata = (double *) x->data;
-    printf("x->data[0] %g\n",xdata[0]);y
+  /* process the parameters */
+  if (!PyArg_ParseTuple(args, "OO", &send_dict, &recv_dict)) {
+    PyErr_SetString(PyExc_RuntimeError,
+		    "mpiextras.c (send_recv_via_dicts): could not parse input");
+    return NULL;
   }
-  Py_DECREF(seq);
-*/
 
+  if (_start_send_recv_via_dicts(send_dict, recv_dict) < 0) return NULL;
 
-/*
-//   Input check and determination of MPI type
-  mpi_type = type_map(x, &count);
-  if (!mpi_type) {
+  if (_wait_send_recv_via_dicts() < 0) return NULL;
+
+  Py_INCREF(Py_None);
+  return (Py_None);
+}
+
+
+/*************************************************************/
+/* start_send_recv_via_dicts                                 */
+/* Post the irecvs and isends of send_recv_via_dicts and      */
+/* return without waiting for them to complete. The buffers   */
+/* must not be touched until wait_send_recv_via_dicts         */
+/*************************************************************/
+static PyObject *start_send_recv_via_dicts(PyObject *self, PyObject *args) {
+
+  PyObject *send_dict;
+  PyObject *recv_dict;
+
+  /* process the parameters */
+  if (!PyArg_ParseTuple(args, "OO", &send_dict, &recv_dict)) {
     PyErr_SetString(PyExc_RuntimeError,
-		    "mpiext.c (allreduce_array): could not determine mpi_type");
+		    "mpiextras.c (start_send_recv_via_dicts): could not parse input");
     return NULL;
   }
 
+  if (_start_send_recv_via_dicts(send_dict, recv_dict) < 0) return NULL;
 
-  //This error is caught at the pypar level - so we won't end up here
-  //  unless mpiext is being used independently
-  buffer_type = type_map(d, &count1);
-  if (mpi_type != buffer_type) {
-    sprintf(errmsg, "mpiext.c (allreduce_array): Input array and buffer must be of the same type.");
-    PyErr_SetString(PyExc_RuntimeError, errmsg);
+  Py_INCREF(Py_None);
+  return (Py_None);
+}
+
+
+/*************************************************************/
+/* wait_send_recv_via_dicts                                  */
+/* Wait for the communication posted by                      */
+/* start_send_recv_via_dicts to complete                     */
+/*************************************************************/
+static PyObject *wait_send_recv_via_dicts(PyObject *self, PyObject *args) {
+
+  if (_wait_send_recv_via_dicts() < 0) return NULL;
 
+  Py_INCREF(Py_None);
+  return (Py_None);
+}
+
+
+ 
+/* Argument checks for gather_buffer and scatter_buffer */
+int _check_buffer_arguments(PyObject *arrays, PyArrayObject *index,
+			    PyArrayObject *buffer) {
+
+  if (!PySequence_Check(arrays) ||
+      !PyArray_Check(index) || !PyArray_Check(buffer)) {
+    PyErr_SetString(PyExc_TypeError,
+		    "mpiextras.c: expected a list of arrays, an index array and a buffer");
+    return -1;
+  }
+
+  if (PyArray_TYPE(index) != NPY_LONG || !PyArray_ISCARRAY(index) ||
+      PyArray_NDIM(index) != 1) {
+    PyErr_SetString(PyExc_ValueError,
+		    "mpiextras.c: index must be a contiguous 1d integer array");
+    return -1;
+  }
+
+  if (PyArray_TYPE(buffer) != NPY_DOUBLE || !PyArray_ISCARRAY(buffer) ||
+      PyArray_NDIM(buffer) != 2 ||
+      PyArray_DIM(buffer, 0) != PyArray_DIM(index, 0) ||
+      PyArray_DIM(buffer, 1) < PySequence_Size(arrays)) {
+    PyErr_SetString(PyExc_ValueError,
+		    "mpiextras.c: buffer must be a contiguous double array with a row for each index and a column for each array");
+    return -1;
+  }
+
+  return 0;
+}
+
+
+/* Data of the j-th array of the list (a new reference is returned in array) */
+double *_get_buffer_array(PyObject *arrays, int j, PyObject **array) {
+
+  PyArrayObject *x;
+
+  *array = PySequence_GetItem(arrays, j); /* New reference */
+  if (*array == NULL) return NULL;
+
+  x = (PyArrayObject *) *array;
+  if (!PyArray_Check(*array) || PyArray_TYPE(x) != NPY_DOUBLE ||
+      !PyArray_ISCARRAY(x)) {
+    PyErr_SetString(PyExc_ValueError,
+		    "mpiextras.c: arrays must be contiguous double arrays");
+    Py_DECREF(*array);
     return NULL;
   }
 
-  if (count != count1) {
+  return (double *) PyArray_DATA(x);
+}
+
+
+/*************************************************************/
+/* gather_buffer                                             */
+/* Pack the values of a list of double arrays at the given   */
+/* indices into the columns of a contiguous buffer,          */
+/* buffer[k,j] = arrays[j][index[k]]                         */
+/*************************************************************/
+static PyObject *gather_buffer(PyObject *self, PyObject *args) {
+
+  PyObject *arrays, *array;
+  PyArrayObject *index, *buffer;
+  double *x, *b;
+  long *id;
+  long k, n;
+  int j, m, width;
+
+  if (!PyArg_ParseTuple(args, "OOO", &arrays, &index, &buffer)) {
     PyErr_SetString(PyExc_RuntimeError,
-		    "mpiext.c (allreduce_array): Input array and buffer must have same length");
+		    "mpiextras.c (gather_buffer): could not parse input");
     return NULL;
   }
 
-  // Input check and determination of MPI op
-  mpi_op = op_map(op);
-  if (!mpi_op) {
+  if (_check_buffer_arguments(arrays, index, buffer) < 0) return NULL;
+
+  m = PySequence_Size(arrays);
+  n = PyArray_DIM(index, 0);
+  width = PyArray_DIM(buffer, 1);
+  id = (long *) PyArray_DATA(index);
+  b = (double *) PyArray_DATA(buffer);
+
+  for (j = 0; j < m; j++) {
+    x = _get_buffer_array(arrays, j, &array);
+    if (x == NULL) return NULL;
+
+    for (k = 0; k < n; k++) {
+      b[k*width + j] = x[id[k]];
+    }
+
+    Py_DECREF(array);
+  }
+
+  Py_INCREF(Py_None);
+  return (Py_None);
+}
+
+
+/*************************************************************/
+/* scatter_buffer                                            */
+/* Unpack the columns of a contiguous buffer into a list of  */
+/* double arrays at the given indices,                       */
+/* arrays[j][index[k]] = buffer[k,j]                         */
+/*************************************************************/
+static PyObject *scatter_buffer(PyObject *self, PyObject *args) {
+
+  PyObject *arrays, *array;
+  PyArrayObject *index, *buffer;
+  double *x, *b;
+  long *id;
+  long k, n;
+  int j, m, width;
+
+  if (!PyArg_ParseTuple(args, "OOO", &arrays, &index, &buffer)) {
     PyErr_SetString(PyExc_RuntimeError,
-		    "mpiext.c (allreduce_array): could not determine mpi_op");
+		    "mpiextras.c (scatter_buffer): could not parse input");
     return NULL;
   }
 
-  if (op == MAXLOC || op == MINLOC) {
+  if (_check_buffer_arguments(arrays, index, buffer) < 0) return NULL;
+
+  m = PySequence_Size(arrays);
+  n = PyArray_DIM(index, 0);
+  width = PyArray_DIM(buffer, 1);
+  id = (long *) PyArray_DATA(index);
+  b = (double *) PyArray_DATA(buffer);
+
+  for (j = 0; j < m; j++) {
+    x = _get_buffer_array(arrays, j, &array);
+    if (x == NULL) return NULL;
+
+    for (k = 0; k < n; k++) {
+      x[id[k]] = b[k*width + j];
+    }
+
+    Py_DECREF(array);
+  }
+
+  Py_INCREF(Py_None);
+  return (Py_None);
+}
+
+
+
+/*************************************************************/
+/* allreduce_packed                                          */
+/* Allreduce a packed (n,2) double array in which each row   */
+/* holds a value and the op (MAX, MIN or SUM) to reduce it    */
+/* with, so that reductions of different kinds can be done   */
+/* in a single MPI_Allreduce. The (value, op) rows are kept  */
+/* together by the pair datatype, so the op is applied       */
+/* correctly however MPI segments the message.               */
+/*************************************************************/
+static MPI_Datatype packed_pair_type;
+static MPI_Op packed_op;
+static int packed_initialised = 0;
+
+
+void _packed_reduce(void *in, void *inout, int *len, MPI_Datatype *type) {
+  double *a = (double *) in;
+  double *b = (double *) inout;
+  int k, op;
+
+  for (k = 0; k < *len; k++) {
+    op = (int) b[2*k+1];
+    if (op == MIN) {
+      b[2*k] = fmin(a[2*k], b[2*k]);
+    } else if (op == MAX) {
+      b[2*k] = fmax(a[2*k], b[2*k]);
+    } else {
+      b[2*k] = a[2*k] + b[2*k];
+    }
+  }
+}
+
+
+static PyObject *allreduce_packed(PyObject *self, PyObject *args) {
+  PyArrayObject *x;
+  PyArrayObject *d;
+  int error, count, myid;
+
+  /* process the parameters */
+  if (!PyArg_ParseTuple(args, "O!O!", &PyArray_Type, &x, &PyArray_Type, &d)) {
     PyErr_SetString(PyExc_RuntimeError,
-		    "mpiext.c (allreduce_array): MAXLOC and MINLOC are not implemented");
+		    "mpiextras.c (allreduce_packed): could not parse input");
     return NULL;
   }
-  else {
-    // call the MPI routine
-    error =  MPI_Allreduce(x->data, d->data, count, mpi_type, mpi_op, \
-			MPI_COMM_WORLD);
+
+  if (PyArray_TYPE(x) != NPY_DOUBLE || PyArray_TYPE(d) != NPY_DOUBLE ||
+      PyArray_NDIM(x) != 2 || PyArray_NDIM(d) != 2 ||
+      PyArray_DIM(x, 1) != 2 || PyArray_DIM(d, 1) != 2 ||
+      !PyArray_ISCARRAY(x) || !PyArray_ISCARRAY(d)) {
+    PyErr_SetString(PyExc_RuntimeError,
+		    "mpiextras.c (allreduce_packed): Input array and buffer must be contiguous (n,2) double arrays");
+    return NULL;
   }
 
+  count = (int) PyArray_DIM(x, 0);
+  if (count != PyArray_DIM(d, 0)) {
+    PyErr_SetString(PyExc_RuntimeError,
+		    "mpiextras.c (allreduce_packed): Input array and buffer must have same length");
+    return NULL;
+  }
+
+  if (!packed_initialised) {
+    MPI_Type_contiguous(2, MPI_DOUBLE, &packed_pair_type);
+    MPI_Type_commit(&packed_pair_type);
+    MPI_Op_create(_packed_reduce, 1, &packed_op);
+    packed_initialised = 1;
+  }
+
+  error = MPI_Allreduce(PyArray_DATA(x), PyArray_DATA(d), count,
+                        packed_pair_type, packed_op, MPI_COMM_WORLD);
+
   if (error != 0) {
     MPI_Comm_rank(MPI_COMM_WORLD, &myid);
     sprintf(errmsg, "Proc %d: MPI_Allreduce failed with error code %d\n",
@@ -590,15 +804,13 @@ static PyObject *send_recv_via_dicts(PyObject *self, PyObject *args) {
     PyErr_SetString(PyExc_RuntimeError, errmsg);
     return NULL;
   }
-*/
-
 
   Py_INCREF(Py_None);
   return (Py_None);
 }
 
 
- 
+
 /**********************************/
 /* Method table for python module */
 /**********************************/
@@ -608,6 +820,11 @@ static struct PyMethodDef MethodTable[] = {
   {"allreduce_array", allreduce_array, METH_VARARGS},
   {"sendrecv_array", sendrecv_array, METH_VARARGS},
   {"send_recv_via_dicts", send_recv_via_dicts, METH_VARARGS},
+  {"start_send_recv_via_dicts", start_send_recv_via_dicts, METH_VARARGS},
+  {"wait_send_recv_via_dicts", wait_send_recv_via_dicts, METH_VARARGS},
+  {"gather_buffer", gather_buffer, METH_VARARGS},
+  {"scatter_buffer", scatter_buffer, METH_VARARGS},
+  {"allreduce_packed", allreduce_packed, METH_VARARGS},
   {NULL, NULL}
 };
 
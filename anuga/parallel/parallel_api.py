@@ -71,12 +71,62 @@ def distribute(domain, verbose=False, debug=False, parameters = None):
     """ Distribute the domain to all processes
 
     parameters allows user to change size of ghost layer
+    (parameters['ghost_layer_width'])
+
+    parameters['partition_weights'] gives the relative cost of each
+    triangle (say higher for triangles expected to be wet or with
+    expensive operators), parameters['partition_objective'] is 'edgecut'
+    or 'ghosts' (minimise the number of ghost triangles). With either,
+    the triangles are partitioned on the dual graph of the mesh
+
+    If parameters['partition_dir'] is set (a directory shared by all
+    processes) processor 0 writes the partition there, and each processor
+    reads its own submesh from it, rather than processor 0 building and
+    sending all the submeshes
+
+    If parameters['partition_cache'] is set (a directory shared by all
+    processes) the partition of the mesh is kept there and reused when the
+    same mesh is distributed again to the same number of processes
+    (see partition_cache). parameters['partition_cache_size'] (bytes) and
+    parameters['partition_cache_age'] (seconds) limit the cache, and
+    parameters['partition_cache_tmp_age'] (seconds) is the age after which
+    the temporary entries of interrupted writes are removed
     """
 
     if not pypar_available or numprocs == 1 : return domain # Bypass
 
-        
-    if myid == 0:
+    if parameters is not None and 'partition_dir' in parameters:
+        from anuga.parallel.partition_file import write_partition
+        from anuga.parallel.partition_file import read_partition
+
+        if myid == 0:
+            dirname = write_partition(domain, numprocs,
+                                      parameters['partition_dir'],
+                                      verbose, parameters)
+            for p in range(1, numprocs):
+                send(dirname, p)
+        else:
+            dirname = receive(0)
+
+        kwargs, points, vertices, boundary, quantities, boundary_map, \
+            domain_name, domain_dir, domain_store, domain_store_centroids, \
+            domain_minimum_storable_height, domain_minimum_allowed_height, \
+            domain_flow_algorithm, domain_georef, \
+            domain_quantities_to_be_stored, domain_smooth \
+             = read_partition(dirname, myid, verbose)
+
+    elif parameters is not None and 'partition_cache' in parameters:
+        from anuga.parallel.partition_cache import cached_extract_submesh
+
+        kwargs, points, vertices, boundary, quantities, boundary_map, \
+            domain_name, domain_dir, domain_store, domain_store_centroids, \
+            domain_minimum_storable_height, domain_minimum_allowed_height, \
+            domain_flow_algorithm, domain_georef, \
+            domain_quantities_to_be_stored, domain_smooth \
+             = cached_extract_submesh(domain, numprocs, myid, parameters,
+                                      verbose)
+
+    elif myid == 0:
         from sequential_distribute import Sequential_distribute
         partition = Sequential_distribute(domain, verbose, debug, parameters)
 
@@ -398,7 +448,7 @@ def distribute_mesh(domain, verbose=False, debug=False, parameters=None):
     if verbose: print 'Subdivide mesh'
     new_nodes, new_triangles, new_boundary, triangles_per_proc, quantities, \
            s2p_map, p2s_map = \
-           pmesh_divide_metis_with_map(domain, numprocs)
+           pmesh_divide_metis_with_map(domain, numprocs, parameters)
 
     #PETE: s2p_map (maps serial domain triangles to parallel domain triangles)
     #      sp2_map (maps parallel domain triangles to domain triangles)
@@ -14,6 +14,10 @@ import anuga.utilities.parallel_abstraction as pypar
 
 
 
+# Codes of the reduction ops, matching MAX, MIN and SUM in mpiextras
+reduction_ops = {'max' : 1, 'min' : 2, 'sum' : 3}
+
+
 def setup_buffers(domain):
     """Buffers for synchronisation of timesteps
     """
@@ -27,47 +31,81 @@ def setup_buffers(domain):
     domain.communication_reduce_time = 0.0
     domain.communication_broadcast_time = 0.0
 
+    domain.reductions = []
+    domain.reduction_values = {}
+    setup_reduction_buffers(domain)
+
+    domain.number_of_reductions = 0
+
+
+def setup_reduction_buffers(domain):
+    """Packed buffers for the per step reduction. Row 0 holds the
+    timestep, the following rows the registered reductions. Each row
+    is a (value, op code) pair.
+    """
+
+    n = len(domain.reductions) + 1
+
+    domain.local_reduction = num.zeros((n, 2), num.float)
+    domain.global_reduction = num.zeros((n, 2), num.float)
+
+    domain.local_reduction[0, 1] = reduction_ops['min']
+    for k, (name, function, op) in enumerate(domain.reductions):
+        domain.local_reduction[k+1, 1] = reduction_ops[op]
+
+    # Whether reduction_values hold the registered values as they are now
+    domain.reductions_current = False
+
 
 def communicate_flux_timestep(domain, yieldstep, finaltime):
     """Calculate local timestep
+
+    The minimal timestep across all processes is found in the same
+    allreduce as the registered reductions (see
+    Parallel_domain.register_reduction)
     """
 
-    import time
+    domain.local_reduction[0, 0] = domain.flux_timestep
 
-    #Compute minimal timestep across all processes
-    domain.local_timestep[0] = domain.flux_timestep
-    t0 = time.time()
+    communicate_reductions(domain)
 
+    domain.local_timestep[0] = domain.local_reduction[0, 0]
+    domain.global_timestep[0] = domain.global_reduction[0, 0]
 
-    import anuga.parallel.pypar_ext as par_exts
+    domain.flux_timestep = domain.global_timestep[0]
 
-    par_exts.allreduce(domain.local_timestep, pypar.MIN,
-                      buffer=domain.global_timestep,
-                      bypass=True)
 
-    domain.communication_reduce_time += time.time()-t0
+def communicate_reductions(domain):
+    """Reduce the registered values (and row 0 of the packed buffer)
+    across all processes in a single allreduce
+    """
 
+    import time
 
+    local_reduction = domain.local_reduction
+    global_reduction = domain.global_reduction
 
+    for k, (name, function, op) in enumerate(domain.reductions):
+        local_reduction[k+1, 0] = function()
 
-#    pypar.reduce(domain.local_timestep, pypar.MIN, 0,
-#                      buffer=domain.global_timestep,
-#                      bypass=True)
-#
-#
-#    domain.communication_reduce_time += time.time()-t0
+    t0 = time.time()
 
+    if domain.numproc == 1:
+        global_reduction[:] = local_reduction
+    else:
+        from anuga.parallel import mpiextras
 
-    #Broadcast minimal timestep to all processors
-    t0 = time.time()
-    #pypar.broadcast(domain.global_timestep, 0)#, bypass=True)
+        mpiextras.allreduce_packed(local_reduction, global_reduction)
+
+    domain.communication_reduce_time += time.time()-t0
+    domain.number_of_reductions += 1
+
+    for k, (name, function, op) in enumerate(domain.reductions):
+        domain.reduction_values[name] = global_reduction[k+1, 0]
+
+    domain.reductions_current = True
 
-    domain.communication_broadcast_time += time.time()-t0
 
-    #old_flux_timestep = domain.flux_timestep
-    domain.flux_timestep = domain.global_timestep[0]
-    
-    
 
 def communicate_ghosts_blocking(domain):
 
@@ -76,10 +114,18 @@ def communicate_ghosts_blocking(domain):
     # We have a dictionary of lists with ghosts expecting updates from
     # the separate processors
 
-    import numpy as num
     import time
     t0 = time.time()
 
+    from anuga.parallel import mpiextras
+
+    Q_cvs = [domain.quantities[q].centroid_values
+             for q in domain.conserved_quantities]
+
+    # Pack the full cell data for all processors into the send buffers
+    mpiextras.gather_buffer(Q_cvs, domain.full_send_index,
+                            domain.full_send_buffer)
+
     # update of non-local ghost cells
     for iproc in range(domain.numproc):
         if iproc == domain.processor:
@@ -87,14 +133,8 @@ def communicate_ghosts_blocking(domain):
             for send_proc in domain.full_send_dict:
                 if send_proc != iproc:
 
-                    Idf  = domain.full_send_dict[send_proc][0]
                     Xout = domain.full_send_dict[send_proc][2]
 
-                    for i, q in enumerate(domain.conserved_quantities):
-                        #print 'Send',i,q
-                        Q_cv =  domain.quantities[q].centroid_values
-                        Xout[:,i] = num.take(Q_cv, Idf)
-
                     pypar.send(Xout, int(send_proc), use_buffer=True, bypass=True)
 
 
@@ -102,32 +142,19 @@ def communicate_ghosts_blocking(domain):
             #Receive data from the iproc processor
             if  domain.ghost_recv_dict.has_key(iproc):
 
-                Idg = domain.ghost_recv_dict[iproc][0]
                 X   = domain.ghost_recv_dict[iproc][2]
 
                 X = pypar.receive(int(iproc), buffer=X, bypass=True)
 
-                for i, q in enumerate(domain.conserved_quantities):
-                    #print 'Receive',i,q
-                    Q_cv =  domain.quantities[q].centroid_values
-                    num.put(Q_cv, Idg, X[:,i])
-
     #local update of ghost cells
     iproc = domain.processor
     if domain.full_send_dict.has_key(iproc):
 
-        # LINDA:
-        # now store full as local id, global id, value
-        Idf  = domain.full_send_dict[iproc][0]
-
-        # LINDA:
-        # now store ghost as local id, global id, value
-        Idg = domain.ghost_recv_dict[iproc][0]
+        domain.ghost_recv_dict[iproc][2][:] = domain.full_send_dict[iproc][2]
 
-        for i, q in enumerate(domain.conserved_quantities):
-            #print 'LOCAL SEND RECEIVE',i,q
-            Q_cv =  domain.quantities[q].centroid_values
-            num.put(Q_cv, Idg, num.take(Q_cv, Idf))
+    # Unpack the receive buffers of all processors into the ghost cells
+    mpiextras.scatter_buffer(Q_cvs, domain.ghost_recv_index,
+                             domain.ghost_recv_buffer)
 
     domain.communication_time += time.time()-t0
 
@@ -141,62 +168,72 @@ def communicate_ghosts_asynchronous(domain, quantities=None):
     # the separate processors
     # Using isend and irecv
 
-    import numpy as num
+    communicate_ghosts_start(domain, quantities)
+
+    communicate_ghosts_finish(domain, quantities)
+
+
+
+def communicate_ghosts_start(domain, quantities=None):
+    """Pack the full cell data and post the isend/irecv calls for the
+    ghost exchange, without waiting for them to complete.
+
+    The ghost centroid values are only updated, and the send and receive
+    buffers may only be reused, after communicate_ghosts_finish.
+    """
+
+    # No ghosts on a single processor
+    if domain.numproc == 1:
+        return
+
     import time
     t0 = time.time()
     
     if quantities is None:
         quantities = domain.conserved_quantities
 
+    from anuga.parallel import mpiextras
+
     # update of non-local ghost cells by copying full cell data into the
-    # Xout buffer arrays
+    # send buffers of all processors (the Xout buffer arrays of the
+    # full_send_dict are views into full_send_buffer)
+    Q_cvs = [domain.quantities[q].centroid_values for q in quantities]
 
-    #iproc == domain.processor
+    mpiextras.gather_buffer(Q_cvs, domain.full_send_index,
+                            domain.full_send_buffer)
 
-    #Setup send buffer arrays for sending full data to other processors
-    for send_proc in domain.full_send_dict:
-        Idf  = domain.full_send_dict[send_proc][0]
-        Xout = domain.full_send_dict[send_proc][2]
+    # Post all the communication using isend/irecv via the buffers in the
+    # full_send_dict and ghost_recv_dict
 
-        for i, q in enumerate(quantities):
-            #print 'Store send data',i,q
-            Q_cv =  domain.quantities[q].centroid_values
-            Xout[:,i] = num.take(Q_cv, Idf)
+    mpiextras.start_send_recv_via_dicts(domain.full_send_dict,domain.ghost_recv_dict)
 
+    domain.communication_time += time.time()-t0
 
 
 
+def communicate_ghosts_finish(domain, quantities=None):
+    """Wait for the communication posted by communicate_ghosts_start and
+    copy the received data into the ghost cells
+    """
 
+    if domain.numproc == 1:
+        return
 
-    # Do all the comuunication using isend/irecv via the buffers in the
-    # full_send_dict and ghost_recv_dict
-    from anuga.parallel import mpiextras
+    import time
+    t0 = time.time()
 
-    mpiextras.send_recv_via_dicts(domain.full_send_dict,domain.ghost_recv_dict)
+    if quantities is None:
+        quantities = domain.conserved_quantities
 
-#
-#    if pypar.rank() == 0:
-#        print 'After commun 0'
-#        pprint(domain.ghost_recv_dict)
-#
-#    if pypar.rank() == 1:
-#        print 'After commun 1'
-#        pprint(domain.ghost_recv_dict)
+    from anuga.parallel import mpiextras
 
-    # Now copy data from receive buffers to the domain
-    for recv_proc in domain.ghost_recv_dict:
-        Idg  = domain.ghost_recv_dict[recv_proc][0]
-        X    = domain.ghost_recv_dict[recv_proc][2]
+    mpiextras.wait_send_recv_via_dicts()
 
-        #print recv_proc
-        #print X
+    # Now copy data from the receive buffers of all processors to the domain
+    Q_cvs = [domain.quantities[q].centroid_values for q in quantities]
 
-        for i, q in enumerate(quantities):
-            #print 'Read receive data',i,q
-            Q_cv =  domain.quantities[q].centroid_values
-            num.put(Q_cv, Idg, X[:,i])
+    mpiextras.scatter_buffer(Q_cvs, domain.ghost_recv_index,
+                             domain.ghost_recv_buffer)
 
 
     domain.communication_time += time.time()-t0
-
-
@@ -14,12 +14,14 @@ Geoscience Australia, 2004-2005
 from anuga import Domain
 
 import parallel_generic_communications as generic_comms
+from anuga.parallel.distribute_mesh import ghost_halo_levels
 
 import anuga.utilities.parallel_abstraction as pypar
 
 #from anuga.abstract_2d_finite_volumes.neighbour_mesh import Mesh
 
 import numpy as num
+import time
 from os.path import join
 
 
@@ -27,6 +29,22 @@ from os.path import join
 
 
 
+class _Domain_method:
+    """Method of a domain without arguments, as a function which can be
+    pickled with the domain (eg registered with register_reduction)
+    """
+
+    def __init__(self, domain, name):
+
+        self.domain = domain
+        self.name = name
+
+    def __call__(self):
+
+        return getattr(self.domain, self.name)()
+
+
+
 class Parallel_domain(Domain):
 
     def __init__(self, coordinates, vertices,
@@ -106,6 +124,25 @@ class Parallel_domain(Domain):
 
         self.ghost_counter = 0
 
+        # Distance of each triangle from the ghosts, used to overlap the
+        # ghost exchange with the computation
+        self.halo_level = ghost_halo_levels(self.neighbours, self.tri_full_flag)
+        self.ghost_exchange_overlap = False
+
+        # Store into the per processor sww files by default
+        self.store_collective = False
+
+        # Start of the compute walltime used to measure the load balance
+        # (see get_load_imbalance)
+        self.compute_walltime_start = time.time()
+
+        # The global integrals of the flows through the boundary and of
+        # the fractional steps are reduced together with the timestep
+        self.register_reduction('boundary_flux_integral',
+            _Domain_method(self, 'get_local_boundary_flux_integral'))
+        self.register_reduction('fractional_step_volume_integral',
+            _Domain_method(self, 'get_local_fractional_step_volume_integral'))
+
 
     def set_name(self, name):
         """Assign name based on processor number 
@@ -134,6 +171,94 @@ class Parallel_domain(Domain):
         Domain.update_timestep(self, yieldstep, finaltime)
 
 
+    def register_reduction(self, name, function, op='sum'):
+        """Register a value to be reduced across all processors.
+
+        function() should return the local (float) value, and op is
+        one of 'min', 'max' or 'sum'. The registered values are reduced
+        every step in a single allreduce together with the timestep, so
+        function is called once per step after the first flux
+        computation of the step (ie before the fractional steps).
+        Use get_reduction to get the result of the last reduction.
+        """
+
+        if op not in generic_comms.reduction_ops:
+            msg = 'Reduction op must be one of %s, got %s' \
+                  % (generic_comms.reduction_ops.keys(), op)
+            raise Exception(msg)
+
+        if name in self.reduction_values:
+            msg = 'Reduction %s is already registered' % name
+            raise Exception(msg)
+
+        self.reductions.append((name, function, op))
+        self.reduction_values[name] = None
+        generic_comms.setup_reduction_buffers(self)
+
+
+    def remove_reduction(self, name):
+        """Stop reducing the value registered as name
+        """
+
+        self.reductions = [r for r in self.reductions if r[0] != name]
+        del self.reduction_values[name]
+        generic_comms.setup_reduction_buffers(self)
+
+
+    def get_reduction(self, name):
+        """Global value of the reduction registered as name, as of the
+        last step. None before the first step.
+        """
+
+        return self.reduction_values[name]
+
+
+    def update_reductions(self):
+        """Reduce the registered values now, unless they have not changed
+        since the last reduction (the values of the operators only change
+        in the fractional steps). Must be called by all processors.
+        """
+
+        if not self.reductions_current:
+            generic_comms.communicate_reductions(self)
+
+
+    def get_local_boundary_flux_integral(self):
+
+        return float(self.boundary_flux_integral.boundary_flux_integral[0])
+
+
+    def get_local_fractional_step_volume_integral(self):
+
+        return float(self.fractional_step_volume_integral)
+
+
+    def get_boundary_flux_integral(self):
+        """Global boundary flux integral, from the reduction of the last
+        timestep if the fractional steps have not been applied since
+        """
+
+        if not self.compute_fluxes_method=='DE':
+            msg='Boundary flux integral only supported for DE fluxes '+\
+                '(because computation of boundary_flux_sum is only implemented there)'
+            raise Exception, msg
+
+        self.update_reductions()
+
+        return num.array([self.get_reduction('boundary_flux_integral')])
+
+
+    def get_fractional_step_volume_integral(self):
+        """Global volume integral of the fractional steps, from the
+        reduction of the last timestep if the fractional steps have not
+        been applied since
+        """
+
+        self.update_reductions()
+
+        return self.get_reduction('fractional_step_volume_integral')
+
+
 
     def update_ghosts(self, quantities=None):
         """We must send the information from the full cells and
@@ -143,9 +268,76 @@ class Parallel_domain(Domain):
         generic_comms.communicate_ghosts_asynchronous(self, quantities)
         #generic_comms.communicate_ghosts_blocking(self)
 
+
+    def set_ghost_exchange_overlap(self, flag=True):
+        """Overlap the ghost exchange within each rk2 and rk3 step with the
+        computation on the triangles which do not depend on the ghosts.
+
+        Only used with the DE flow algorithms, and not with the fused
+        evolve (see set_fused_evolve). The results are unchanged.
+        """
+
+        self.ghost_exchange_overlap = flag
+
+
+    def get_ghost_exchange_overlap(self):
+
+        return self.ghost_exchange_overlap
+
+
+    def update_ghosts_and_compute_fluxes(self, update_ghosts=True):
+        """See Generic_Domain.update_ghosts_and_compute_fluxes
+
+        With the ghost exchange overlap the sends and receives are posted,
+        then the triangles at least 4 triangles away from the ghosts
+        (see halo_level) and the boundary are protected, extrapolated and
+        their fluxes computed while the messages are in flight. The
+        remaining triangles are done once the ghosts have been received.
+        """
+
+        if not (update_ghosts and self.ghost_exchange_overlap and
+                self.compute_fluxes_method == 'DE'):
+            Domain.update_ghosts_and_compute_fluxes(self, update_ghosts)
+            return
+
+        from anuga.shallow_water.swDE1_domain_ext import protect_new
+        from anuga.shallow_water.swDE1_domain_ext \
+             import extrapolate_second_order_edge_sw as extrapol2
+        from anuga.shallow_water.swDE1_domain_ext \
+             import compute_fluxes_ext_central as compute_fluxes_ext
+
+        D = self.get_c_domain()
+        timestep = self.evolve_max_timestep
+
+        generic_comms.communicate_ghosts_start(self)
+
+        # Triangles which do not depend on the ghosts
+        t0 = time.time()
+        protect_new(D, self.halo_level, 1)
+        extrapol2(D, self.halo_level, 1)
+        compute_fluxes_ext(D, timestep, self.halo_level, 1)
+        self.kernel_walltime += time.time() - t0
+
+        generic_comms.communicate_ghosts_finish(self)
+
+        # Remaining triangles
+        t0 = time.time()
+        protect_new(D, self.halo_level, 2)
+        extrapol2(D, self.halo_level, 2)
+        self.kernel_walltime += time.time() - t0
+
+        self.update_boundary()
+
+        t0 = time.time()
+        self.flux_timestep = compute_fluxes_ext(D, timestep, self.halo_level, 2)
+        self.kernel_walltime += time.time() - t0
+
     def apply_fractional_steps(self):
 
-        for operator in self.fractional_step_operators:
+        # The operators change the integrals of the registered reductions
+        self.reductions_current = False
+
+        for operator in self.get_fractional_step_batches():
             operator()
 
         # PETE: Make sure that there are no deadlocks here
@@ -154,7 +346,45 @@ class Parallel_domain(Domain):
 
 
 
-    def sww_merge(self, verbose=False, delete_old=False):
+    def set_store_collective(self, flag=True):
+        """Set whether the sww output is stored in a single global file,
+        written by processor 0 from the full triangles of all
+        processors (see Parallel_SWW_file), instead of per processor
+        files which are merged by sww_merge.
+        """
+
+        self.store_collective = flag
+
+
+    def get_store_collective(self):
+
+        return self.store_collective
+
+
+    def initialise_storage(self, mode='w'):
+        """Create and initialise self.writer object for storing data.
+        Also, save x,y and bed elevation
+        """
+
+        if not self.store_collective:
+            Domain.initialise_storage(self, mode)
+            return
+
+        from anuga.parallel.parallel_sww import Parallel_SWW_file
+
+        self.writer = Parallel_SWW_file(self, mode=mode)
+        self.writer.set_async(self.store_async, self.store_async_queue_size)
+
+        if mode[0] == 'w':
+            self.writer.store_connectivity()
+
+
+    def sww_merge(self, verbose=False, delete_old=False, processes=1,
+                  frames_per_block=None):
+
+        # Nothing to merge with collective storage
+        if self.store_collective:
+            return
 
         # make sure all the computations have finished
 
@@ -166,13 +396,38 @@ class Parallel_domain(Domain):
 
             global_name = join(self.get_datadir(),self.get_global_name())
             
-            merge.sww_merge_parallel(global_name,self.numproc,verbose,delete_old)
+            merge.sww_merge_parallel(global_name,self.numproc,verbose,delete_old,
+                                     processes,frames_per_block)
 
         # make sure all the merge completes on processor 0 before other
         # processors complete (like when finalize is forgotten in main script)
         
         pypar.barrier()
         
+    def get_load_imbalance(self):
+        """Ratio of the maximum to the mean compute walltime of the
+        processors since the domain was created. Must be called on all
+        processors.
+        """
+
+        from anuga.parallel.rebalance import get_load_imbalance
+
+        return get_load_imbalance(self)
+
+
+    def rebalance(self, weights='time', dry_weight=0.1, parameters=None,
+                  verbose=False):
+        """Repartition the domain with the cost of the triangles as
+        weights, and return the new Parallel_domain. Must be called on all
+        processors at a yield time. The boundary conditions and operators
+        have to be set again on the new domain. See rebalance.py
+        """
+
+        from anuga.parallel.rebalance import rebalance
+
+        return rebalance(self, weights, dry_weight, parameters, verbose)
+
+
     def write_time(self):
 
         if self.processor == 0:
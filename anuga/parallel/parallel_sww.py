@@ -0,0 +1,233 @@
+"""Class Parallel_SWW_file -
+Storage of a parallel domain in a single global sww file.
+
+Each processor sends the values of its full triangles (and of the
+vertices of its full triangles) to processor 0, which writes them
+into the global file using the tri_l2g and node_l2g maps. So the
+file is the same as the one built by sww_merge from the
+per processor files, without the per processor files.
+"""
+
+import numpy as num
+
+import anuga.utilities.parallel_abstraction as pypar
+
+from anuga.config import netcdf_mode_w
+from anuga.file.netcdf import NetCDFFile
+from anuga.file.sww import SWW_file
+from anuga.utilities.file_utils import create_filename
+
+
+class Parallel_SWW_file(SWW_file):
+    """Interface to a global sww file written collectively by the
+    processors of a parallel domain.
+
+    Only processor 0 opens the file. store_connectivity and
+    store_timestep must be called on all processors.
+
+    Monitored extrema are not stored, and the file is never split
+    because of its size.
+    """
+
+    def _create_file(self, mode):
+        """Set up the global ids of the stored values on each processor
+        and create the global file on processor 0
+        """
+
+        domain = self.domain
+
+        self.processor = domain.processor
+        self.numproc = domain.numproc
+
+        self.filename = create_filename(domain.get_datadir(),
+                                        domain.get_global_name(), 'sww')
+
+        # Local ids of the full triangles and global ids of the
+        # vertex and centroid values stored for them
+        full_ids = num.flatnonzero(domain.tri_full_flag == 1)
+        full_gids = domain.tri_l2g[full_ids]
+
+        self.number_of_volumes = domain.number_of_global_triangles
+
+        if domain.smooth:
+            self.number_of_nodes = domain.number_of_global_nodes
+
+            full_triangles = domain.triangles[full_ids]
+            self.vertex_ids = num.unique(full_triangles)
+            vertex_gids = domain.node_l2g[self.vertex_ids]
+            volumes = domain.node_l2g[full_triangles]
+        else:
+            self.number_of_nodes = 3*domain.number_of_global_triangles
+
+            offsets = num.array([0, 1, 2])
+            self.vertex_ids = (3*full_ids.reshape(-1,1) + offsets).reshape(-1,)
+            vertex_gids = (3*full_gids.reshape(-1,1) + offsets).reshape(-1,)
+            volumes = vertex_gids.reshape(-1,3)
+
+        self.centroid_ids = full_ids
+
+        # Processor 0 keeps the global ids of all processors
+        self.vertex_gids = self._gather_list(vertex_gids)
+        self.centroid_gids = self._gather_list(full_gids)
+
+        # The global connectivity, only needed by store_connectivity
+        self.volumes = self._gather(volumes, self.centroid_gids,
+                                    self.number_of_volumes, axis=0)
+
+        if self.processor == 0:
+            fid = NetCDFFile(self.filename, mode)
+            if mode[0] == 'w':
+                description = 'Output from anuga.parallel.parallel_sww ' \
+                              'suitable for plotting'
+
+                self.writer.store_header(fid,
+                                         domain.starttime,
+                                         self.number_of_volumes,
+                                         self.number_of_nodes,
+                                         description=description,
+                                         smoothing=domain.smooth,
+                                         order=domain.default_order,
+                                         sww_precision=self.precision)
+
+                # Extra optional information
+                if hasattr(domain, 'texture'):
+                    fid.texture = domain.texture
+
+            fid.close()
+
+
+    def _gather_list(self, x):
+        """List of the arrays x of all processors on processor 0,
+        None on the other processors
+        """
+
+        if self.processor == 0:
+            return [x] + [pypar.receive(p) for p in range(1, self.numproc)]
+        else:
+            pypar.send(x, 0)
+            return None
+
+
+    def _gather(self, x, gids, n, axis=-1):
+        """Global array of length n along axis on processor 0, with the
+        local arrays x of all processors put at their global ids gids.
+        Where processors share an id, the last processor wins (as in
+        sww_merge). None on the other processors.
+        """
+
+        xs = self._gather_list(x)
+
+        if self.processor != 0:
+            return None
+
+        shape = list(x.shape)
+        shape[axis] = n
+        result = num.zeros(shape, x.dtype)
+
+        for x_p, gids_p in zip(xs, gids):
+            if axis == 0:
+                result[gids_p] = x_p
+            else:
+                result[..., gids_p] = x_p
+
+        return result
+
+
+    def _gather_vertex_values(self, values):
+
+        values = num.array(values)[..., self.vertex_ids]
+        return self._gather(values, self.vertex_gids, self.number_of_nodes)
+
+
+    def _gather_centroid_values(self, values):
+
+        values = num.array(values, self.precision)[..., self.centroid_ids]
+        return self._gather(values, self.centroid_gids, self.number_of_volumes)
+
+
+    def store_connectivity(self):
+        """Store the global nodes, triangles and static quantities
+        """
+
+        domain = self.domain
+
+        # Get X, Y from one (any) of the quantities
+        Q = domain.quantities.values()[0]
+        X,Y,_,_ = Q.get_vertex_values(xy=True, precision=self.precision)
+
+        points = self._gather_vertex_values(num.array([X, Y]))
+
+        static_quantities = {}
+        for name in self.writer.static_quantities:
+            Q = domain.quantities[name]
+            A, _ = Q.get_vertex_values(xy=False,
+                                       precision=self.precision)
+            static_quantities[name] = self._gather_vertex_values(A)
+
+        static_quantities_centroid = {}
+        for name in self.writer.static_c_quantities:
+            Q = domain.quantities[name[:-2]]  # rip off _c from name
+            static_quantities_centroid[name] = \
+                            self._gather_centroid_values(Q.centroid_values)
+
+        if self.processor != 0:
+            return
+
+        fid = NetCDFFile(self.filename, 'a')
+
+        self.writer.store_triangulation(fid,
+                                        points.transpose(),
+                                        self.volumes.astype(num.float32),
+                                        points_georeference=\
+                                        domain.geo_reference)
+
+        self.writer.store_static_quantities(fid, **static_quantities)
+        self.writer.store_static_quantities_centroid(fid,
+                                                **static_quantities_centroid)
+
+        fid.close()
+
+
+    def store_timestep(self):
+        """Gather the time dependent quantities on processor 0, which
+        writes them (or queues them for the writer thread)
+        """
+
+        data = self.get_timestep_data()
+
+        if self.processor == 0:
+            # The timesteps already in the file, eg when appending
+            if self.number_of_frames is None:
+                self._read_frame_sizes()
+
+            self._store_timestep_data(data)
+
+
+    def get_timestep_data(self):
+        """Global time dependent quantities on processor 0, None on
+        the other processors
+        """
+
+        data = SWW_file.get_timestep_data(self)
+
+        names = data['quantities'].keys()
+        if len(names) > 0:
+            values = num.array([data['quantities'][name] for name in names])
+            values = self._gather_vertex_values(values)
+            if values is not None:
+                data['quantities'] = dict(zip(names, values))
+
+        names = data['centroid_quantities'].keys()
+        if len(names) > 0:
+            values = num.array([data['centroid_quantities'][name]
+                                for name in names])
+            values = self._gather_centroid_values(values)
+            if values is not None:
+                data['centroid_quantities'] = dict(zip(names, values))
+
+        if self.processor != 0:
+            return None
+
+        data['extrema'] = None
+
+        return data
@@ -0,0 +1,293 @@
+"""Cache of the partitions of meshes, to skip the partition of the mesh
+and the build of the ghost layers and communication patterns when the
+same mesh is run again on the same number of processors.
+
+distribute uses the cache when parameters['partition_cache'] names the
+cache directory, which has to be shared by all the processes. The key of
+an entry is a hash of the mesh (nodes, triangles and boundary), the
+number of processors and the partition parameters (ghost layer width,
+partition weights and objective). An entry is a directory with the
+submesh of each processor (see Sequential_distribute.extract_submesh)
+without the quantities, so the same entry serves runs with different
+quantities (or boundary conditions).
+
+Processor 0 looks up the entry, and writes it if it is not there yet.
+Each processor then reads its own submesh from the entry, and gets the
+quantities of its triangles and the domain settings from processor 0.
+
+Entries which have not been used for partition_cache_age seconds are
+removed, and then the least recently used entries until the cache is at
+most partition_cache_size bytes. Temporary entries left by interrupted
+writes are removed after partition_cache_tmp_age seconds. The cache is
+evicted on each distribute, whether the entry was found or written.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import cPickle
+
+import numpy as num
+
+
+# Version of the format of the cache entries, part of the key
+partition_cache_version = 1
+
+# Default limits of the cache
+partition_cache_size = 10*1024**3  # bytes
+partition_cache_age = 30*24*3600   # seconds
+partition_cache_tmp_age = 24*3600  # seconds
+
+
+def get_partition_cache_key(domain, numprocs, parameters=None):
+    """Hash of the mesh of domain, numprocs and the partition parameters
+    """
+
+    if parameters is None:
+        parameters = {}
+
+    h = hashlib.sha1()
+
+    h.update('version %d, numprocs %d, ' % (partition_cache_version, numprocs))
+    h.update('ghost_layer_width %d, ' % parameters.get('ghost_layer_width', 2))
+    h.update('partition_objective %s, ' % parameters.get('partition_objective', None))
+
+    weights = parameters.get('partition_weights', None)
+    if weights is not None:
+        h.update('partition_weights ')
+        h.update(num.ascontiguousarray(weights, num.float).tostring())
+
+    h.update(num.ascontiguousarray(domain.get_nodes(), num.float).tostring())
+    h.update(num.ascontiguousarray(domain.triangles, num.int64).tostring())
+    h.update(repr(sorted(domain.boundary.items())))
+    h.update(repr(domain.geo_reference))
+
+    return h.hexdigest()
+
+
+def get_partition_cache_entry(cache_dir, key):
+    """Name of the directory of the entry key in cache_dir
+    """
+
+    return os.path.join(cache_dir, key + '.partition')
+
+
+def write_partition_cache_entry(domain, numprocs, entry, parameters=None,
+                                verbose=False):
+    """Partition domain for numprocs processors and write the submeshes,
+    without the quantities, as the cache entry. The entry is written
+    under a temporary name and then renamed, so that an entry is always
+    complete.
+    """
+
+    from anuga.parallel.sequential_distribute import Sequential_distribute
+
+    partition = Sequential_distribute(domain, verbose, False, parameters)
+    partition.distribute(numprocs)
+
+    cache_dir = os.path.dirname(entry)
+    if cache_dir != '' and not os.path.exists(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Another process made it
+            pass
+
+    tmp_entry = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp_')
+
+    for p in range(numprocs):
+        kwargs, points, vertices, boundary = partition.extract_submesh(p)[:4]
+
+        fid = open(os.path.join(tmp_entry, 'P%d.pickle' % p), 'wb')
+        cPickle.dump((kwargs, points, vertices, boundary), fid,
+                     protocol=cPickle.HIGHEST_PROTOCOL)
+        fid.close()
+
+        # Processor 0 needs the triangles of all processors to send
+        # the quantities
+        num.save(os.path.join(tmp_entry, 'tri_l2g_P%d.npy' % p),
+                 num.array(kwargs['tri_l2g'], num.int))
+
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Another run has written the same entry
+        shutil.rmtree(tmp_entry)
+
+    if verbose: print 'partition_cache: Wrote %s' % entry
+
+
+def read_partition_cache_entry(entry, p):
+    """The submesh of processor p, without the quantities, as the tuple
+    kwargs, points, vertices, boundary
+    """
+
+    fid = open(os.path.join(entry, 'P%d.pickle' % p), 'rb')
+    submesh = cPickle.load(fid)
+    fid.close()
+
+    return submesh
+
+
+def get_submesh_values(domain, tri_l2g):
+    """The quantities of the triangles tri_l2g of domain and the domain
+    settings, in the order of the tuple of
+    Sequential_distribute.extract_submesh
+    """
+
+    quantities = {}
+    for k in domain.quantities:
+        quantities[k] = domain.quantities[k].vertex_values[tri_l2g]
+
+    return (quantities,
+            domain.boundary_map,
+            domain.get_name(),
+            domain.get_datadir(),
+            domain.get_store(),
+            domain.get_store_centroids(),
+            domain.minimum_storable_height,
+            domain.get_minimum_allowed_height(),
+            domain.get_flow_algorithm(),
+            domain.geo_reference,
+            domain.quantities_to_be_stored,
+            domain.smooth)
+
+
+def get_partition_cache_size(cache_dir):
+    """Total size in bytes of the entries of the cache
+    """
+
+    size = 0
+    for entry in _get_entries(cache_dir):
+        size += _get_entry_size(entry)
+
+    return size
+
+
+def _get_entries(cache_dir):
+
+    if not os.path.isdir(cache_dir):
+        return []
+
+    return [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+            if name.endswith('.partition')]
+
+
+def _get_tmp_entries(cache_dir):
+
+    if not os.path.isdir(cache_dir):
+        return []
+
+    return [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+            if name.startswith('.tmp_')]
+
+
+def _get_entry_size(entry):
+
+    return sum([os.path.getsize(os.path.join(entry, name))
+                for name in os.listdir(entry)])
+
+
+def evict_partition_cache(cache_dir, max_size=None, max_age=None, keep=None,
+                          verbose=False, tmp_age=None):
+    """Remove the entries of the cache which have not been used for
+    max_age seconds, then remove the least recently used entries until the
+    cache is at most max_size bytes. The entry keep is never removed.
+    Temporary entries older than tmp_age seconds, left by interrupted
+    writes, are removed too.
+    """
+
+    import time
+
+    if max_size is None:
+        max_size = partition_cache_size
+    if max_age is None:
+        max_age = partition_cache_age
+    if tmp_age is None:
+        tmp_age = partition_cache_tmp_age
+
+    now = time.time()
+
+    # A temporary entry still being written is younger than tmp_age
+    for tmp_entry in _get_tmp_entries(cache_dir):
+        try:
+            stale = now - os.path.getmtime(tmp_entry) > tmp_age
+        except OSError:
+            # Renamed or removed by another process
+            continue
+
+        if stale:
+            if verbose: print 'partition_cache: Remove %s' % tmp_entry
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    # The last use of an entry is the modification time of its directory
+    entries = []
+    for entry in _get_entries(cache_dir):
+        try:
+            entries.append((os.path.getmtime(entry), _get_entry_size(entry), entry))
+        except OSError:
+            # Removed by another process
+            pass
+
+    entries.sort()
+
+    size = sum([e[1] for e in entries])
+
+    for last_used, entry_size, entry in entries:
+        if entry == keep:
+            continue
+
+        if now - last_used > max_age or size > max_size:
+            if verbose: print 'partition_cache: Remove %s' % entry
+            shutil.rmtree(entry, ignore_errors=True)
+            size -= entry_size
+
+
+def cached_extract_submesh(domain, numprocs, myid, parameters, verbose=False):
+    """The submesh of processor myid, as returned by
+    Sequential_distribute.extract_submesh, through the partition cache
+    parameters['partition_cache']. Must be called on all processors,
+    domain is only used on processor 0.
+    """
+
+    from anuga.utilities.parallel_abstraction import send, receive
+
+    if myid == 0:
+        cache_dir = parameters['partition_cache']
+
+        # FIXME: Dummy assignment (until boundaries are refactored to
+        # be independent of domains until they are applied)
+        bdmap = {}
+        for tag in domain.get_boundary_tags():
+            bdmap[tag] = None
+        domain.set_boundary(bdmap)
+
+        key = get_partition_cache_key(domain, numprocs, parameters)
+        entry = get_partition_cache_entry(cache_dir, key)
+
+        if os.path.isdir(entry):
+            if verbose: print 'partition_cache: Use %s' % entry
+
+            # Mark the entry as used
+            os.utime(entry, None)
+        else:
+            write_partition_cache_entry(domain, numprocs, entry, parameters,
+                                        verbose)
+
+        evict_partition_cache(cache_dir,
+                              parameters.get('partition_cache_size', None),
+                              parameters.get('partition_cache_age', None),
+                              keep=entry, verbose=verbose,
+                              tmp_age=parameters.get('partition_cache_tmp_age', None))
+
+        for p in range(1, numprocs):
+            tri_l2g = num.load(os.path.join(entry, 'tri_l2g_P%d.npy' % p))
+            send((entry, get_submesh_values(domain, tri_l2g)), p)
+
+        tri_l2g = num.load(os.path.join(entry, 'tri_l2g_P0.npy'))
+        values = get_submesh_values(domain, tri_l2g)
+    else:
+        entry, values = receive(0)
+
+    return read_partition_cache_entry(entry, myid) + values
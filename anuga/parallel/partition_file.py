@@ -0,0 +1,316 @@
+"""Distribute a domain through a shared partition directory.
+
+The partition of the global mesh is computed once and written by one
+processor (see write_partition) as a directory of numpy .npy files,
+with the triangles, neighbours, boundary and quantities in partition
+order. Each processor then memory maps those arrays and builds its own
+submesh, ghost layer and communication pattern (see read_partition),
+reading only the parts of the arrays it needs. So no processor has to
+build and send (or pickle) the submeshes of all the others.
+
+The submesh built by read_partition is the same as the one built by
+Sequential_distribute.extract_submesh.
+"""
+
+import os
+import shutil
+import cPickle
+
+import numpy as num
+import numpy.lib.arraysetops as numset
+
+from anuga.parallel.distribute_mesh import pmesh_divide_metis_with_map
+from anuga.parallel.distribute_mesh import build_local_mesh
+
+
+def get_partition_dir(domain_name, numprocs, partition_dir='.'):
+    """Name of the partition directory of domain_name on numprocs processors
+    """
+
+    return os.path.join(partition_dir, domain_name + '_P%g.partition' % numprocs)
+
+
+def write_partition(domain, numprocs, partition_dir='.', verbose=False,
+                    parameters=None):
+    """Partition domain for numprocs processors and write the partition
+    directory (see get_partition_dir) into partition_dir.
+    Return the name of the partition directory.
+    """
+
+    # FIXME: Dummy assignment (until boundaries are refactored to
+    # be independent of domains until they are applied)
+    bdmap = {}
+    for tag in domain.get_boundary_tags():
+        bdmap[tag] = None
+
+    domain.set_boundary(bdmap)
+
+    if verbose: print 'write_partition: Subdivide mesh'
+
+    new_nodes, new_triangles, new_boundary, triangles_per_proc, quantities, \
+           s2p_map, p2s_map = \
+           pmesh_divide_metis_with_map(domain, numprocs, parameters)
+
+    number_of_triangles = len(new_triangles)
+    p2s_map = num.array(p2s_map, num.int)
+
+    # The neighbours in the partition ordering (negative ids mark
+    # boundary edges)
+    s2p = num.zeros(number_of_triangles, num.int)
+    s2p[p2s_map] = num.arange(number_of_triangles)
+
+    neighbours = domain.neighbours[p2s_map]
+    neighbours = num.where(neighbours >= 0, s2p[num.maximum(neighbours, 0)],
+                           neighbours)
+
+    # The boundary as arrays sorted by triangle and edge
+    boundary_tags = sorted(set(new_boundary.values()))
+    keys = sorted(new_boundary.keys())
+    boundary_ids = num.array([k[0] for k in keys], num.int)
+    boundary_edges = num.array([k[1] for k in keys], num.int)
+    boundary_tag_ids = num.array([boundary_tags.index(new_boundary[k])
+                                  for k in keys], num.int)
+
+    dirname = get_partition_dir(domain.get_name(), numprocs, partition_dir)
+
+    if verbose: print 'write_partition: Write %s' % dirname
+
+    # Clear out a previous partition, so that no stale quantity files
+    # are left behind
+    if os.path.exists(dirname):
+        shutil.rmtree(dirname)
+    os.makedirs(dirname)
+
+    arrays = {'nodes' : num.array(new_nodes, num.float),
+              'triangles' : num.array(new_triangles, num.int),
+              'neighbours' : neighbours,
+              'triangles_per_proc' : num.array(triangles_per_proc, num.int),
+              'p2s_map' : p2s_map,
+              'boundary_ids' : boundary_ids,
+              'boundary_edges' : boundary_edges,
+              'boundary_tag_ids' : boundary_tag_ids}
+
+    for name, values in arrays.items():
+        num.save(os.path.join(dirname, name + '.npy'), values)
+
+    for name, values in quantities.items():
+        num.save(os.path.join(dirname, 'quantity_' + name + '.npy'), values)
+
+    ghost_layer_width = 2
+    if parameters is not None and 'ghost_layer_width' in parameters:
+        ghost_layer_width = parameters['ghost_layer_width']
+
+    metadata = {'numprocs' : numprocs,
+                'ghost_layer_width' : ghost_layer_width,
+                'quantity_names' : quantities.keys(),
+                'boundary_tags' : boundary_tags,
+                'number_of_global_triangles' : domain.number_of_triangles,
+                'number_of_global_nodes' : domain.number_of_nodes,
+                'boundary_map' : domain.boundary_map,
+                'domain_name' : domain.get_name(),
+                'domain_dir' : domain.get_datadir(),
+                'domain_store' : domain.get_store(),
+                'domain_store_centroids' : domain.get_store_centroids(),
+                'domain_minimum_storable_height' : domain.minimum_storable_height,
+                'domain_minimum_allowed_height' : domain.get_minimum_allowed_height(),
+                'domain_flow_algorithm' : domain.get_flow_algorithm(),
+                'domain_georef' : domain.geo_reference,
+                'domain_quantities_to_be_stored' : domain.quantities_to_be_stored,
+                'domain_smooth' : domain.smooth}
+
+    # The metadata is written last, it marks the partition as complete
+    fid = open(os.path.join(dirname, 'metadata.pickle'), 'wb')
+    cPickle.dump(metadata, fid, protocol=cPickle.HIGHEST_PROTOCOL)
+    fid.close()
+
+    return dirname
+
+
+def read_partition(dirname, p, verbose=False):
+    """Build the submesh of processor p from the partition directory
+    dirname. Return the same tuple as Sequential_distribute.extract_submesh
+    """
+
+    fid = open(os.path.join(dirname, 'metadata.pickle'), 'rb')
+    metadata = cPickle.load(fid)
+    fid.close()
+
+    def load(name):
+        return num.load(os.path.join(dirname, name + '.npy'), mmap_mode='r')
+
+    numprocs = metadata['numprocs']
+    ghost_layer_width = metadata['ghost_layer_width']
+
+    assert p >= 0
+    assert p < numprocs
+
+    triangles_per_proc = num.array(load('triangles_per_proc'))
+    proc_sum = num.zeros(numprocs+1, num.int)
+    proc_sum[1:] = num.cumsum(triangles_per_proc)
+
+    tlower = proc_sum[p]
+    tupper = proc_sum[p+1]
+
+    nodes = load('nodes')
+    triangles = load('triangles')
+    neighbours = load('neighbours')
+
+    #---------------------------------------------------------------------------
+    # The full triangles and nodes
+    #---------------------------------------------------------------------------
+    full_triangles = num.array(triangles[tlower:tupper])
+
+    full_node_ids = num.unique(full_triangles.flat)
+    full_nodes = num.concatenate((num.reshape(full_node_ids, (-1,1)),
+                                  nodes[full_node_ids]), 1)
+
+    boundary_ids = load('boundary_ids')
+    boundary_edges = load('boundary_edges')
+    boundary_tag_ids = load('boundary_tag_ids')
+    boundary_tags = metadata['boundary_tags']
+
+    lower, upper = num.searchsorted(boundary_ids, [tlower, tupper])
+    full_boundary = {}
+    for k in xrange(lower, upper):
+        full_boundary[boundary_ids[k], boundary_edges[k]] = \
+                                       boundary_tags[boundary_tag_ids[k]]
+
+    #---------------------------------------------------------------------------
+    # The layers of ghost triangles (see ghost_layer)
+    #---------------------------------------------------------------------------
+    def outside(ids):
+        ids = num.unique(ids.flat)
+        return num.extract(num.logical_and(ids >= 0,
+                           num.logical_or(ids < tlower, tupper <= ids)), ids)
+
+    layer = outside(neighbours[tlower:tupper])
+    ghost_ids = layer
+    for i in range(ghost_layer_width-1):
+        layer = numset.setdiff1d(outside(neighbours[layer]), ghost_ids)
+        ghost_ids = numset.union1d(ghost_ids, layer)
+
+    ghost_triangles = num.concatenate((num.reshape(ghost_ids, (-1,1)),
+                                       triangles[ghost_ids]), 1)
+
+    ghost_node_ids = numset.setdiff1d(num.unique(triangles[ghost_ids].flat),
+                                      full_node_ids)
+    ghost_nodes = num.concatenate((num.reshape(ghost_node_ids, (-1,1)),
+                                   nodes[ghost_node_ids]), 1)
+
+    #---------------------------------------------------------------------------
+    # The boundary of the ghost triangles (see ghost_bnd_layer)
+    #---------------------------------------------------------------------------
+    ghost_neighbours = neighbours[ghost_ids]
+
+    ghost_boundary = {}
+    for edge in range(3):
+        n = ghost_neighbours[:, edge]
+        flag = num.logical_and(num.logical_or(n < tlower, n >= tupper),
+                               num.logical_not(numset.in1d(n, ghost_ids)))
+        for t in ghost_ids[flag]:
+            ghost_boundary[t, edge] = 'ghost'
+
+    for k in num.flatnonzero(numset.in1d(boundary_ids, ghost_ids)):
+        key = (boundary_ids[k], boundary_edges[k])
+        if key in ghost_boundary:
+            ghost_boundary[key] = boundary_tags[boundary_tag_ids[k]]
+
+    #---------------------------------------------------------------------------
+    # The communication pattern
+    #---------------------------------------------------------------------------
+
+    # The processor of each ghost triangle (see ghost_commun_pattern)
+    ghost_owners = num.searchsorted(proc_sum[1:] - 1, ghost_ids)
+    ghost_commun = num.concatenate((num.reshape(ghost_ids, (-1,1)),
+                                    num.reshape(ghost_owners, (-1,1))), 1)
+
+    # A full triangle is a ghost on processor q if it is within
+    # ghost_layer_width triangles of a triangle of q. All of those paths
+    # stay within the full and ghost triangles of this processor, so
+    # spread out from the ghost triangles, as (triangle, processor) keys
+    local_ids = numset.union1d(num.arange(tlower, tupper), ghost_ids)
+
+    def is_local(ids):
+        k = num.minimum(num.searchsorted(local_ids, ids), len(local_ids)-1)
+        return local_ids[k] == ids
+
+    keys = ghost_ids*numprocs + ghost_owners
+    front = keys
+    for i in range(ghost_layer_width):
+        n = neighbours[front//numprocs]
+        q = num.repeat(front % numprocs, 3)
+        n = n.flatten()
+        flag = num.logical_and(n >= 0, is_local(n))
+        front = numset.setdiff1d(n[flag]*numprocs + q[flag], keys)
+        keys = numset.union1d(keys, front)
+
+    full_commun = {}
+    for t in xrange(tlower, tupper):
+        full_commun[t] = []
+
+    keys = keys[num.logical_and(keys >= tlower*numprocs, keys < tupper*numprocs)]
+    for key in keys:
+        full_commun[key//numprocs].append(key % numprocs)
+
+    #---------------------------------------------------------------------------
+    # The quantities
+    #---------------------------------------------------------------------------
+    full_quan = {}
+    ghost_quan = {}
+    for k in metadata['quantity_names']:
+        values = load('quantity_' + k)
+        full_quan[k] = num.array(values[tlower:tupper])
+        ghost_quan[k] = num.array(values[ghost_ids])
+
+    submesh_cell = {}
+    submesh_cell["ghost_layer_width"] = ghost_layer_width
+    submesh_cell["full_nodes"] = full_nodes
+    submesh_cell["ghost_nodes"] = ghost_nodes
+    submesh_cell["full_triangles"] = full_triangles
+    submesh_cell["ghost_triangles"] = ghost_triangles
+    submesh_cell["full_boundary"] = full_boundary
+    submesh_cell["ghost_boundary"] = ghost_boundary
+    submesh_cell["ghost_commun"] = ghost_commun
+    submesh_cell["full_commun"] = full_commun
+    submesh_cell["full_quan"] = full_quan
+    submesh_cell["ghost_quan"] = ghost_quan
+
+    points, vertices, boundary, quantities, ghost_recv_dict, \
+            full_send_dict, tri_map, node_map, tri_l2g, node_l2g, \
+            ghost_layer_width = \
+            build_local_mesh(submesh_cell, tlower, tupper, numprocs)
+
+    tri_l2g = num.array(load('p2s_map')[tri_l2g])
+
+    number_of_full_nodes = len(full_nodes)
+    number_of_full_triangles = len(full_triangles)
+
+    if verbose:
+        print 'read_partition: P%g, no_full_nodes = %g, no_full_triangles = %g' \
+              % (p, number_of_full_nodes, number_of_full_triangles)
+
+    kwargs = {'full_send_dict': full_send_dict,
+              'ghost_recv_dict': ghost_recv_dict,
+              'number_of_full_nodes': number_of_full_nodes,
+              'number_of_full_triangles': number_of_full_triangles,
+              'geo_reference': metadata['domain_georef'],
+              'number_of_global_triangles': metadata['number_of_global_triangles'],
+              'number_of_global_nodes': metadata['number_of_global_nodes'],
+              'processor': p,
+              'numproc': numprocs,
+              's2p_map': None,
+              'p2s_map': None,
+              'tri_l2g': tri_l2g,
+              'node_l2g': node_l2g,
+              'ghost_layer_width': ghost_layer_width}
+
+    return (kwargs, points, vertices, boundary, quantities,
+            metadata['boundary_map'],
+            metadata['domain_name'], metadata['domain_dir'],
+            metadata['domain_store'], metadata['domain_store_centroids'],
+            metadata['domain_minimum_storable_height'],
+            metadata['domain_minimum_allowed_height'],
+            metadata['domain_flow_algorithm'],
+            metadata['domain_georef'],
+            metadata['domain_quantities_to_be_stored'],
+            metadata['domain_smooth'])
@@ -0,0 +1,389 @@
+"""Rebalance the partition of a parallel domain during a run.
+
+As wet/dry fronts move the cost of the triangles of each processor
+changes, and the processors with newly wet triangles hold up the others
+(which wait in communicate_flux_timestep). At a yield time rebalance
+measures the cost of each processor's triangles, repartitions the
+global mesh with those costs as weights (see pmesh_divide_metis_dual),
+and moves the triangles and their quantities to their new processors.
+It returns a new Parallel_domain, with the same global triangle and node
+numbering (tri_l2g, node_l2g), time and evolve state as the old one.
+
+The triangles and their values are gathered on processor 0, which
+builds the new submeshes as distribute does, and sends each processor
+its submesh and values.
+
+Typical use:
+
+    while domain.get_time() < finaltime:
+        for t in domain.evolve(yieldstep=yieldstep, finaltime=finaltime):
+            domain.print_timestepping_statistics()
+            if domain.get_load_imbalance() > 1.2:
+                break
+
+        if domain.get_time() < finaltime:
+            domain = domain.rebalance()
+            set_boundaries_and_operators(domain)
+
+Boundary conditions and fractional step operators are bound to the old
+domain, so they have to be set up again on the new domain (as after
+distribute). The tags of the boundary are kept.
+
+The run is stored into the single global sww file (see
+set_store_collective), which has the same global numbering before and
+after the rebalance. Per processor sww files can't be carried on after
+a rebalance.
+"""
+
+import time
+
+import numpy as num
+
+import anuga.utilities.parallel_abstraction as pypar
+
+# Evolve state of the domain which is carried over to the new domain
+from anuga.shallow_water.checkpoint import checkpoint_attributes
+from anuga.shallow_water.checkpoint import checkpoint_arrays
+
+
+def get_compute_walltime(domain):
+    """Walltime the processor has spent since domain was created other than
+    communicating, ie computing (or storing)
+    """
+
+    return time.time() - domain.compute_walltime_start \
+           - domain.communication_time - domain.communication_reduce_time \
+           - domain.communication_broadcast_time
+
+
+def _gather_list(domain, x):
+    """List of the values x of all processors on processor 0, None on
+    the other processors
+    """
+
+    if domain.processor == 0:
+        return [x] + [pypar.receive(p) for p in range(1, domain.numproc)]
+    else:
+        pypar.send(x, 0)
+        return None
+
+
+def _broadcast(domain, x):
+    """Value x of processor 0 on all processors
+    """
+
+    if domain.processor == 0:
+        for p in range(1, domain.numproc):
+            pypar.send(x, p)
+        return x
+    else:
+        return pypar.receive(0)
+
+
+def get_load_imbalance(domain):
+    """Ratio of the maximum to the mean compute walltime of the
+    processors (see get_compute_walltime), 1.0 is perfectly balanced.
+    Must be called on all processors.
+    """
+
+    times = _gather_list(domain, get_compute_walltime(domain))
+
+    imbalance = None
+    if domain.processor == 0:
+        mean = num.mean(times)
+        if mean > 0.0:
+            imbalance = max(times)/mean
+        else:
+            imbalance = 1.0
+
+    return _broadcast(domain, imbalance)
+
+
+def get_rebalance_weights(domain, weights='time', dry_weight=0.1):
+    """Cost of each full triangle of the processor.
+
+    weights 'time' gives each triangle the same share of the compute
+    walltime of the processor. weights 'wet' gives the wet triangles
+    weight 1 and the dry triangles weight dry_weight. Otherwise weights
+    are the weights of the full triangles.
+    """
+
+    full_ids = num.flatnonzero(domain.tri_full_flag == 1)
+    n = len(full_ids)
+
+    if weights == 'time':
+        return num.ones(n, num.float)*max(get_compute_walltime(domain), 0.0)/n
+    elif weights == 'wet':
+        depth = domain.quantities['stage'].centroid_values[full_ids] \
+                - domain.quantities['elevation'].centroid_values[full_ids]
+        wet = depth > domain.minimum_allowed_height
+        return num.where(wet, 1.0, dry_weight)
+    else:
+        weights = num.array(weights, num.float).reshape(-1)
+        msg = 'Expected one weight per full triangle (%d), got %d' \
+              % (n, len(weights))
+        assert len(weights) == n, msg
+        return weights
+
+
+def get_rebalance_data(domain, weights):
+    """The full triangles of the processor in the global numbering,
+    with their nodes, boundary, weights and quantities, as a dictionary
+    """
+
+    full_ids = num.flatnonzero(domain.tri_full_flag == 1)
+    triangles = domain.triangles[full_ids]
+
+    node_ids = num.unique(triangles)
+
+    boundary = []
+    for (t, e), tag in domain.boundary.items():
+        if domain.tri_full_flag[t] == 1:
+            boundary.append((domain.tri_l2g[t], e, tag))
+
+    quantities = {}
+    for name, Q in domain.quantities.items():
+        quantities[name] = (Q.centroid_values[full_ids],
+                            Q.vertex_values[full_ids],
+                            Q.edge_values[full_ids])
+
+    data = {'tri_gids' : domain.tri_l2g[full_ids],
+            'triangles' : domain.node_l2g[triangles],
+            'node_gids' : domain.node_l2g[node_ids],
+            'nodes' : domain.mesh.nodes[node_ids],
+            'boundary' : boundary,
+            'weights' : weights,
+            'quantities' : quantities}
+
+    return data
+
+
+def rebalance_submeshes(datas, numprocs, number_of_global_triangles,
+                        number_of_global_nodes, geo_reference=None,
+                        parameters=None, verbose=False):
+    """Partition the global mesh put together from the rebalance data of
+    all the processors (see get_rebalance_data), with their weights.
+    Return for each processor the tuple of
+    Sequential_distribute.extract_submesh and the values of the
+    quantities of its triangles (full and ghost) as a dictionary of
+    (centroid, vertex, edge) values.
+    """
+
+    from anuga import Domain
+    from anuga.parallel.sequential_distribute import Sequential_distribute
+
+    nodes = num.zeros((number_of_global_nodes, 2), num.float)
+    triangles = num.zeros((number_of_global_triangles, 3), num.int)
+    weights = num.zeros(number_of_global_triangles, num.float)
+    boundary = {}
+
+    values = {}
+    for name in datas[0]['quantities']:
+        values[name] = (num.zeros(number_of_global_triangles, num.float),
+                        num.zeros((number_of_global_triangles, 3), num.float),
+                        num.zeros((number_of_global_triangles, 3), num.float))
+
+    for data in datas:
+        gids = data['tri_gids']
+        nodes[data['node_gids']] = data['nodes']
+        triangles[gids] = data['triangles']
+        weights[gids] = data['weights']
+        for (t, e, tag) in data['boundary']:
+            boundary[t, e] = tag
+        for name, (c, v, e) in data['quantities'].items():
+            values[name][0][gids] = c
+            values[name][1][gids] = v
+            values[name][2][gids] = e
+
+    if verbose: print 'rebalance: Partition the global mesh'
+
+    domain = Domain(nodes, triangles, boundary, geo_reference=geo_reference)
+
+    if parameters is None:
+        parameters = {}
+    else:
+        parameters = parameters.copy()
+
+    # Processors which did no work, say, still count
+    if num.max(weights) > 0.0:
+        parameters['partition_weights'] = weights
+    elif 'partition_objective' not in parameters:
+        parameters['partition_objective'] = 'edgecut'
+
+    partition = Sequential_distribute(domain, parameters=parameters)
+    partition.distribute(numprocs)
+
+    submeshes = []
+    for p in range(numprocs):
+        submesh = partition.extract_submesh(p)
+        tri_l2g = submesh[0]['tri_l2g']
+
+        p_values = {}
+        for name, (c, v, e) in values.items():
+            p_values[name] = (c[tri_l2g], v[tri_l2g], e[tri_l2g])
+
+        submeshes.append((submesh, p_values))
+
+    return submeshes
+
+
+def create_rebalanced_domain(domain, submesh, values):
+    """New Parallel_domain built from the submesh and values returned by
+    rebalance_submeshes, with the settings and evolve state of domain
+    """
+
+    from anuga import Quantity
+    from anuga.parallel.parallel_shallow_water import Parallel_domain
+
+    kwargs, points, vertices, boundary = submesh[:4]
+
+    new_domain = Parallel_domain(points, vertices, boundary, **kwargs)
+
+    #------------------------------------------------------------------------
+    # Copy in the quantities
+    #------------------------------------------------------------------------
+    for name, (c, v, e) in values.items():
+        if name not in new_domain.quantities:
+            Quantity(new_domain, name=name, register=True)
+
+        Q = new_domain.quantities[name]
+        Q.centroid_values[:] = c
+        Q.vertex_values[:] = v
+        Q.edge_values[:] = e
+
+    #------------------------------------------------------------------------
+    # Boundary tags, the boundary conditions have to be set again
+    #------------------------------------------------------------------------
+    boundary_map = {}
+    for tag in new_domain.get_boundary_tags():
+        boundary_map[tag] = None
+    new_domain.set_boundary(boundary_map)
+
+    #------------------------------------------------------------------------
+    # Settings
+    #------------------------------------------------------------------------
+    new_domain.set_flow_algorithm(domain.get_flow_algorithm())
+    new_domain.set_name(domain.get_global_name())
+    new_domain.set_datadir(domain.get_datadir())
+    new_domain.set_store(domain.get_store())
+    new_domain.set_store_centroids(domain.get_store_centroids())
+    new_domain.set_store_collective(domain.get_store_collective())
+    new_domain.set_store_async(domain.store_async, domain.store_async_queue_size)
+    new_domain.set_minimum_storable_height(domain.minimum_storable_height)
+    new_domain.set_minimum_allowed_height(domain.get_minimum_allowed_height())
+    new_domain.geo_reference = domain.geo_reference
+    new_domain.set_quantities_to_be_stored(domain.quantities_to_be_stored)
+    new_domain.smooth = domain.smooth
+
+    new_domain.set_CFL(domain.CFL)
+    new_domain.set_default_order(domain.default_order)
+    new_domain.set_timestepping_method(domain.timestepping_method)
+    new_domain.set_ghost_exchange_overlap(domain.get_ghost_exchange_overlap())
+
+    new_domain.set_omp_num_threads(domain.get_omp_num_threads())
+    new_domain.report_kernel_walltime = domain.report_kernel_walltime
+
+    if domain.checkpoint:
+        writer = domain.checkpoint_writer
+        if domain.checkpoint_step == 0:
+            checkpoint_time = domain.checkpoint_time
+        else:
+            checkpoint_time = None
+
+        # The first checkpoint of the new partition is a full one
+        new_domain.set_checkpointing(checkpoint_dir=domain.checkpoint_dir,
+                                     checkpoint_step=domain.checkpoint_step,
+                                     checkpoint_time=checkpoint_time,
+                                     checkpoint_async=writer.store_async,
+                                     checkpoint_full_step=writer.full_step,
+                                     checkpoint_keep=writer.keep)
+        if checkpoint_time is not None:
+            new_domain.walltime_prev = domain.walltime_prev
+
+    for name in ['beta_w', 'beta_w_dry', 'beta_uh', 'beta_uh_dry',
+                 'beta_vh', 'beta_vh_dry', 'maximum_allowed_speed',
+                 'optimise_dry_cells', 'use_edge_limiter',
+                 'extrapolate_velocity_second_order', 'fused_evolve']:
+        if hasattr(domain, name):
+            setattr(new_domain, name, getattr(domain, name))
+
+    #------------------------------------------------------------------------
+    # Evolve state
+    #------------------------------------------------------------------------
+    for name in checkpoint_attributes:
+        if hasattr(domain, name):
+            setattr(new_domain, name, getattr(domain, name))
+
+    for name in checkpoint_arrays:
+        if hasattr(domain, name):
+            getattr(new_domain, name)[:] = getattr(domain, name)
+
+    return new_domain
+
+
+def rebalance(domain, weights='time', dry_weight=0.1, parameters=None,
+              verbose=False):
+    """Rebalance the partition of the parallel domain, and return the
+    new Parallel_domain. Must be called on all processors, at a yield time.
+
+    weights are the cost of the full triangles of this processor, or
+    'time' or 'wet' (see get_rebalance_weights). parameters are passed on
+    to the partition (see distribute), except the partition_weights.
+    """
+
+    if domain.get_store() and not domain.get_store_collective():
+        msg = 'Rebalancing needs the run stored in a single global sww file '
+        msg += '(see set_store_collective), the per processor sww files '
+        msg += 'can not be carried on with a new partition'
+        raise Exception(msg)
+
+    weights = get_rebalance_weights(domain, weights, dry_weight)
+    data = get_rebalance_data(domain, weights)
+
+    # Write out the timesteps stored so far
+    if domain.get_store() and hasattr(domain, 'writer'):
+        domain.writer.close()
+
+    # and the checkpoints still queued
+    if domain.checkpoint_writer is not None:
+        domain.checkpoint_writer.close()
+
+    if parameters is None:
+        parameters = {}
+    else:
+        parameters = parameters.copy()
+    parameters['ghost_layer_width'] = domain.ghost_layer_width
+
+    #------------------------------------------------------------------------
+    # Processor 0 builds and sends the new submeshes
+    #------------------------------------------------------------------------
+    datas = _gather_list(domain, data)
+
+    if domain.processor == 0:
+        submeshes = rebalance_submeshes(datas, domain.numproc,
+                                        domain.number_of_global_triangles,
+                                        domain.number_of_global_nodes,
+                                        domain.geo_reference,
+                                        parameters, verbose)
+        del datas
+
+        for p in range(1, domain.numproc):
+            pypar.send(submeshes[p], p)
+
+        submesh, values = submeshes[0]
+        del submeshes
+    else:
+        submesh, values = pypar.receive(0)
+
+    new_domain = create_rebalanced_domain(domain, submesh, values)
+
+    if verbose:
+        print 'rebalance: P%g, %g full triangles (was %g)' \
+              % (domain.processor, new_domain.number_of_full_triangles,
+                 domain.number_of_full_triangles)
+
+    # Carry on storing into the global sww file
+    if new_domain.get_store():
+        new_domain.initialise_storage(mode='a')
+
+    return new_domain
@@ -71,7 +71,7 @@ class Sequential_distribute(object):
 
         new_nodes, new_triangles, new_boundary, triangles_per_proc, quantities, \
                s2p_map, p2s_map = \
-               pmesh_divide_metis_with_map(domain, numprocs)
+               pmesh_divide_metis_with_map(domain, numprocs, parameters)
 
 
         # Build the mesh that should be assigned to each processor,
@@ -248,16 +248,56 @@ def sequential_distribute_dump(domain, numprocs=1, verbose=False, partition_dir=
     return
 
 
-def sequential_distribute_load(filename = 'domain', partition_dir = '.', verbose = False):
+def sequential_partition_dump(domain, numprocs=1, verbose=False, partition_dir='.', parameters = None):
+    """ Partition the domain and write a single partition directory, from
+    which each processor builds its own submesh (see partition_file.py)
+    """
+
+    from anuga.parallel.partition_file import write_partition
+
+    return write_partition(domain, numprocs, partition_dir, verbose, parameters)
+
+
+def sequential_distribute_load(filename = 'domain', partition_dir = '.', verbose = False,
+                               use_partition = None):
+    """Load the local domain of this processor, either from the partition
+    directory written by sequential_partition_dump or from the pickle
+    file written by sequential_distribute_dump.
 
+    use_partition = True loads from the partition directory,
+    use_partition = False from the pickle file. By default (None) the
+    newer of the two is used.
+    """
 
     from anuga import myid, numprocs
 
-    from os.path import join
+    from os.path import join, isdir, exists, getmtime
+
+    from anuga.parallel.partition_file import get_partition_dir
+    from anuga.parallel.partition_file import read_partition
+
+    dirname = get_partition_dir(filename, numprocs, partition_dir)
+    metadata_name = join(dirname, 'metadata.pickle')
 
     pickle_name = filename+'_P%g_%g.pickle'% (numprocs,myid)
     pickle_name = join(partition_dir,pickle_name) 
-    
+
+    if use_partition is None:
+        if not exists(metadata_name):
+            use_partition = False
+        elif not exists(pickle_name):
+            use_partition = True
+        else:
+            use_partition = getmtime(metadata_name) >= getmtime(pickle_name)
+
+    if use_partition:
+        if not isdir(dirname):
+            msg = 'Partition directory %s does not exist' % dirname
+            raise Exception(msg)
+        if verbose: print 'sequential_distribute_load: Read %s' % dirname
+        tostore = read_partition(dirname, myid, verbose=verbose)
+        return sequential_distribute_create_domain(tostore, numprocs)
+
     return sequential_distribute_load_pickle_file(pickle_name, numprocs, verbose = verbose)
 
 
@@ -268,13 +308,23 @@ def sequential_distribute_load_pickle_file(pickle_name, np=1, verbose = False):
     
     import cPickle    
     f = file(pickle_name, 'rb')
+    tostore = cPickle.load(f)
+    f.close()
+
+    return sequential_distribute_create_domain(tostore, np)
+
+
+def sequential_distribute_create_domain(tostore, np=1):
+    """
+    Create the domain of a processor from the tuple returned by
+    Sequential_distribute.extract_submesh
+    """
 
     kwargs, points, vertices, boundary, quantities, boundary_map, \
                    domain_name, domain_dir, domain_store, domain_store_centroids, \
                    domain_minimum_storable_height, domain_minimum_allowed_height, \
                    domain_flow_algorithm, domain_georef, \
-                   domain_quantities_to_be_stored, domain_smooth = cPickle.load(f)
-    f.close()
+                   domain_quantities_to_be_stored, domain_smooth = tostore
 
     #---------------------------------------------------------------------------
     # Create domain (parallel if np>1)
@@ -9,9 +9,12 @@ from anuga import Domain
 from anuga import rectangular_cross
 
 from anuga.parallel.distribute_mesh import pmesh_divide_metis
+from anuga.parallel.distribute_mesh import pmesh_divide_metis_dual
+from anuga.parallel.distribute_mesh import dual_graph
 from anuga.parallel.distribute_mesh import build_submesh
 from anuga.parallel.distribute_mesh import submesh_full, submesh_ghost, submesh_quantities
 from anuga.parallel.distribute_mesh import extract_submesh, rec_submesh, send_submesh
+from anuga.parallel.distribute_mesh import ghost_halo_levels
 
 import numpy as num
 
@@ -1517,6 +1520,153 @@ class Test_Distribute_Mesh(unittest.TestCase):
 
         #pprint(submesh_cell_1)
 
+
+    def test_ghost_halo_levels(self):
+        """
+        Test the distance of the triangles from the ghost triangles
+        """
+
+        # A row of 8 cells, each made of a left, bottom, right and top
+        # triangle. The first cell holds the ghosts
+        points, vertices, boundary = rectangular_cross(8, 1, len1=8.0, len2=1.0)
+        domain = Domain(points, vertices, boundary)
+
+        x = domain.centroid_coordinates[:,0]
+        y = domain.centroid_coordinates[:,1]
+
+        tri_full_flag = num.where(x < 1.0, 0, 1)
+
+        levels = ghost_halo_levels(domain.neighbours, tri_full_flag)
+
+        assert levels.dtype == num.int
+        assert num.all(levels[x < 1.0] == 0)
+
+        # Second cell: left 1, bottom and top 2, right 3
+        second = (x > 1.0) & (x < 2.0)
+        assert num.all(levels[second & (x < 1.25)] == 1)
+        assert num.all(levels[second & (num.abs(x - 1.5) < 0.01)] == 2)
+        assert num.all(levels[second & (x > 1.75)] == 3)
+
+        # Capped at 4 for the remaining cells
+        assert num.all(levels[x > 2.0] == 4)
+
+        levels = ghost_halo_levels(domain.neighbours, tri_full_flag, max_level=2)
+        assert num.all(levels[x > 1.5] == 2)
+
+        # No ghosts
+        levels = ghost_halo_levels(domain.neighbours, num.ones_like(tri_full_flag))
+        assert num.all(levels == 4)
+
+    def test_pmesh_divide_metis_dual(self):
+        """
+        Test the partition of the dual graph with triangle weights
+        """
+
+        points, vertices, boundary = rectangular_cross(20, 10, len1=2.0, len2=1.0)
+        domain = Domain(points, vertices, boundary)
+
+        xadj, adjncy = dual_graph(domain)
+
+        assert len(xadj) == domain.number_of_triangles + 1
+        for i in [0, 17, 400]:
+            neighbours = domain.neighbours[i]
+            assert num.all(adjncy[xadj[i]:xadj[i+1]] == neighbours[neighbours >= 0])
+
+        # The left half of the domain is ten times as expensive
+        x = domain.centroid_coordinates[:,0]
+        weights = num.where(x < 1.0, 10.0, 1.0)
+
+        numprocs = 4
+        for objective in ['edgecut', 'ghosts']:
+            epart = pmesh_divide_metis_dual(domain, numprocs, weights, objective)
+
+            assert len(epart) == domain.number_of_triangles
+            loads = num.bincount(epart, weights=weights, minlength=numprocs)
+            assert num.max(loads) < 1.1*num.mean(loads)
+
+            # So most triangles go to the processors on the right half
+            assert num.max(num.bincount(epart)) > 2*domain.number_of_triangles/numprocs
+
+        # Weights and the objective are passed through the parameters
+        nodes, triangles, boundary, triangles_per_proc, quantities = \
+              pmesh_divide_metis(domain, numprocs,
+                                 parameters={'partition_weights': weights})
+
+        assert num.sum(triangles_per_proc) == domain.number_of_triangles
+        assert num.all(triangles == domain.triangles[num.argsort(
+            pmesh_divide_metis_dual(domain, numprocs, weights), kind='mergesort')])
+
+        self.assertRaises(AssertionError, pmesh_divide_metis_dual,
+                          domain, numprocs, weights[:10])
+        self.assertRaises(AssertionError, pmesh_divide_metis_dual,
+                          domain, numprocs, -weights)
+        self.assertRaises(AssertionError, pmesh_divide_metis_dual,
+                          domain, numprocs, weights, 'nodal')
+
+    def test_ghost_layer_commun_pattern_old(self):
+        """
+        Test the ghost layers and communication patterns against the
+        previous implementations, for several ghost layer widths
+        """
+
+        from anuga.abstract_2d_finite_volumes.neighbour_mesh import Mesh
+        from anuga.parallel.distribute_mesh import ghost_layer, ghost_bnd_layer
+        from anuga.parallel.distribute_mesh import full_commun_pattern, build_local_commun
+        from anuga.parallel.benchmark_distribute_mesh import ghost_layer_old_2
+        from anuga.parallel.benchmark_distribute_mesh import ghost_bnd_layer_old_2
+        from anuga.parallel.benchmark_distribute_mesh import full_commun_pattern_old
+        from anuga.parallel.benchmark_distribute_mesh import build_local_commun_old
+
+        points, vertices, boundary = rectangular_cross(12, 9)
+        domain = Domain(points, vertices, boundary)
+
+        numprocs = 7
+        nodes, triangles, boundary, triangles_per_proc, quantities = \
+               pmesh_divide_metis(domain, numprocs)
+        mesh = Mesh(nodes, triangles, boundary)
+
+        bounds = num.concatenate(([0], num.cumsum(triangles_per_proc)))
+
+        for width in [1, 2, 3]:
+            parameters = {'ghost_layer_width': width}
+            submesh = submesh_full(mesh, triangles_per_proc)
+
+            for p in range(numprocs):
+                tlower, tupper = bounds[p], bounds[p+1]
+
+                nodes_p, triangles_p, width_p = \
+                    ghost_layer(submesh, mesh, p, tupper, tlower, parameters)
+                nodes_o, triangles_o, width_o = \
+                    ghost_layer_old_2(submesh, mesh, p, tupper, tlower, parameters)
+
+                assert num.array_equal(nodes_p, nodes_o)
+                assert num.array_equal(triangles_p, triangles_o)
+                assert width_p == width_o == width
+
+                assert ghost_bnd_layer(triangles_p, tlower, tupper, mesh, p) == \
+                       ghost_bnd_layer_old_2(triangles_p, tlower, tupper, mesh, p)
+
+            submesh = submesh_ghost(submesh, mesh, triangles_per_proc, parameters)
+
+            assert full_commun_pattern(submesh, triangles_per_proc) == \
+                   full_commun_pattern_old(submesh, triangles_per_proc)
+
+            submesh = submesh_quantities(submesh, quantities, triangles_per_proc)
+
+            for p in range(numprocs):
+                tri_map = extract_submesh(submesh, triangles_per_proc, p=p)[6]
+
+                ghost_recv, full_send = build_local_commun(tri_map,
+                    submesh["ghost_commun"][p], submesh["full_commun"][p], numprocs)
+                ghost_recv_o, full_send_o = build_local_commun_old(tri_map,
+                    submesh["ghost_commun"][p], submesh["full_commun"][p], numprocs)
+
+                for new, old in [(ghost_recv, ghost_recv_o), (full_send, full_send_o)]:
+                    assert sorted(new.keys()) == sorted(old.keys())
+                    for q in new:
+                        assert num.array_equal(new[q][0], old[q][0])
+                        assert num.array_equal(new[q][1], old[q][1])
+
 #-------------------------------------------------------------
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+"""Test the per step reductions of the parallel domain, run on a single
+processor
+"""
+
+import unittest
+
+import numpy as num
+
+from anuga import rectangular_cross
+from anuga import Reflective_boundary
+from anuga import Dirichlet_boundary
+from anuga import Rate_operator
+from anuga.parallel.parallel_shallow_water import Parallel_domain
+
+
+def create_domain():
+
+    points, vertices, boundary = rectangular_cross(4, 4)
+    domain = Parallel_domain(points, vertices, boundary,
+                             full_send_dict={}, ghost_recv_dict={},
+                             processor=0, numproc=1)
+    domain.set_store(False)
+    domain.set_quantity('elevation', 0.0)
+    domain.set_quantity('stage', lambda x, y: num.where(x < 0.5, 1.0, 0.5))
+
+    Br = Reflective_boundary(domain)
+    domain.set_boundary({'left': Br, 'right': Br, 'top': Br, 'bottom': Br})
+
+    return domain
+
+
+class Test_Parallel_Reductions(unittest.TestCase):
+
+    def test_register_reduction(self):
+
+        domain = create_domain()
+
+        stage = domain.quantities['stage'].centroid_values
+
+        domain.register_reduction('max_stage', lambda: stage.max(), op='max')
+        domain.register_reduction('min_stage', lambda: stage.min(), op='min')
+        domain.register_reduction('calls', lambda: 1.0)
+
+        assert domain.get_reduction('max_stage') is None
+
+        # After the timestep and the integrals of the domain
+        assert domain.local_reduction.shape == (6, 2)
+        assert num.allclose(domain.local_reduction[:, 1], [2, 3, 3, 1, 2, 3])
+
+        domain.distribute_to_vertices_and_edges()
+        domain.update_boundary()
+        domain.compute_fluxes()
+        flux_timestep = domain.flux_timestep
+        domain.yieldtime = 1.0
+        domain.update_timestep(yieldstep=1.0, finaltime=1.0)
+
+        # The timestep and the reductions are packed together
+        assert domain.global_reduction[0, 0] == flux_timestep
+        assert domain.global_timestep[0] == flux_timestep
+
+        assert domain.get_reduction('calls') == 1.0
+        assert domain.get_reduction('min_stage') == 0.5
+        assert domain.get_reduction('max_stage') == 1.0
+
+        domain.remove_reduction('min_stage')
+        assert domain.local_reduction.shape == (5, 2)
+        assert num.allclose(domain.local_reduction[:, 1], [2, 3, 3, 1, 3])
+        self.assertRaises(KeyError, domain.get_reduction, 'min_stage')
+
+    def test_integral_reductions(self):
+        """The boundary flux and fractional step volume integrals are
+        reduced with the timestep, and at most once more when asked for
+        after the fractional steps
+        """
+
+        domain = create_domain()
+        domain.set_flow_algorithm('DE0')
+
+        Br = Reflective_boundary(domain)
+        Bd = Dirichlet_boundary([1.0, 0.0, 0.0])
+        domain.set_boundary({'left': Bd, 'right': Br, 'top': Br, 'bottom': Br})
+
+        Rate_operator(domain, rate=0.1)
+
+        initial_volume = domain.get_water_volume()
+
+        number_of_reductions = 0
+        for t in domain.evolve(yieldstep=0.05, finaltime=0.2):
+            # Otherwise a single reduction per step (number_of_steps
+            # counts the steps since the last yield)
+            assert domain.number_of_reductions - number_of_reductions == \
+                   domain.number_of_steps
+
+            number_of_reductions = domain.number_of_reductions
+
+            # Both integrals in one reduction
+            flux_integral = domain.get_boundary_flux_integral()
+            volume_integral = domain.get_fractional_step_volume_integral()
+            assert domain.number_of_reductions == number_of_reductions + 1
+
+            assert num.allclose(flux_integral,
+                domain.boundary_flux_integral.boundary_flux_integral)
+            assert volume_integral == domain.fractional_step_volume_integral
+
+            assert num.allclose(domain.get_water_volume(),
+                initial_volume + flux_integral + volume_integral)
+
+            # No more reductions until the fractional steps change them
+            domain.get_boundary_flux_integral()
+            assert domain.number_of_reductions == number_of_reductions + 1
+
+            number_of_reductions = domain.number_of_reductions
+
+        assert flux_integral > 0.0
+        assert volume_integral > 0.0
+
+        # Within a step the integrals come from the timestep reduction
+        domain.distribute_to_vertices_and_edges()
+        domain.update_boundary()
+        domain.compute_fluxes()
+        domain.update_timestep(yieldstep=1.0, finaltime=1.0)
+
+        number_of_reductions = domain.number_of_reductions
+        assert num.allclose(domain.get_boundary_flux_integral(), flux_integral)
+        assert domain.get_fractional_step_volume_integral() == volume_integral
+        assert domain.number_of_reductions == number_of_reductions
+
+    def test_register_reduction_errors(self):
+
+        domain = create_domain()
+
+        self.assertRaises(Exception, domain.register_reduction,
+                          'x', lambda: 1.0, op='prod')
+
+        domain.register_reduction('x', lambda: 1.0)
+        self.assertRaises(Exception, domain.register_reduction,
+                          'x', lambda: 1.0)
+
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(Test_Parallel_Reductions, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
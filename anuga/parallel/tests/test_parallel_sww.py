@@ -0,0 +1,113 @@
+"""Test the storage of a parallel domain in a single global sww file,
+run on a single processor
+"""
+
+import os
+import unittest
+
+import numpy as num
+
+from anuga import Domain
+from anuga import rectangular_cross
+from anuga.file.netcdf import NetCDFFile
+from anuga.parallel.parallel_shallow_water import Parallel_domain
+
+
+def set_quantities(domain):
+
+    domain.set_quantity('elevation', lambda x, y: -x/3)
+    domain.set_quantity('stage', lambda x, y: num.where(x < 0.5, 0.1, -x/3))
+    domain.set_quantity('xmomentum', lambda x, y: x*y)
+
+
+class Test_Parallel_SWW(unittest.TestCase):
+
+    def setUp(self):
+        self.filenames = []
+
+    def tearDown(self):
+        for filename in self.filenames:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def check_global_sww(self, smooth):
+        """Store a domain, and the same domain with its nodes and triangles
+        permuted as a Parallel_domain with the tri_l2g and node_l2g maps
+        back to the original numbering. The global file should be the same.
+        """
+
+        points, vertices, boundary = rectangular_cross(3, 2)
+        points = num.array(points)
+        vertices = num.array(vertices)
+
+        domain = Domain(points, vertices, boundary)
+        domain.set_name('test_global_sww')
+        domain.set_store_vertices_uniquely(not smooth)
+        set_quantities(domain)
+
+        # Local numbering of the "parallel" domain
+        node_l2g = num.random.permutation(len(points))
+        tri_l2g = num.random.permutation(len(vertices))
+
+        node_g2l = num.argsort(node_l2g)
+        l_vertices = node_g2l[vertices[tri_l2g]]
+
+        l_boundary = {}
+        tri_g2l = num.argsort(tri_l2g)
+        for (tri, edge), tag in boundary.items():
+            l_boundary[(tri_g2l[tri], edge)] = tag
+
+        p_domain = Parallel_domain(points[node_l2g], l_vertices, l_boundary,
+                                   full_send_dict={}, ghost_recv_dict={},
+                                   processor=0, numproc=1,
+                                   number_of_global_triangles=len(vertices),
+                                   number_of_global_nodes=len(points),
+                                   tri_l2g=tri_l2g, node_l2g=node_l2g)
+        p_domain.set_name('test_parallel_sww')
+        p_domain.set_store_vertices_uniquely(not smooth)
+        p_domain.set_store_collective()
+        assert p_domain.get_store_collective()
+        set_quantities(p_domain)
+
+        self.filenames = ['test_global_sww.sww', 'test_parallel_sww.sww']
+
+        for d in [domain, p_domain]:
+            d.initialise_storage()
+            for t in [0.0, 1.0, 2.0]:
+                d.set_time(t)
+                d.set_quantity('stage', lambda x, y: num.where(x < 0.5, 0.1 + t, -x/3))
+                d.store_timestep()
+            d.writer.close()
+
+        # The global file has the global name, no per processor files
+        assert p_domain.writer.filename == os.path.join('.', 'test_parallel_sww.sww')
+        assert not os.path.exists('test_parallel_sww_P1_0.sww')
+
+        fid = NetCDFFile('test_global_sww.sww')
+        p_fid = NetCDFFile('test_parallel_sww.sww')
+
+        assert len(fid.variables['time']) == 3
+        assert fid.variables.keys() == p_fid.variables.keys()
+        for name in fid.variables:
+            assert num.allclose(fid.variables[name][:], p_fid.variables[name][:]), name
+
+        fid.close()
+        p_fid.close()
+
+    def test_global_sww_smooth(self):
+
+        self.check_global_sww(smooth=True)
+
+    def test_global_sww_non_smooth(self):
+
+        self.check_global_sww(smooth=False)
+
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(Test_Parallel_SWW, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
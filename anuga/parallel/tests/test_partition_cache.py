@@ -0,0 +1,194 @@
+"""Test the cache of the partitions of meshes
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import numpy as num
+
+import anuga
+from anuga.parallel.sequential_distribute import Sequential_distribute
+from anuga.parallel.partition_cache import get_partition_cache_key
+from anuga.parallel.partition_cache import get_partition_cache_entry
+from anuga.parallel.partition_cache import get_partition_cache_size
+from anuga.parallel.partition_cache import write_partition_cache_entry
+from anuga.parallel.partition_cache import read_partition_cache_entry
+from anuga.parallel.partition_cache import get_submesh_values
+from anuga.parallel.partition_cache import evict_partition_cache
+from anuga.parallel.partition_cache import cached_extract_submesh
+from test_partition_file import assert_same
+
+
+def create_domain(name, m=12, n=9):
+
+    domain = anuga.rectangular_cross_domain(m, n)
+    domain.set_name(name)
+    domain.set_quantity('elevation', lambda x, y: -x/3)
+    domain.set_quantity('stage', lambda x, y: x*y)
+
+    return domain
+
+
+class Test_Partition_Cache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_key(self):
+
+        domain = create_domain('test_partition_cache')
+        key = get_partition_cache_key(domain, 3)
+
+        # Independent of the quantities
+        domain.set_quantity('stage', 1.0)
+        assert get_partition_cache_key(domain, 3) == key
+        assert get_partition_cache_key(domain, 3, {'ghost_layer_width': 2}) \
+               == key
+
+        # But not of the mesh, processors or partition parameters
+        assert get_partition_cache_key(domain, 4) != key
+        assert get_partition_cache_key(domain, 3, {'ghost_layer_width': 1}) \
+               != key
+        assert get_partition_cache_key(domain, 3,
+                        {'partition_objective': 'edgecut'}) != key
+        assert get_partition_cache_key(create_domain('other', 9, 12), 3) != key
+
+    def test_entry(self):
+        """The submeshes from the cache are those of Sequential_distribute
+        """
+
+        numprocs = 3
+        name = 'test_partition_cache'
+        parameters = {'ghost_layer_width': 3}
+
+        partition = Sequential_distribute(create_domain(name),
+                                          parameters=parameters)
+        partition.distribute(numprocs)
+
+        domain = create_domain(name)
+        key = get_partition_cache_key(domain, numprocs, parameters)
+        entry = get_partition_cache_entry(self.cache_dir, key)
+        write_partition_cache_entry(domain, numprocs, entry, parameters)
+
+        assert os.path.isdir(entry)
+
+        # With other values of the quantities
+        domain = create_domain(name)
+        domain.set_quantity('stage', lambda x, y: x + y)
+        stage = Sequential_distribute(domain, parameters=parameters)
+        stage.distribute(numprocs)
+
+        for p in range(numprocs):
+            submesh = partition.extract_submesh(p)
+            p_submesh = read_partition_cache_entry(entry, p)
+            p_values = get_submesh_values(domain, p_submesh[0]['tri_l2g'])
+
+            assert_same(submesh[:4], p_submesh)
+            assert_same(stage.extract_submesh(p)[4:13], p_values[:9])
+            assert_same(submesh[14:], p_values[10:])
+
+    def test_cached_extract_submesh(self):
+        """The second distribute of the mesh uses the entry of the first
+        """
+
+        name = 'test_partition_cache'
+        parameters = {'partition_cache': self.cache_dir}
+
+        partition = Sequential_distribute(create_domain(name))
+        partition.distribute(1)
+        submesh = partition.extract_submesh(0)
+
+        c_submesh = cached_extract_submesh(create_domain(name), 1, 0,
+                                           parameters)
+        assert_same(submesh[:13], c_submesh[:13])
+
+        entries = os.listdir(self.cache_dir)
+        assert len(entries) == 1
+
+        entry = os.path.join(self.cache_dir, entries[0])
+        os.utime(entry, (0, 0))
+
+        c_submesh = cached_extract_submesh(create_domain(name), 1, 0,
+                                           parameters)
+        assert_same(submesh[:13], c_submesh[:13])
+
+        # Used, not written again
+        assert os.listdir(self.cache_dir) == entries
+        assert os.path.getmtime(entry) > 0
+
+    def test_evict(self):
+
+        domain = create_domain('test_partition_cache')
+
+        entries = []
+        for numprocs in [1, 2, 3]:
+            key = get_partition_cache_key(domain, numprocs)
+            entry = get_partition_cache_entry(self.cache_dir, key)
+            write_partition_cache_entry(domain, numprocs, entry)
+            entries.append(entry)
+
+        # Last used in the order 1, 0, 2
+        now = time.time()
+        os.utime(entries[1], (now - 300, now - 300))
+        os.utime(entries[0], (now - 200, now - 200))
+        os.utime(entries[2], (now - 100, now - 100))
+
+        size = get_partition_cache_size(self.cache_dir)
+
+        # Nothing to remove
+        evict_partition_cache(self.cache_dir, size, 1000)
+        assert map(os.path.isdir, entries) == [True, True, True]
+
+        # By age
+        evict_partition_cache(self.cache_dir, size, 250)
+        assert map(os.path.isdir, entries) == [True, False, True]
+
+        # By size, the least recently used goes first, but not the one kept
+        evict_partition_cache(self.cache_dir, 0, 1000, keep=entries[2])
+        assert map(os.path.isdir, entries) == [False, False, True]
+
+    def test_evict_tmp(self):
+        """Stale temporary entries are removed, also when the entry
+        is found in the cache
+        """
+
+        name = 'test_partition_cache'
+        parameters = {'partition_cache': self.cache_dir,
+                      'partition_cache_tmp_age': 1000}
+
+        cached_extract_submesh(create_domain(name), 1, 0, parameters)
+        entries = os.listdir(self.cache_dir)
+
+        # Left by interrupted writes
+        stale = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp_')
+        fresh = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp_')
+        open(os.path.join(stale, 'P0.pickle'), 'wb').close()
+        now = time.time()
+        os.utime(stale, (now - 2000, now - 2000))
+
+        cached_extract_submesh(create_domain(name), 1, 0, parameters)
+
+        assert not os.path.exists(stale)
+        assert os.path.isdir(fresh)
+        assert sorted(os.listdir(self.cache_dir)) == \
+               sorted(entries + [os.path.basename(fresh)])
+
+        # Directly, with the default age
+        os.utime(fresh, (0, 0))
+        evict_partition_cache(self.cache_dir)
+        assert os.listdir(self.cache_dir) == entries
+
+
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(Test_Partition_Cache, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -0,0 +1,150 @@
+"""Test the distribution of a domain through a shared partition directory
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as num
+
+import anuga
+from anuga.parallel.sequential_distribute import Sequential_distribute
+from anuga.parallel.sequential_distribute import sequential_partition_dump
+from anuga.parallel.sequential_distribute import sequential_distribute_load
+from anuga.parallel.partition_file import read_partition
+
+
+def create_domain(name):
+
+    domain = anuga.rectangular_cross_domain(12, 9)
+    domain.set_name(name)
+    domain.set_quantity('elevation', lambda x, y: -x/3)
+    domain.set_quantity('stage', lambda x, y: x*y)
+
+    return domain
+
+
+def assert_same(a, b, path=''):
+    """Compare the nested tuples, lists, dictionaries and arrays of
+    two submeshes
+    """
+
+    if isinstance(a, dict):
+        assert sorted(a.keys()) == sorted(b.keys()), path
+        for k in a:
+            assert_same(a[k], b[k], path + '/' + str(k))
+    elif isinstance(a, (list, tuple)):
+        assert len(a) == len(b), path
+        for i in range(len(a)):
+            assert_same(a[i], b[i], path + '[%d]' % i)
+    elif isinstance(a, num.ndarray) or isinstance(b, num.ndarray):
+        assert num.array_equal(a, b), path
+    else:
+        assert a == b, path
+
+
+class Test_Partition_File(unittest.TestCase):
+
+    def setUp(self):
+        self.partition_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.partition_dir)
+
+    def check_partition(self, numprocs, parameters):
+
+        name = 'test_partition_file'
+
+        partition = Sequential_distribute(create_domain(name),
+                                          parameters=parameters)
+        partition.distribute(numprocs)
+
+        dirname = sequential_partition_dump(create_domain(name), numprocs,
+                                            partition_dir=self.partition_dir,
+                                            parameters=parameters)
+
+        assert os.path.isdir(dirname)
+
+        for p in range(numprocs):
+            submesh = partition.extract_submesh(p)
+            p_submesh = read_partition(dirname, p)
+
+            # All but the geo reference, which is a copy
+            assert_same(submesh[:13], p_submesh[:13])
+            assert_same(submesh[14:], p_submesh[14:])
+
+    def test_partition(self):
+
+        self.check_partition(3, None)
+
+    def test_partition_ghost_layer_width(self):
+
+        self.check_partition(4, {'ghost_layer_width': 3})
+        self.check_partition(2, {'ghost_layer_width': 1})
+
+    def test_load(self):
+
+        name = 'test_partition_load'
+        domain = create_domain(name)
+        sequential_partition_dump(domain, 1, partition_dir=self.partition_dir)
+
+        l_domain = sequential_distribute_load(name, self.partition_dir)
+
+        assert l_domain.get_name() == name
+        assert l_domain.number_of_triangles == domain.number_of_triangles
+        assert num.allclose(
+            num.sort(l_domain.quantities['stage'].centroid_values),
+            num.sort(domain.quantities['stage'].centroid_values))
+
+    def test_load_newer(self):
+
+        import time
+        from anuga.parallel.sequential_distribute import sequential_distribute_dump
+
+        name = 'test_partition_newer'
+
+        # A stale partition directory with a quantity that is no longer
+        # stored
+        domain = create_domain(name)
+        dirname = sequential_partition_dump(domain, 1,
+                                            partition_dir=self.partition_dir)
+        stale = os.path.join(dirname, 'quantity_stale.npy')
+        num.save(stale, num.zeros(3))
+
+        time.sleep(1.1)
+
+        # The pickle is newer, so it is used by default
+        domain = create_domain(name)
+        domain.set_quantity('stage', 1.0)
+        sequential_distribute_dump(domain, 1, partition_dir=self.partition_dir)
+
+        l_domain = sequential_distribute_load(name, self.partition_dir)
+        assert num.allclose(l_domain.quantities['stage'].centroid_values, 1.0)
+
+        l_domain = sequential_distribute_load(name, self.partition_dir,
+                                              use_partition=True)
+        assert not num.allclose(l_domain.quantities['stage'].centroid_values,
+                                1.0)
+
+        # Rewriting the partition clears the old directory
+        time.sleep(1.1)
+        domain.set_quantity('stage', 2.0)
+        sequential_partition_dump(domain, 1, partition_dir=self.partition_dir)
+        assert not os.path.exists(stale)
+
+        l_domain = sequential_distribute_load(name, self.partition_dir)
+        assert num.allclose(l_domain.quantities['stage'].centroid_values, 2.0)
+
+        l_domain = sequential_distribute_load(name, self.partition_dir,
+                                              use_partition=False)
+        assert num.allclose(l_domain.quantities['stage'].centroid_values, 1.0)
+
+
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(Test_Partition_File, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
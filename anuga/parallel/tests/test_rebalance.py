@@ -0,0 +1,232 @@
+"""Test the rebalance of the partition of a parallel domain, with the
+processors of the partition built on a single processor
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as num
+
+import anuga
+from anuga.file.netcdf import NetCDFFile
+from anuga.parallel.parallel_shallow_water import Parallel_domain
+from anuga.parallel.sequential_distribute import Sequential_distribute
+from anuga.parallel.rebalance import get_rebalance_data
+from anuga.parallel.rebalance import get_rebalance_weights
+from anuga.parallel.rebalance import rebalance_submeshes
+from anuga.parallel.rebalance import create_rebalanced_domain
+
+
+def create_domain(name):
+
+    domain = anuga.rectangular_cross_domain(12, 8, len1=3.0, len2=2.0)
+    domain.set_name(name)
+
+    domain.set_quantity('elevation', lambda x, y: -x/3)
+    domain.set_quantity('friction', 0.01)
+    domain.set_quantity('stage', lambda x, y: num.where(x < 1.0, 0.2, -x/3))
+
+    return domain
+
+
+def set_boundaries(domain):
+
+    Br = anuga.Reflective_boundary(domain)
+    domain.set_boundary({'left': Br, 'right': Br, 'top': Br, 'bottom': Br,
+                         'ghost': None})
+
+
+class Test_Rebalance(unittest.TestCase):
+
+    def setUp(self):
+        self.filenames = []
+
+    def tearDown(self):
+        for filename in self.filenames:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def test_rebalance_submeshes(self):
+        """Rebalance a partition on three processors, with the left of the
+        domain (which is wet) more expensive
+        """
+
+        numprocs = 3
+
+        domain = create_domain('test_rebalance_submeshes')
+        domain.set_quantity('xmomentum', lambda x, y: x*y)
+
+        # The values to check the moved values against
+        quantities = {}
+        for name, Q in domain.quantities.items():
+            quantities[name] = (Q.centroid_values.copy(),
+                                Q.vertex_values.copy(),
+                                Q.edge_values.copy())
+        vertex_coordinates = domain.get_vertex_coordinates().reshape(-1,3,2)
+        boundary = domain.boundary.copy()
+
+        partition = Sequential_distribute(domain)
+        partition.distribute(numprocs)
+
+        domains = []
+        for p in range(numprocs):
+            kwargs, points, vertices, p_boundary, p_quantities = \
+                    partition.extract_submesh(p)[:5]
+
+            p_domain = Parallel_domain(points, vertices, p_boundary, **kwargs)
+            p_domain.set_name('test_rebalance_submeshes')
+            p_domain.set_time(1.5)
+            tri_l2g = p_domain.tri_l2g
+            for name, (c, v, e) in quantities.items():
+                Q = p_domain.quantities[name]
+                Q.centroid_values[:] = c[tri_l2g]
+                Q.vertex_values[:] = v[tri_l2g]
+                Q.edge_values[:] = e[tri_l2g]
+            domains.append(p_domain)
+
+        datas = []
+        for p_domain in domains:
+            weights = get_rebalance_weights(p_domain, 'wet', dry_weight=0.1)
+            datas.append(get_rebalance_data(p_domain, weights))
+
+        submeshes = rebalance_submeshes(datas, numprocs,
+                                        domain.number_of_triangles,
+                                        domain.number_of_nodes)
+
+        new_domains = [create_rebalanced_domain(domains[p], *submeshes[p])
+                       for p in range(numprocs)]
+
+        wet = quantities['stage'][0] - quantities['elevation'][0] > \
+              domain.minimum_allowed_height
+        weights = num.where(wet, 1.0, 0.1)
+
+        # Every triangle has one new processor, and the loads are balanced
+        full_gids = []
+        loads = []
+        for p_domain in new_domains:
+            full = p_domain.tri_full_flag == 1
+            full_gids.extend(p_domain.tri_l2g[full])
+            loads.append(num.sum(weights[p_domain.tri_l2g[full]]))
+
+        assert sorted(full_gids) == range(domain.number_of_triangles)
+        assert max(loads) < 1.1*num.mean(loads)
+
+        for p, p_domain in enumerate(new_domains):
+            tri_l2g = p_domain.tri_l2g
+
+            assert p_domain.get_time() == 1.5
+            assert p_domain.get_global_name() == 'test_rebalance_submeshes'
+
+            # The same triangles and values, full and ghost
+            assert num.allclose(
+                p_domain.get_vertex_coordinates().reshape(-1,3,2),
+                vertex_coordinates[tri_l2g])
+
+            for name, (c, v, e) in quantities.items():
+                Q = p_domain.quantities[name]
+                assert num.all(Q.centroid_values == c[tri_l2g])
+                assert num.all(Q.vertex_values == v[tri_l2g])
+                assert num.all(Q.edge_values == e[tri_l2g])
+
+            for (t, e), tag in p_domain.boundary.items():
+                if p_domain.tri_full_flag[t] == 1:
+                    assert boundary[tri_l2g[t], e] == tag
+
+            # The ghosts received from q are the triangles sent by q
+            for q in p_domain.ghost_recv_dict:
+                ghost_ids = p_domain.ghost_recv_dict[q][0]
+                full_ids = new_domains[q].full_send_dict[p][0]
+                assert num.all(tri_l2g[ghost_ids] ==
+                               new_domains[q].tri_l2g[full_ids])
+
+    def test_rebalance(self):
+        """Rebalance a domain during a run, which should carry on as if
+        there was no rebalance, and store into the same sww file
+        """
+
+        name = 'test_rebalance'
+        self.filenames = [name + '.sww', name + '_seq.sww']
+
+        domain = create_domain(name + '_seq')
+        set_boundaries(domain)
+        for t in domain.evolve(yieldstep=0.25, finaltime=1.0):
+            pass
+        stage = domain.quantities['stage'].centroid_values.copy()
+
+        domain = create_domain(name)
+        partition = Sequential_distribute(domain)
+        partition.distribute(1)
+        kwargs, points, vertices, boundary, quantities = \
+                partition.extract_submesh(0)[:5]
+
+        p_domain = Parallel_domain(points, vertices, boundary, **kwargs)
+        p_domain.set_name(name)
+        p_domain.set_store_collective()
+        for q in quantities:
+            p_domain.set_quantity(q, quantities[q])
+        set_boundaries(p_domain)
+
+        for t in p_domain.evolve(yieldstep=0.25, finaltime=1.0):
+            if t == 0.5:
+                break
+
+        assert p_domain.get_load_imbalance() == 1.0
+
+        p_domain = p_domain.rebalance()
+        assert p_domain.get_time() == 0.5
+        set_boundaries(p_domain)
+
+        for t in p_domain.evolve(yieldstep=0.25, finaltime=1.0):
+            pass
+
+        tri_l2g = p_domain.tri_l2g
+        assert num.allclose(p_domain.quantities['stage'].centroid_values,
+                            stage[tri_l2g])
+
+        fid = NetCDFFile(name + '.sww')
+        assert num.allclose(fid.variables['time'][:], [0.0, 0.25, 0.5, 0.75, 1.0])
+        assert num.allclose(fid.variables['stage_c'][-1], stage)
+        fid.close()
+
+        # Checkpointing and the number of OpenMP threads are carried over
+        checkpoint_dir = tempfile.mkdtemp()
+        try:
+            p_domain.set_omp_num_threads(2)
+            p_domain.set_checkpointing(checkpoint_dir=checkpoint_dir,
+                                       checkpoint_step=2,
+                                       checkpoint_async=True,
+                                       checkpoint_full_step=3,
+                                       checkpoint_keep=4)
+
+            r_domain = p_domain.rebalance()
+
+            assert r_domain.get_omp_num_threads() == 2
+            assert r_domain.checkpoint
+            assert r_domain.checkpoint_dir == checkpoint_dir
+            assert r_domain.checkpoint_step == 2
+
+            writer = r_domain.checkpoint_writer
+            assert writer is not p_domain.checkpoint_writer
+            assert writer.store_async
+            assert writer.full_step == 3
+            assert writer.keep == 4
+
+            r_domain.set_checkpointing(False)
+        finally:
+            shutil.rmtree(checkpoint_dir)
+
+        # Per processor sww files can't be carried on
+        p_domain.set_store_collective(False)
+        self.assertRaises(Exception, p_domain.rebalance)
+
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(Test_Rebalance, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
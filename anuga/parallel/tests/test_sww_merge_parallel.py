@@ -0,0 +1,139 @@
+"""Test the merge of the sww files of a parallel run, with the
+partitions built and stored on a single processor
+"""
+
+import os
+import unittest
+
+import numpy as num
+
+import anuga
+from anuga.file.netcdf import NetCDFFile
+from anuga.parallel.parallel_shallow_water import Parallel_domain
+from anuga.parallel.sequential_distribute import Sequential_distribute
+from anuga.utilities.sww_merge import sww_merge_parallel
+
+
+def stage(t):
+
+    return lambda x, y: -x/3 + 0.1*t + y*t
+
+
+def store_partitions(name, numprocs, smooth, times):
+    """Store the sww files of the partitions of a domain, as a parallel
+    run on numprocs processors would
+    """
+
+    domain = anuga.rectangular_cross_domain(6, 4)
+    domain.set_name(name)
+    domain.set_store_vertices_uniquely(not smooth)
+    domain.set_quantity('elevation', lambda x, y: -x/3)
+
+    partition = Sequential_distribute(domain)
+    partition.distribute(numprocs)
+
+    for p in range(numprocs):
+        kwargs, points, vertices, boundary, quantities = \
+                            partition.extract_submesh(p)[:5]
+
+        p_domain = Parallel_domain(points, vertices, boundary, **kwargs)
+        p_domain.set_name(name)
+        p_domain.set_store_vertices_uniquely(not smooth)
+        for q in quantities:
+            p_domain.set_quantity(q, quantities[q])
+
+        p_domain.initialise_storage()
+        for t in times:
+            p_domain.set_time(t)
+            p_domain.set_quantity('stage', stage(t))
+            p_domain.store_timestep()
+        p_domain.writer.close()
+
+
+class Test_SWW_Merge_Parallel(unittest.TestCase):
+
+    def setUp(self):
+        self.filenames = []
+
+    def tearDown(self):
+        for filename in self.filenames:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def check_merge(self, smooth):
+
+        name = 'test_sww_merge_parallel'
+        numprocs = 3
+        times = [0.0, 1.0, 2.0, 3.0, 4.0]
+
+        self.filenames = [name + '_P%g_%g.sww' % (numprocs, p)
+                          for p in range(numprocs)]
+        self.filenames += [name + '.sww', name + '_blocks.sww']
+
+        store_partitions(name, numprocs, smooth, times)
+
+        # One block of frames in this process, then blocks of two
+        # frames merged by worker processes
+        sww_merge_parallel(name, numprocs)
+        os.rename(name + '.sww', name + '_blocks.sww')
+        sww_merge_parallel(name, numprocs, processes=2, frames_per_block=2)
+
+        fid = NetCDFFile(name + '.sww')
+        b_fid = NetCDFFile(name + '_blocks.sww')
+
+        assert fid.variables.keys() == b_fid.variables.keys()
+        for q in fid.variables:
+            assert num.allclose(fid.variables[q][:], b_fid.variables[q][:]), q
+
+        b_fid.close()
+
+        x = fid.variables['x'][:]
+        y = fid.variables['y'][:]
+        volumes = fid.variables['volumes'][:]
+
+        # Every triangle of the global mesh is merged
+        assert len(volumes) == 96
+        if smooth:
+            assert len(x) == 59
+        else:
+            assert len(x) == 3*96
+
+        areas = 0.5*abs((x[volumes[:,1]] - x[volumes[:,0]])*(y[volumes[:,2]] - y[volumes[:,0]])
+                        - (x[volumes[:,2]] - x[volumes[:,0]])*(y[volumes[:,1]] - y[volumes[:,0]]))
+        assert num.allclose(num.sum(areas), 1.0)
+
+        assert num.allclose(fid.variables['time'][:], times)
+        stages = fid.variables['stage'][:]
+
+        # Smooth vertex values are averaged at the nodes of each partition
+        if not smooth:
+            assert num.allclose(fid.variables['elevation'][:], -x/3)
+            for i, t in enumerate(times):
+                assert num.allclose(stages[i], stage(t)(x, y))
+
+        stage_range = fid.variables['stage_range'][:]
+        assert num.allclose(stage_range, [stages.min(), stages.max()])
+
+        fid.close()
+
+        # The partition files are kept
+        for filename in self.filenames[:numprocs]:
+            assert os.path.exists(filename)
+
+    def test_merge_smooth(self):
+
+        self.check_merge(smooth=True)
+
+    def test_merge_non_smooth(self):
+
+        self.check_merge(smooth=False)
+
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(Test_SWW_Merge_Parallel, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -125,6 +125,37 @@ class MeshQuadtree(Cell):
 
         return element_found, sigma[0], sigma[1], sigma[2], index
 
+    def search_points(self, points):
+        """
+        Find the triangles (elements) that the points are in.
+
+        Does the quadtree search of search_fast for all the points in C.
+
+        Inputs:
+            points:    The n x 2 array of points to test
+
+        Return:
+            k, sigma
+
+            where
+            k: Array of the indices of the triangles (-1 if not found)
+            sigma: n x 3 array of the interpolated values (-1 if not found)
+
+        """
+
+        if not hasattr(self, 'root'):
+            self.add_quad_tree()
+
+        points = num.ascontiguousarray(ensure_numeric(points, num.float))
+        points = points.reshape(-1, 2)
+
+        k = num.zeros(len(points), num.int)
+        sigma = num.zeros((len(points), 3), num.float)
+
+        fitsmooth.tree_search_points(self.root, points, k, sigma)
+
+        return k, sigma
+
     # PADARN NOTE: Only here to pass unit tests - does nothing.
     def set_last_triangle(self):
         pass
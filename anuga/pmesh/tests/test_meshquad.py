@@ -68,7 +68,36 @@ class Test_Quad(unittest.TestCase):
 
         #This was causing round off error
         Q = MeshQuadtree(mesh)
-        
+
+    def test_search_points(self):
+        """search_points finds the same triangles as search_fast
+        """
+
+        points = [[3, 7], [5, 7], [5, 5], [7, 7],
+                  [15, 15], [15, 30], [30, 10], [30, 30]]
+        vertices = [[1,0,2], [1,3,4], [1,2,3], [5,4,7], [4,6,7]]
+
+        mesh = Mesh(points, vertices)
+        Q = MeshQuadtree(mesh)
+
+        x = [[5.5, 5.5], [10, 10], [20, 25], [25, 12], [30, 10],
+             [0, 0], [100, 100]]
+
+        k, sigma = Q.search_points(x)
+
+        assert num.all(k[-2:] == -1)
+        for i, point in enumerate(x[:-2]):
+            found, s0, s1, s2, index = Q.search_fast(point)
+            assert found
+            assert k[i] == index
+            assert num.allclose(sigma[i], [s0, s1, s2])
+            assert num.allclose(sum(sigma[i]), 1.0)
+
+        # No points
+        k, sigma = Q.search_points(num.zeros((0, 2)))
+        assert k.shape == (0,)
+        assert sigma.shape == (0, 3)
+
     def NOtest_interpolate_one_point_many_triangles(self):
         # this test has 10 triangles that share the same vert.
         # If the number of points per cell in  a quad tree is less
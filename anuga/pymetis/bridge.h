@@ -1 +1,3 @@
 void bridge_partMeshNodal(int *, int *, idxtype *, int *, int *, int *, int *, idxtype *, idxtype *);
+void bridge_partGraphKway(int *, idxtype *, idxtype *, idxtype *, int *, int *, int *, int *, int *, idxtype *);
+void bridge_partGraphVKway(int *, idxtype *, idxtype *, idxtype *, int *, int *, int *, int *, int *, idxtype *);
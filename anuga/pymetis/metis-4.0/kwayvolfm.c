@@ -441,7 +441,9 @@ void Greedy_KWayVolBalance(CtrlType *ctrl, GraphType *graph, int nparts, float *
   perm = idxwspacemalloc(ctrl, nvtxs);
   moved = idxwspacemalloc(ctrl, nvtxs);
 
-  PQueueInit(ctrl, &queue, nvtxs, graph->adjwgtsum[idxamax(nvtxs, graph->adjwgtsum)]);
+  /* The volume gains are not bounded by the adjwgtsum, so use the heap
+   * based queue (anuga: the bucket queue was written out of bounds) */
+  PQueueInit(ctrl, &queue, nvtxs, PLUS_GAINSPAN+1);
 
   IFSET(ctrl->dbglvl, DBG_REFINE,
      printf("VolPart: [%5d %5d]-[%5d %5d], Balance: %3.2f, Nv-Nb[%5d %5d]. Cut: %5d, Vol: %5d [B]\n",
@@ -601,7 +603,9 @@ void Greedy_KWayVolBalanceMConn(CtrlType *ctrl, GraphType *graph, int nparts, fl
   perm = idxwspacemalloc(ctrl, nvtxs);
   moved = idxwspacemalloc(ctrl, nvtxs);
 
-  PQueueInit(ctrl, &queue, nvtxs, graph->adjwgtsum[idxamax(nvtxs, graph->adjwgtsum)]);
+  /* The volume gains are not bounded by the adjwgtsum, so use the heap
+   * based queue (anuga: the bucket queue was written out of bounds) */
+  PQueueInit(ctrl, &queue, nvtxs, PLUS_GAINSPAN+1);
 
   IFSET(ctrl->dbglvl, DBG_REFINE,
      printf("VolPart: [%5d %5d]-[%5d %5d], Balance: %3.2f, Nv-Nb[%5d %5d]. Cut: %5d, Vol: %5d [B]\n",
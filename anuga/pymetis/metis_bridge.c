@@ -4,6 +4,8 @@
 
 //#include <metis.h>
 
+#include <stddef.h>
+
 #include <defs.h>
 #include <struct.h>
 #include <macros.h>
@@ -14,3 +16,14 @@
 void bridge_partMeshNodal(int * ne, int * nn, idxtype * elmnts, int * etype, int * numflag, int * nparts, int * edgecut, idxtype * epart, idxtype * npart){
   METIS_PartMeshNodal(ne, nn, elmnts, etype, numflag, nparts, edgecut, epart, npart);
 }
+
+/* Partition a graph with vertex weights, minimising the edge cut */
+void bridge_partGraphKway(int * nvtxs, idxtype * xadj, idxtype * adjncy, idxtype * vwgt, int * wgtflag, int * numflag, int * nparts, int * options, int * edgecut, idxtype * part){
+  METIS_PartGraphKway(nvtxs, xadj, adjncy, vwgt, NULL, wgtflag, numflag, nparts, options, edgecut, part);
+}
+
+/* Partition a graph with vertex weights, minimising the total
+ * communication volume */
+void bridge_partGraphVKway(int * nvtxs, idxtype * xadj, idxtype * adjncy, idxtype * vwgt, int * wgtflag, int * numflag, int * nparts, int * options, int * volume, idxtype * part){
+  METIS_PartGraphVKway(nvtxs, xadj, adjncy, vwgt, NULL, wgtflag, numflag, nparts, options, volume, part);
+}
@@ -7,9 +7,11 @@ typedef int idxtype;
 #include "bridge.h"
 
 static PyObject * metis_partMeshNodal(PyObject *, PyObject *);
+static PyObject * metis_partGraphKway(PyObject *, PyObject *);
 
 static PyMethodDef methods[] = {
   {"partMeshNodal", metis_partMeshNodal, METH_VARARGS, "METIS_PartMeshNodal"},
+  {"partGraphKway", metis_partGraphKway, METH_VARARGS, "METIS_PartGraphKway and METIS_PartGraphVKway"},
   {NULL, NULL, 0, NULL}
 };
 
@@ -115,3 +117,89 @@ static PyObject * metis_partMeshNodal(PyObject * self, PyObject * args){
 
   return Py_BuildValue("iOO", edgecut, (PyObject *)epart_pyarr, (PyObject *)npart_pyarr);
 }
+
+/* Run the metis METIS_PartGraphKway or METIS_PartGraphVKway function
+ * expected args:
+ * xadj: offsets of the adjacency lists of the vertices (nvtxs+1 entries)
+ * adjncy: adjacency lists of the vertices
+ * vwgt: vertex weights, or None for uniform weights
+ * nparts: number of partitions
+ * volume: 0 to minimise the edge cut (METIS_PartGraphKway),
+ *         1 to minimise the total communication volume (METIS_PartGraphVKway)
+ * returns:
+ * objective: edge cut or communication volume of the partition
+ * part: partitioning of the vertices
+ */
+static PyObject * metis_partGraphKway(PyObject * self, PyObject * args){
+  int nvtxs;
+  int nparts;
+  int volume;
+  int objective;
+  int wgtflag;
+  int numflag = 0;
+  int options[5] = {0, 0, 0, 0, 0}; // Default options
+  npy_intp dims[1];
+
+  PyObject * xadj;
+  PyObject * adjncy;
+  PyObject * vwgt;
+  PyArrayObject * xadj_arr;
+  PyArrayObject * adjncy_arr;
+  PyArrayObject * vwgt_arr = NULL;
+  PyArrayObject * part_arr;
+
+  if(!PyArg_ParseTuple(args, "OOOii", &xadj, &adjncy, &vwgt, &nparts, &volume))
+    return NULL;
+
+  /* Convert to arrays of the metis idxtype */
+  xadj_arr = (PyArrayObject *) PyArray_ContiguousFromObject(xadj, PyArray_INT, 1, 1);
+  adjncy_arr = (PyArrayObject *) PyArray_ContiguousFromObject(adjncy, PyArray_INT, 1, 1);
+  if(vwgt != Py_None)
+    vwgt_arr = (PyArrayObject *) PyArray_ContiguousFromObject(vwgt, PyArray_INT, 1, 1);
+
+  if(!xadj_arr || !adjncy_arr || (vwgt != Py_None && !vwgt_arr)){
+    Py_XDECREF(xadj_arr);
+    Py_XDECREF(adjncy_arr);
+    Py_XDECREF(vwgt_arr);
+    return NULL;
+  }
+
+  nvtxs = PyArray_DIM(xadj_arr, 0) - 1;
+
+  if(vwgt_arr && PyArray_DIM(vwgt_arr, 0) != nvtxs){
+    PyErr_SetString(PyExc_ValueError, "partGraphKway: vwgt must have one weight per vertex");
+    Py_DECREF(xadj_arr);
+    Py_DECREF(adjncy_arr);
+    Py_DECREF(vwgt_arr);
+    return NULL;
+  }
+
+  /* 0: no weights, 2: weights on the vertices only */
+  wgtflag = vwgt_arr ? 2 : 0;
+
+  dims[0] = nvtxs;
+  part_arr = (PyArrayObject *) PyArray_SimpleNew(1, dims, PyArray_INT);
+  if(!part_arr){
+    Py_DECREF(xadj_arr);
+    Py_DECREF(adjncy_arr);
+    Py_XDECREF(vwgt_arr);
+    return NULL;
+  }
+
+  if(volume)
+    bridge_partGraphVKway(&nvtxs, (idxtype *) xadj_arr->data, (idxtype *) adjncy_arr->data,
+                          vwgt_arr ? (idxtype *) vwgt_arr->data : NULL,
+                          &wgtflag, &numflag, &nparts, options, &objective,
+                          (idxtype *) part_arr->data);
+  else
+    bridge_partGraphKway(&nvtxs, (idxtype *) xadj_arr->data, (idxtype *) adjncy_arr->data,
+                         vwgt_arr ? (idxtype *) vwgt_arr->data : NULL,
+                         &wgtflag, &numflag, &nparts, options, &objective,
+                         (idxtype *) part_arr->data);
+
+  Py_DECREF(xadj_arr);
+  Py_DECREF(adjncy_arr);
+  Py_XDECREF(vwgt_arr);
+
+  return Py_BuildValue("iN", objective, (PyObject *) part_arr);
+}
@@ -144,7 +144,37 @@ class TestMetis(unittest.TestCase):
             self.assert_(edgecut == 14)
             assert allclose(epart, epart_expected)
             assert allclose(npart, npart_expected)
-                
+
+    def test_partGraphKway(self):
+        # Dual graph of the hexagonal mesh
+        #
+        #   1---2
+        #  / \1/ \
+        # 6-0-0-2-3
+        #  \5/ \3/
+        #   5-4-4
+        #
+        # The triangles form a ring
+        xadj = array([0, 2, 4, 6, 8, 10, 12], 'i')
+        adjncy = array([5, 1, 0, 2, 1, 3, 2, 4, 3, 5, 4, 0], 'i')
+
+        # Two halves of the ring, cut at two edges, and so with four
+        # triangles next to the other half
+        for volume, expected in [(0, 2), (1, 4)]:
+            objective, part = metis.partGraphKway(xadj, adjncy, None, 2, volume)
+
+            assert sorted(part) == [0, 0, 0, 1, 1, 1]
+            assert objective == expected
+            assert part[0] != part[3]
+
+        # The weights of the triangles are balanced
+        vwgt = array([3, 1, 1, 1, 1, 1], 'i')
+        objective, part = metis.partGraphKway(xadj, adjncy, vwgt, 2, 0)
+        assert sum(vwgt[part == part[0]]) == 4
+
+        self.assertRaises(ValueError, metis.partGraphKway,
+                          xadj, adjncy, vwgt[:3], 2, 0)
+
 
 if __name__ == "__main__":
     suite = unittest.makeSuite(TestMetis,'test_')
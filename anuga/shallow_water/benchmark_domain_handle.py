@@ -0,0 +1,93 @@
+"""Benchmark the per call overhead of the DE kernels when passing the
+python domain (all arrays looked up by get_python_domain on every call)
+and when passing the cached C domain handle (see Domain.get_c_domain).
+
+The kernels are called repeatedly on a fixed state, alternating between
+the domain and the handle, and the median time per call over the repeats
+is reported. The cost of get_python_domain does not depend on the size of
+the mesh, so it is isolated on a 16 triangle mesh, where the work of the
+kernels is negligible. The 10000 triangle mesh shows it against the cost
+of the kernels. Run as
+
+    python benchmark_domain_handle.py
+"""
+
+import timeit
+
+import numpy as num
+import anuga
+
+from anuga.shallow_water.swDE1_domain_ext import protect_new
+from anuga.shallow_water.swDE1_domain_ext import extrapolate_second_order_edge_sw
+from anuga.shallow_water.swDE1_domain_ext import compute_fluxes_ext_central
+
+
+def create_domain(m=50, n=50):
+    """Rectangular cross domain with 4*m*n triangles
+    """
+
+    domain = anuga.rectangular_cross_domain(m, n, len1=1000., len2=1000.)
+    domain.set_flow_algorithm('DE1')
+    domain.set_store(False)
+
+    domain.set_quantity('elevation', lambda x,y: -x/100.)
+    domain.set_quantity('stage', lambda x,y: num.where(x < 500., 1.0, -x/100.))
+
+    Br = anuga.Reflective_boundary(domain)
+    domain.set_boundary({'left': Br, 'right': Br, 'top': Br, 'bottom': Br})
+
+    return domain
+
+
+def time_calls(f_domain, f_handle, number, repeat):
+    """Median time per call in microseconds of f_domain and of f_handle,
+    and the median of the differences, over repeat alternated runs of
+    number calls
+    """
+
+    t_domain = []
+    t_handle = []
+    for r in range(repeat):
+        t_domain.append(timeit.timeit(f_domain, number=number)/number*1.0e6)
+        t_handle.append(timeit.timeit(f_handle, number=number)/number*1.0e6)
+
+    t_domain = num.array(t_domain)
+    t_handle = num.array(t_handle)
+
+    return (num.median(t_domain), num.median(t_handle),
+            num.median(t_domain - t_handle))
+
+
+def benchmark(m, n, number, repeat=51):
+
+    domain = create_domain(m, n)
+    handle = domain.get_c_domain()
+    timestep = domain.evolve_max_timestep
+
+    print 'Number of triangles: %d (median of %d x %d calls)' \
+          % (len(domain), repeat, number)
+    print
+    print '%-35s %12s %12s %12s' % ('Kernel', 'domain (us)', 'handle (us)', 'saved (us)')
+
+    kernels = [('protect_new', lambda D: protect_new(D)),
+               ('extrapolate_second_order_edge_sw',
+                    lambda D: extrapolate_second_order_edge_sw(D)),
+               ('compute_fluxes_ext_central',
+                    lambda D: compute_fluxes_ext_central(D, timestep))]
+
+    for name, kernel in kernels:
+        # Bring the state to the fixed point of the kernel
+        kernel(domain)
+
+        t_domain, t_handle, saved = time_calls(lambda: kernel(domain),
+                                               lambda: kernel(handle),
+                                               number, repeat)
+
+        print '%-35s %12.2f %12.2f %12.2f' % (name, t_domain, t_handle, saved)
+
+    print
+
+
+if __name__ == '__main__':
+    benchmark(2, 2, number=2000)
+    benchmark(50, 50, number=50)
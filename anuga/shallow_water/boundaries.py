@@ -24,7 +24,7 @@ ModifiedBy:
 
 
 from anuga.abstract_2d_finite_volumes.generic_boundary_conditions\
-     import Boundary, File_boundary
+     import Boundary, File_boundary, Tabulated_time_boundary
 import numpy as num
 
 import anuga.utilities.log as log
@@ -207,6 +207,31 @@ class Transmissive_momentum_set_stage_boundary(Boundary):
         """
 
         q = self.domain.get_conserved_quantities(vol_id, edge = edge_id)
+
+        q[0] = self._get_stage()
+           
+        return q
+
+        # FIXME: Consider this (taken from File_boundary) to allow
+        # spatial variation
+        # if vol_id is not None and edge_id is not None:
+        #     i = self.boundary_indices[ vol_id, edge_id ]
+        #     return self.F(t, point_id = i)
+        # else:
+        #     return self.F(t)
+
+
+    def get_kernel_values(self, domain, segment_edges):
+        """[stage] for the C boundary kernel
+        """
+
+        return num.array([self._get_stage()], num.float)
+
+
+    def _get_stage(self):
+        """Stage at the current time
+        """
+
         t = self.domain.get_time()
 
         if hasattr(self.function, 'time'):
@@ -225,17 +250,7 @@ class Transmissive_momentum_set_stage_boundary(Boundary):
         except:
             x = float(value[0])
 
-        q[0] = x
-           
-        return q
-
-        # FIXME: Consider this (taken from File_boundary) to allow
-        # spatial variation
-        # if vol_id is not None and edge_id is not None:
-        #     i = self.boundary_indices[ vol_id, edge_id ]
-        #     return self.F(t, point_id = i)
-        # else:
-        #     return self.F(t)
+        return x
 
 
 class Transmissive_n_momentum_zero_t_momentum_set_stage_boundary(Boundary):
@@ -312,13 +327,7 @@ class Transmissive_n_momentum_zero_t_momentum_set_stage_boundary(Boundary):
         ## except:
         ##     x = float(value[0])
 
-        value = self.get_boundary_values()
-        try:
-            x = float(value)
-        except:
-            x = float(value[0])
-
-        q[0] = x
+        q[0] = self._get_stage()
 
         ndotq = (normal[0]*q[1] + normal[1]*q[2])
         q[1] = normal[0]*ndotq
@@ -347,11 +356,7 @@ class Transmissive_n_momentum_zero_t_momentum_set_stage_boundary(Boundary):
         n2  = Normals[vol_ids,2*edge_ids+1]
        
         # Call the boundary function which returns stage 
-        value = self.get_boundary_values()
-        try:
-            x = float(value)
-        except:
-            x = float(value[0])
+        x = self._get_stage()
        
         # Set stage 
         Stage.boundary_values[ids]  = x
@@ -365,6 +370,26 @@ class Transmissive_n_momentum_zero_t_momentum_set_stage_boundary(Boundary):
         Ymom.boundary_values[ids] = ndotq * n2
 
 
+    def get_kernel_values(self, domain, segment_edges):
+        """[stage] for the C boundary kernel
+        """
+
+        return num.array([self._get_stage()], num.float)
+
+
+    def _get_stage(self):
+        """Stage at the current time
+        """
+
+        value = self.get_boundary_values()
+        try:
+            x = float(value)
+        except:
+            x = float(value[0])
+
+        return x
+
+
 class Transmissive_stage_zero_momentum_boundary(Boundary):
     """Return same stage as those present in its neighbour volume.
     Set momentum to zero.
@@ -451,6 +476,7 @@ class Time_stage_zero_momentum_boundary(Boundary):
 
 
         self.f = function
+        self.function = function # Used by get_boundary_values
         self.domain = domain
 
     def __repr__(self):
@@ -484,6 +510,78 @@ class Time_stage_zero_momentum_boundary(Boundary):
         domain.quantities['ymomentum'].boundary_values[ids] = 0.0        
 
 
+    def get_kernel_values(self, domain, segment_edges):
+        """[stage, 0, 0] for the C boundary kernel
+        """
+
+        q_bdry = self.get_boundary_values()
+
+        try:
+            stage = float(q_bdry)
+        except:
+            # Default boundary
+            return None
+
+        return num.array([stage, 0.0, 0.0], num.float)
+
+
+
+class Tabulated_time_stage_zero_momentum_boundary(Tabulated_time_boundary):
+    """Time dependent boundary with the stage tabulated at a sequence of
+    times and linearly interpolated in between, and zero momentum.
+    As Time_stage_zero_momentum_boundary, without calling a function
+    during the evolve (see Tabulated_time_boundary).
+
+    Example:
+      B = Tabulated_time_stage_zero_momentum_boundary(domain,
+                        times=[0, 60, 3660, 3720], stages=[0, 2, 2, 0])
+
+      B = Tabulated_time_stage_zero_momentum_boundary(domain,
+                        function=lambda t: (60<t<3660)*2,
+                        times=num.arange(0, 3720, 1))
+    """
+
+    def __init__(self, domain=None,
+                 times=None,
+                 stages=None,
+                 function=None,
+                 default_boundary=None,
+                 verbose=False):
+
+        if domain is None:
+            raise Exception('You must specify a domain to '
+                            'Tabulated_time_stage_zero_momentum_boundary')
+
+        if times is None and hasattr(function, 'time'):
+            times = function.time
+
+        if stages is None and function is not None and times is not None:
+            try:
+                stages = [float(function(t)) for t in times]
+            except Exception, e:
+                msg = 'Function for tabulated time stage boundary could not '
+                msg += 'be executed:\n%s' %e
+                raise Exception(msg)
+
+        values = None
+        if stages is not None:
+            stages = num.array(stages, num.float)
+
+            msg = 'ERROR: Stages of a tabulated time stage boundary must be '
+            msg += 'a 1d list or array'
+            assert len(stages.shape) == 1, msg
+
+            values = num.zeros((len(stages), 3), num.float)
+            values[:,0] = stages
+
+        Tabulated_time_boundary.__init__(self, domain, times, values,
+                                         default_boundary=default_boundary,
+                                         verbose=verbose)
+
+    def __repr__(self):
+        return 'Tabulated_time_stage_zero_momentum_boundary'
+
+
 
 class Characteristic_stage_boundary(Boundary):
     """Sets the stage via a function and the momentum is determined 
@@ -694,6 +792,13 @@ class Dirichlet_discharge_boundary(Boundary):
         #     return self.F(t)
 
 
+    def get_kernel_values(self, domain, segment_edges):
+        """[stage0, wh0] for the C boundary kernel
+        """
+
+        return num.array([self.stage0, self.wh0], num.float)
+
+
 class Inflow_boundary(Boundary):
     """Apply given flow in m^3/s to boundary segment.
     Depth and momentum is derived using Manning's formula.
@@ -727,18 +832,7 @@ class Inflow_boundary(Boundary):
         
         # First find all segments having the same tag is vol_id, edge_id
         # This will be done the first time evaluate is called.
-        if self.tag is None:
-            boundary = self.domain.boundary
-            self.tag = boundary[(vol_id, edge_id)]        
-            
-            # Find total length of boundary with this tag
-            length = 0.0
-            for v_id, e_id in boundary:
-                if self.tag == boundary[(v_id, e_id)]:
-                    length += self.domain.mesh.get_edgelength(v_id, e_id)            
-
-            self.length = length
-            self.average_momentum = self.rate/length
+        self._set_average_momentum(vol_id, edge_id)
             
             
         # Average momentum has now been established across this boundary
@@ -756,19 +850,13 @@ class Inflow_boundary(Boundary):
         #             h = (mu n/sqrt(S) )^{3/5} 
         
         slope = 0 # get gradient for this triangle dot normal
-        epsilon = 1.0e-12
-        import math
         
         # get manning coef from this triangle
         friction = self.domain.get_quantity('friction').get_values(\
                     location='edges', indices=[vol_id])[0]
         mannings_n = friction[edge_id]
 
-        if slope > epsilon and mannings_n > epsilon:
-            depth = pow(self.average_momentum * mannings_n/math.sqrt(slope), \
-                        3.0/5) 
-        else:
-            depth = 1.0
+        depth = self._get_depth(slope, mannings_n)
             
         # Elevation on this edge    
         
@@ -781,6 +869,60 @@ class Inflow_boundary(Boundary):
         return q
 
 
+    def get_kernel_values(self, domain, segment_edges):
+        """[average_momentum, depth] for the C boundary kernel. As the
+        slope is 0 (see evaluate) the depth is the same at all edges.
+        """
+
+        if len(segment_edges) == 0:
+            return None
+
+        i = segment_edges[0]
+        self._set_average_momentum(domain.boundary_cells[i],
+                                   domain.boundary_edges[i])
+
+        return num.array([self.average_momentum, self._get_depth(0, 0.0)],
+                         num.float)
+
+
+    def _set_average_momentum(self, vol_id, edge_id):
+        """Find the tag of edge_id of vol_id, the total length of the
+        boundary with this tag and the average momentum across it
+        (only the first time)
+        """
+
+        if self.tag is not None:
+            return
+
+        boundary = self.domain.boundary
+        self.tag = boundary[(vol_id, edge_id)]        
+        
+        # Find total length of boundary with this tag
+        length = 0.0
+        for v_id, e_id in boundary:
+            if self.tag == boundary[(v_id, e_id)]:
+                length += self.domain.mesh.get_edgelength(v_id, e_id)            
+
+        self.length = length
+        self.average_momentum = self.rate/length
+
+
+    def _get_depth(self, slope, mannings_n):
+        """Depth from Manning's formula (see evaluate)
+        """
+
+        epsilon = 1.0e-12
+        import math
+
+        if slope > epsilon and mannings_n > epsilon:
+            depth = pow(self.average_momentum * mannings_n/math.sqrt(slope), \
+                        3.0/5) 
+        else:
+            depth = 1.0
+
+        return depth
+
+
         
     
             
@@ -811,7 +953,8 @@ class Field_boundary(Boundary):
                  boundary_polygon=None,
                  default_boundary=None,
                  use_cache=False,
-                 verbose=False):
+                 verbose=False,
+                 time_window=None):
         """Constructor
 
         filename: Name of sww file containing stage and x/ymomentum
@@ -839,6 +982,8 @@ class Field_boundary(Boundary):
         boundary_polygon: 
         use_cache:        True if caching is to be used.
         verbose:          True if this method is to be verbose.
+        time_window:      Number of timesteps of the sww file kept in
+                          memory, None to read all of them up front.
 
         """
 
@@ -850,7 +995,8 @@ class Field_boundary(Boundary):
                                            boundary_polygon=boundary_polygon,
                                            default_boundary=default_boundary,
                                            use_cache=use_cache,
-                                           verbose=verbose)
+                                           verbose=verbose,
+                                           time_window=time_window)
 
         # Record information from File_boundary
         self.F = self.file_boundary.F
@@ -882,6 +1028,30 @@ class Field_boundary(Boundary):
         return q
 
 
+    def evaluate_segment(self, domain, segment_edges):
+        """Set the boundary values of the edges in segment_edges with
+        the vectorised File_boundary.evaluate_segment, and adjust stage
+        by mean_stage
+        """
+
+        if segment_edges is None:
+            return
+        if domain is None:
+            return
+
+        if len(domain.evolved_quantities) != len(domain.conserved_quantities):
+            # The evolved quantities are computed edge by edge
+            Boundary.evaluate_segment(self, domain, segment_edges)
+            return
+
+        self.file_boundary.evaluate_segment(domain, segment_edges)
+
+        # Adjust stage, including values from the default boundary
+        if 'stage' in domain.conserved_quantities:
+            Stage = domain.quantities['stage']
+            Stage.boundary_values[segment_edges] += self.mean_stage
+
+
 
 
 
@@ -970,13 +1140,7 @@ class Flather_external_stage_zero_velocity_boundary(Boundary):
         normal = self.domain.get_normal(vol_id, edge_id)
 
 
-        t = self.domain.get_time()
-
-        value = self.function(t)
-        try:
-            stage_outside = float(value)
-        except:
-            stage_outside = float(value[0])
+        stage_outside = self._get_stage_outside()
 
         if(depth_inside==0.):
             q[0] = stage_outside
@@ -1053,12 +1217,7 @@ class Flather_external_stage_zero_velocity_boundary(Boundary):
         n2  = Normals[vol_ids,2*edge_ids+1]
    
         # Get stage value 
-        t = self.domain.get_time()
-        value = self.function(t)
-        try:
-            stage_outside = float(value)
-        except:
-            stage_outside = float(value[0])
+        stage_outside = self._get_stage_outside()
 
         # Transfer these quantities to the boundary array
         Stage.boundary_values[ids] = Stage.edge_values[vol_ids,edge_ids]
@@ -1121,3 +1280,24 @@ class Flather_external_stage_zero_velocity_boundary(Boundary):
 
 
         
+
+
+    def get_kernel_values(self, domain, segment_edges):
+        """[stage_outside, gravity] for the C boundary kernel
+        """
+
+        return num.array([self._get_stage_outside(), gravity], num.float)
+
+
+    def _get_stage_outside(self):
+        """External stage at the current time
+        """
+
+        t = self.domain.get_time()
+        value = self.function(t)
+        try:
+            stage_outside = float(value)
+        except:
+            stage_outside = float(value[0])
+
+        return stage_outside
@@ -9,28 +9,524 @@ checkpoint_step: the number of yieldsteps between saving a checkpoint file
 checkpoint_dir: the name of the directory where teh checkpoint files are stored. 
 
 
-But if we are restarting a calculation there is no domain yet available, so we must 
-read in the last stored domain. Do that via
+The checkpoint files store only the state of the domain (the quantity
+values, the model time and stepping counters and the state of the
+operators) as raw binary arrays. To restart a calculation build the domain
+as usual (mesh, quantities, boundaries and operators) and then read in the
+last stored state. Do that via
 
-domain = load_last_checkpoint_file(domain_name, checkpoint_dir)
+domain = load_checkpoint_file(domain_name, checkpoint_dir, domain=domain)
 
+Old checkpoint files holding a pickled domain can still be read in via
+
+domain = load_checkpoint_file(domain_name, checkpoint_dir)
+
+Layout of a checkpoint file: the magic string, the length of the header,
+the pickled header (format version, scalar state and the dtype, shape,
+offset, size and encoding of each array) and then the arrays, each aligned
+to checkpoint_alignment bytes so the raw ones can be memory mapped.
+
+A checkpoint can also be stored as a delta against the last full
+checkpoint (its base): the arrays are stored as the zlib compressed
+bitwise XOR with the arrays of the base, which is mostly zeros where the
+domain has not changed. The Checkpoint_writer of the domain decides
+which checkpoints are full, writes them from a background thread if
+asked to, and removes old checkpoints. See Domain.set_checkpointing.
 """
 
+import os
+import struct
+import cPickle
+import zlib
+import atexit
+import weakref
+
+import numpy as num
+
 from anuga import send, receive, myid, numprocs, barrier
 from time import time as walltime
 
 
+checkpoint_magic = 'ANUGACHK'
+checkpoint_version = 2
+checkpoint_alignment = 64
+checkpoint_extension = '.checkpoint'
+
+# Scalar state of the domain stored in a checkpoint
+checkpoint_attributes = ['time', 'starttime', 'evolve_starttime',
+                         'evolved_called', 'yieldstep_id', 'timestep',
+                         'number_of_steps', 'number_of_first_order_steps',
+                         'recorded_min_timestep', 'recorded_max_timestep',
+                         'fractional_step_volume_integral']
+
+# Array state of the domain, other than the quantities, stored in a checkpoint
+checkpoint_arrays = ['boundary_flux_sum']
+
+
+def get_checkpoint_state(domain):
+    """Scalar and array state of a domain, the arrays are not copied
+    """
+
+    scalars = {}
+    for name in checkpoint_attributes:
+        if hasattr(domain, name):
+            scalars[name] = getattr(domain, name)
+
+    arrays = {}
+    for name in checkpoint_arrays:
+        if hasattr(domain, name):
+            arrays[name] = getattr(domain, name)
+
+    for name, Q in domain.quantities.items():
+        arrays['quantities/%s/centroid_values' % name] = Q.centroid_values
+        arrays['quantities/%s/vertex_values' % name] = Q.vertex_values
+        arrays['quantities/%s/edge_values' % name] = Q.edge_values
+
+    for i, operator in enumerate(domain.fractional_step_operators):
+        for name, value in operator.get_checkpoint_state().items():
+            arrays['operators/%d/%s' % (i, name)] = num.asarray(value)
+
+    return scalars, arrays
+
+
+def write_checkpoint_file(domain, filename):
+    """Write the state of domain to the binary checkpoint file filename.
+
+    The file is written under a temporary name and then renamed, so an
+    interrupted write never leaves a partial checkpoint file.
+    """
+
+    scalars, arrays = get_checkpoint_state(domain)
+
+    _write_checkpoint_arrays(filename, scalars, arrays)
+
+
+def _write_checkpoint_arrays(filename, scalars, arrays, base=None):
+    """Write a checkpoint file. If base is given as the filename and
+    the arrays of a full checkpoint, the arrays which match those of
+    the base are stored as a delta against them.
+    """
+
+    if base is None:
+        base_name, base_arrays = None, {}
+    else:
+        base_name, base_arrays = os.path.basename(base[0]), base[1]
+
+    # The data of each array, and its offset from the start of the data
+    # which follows the header
+    entries = []
+    data = []
+    offset = 0
+    for name in sorted(arrays.keys()):
+        values = num.ascontiguousarray(arrays[name])
+
+        base_values = base_arrays.get(name, None)
+        if base_values is not None and base_values.dtype == values.dtype \
+                and base_values.shape == values.shape:
+            encoding = 'xor-zlib'
+            values = zlib.compress((values.view(num.uint8) ^
+                                    base_values.view(num.uint8)).tostring(), 1)
+            nbytes = len(values)
+        else:
+            encoding = None
+            nbytes = values.nbytes
+
+        offset = _aligned(offset)
+        entries.append((name, arrays[name].dtype.str, arrays[name].shape,
+                        offset, nbytes, encoding))
+        data.append(values)
+        offset += nbytes
+
+    header = cPickle.dumps({'version' : checkpoint_version,
+                            'base' : base_name,
+                            'scalars' : scalars,
+                            'arrays' : entries}, 2)
+
+    data_start = _aligned(len(checkpoint_magic) + 8 + len(header))
+
+    tmp_filename = filename + '.tmp'
+    fid = open(tmp_filename, 'wb')
+    fid.write(checkpoint_magic)
+    fid.write(struct.pack('<Q', len(header)))
+    fid.write(header)
+
+    for entry, values in zip(entries, data):
+        fid.write('\0'*(data_start + entry[3] - fid.tell()))
+        if entry[5] is None:
+            values.tofile(fid)
+        else:
+            fid.write(values)
+
+    fid.close()
+
+    os.rename(tmp_filename, filename)
+
+
+def _aligned(offset):
+
+    return ((offset + checkpoint_alignment - 1)//checkpoint_alignment)*checkpoint_alignment
+
+
+def _read_checkpoint_header(filename):
+    """Header of a checkpoint file, and the offset of its data
+    """
+
+    fid = open(filename, 'rb')
+    magic = fid.read(len(checkpoint_magic))
+    if magic != checkpoint_magic:
+        fid.close()
+        msg = 'File %s is not a checkpoint file' % filename
+        raise Exception(msg)
+
+    header_size = struct.unpack('<Q', fid.read(8))[0]
+    header = cPickle.loads(fid.read(header_size))
+    fid.close()
+
+    if header['version'] > checkpoint_version:
+        msg = 'Checkpoint file %s has version %d, only versions up to %d ' \
+              'can be read' % (filename, header['version'], checkpoint_version)
+        raise Exception(msg)
+
+    # Version 1 files are always full checkpoints
+    if header['version'] == 1:
+        header['base'] = None
+        header['arrays'] = [(name, dtype, shape, offset, None, None)
+                            for name, dtype, shape, offset in header['arrays']]
+
+    data_start = _aligned(len(checkpoint_magic) + 8 + header_size)
+
+    return header, data_start
+
+
+def read_checkpoint_file(filename, mmap_mode='r'):
+    """Read a binary checkpoint file.
+
+    Return the scalar state as a dictionary and the array state as a
+    dictionary of arrays. The arrays of a full checkpoint are memory
+    mapped from the file (with mmap_mode, see numpy.memmap), so no data
+    is read until it is used. The arrays of a delta checkpoint are
+    decoded against its base checkpoint, which must be in the same
+    directory.
+    """
+
+    header, data_start = _read_checkpoint_header(filename)
+
+    if header['base'] is not None:
+        base_filename = os.path.join(os.path.dirname(filename), header['base'])
+        _, base_arrays = read_checkpoint_file(base_filename)
+
+    arrays = {}
+    for name, dtype, shape, offset, nbytes, encoding in header['arrays']:
+        if encoding == 'xor-zlib':
+            fid = open(filename, 'rb')
+            fid.seek(data_start + offset)
+            values = num.frombuffer(zlib.decompress(fid.read(nbytes)), num.uint8)
+            fid.close()
+
+            base_values = num.ascontiguousarray(base_arrays[name])
+            arrays[name] = (values ^ base_values.view(num.uint8).reshape(-1)).view(dtype).reshape(shape)
+        elif encoding is not None:
+            msg = 'Unknown encoding %s of array %s in checkpoint file %s' \
+                  % (encoding, name, filename)
+            raise Exception(msg)
+        elif num.prod(shape) == 0:
+            arrays[name] = num.zeros(shape, dtype)
+        else:
+            arrays[name] = num.memmap(filename, dtype=dtype, mode=mmap_mode,
+                                      offset=data_start+offset, shape=shape)
+
+    return header['scalars'], arrays
+
+
+def _close_checkpoint_writer(ref):
+    """Close the writer thread of a Checkpoint_writer, if still alive
+    """
+
+    writer = ref()
+    if writer is not None:
+        writer.close()
+
+
+class Checkpoint_writer:
+    """Writes the checkpoint files of a domain into checkpoint_dir.
+
+    Every full_step'th checkpoint is full, the others are stored as deltas
+    against the last full one. If keep is given only the last keep
+    checkpoints of the domain (and the full checkpoints they are based on)
+    are kept in checkpoint_dir.
+    """
+
+    def __init__(self, checkpoint_dir, full_step=1, keep=None):
+
+        msg = 'full_step must be a positive integer'
+        assert full_step >= 1, msg
+
+        msg = 'keep must be None or a positive integer'
+        assert keep is None or keep >= 1, msg
+
+        self.checkpoint_dir = checkpoint_dir
+        self.full_step = full_step
+        self.keep = keep
+
+        self.number_of_checkpoints = 0
+        self.base = None
+
+        self.thread = None
+        self.async_error = None
+        self.set_async(False)
+
+        # Write out the queue if evolve is not run to the end
+        atexit.register(_close_checkpoint_writer, weakref.ref(self))
+
+
+    def set_async(self, flag=True, queue_size=1):
+        """Write the checkpoints from a background thread.
+
+        save copies the state into a queue of at most queue_size
+        snapshots, and blocks while the queue is full. Call flush to
+        wait until the queued checkpoints are written, and close to also
+        stop the thread.
+        """
+
+        if not flag:
+            self.close()
 
-def load_checkpoint_file(domain_name = 'domain', checkpoint_dir = '.', time = None):
+        self.store_async = flag
+        self.queue_size = queue_size
+
+
+    def get_filename(self, domain):
+
+        return os.path.join(self.checkpoint_dir, domain.get_name()) + \
+               '_' + str(domain.get_time()) + checkpoint_extension
+
+
+    def save(self, domain):
+        """Save a checkpoint of domain, and return its filename
+        """
+
+        filename = self.get_filename(domain)
+
+        scalars, arrays = get_checkpoint_state(domain)
+
+        if self.store_async:
+            self._check_async_error()
+
+            if self.thread is None:
+                self._start_writer_thread()
+
+            # Snapshot of the state, the domain carries on evolving
+            for name in arrays:
+                arrays[name] = num.array(arrays[name])
+
+            self.queue.put((domain.get_name(), filename, scalars, arrays))
+        else:
+            self.write(domain.get_name(), filename, scalars, arrays)
+
+        return filename
+
+
+    def write(self, domain_name, filename, scalars, arrays):
+        """Write a checkpoint file, as a delta unless it is time for a
+        full one, and remove the old checkpoints
+        """
+
+        if self.number_of_checkpoints % self.full_step == 0:
+            _write_checkpoint_arrays(filename, scalars, arrays)
+
+            if self.full_step > 1:
+                self.base = (filename, read_checkpoint_file(filename)[1])
+        else:
+            _write_checkpoint_arrays(filename, scalars, arrays, base=self.base)
+
+        self.number_of_checkpoints += 1
+
+        if self.keep is not None:
+            self.remove_old_checkpoints(domain_name)
+
+
+    def remove_old_checkpoints(self, domain_name):
+        """Remove all but the last keep checkpoints of domain_name, and
+        the full checkpoints they are based on
+        """
+
+        checkpoints = []
+        for filename in os.listdir(self.checkpoint_dir):
+            filebase, extension = os.path.splitext(filename)
+            name, _, time = filebase.rpartition('_')
+            if extension == checkpoint_extension and name == domain_name:
+                checkpoints.append((float(time), filename))
+
+        checkpoints.sort()
+
+        kept = set()
+        for time, filename in checkpoints[-self.keep:]:
+            kept.add(filename)
+            header, _ = _read_checkpoint_header(os.path.join(self.checkpoint_dir, filename))
+            if header['base'] is not None:
+                kept.add(header['base'])
+
+        for time, filename in checkpoints:
+            if filename not in kept:
+                os.remove(os.path.join(self.checkpoint_dir, filename))
+
+
+    def _start_writer_thread(self):
+
+        import Queue
+        import threading
+
+        self.queue = Queue.Queue(maxsize=self.queue_size)
+        self.async_error = None
+
+        self.thread = threading.Thread(target=self._write_queued_checkpoints,
+                                       name='Checkpoint writer %s' % self.checkpoint_dir)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def _write_queued_checkpoints(self):
+        """Body of the writer thread. None in the queue stops the thread.
+        After an error the remaining checkpoints are discarded, and the
+        error is raised in the main thread.
+        """
+
+        while True:
+            data = self.queue.get()
+            try:
+                if data is None:
+                    break
+
+                if self.async_error is None:
+                    self.write(*data)
+            except Exception, e:
+                self.async_error = e
+            finally:
+                self.queue.task_done()
+
+
+    def _check_async_error(self):
+
+        if self.async_error is not None:
+            error = self.async_error
+            self.async_error = None
+            msg = 'Asynchronous write of checkpoint failed: %s' % error
+            raise Exception(msg)
+
+
+    def flush(self):
+        """Wait until all queued checkpoints are written
+        """
+
+        if self.thread is not None:
+            self.queue.join()
+
+        self._check_async_error()
+
+
+    def close(self):
+        """Write the queued checkpoints and stop the writer thread. It is
+        restarted by the next save.
+        """
+
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+        self._check_async_error()
+
+
+    def __getstate__(self):
+        """Make sure the checkpoints are written, and leave out the
+        writer thread and the memory mapped base, eg when pickling the
+        domain
+        """
+
+        self.flush()
+
+        state = self.__dict__.copy()
+        state['thread'] = None
+        state['queue'] = None
+        state['base'] = None
+
+        # The next checkpoint is full, without the base
+        state['number_of_checkpoints'] = 0
+
+        return state
+
+
+def restore_checkpoint(domain, filename):
+    """Restore the state of domain from the binary checkpoint file filename.
+
+    The domain must have been built as in the run that stored the
+    checkpoint. The values are copied straight from the memory mapped file
+    into the existing arrays of the domain, which are referenced by the
+    operators and the C code. Nothing is changed if the file does not
+    match the domain.
+    """
+
+    scalars, arrays = read_checkpoint_file(filename)
+
+    # Check everything before changing anything
+    copies = []
+    for name, Q in domain.quantities.items():
+        for location in ['centroid_values', 'vertex_values', 'edge_values']:
+            key = 'quantities/%s/%s' % (name, location)
+            if key not in arrays:
+                msg = 'Quantity %s is not stored in checkpoint file %s' \
+                      % (name, filename)
+                raise Exception(msg)
+
+            copies.append((getattr(Q, location), arrays[key], key))
+
+    for name in checkpoint_arrays:
+        if name in arrays:
+            copies.append((getattr(domain, name), arrays[name], name))
+
+    for target, source, name in copies:
+        if target.shape != source.shape:
+            msg = 'Array %s in checkpoint file %s has shape %s, the domain ' \
+                  'has shape %s' % (name, filename, source.shape, target.shape)
+            raise Exception(msg)
+
+    for target, source, name in copies:
+        target[:] = source
+
+    for i, operator in enumerate(domain.fractional_step_operators):
+        prefix = 'operators/%d/' % i
+        state = {}
+        for key in arrays:
+            if key.startswith(prefix):
+                state[key[len(prefix):]] = num.array(arrays[key])
+        operator.set_checkpoint_state(state)
+
+    for name, value in scalars.items():
+        setattr(domain, name, value)
+
+
+def load_checkpoint_file(domain_name = 'domain', checkpoint_dir = '.', time = None,
+                         domain = None):
+    """Restart from the last checkpoint (or the one at time) of domain_name.
+
+    If domain is given, its state is restored from a binary checkpoint file
+    and domain is returned. Otherwise a domain pickled by an older version
+    of anuga is read in.
+    """
     
     from os.path import join
 
     if numprocs > 1:
         domain_name = domain_name+'_P{}_{}'.format(numprocs,myid)
+
+    if domain is None:
+        extension = '.pickle'
+    else:
+        extension = checkpoint_extension
             
     if time is None:
         # will pull out the last available time
-        times = _get_checkpoint_times(domain_name, checkpoint_dir)
+        times = _get_checkpoint_times(domain_name, checkpoint_dir, extension)
 
         times = list(times)
         times.sort()
@@ -42,12 +538,14 @@ def load_checkpoint_file(domain_name = 'domain', checkpoint_dir = '.', time = No
     
     for time in reversed(times):
         
-        pickle_name = join(checkpoint_dir,domain_name)+'_'+str(time)+'.pickle'
-        #print pickle_name
+        filename = join(checkpoint_dir,domain_name)+'_'+str(time)+extension
+        #print filename
         
         try:
-            import cPickle
-            domain = cPickle.load(open(pickle_name, 'rb'))
+            if extension == checkpoint_extension:
+                restore_checkpoint(domain, filename)
+            else:
+                domain = cPickle.load(open(filename, 'rb'))
             success = True
         except:
             success = False
@@ -74,13 +572,17 @@ def load_checkpoint_file(domain_name = 'domain', checkpoint_dir = '.', time = No
     domain.communication_time = 0.0
     domain.communication_reduce_time = 0.0
     domain.communication_broadcast_time = 0.0
+    domain.reductions_current = False
+
+    # Carry on storing into the existing sww file
+    if extension == checkpoint_extension and domain.store is True:
+        domain.initialise_storage(mode='a')
     
     return domain
 
 
-def _get_checkpoint_times(domain_name, checkpoint_dir):
+def _get_checkpoint_times(domain_name, checkpoint_dir, extension=None):
 
-    import os
     times = set()
     
     for (path, directory, filenames) in os.walk(checkpoint_dir):
@@ -91,6 +593,9 @@ def _get_checkpoint_times(domain_name, checkpoint_dir):
             return None
         else:          
             for filename in filenames:
+                if extension is not None and \
+                       os.path.splitext(filename)[1] != extension:
+                    continue
                 filebase = os.path.splitext(filename)[0].rpartition("_")
                 time = filebase[-1]
                 domain_name_base = filebase[0]
@@ -26,9 +26,17 @@ def configuration(parent_package='',top_path=None):
                          sources=['swb2_domain_ext.c'],
                          include_dirs=[util_dir])
 
+    if sys.platform == 'darwin':
+        extra_args = None
+    else:
+        extra_args = ['-fopenmp']
+
     config.add_extension('swDE1_domain_ext',
                          sources=['swDE1_domain_ext.c'],
-                         include_dirs=[util_dir])
+                         depends=['sw_domain.h', 'sw_boundaries.h'],
+                         include_dirs=[util_dir],
+                         extra_compile_args=extra_args,
+                         extra_link_args=extra_args)
 
 
     return config
@@ -244,6 +244,8 @@ class Domain(Generic_Domain):
         # Stored output
         #-------------------------------
         self.set_store(True)
+        self.set_store_async(False)
+        self.set_store_sync_interval(1)
         self.set_store_centroids(True)
         self.set_store_vertices_uniquely(False)
         self.quantities_to_be_stored = {'elevation': 1, 
@@ -259,6 +261,7 @@ class Domain(Generic_Domain):
         self.checkpoint = False
         self.yieldstep_id = 1 
         self.checkpoint_step = 10
+        self.checkpoint_writer = None
         
         #-------------------------------
         # Useful auxiliary quantity
@@ -277,6 +280,11 @@ class Domain(Generic_Domain):
         #                   etc
         self.edge_flux_type=num.zeros(len(self.edge_coordinates[:,0])).astype(int)
 
+        # Number of riverwall edges up to and including each edge, so that
+        # edge ki is riverwall number edge_river_wall_counter[ki]-1. Used by
+        # the (threaded) DE flux computation. Updated by create_riverwalls
+        self.edge_river_wall_counter=num.zeros(len(self.edge_coordinates[:,0])).astype(int)
+
         # Riverwalls -- initialise with dummy values
         # Presently only works with DE algorithms, will fail otherwise
         import anuga.structures.riverwall
@@ -326,6 +334,10 @@ class Domain(Generic_Domain):
         # extrapolation/flux updating is used) 
         self.allow_timestep_increase=num.zeros(1).astype(int)+1
 
+        # Evolve the DE algorithms with a single call to C per timestep
+        # (see set_fused_evolve)
+        self.fused_evolve = False
+
     def _set_config_defaults(self):
         """Set the default values in this routine. That way we can inherit class
         and just redefine the defaults for the new class
@@ -1042,6 +1054,44 @@ class Domain(Generic_Domain):
         return self.store
 
 
+    def set_store_async(self, flag=True, queue_size=4):
+        """Set whether the sww file is written from a background thread,
+        so that evolve does not wait for the file. At most queue_size
+        timesteps are held in memory waiting to be written. The file is
+        flushed after the final yield of evolve.
+        """
+
+        self.store_async = flag
+        self.store_async_queue_size = queue_size
+
+        if hasattr(self, 'writer'):
+            self.writer.set_async(flag, queue_size)
+
+    def get_store_async(self):
+        """Get whether the sww file is written from a background thread.
+        """
+
+        return self.store_async
+
+
+    def set_store_sync_interval(self, interval=1):
+        """Set the number of stored timesteps between syncs of the sww
+        file, which is kept open while evolving. The file is always
+        synced and closed after the final yield of evolve.
+        """
+
+        self.store_sync_interval = interval
+
+        if hasattr(self, 'writer'):
+            self.writer.sync_interval = interval
+
+    def get_store_sync_interval(self):
+        """Get the number of stored timesteps between syncs of the sww file.
+        """
+
+        return self.store_sync_interval
+
+
     def set_store_centroids(self, flag=True):
         """Set whether centroid data is saved to sww file.
         """
@@ -1054,7 +1104,8 @@ class Domain(Generic_Domain):
         
         return self.store_centroids   
     
-    def set_checkpointing(self, checkpoint= True, checkpoint_dir = 'CHECKPOINTS', checkpoint_step=10, checkpoint_time = None):
+    def set_checkpointing(self, checkpoint= True, checkpoint_dir = 'CHECKPOINTS', checkpoint_step=10, checkpoint_time = None,
+                          checkpoint_async = False, checkpoint_full_step = 1, checkpoint_keep = None):
         """
         Set up checkpointing.
         
@@ -1063,6 +1114,11 @@ class Domain(Generic_Domain):
         @param checkpoint_step: Save checkpoint files after this many yieldsteps
         @param checkpoint_time: If set, over-rides checkpoint_step. save checkpoint files
                         after this amount of walltime
+        @param checkpoint_async: Write the checkpoint files from a background thread,
+                        the evolution carries on from a snapshot of the state
+        @param checkpoint_full_step: Every checkpoint_full_step'th checkpoint is full,
+                        the others are stored as compressed deltas against the last full one
+        @param checkpoint_keep: If set, only keep this many of the last checkpoint files
         """
         
         
@@ -1083,9 +1139,35 @@ class Domain(Generic_Domain):
                 self.checkpoint_step = checkpoint_step
             self.checkpoint = True
             #print self.checkpoint_dir, self.checkpoint_step
+
+            from anuga.shallow_water.checkpoint import Checkpoint_writer
+
+            if self.checkpoint_writer is not None:
+                self.checkpoint_writer.close()
+
+            self.checkpoint_writer = Checkpoint_writer(checkpoint_dir,
+                                                       full_step=checkpoint_full_step,
+                                                       keep=checkpoint_keep)
+            self.checkpoint_writer.set_async(checkpoint_async)
         else:
             self.checkpoint = False
+
+            if self.checkpoint_writer is not None:
+                self.checkpoint_writer.close()
         
+    def save_checkpoint(self):
+        """Save the state of the domain to a binary checkpoint file in
+        the checkpoint directory, named by the domain name and time.
+        Return the name of the file.
+
+        See set_checkpointing and anuga.shallow_water.checkpoint
+        """
+
+        msg = 'Call set_checkpointing before saving checkpoints'
+        assert self.checkpoint_writer is not None, msg
+
+        return self.checkpoint_writer.save(self)
+
     def set_sloped_mannings_function(self, flag=True):
         """Set mannings friction function to use the sloped
         wetted area.
@@ -1143,6 +1225,149 @@ class Domain(Generic_Domain):
                 raise Exception, 'Local extrapolation and flux updating only supported for discontinuous flow algorithms'
 
 
+    def set_omp_num_threads(self, n=1):
+        """Set the number of OpenMP threads used by the DE algorithms
+        for computing fluxes, extrapolating to edges and protecting
+        against negative heights.
+
+        The threaded kernels give the same results as the serial kernels.
+        Once set, timestepping_statistics also reports the time spent
+        in these kernels, which can be used to check the scaling.
+        """
+
+        from swDE1_domain_ext import openmp_enabled
+
+        n = int(n)
+        if n < 1:
+            msg = 'Number of OpenMP threads must be positive, got %d' % n
+            raise Exception(msg)
+
+        if n > 1 and not openmp_enabled():
+            import warnings
+            msg = 'swDE1_domain_ext was compiled without OpenMP support, '
+            msg += 'the DE kernels will run on a single thread'
+            warnings.warn(msg)
+
+        self.omp_num_threads = n
+        self.report_kernel_walltime = True
+
+
+    def get_omp_num_threads(self):
+        """Get the number of OpenMP threads used by the DE kernels.
+        """
+
+        return self.omp_num_threads
+
+
+    def set_fused_evolve(self, flag=True):
+        """Evolve the DE algorithms with a single call to swDE1_domain_ext
+        per euler, rk2 or rk3 timestep rather than one call per kernel.
+
+        Reflective, Dirichlet and Transmissive boundaries and manning
+        friction are evaluated in C, all other boundaries and forcing terms
+        are called back from C. The results are the same as those of the
+        unfused timestepping.
+        """
+
+        if flag:
+            self.fused_evolve = True
+        else:
+            self.fused_evolve = False
+
+
+    def get_fused_evolve(self):
+        """Get flag indicating whether the fused C timestepping is used.
+        """
+
+        return self.fused_evolve
+
+
+    def get_c_domain(self):
+        """Get the handle of the C structure of this domain used by the DE
+        kernels, creating it if necessary.
+
+        Passing the handle rather than the domain saves looking up all the
+        arrays on every call. See Generic_Domain.invalidate_c_domain.
+        """
+
+        if self.c_domain is None:
+            from swDE1_domain_ext import domain_handle
+            self.c_domain = domain_handle(self)
+
+        return self.c_domain
+
+
+    def get_boundary_kernel_codes(self):
+        """Dictionary of the boundary classes evaluated by the C boundary
+        kernels (see sw_boundaries.h) and their codes.
+
+        The kernels work with the default conserved and evolved quantities
+        (stage, xmomentum and ymomentum), otherwise all the boundaries are
+        evaluated by their evaluate_segment method.
+        """
+
+        from anuga.abstract_2d_finite_volumes.generic_boundary_conditions \
+             import Dirichlet_boundary, Transmissive_boundary, Time_boundary, \
+             Tabulated_time_boundary
+        from anuga.shallow_water.boundaries import Reflective_boundary, \
+             Transmissive_momentum_set_stage_boundary, \
+             Transmissive_n_momentum_zero_t_momentum_set_stage_boundary, \
+             Transmissive_stage_zero_momentum_boundary, \
+             Time_stage_zero_momentum_boundary, \
+             Tabulated_time_stage_zero_momentum_boundary, \
+             Dirichlet_discharge_boundary, Inflow_boundary, \
+             Flather_external_stage_zero_velocity_boundary
+
+        default_quantities = ['stage', 'xmomentum', 'ymomentum']
+        if self.conserved_quantities != default_quantities or \
+           self.evolved_quantities != default_quantities:
+            return {}
+
+        return {Reflective_boundary : 1,
+                Dirichlet_boundary : 2,
+                Time_boundary : 2,
+                Time_stage_zero_momentum_boundary : 2,
+                Transmissive_boundary : 3,
+                Transmissive_momentum_set_stage_boundary : 4,
+                Transmissive_n_momentum_zero_t_momentum_set_stage_boundary : 5,
+                Transmissive_stage_zero_momentum_boundary : 6,
+                Dirichlet_discharge_boundary : 7,
+                Inflow_boundary : 8,
+                Flather_external_stage_zero_velocity_boundary : 9,
+                Tabulated_time_boundary : 10,
+                Tabulated_time_stage_zero_momentum_boundary : 10}
+
+
+    def evaluate_boundary_kernels(self, segments):
+        """Evaluate the boundary segments of get_boundary_segments with
+        the C boundary kernels, which update the boundary values in place.
+        """
+
+        for code, segment_edges, B in segments:
+            if code > 0:
+                break
+        else:
+            # No kernels, skip building the C structure
+            Generic_Domain.evaluate_boundary_kernels(self, segments)
+            return
+
+        from swDE1_domain_ext import update_boundary as update_boundary_ext
+
+        update_boundary_ext(self.get_c_domain(), segments,
+                            int(self.centroid_transmissive_bc))
+
+
+    def __getstate__(self):
+        """The C structure handle cannot be pickled, it is recreated
+        when needed.
+        """
+
+        state = self.__dict__.copy()
+        state['c_domain'] = None
+
+        return state
+
+
     def get_compute_fluxes_method(self):
         """Get method for computing fluxes.
 
@@ -1269,6 +1494,9 @@ class Domain(Generic_Domain):
         if self.flow_algorithm == 'DE1_7':
             self._set_DE1_7_defaults()
 
+        # The defaults may have replaced arrays (e.g. edge_coordinates)
+        self.invalidate_c_domain()
+
 
     def get_flow_algorithm(self):
         """
@@ -1905,7 +2133,9 @@ class Domain(Generic_Domain):
 
             timestep = self.evolve_max_timestep 
 
-            flux_timestep = compute_fluxes_ext(self, timestep)
+            t0 = time.time()
+            flux_timestep = compute_fluxes_ext(self.get_c_domain(), timestep)
+            self.kernel_walltime += time.time() - t0
 
             self.flux_timestep = flux_timestep
 
@@ -1983,7 +2213,9 @@ class Domain(Generic_Domain):
             self.protect_against_infinitesimal_and_negative_heights()
             # Do extrapolation step
             from swDE1_domain_ext import extrapolate_second_order_edge_sw as extrapol2
-            extrapol2(self)
+            t0 = time.time()
+            extrapol2(self.get_c_domain())
+            self.kernel_walltime += time.time() - t0
 
         else:
             # Code for original method
@@ -2117,8 +2349,9 @@ class Domain(Generic_Domain):
 
             from swDE1_domain_ext import protect_new
             
-            
-            mass_error = protect_new(self)
+            t0 = time.time()
+            mass_error = protect_new(self.get_c_domain())
+            self.kernel_walltime += time.time() - t0
 
 #             # shortcuts
 #             wc = self.quantities['stage'].centroid_values
@@ -2453,28 +2686,161 @@ class Domain(Generic_Domain):
                         save_checkpoint = True
                         
                 if save_checkpoint:   
-                    pickle_name = os.path.join(self.checkpoint_dir,self.get_name())+'_'+str(self.get_time())+'.pickle'
-                    cPickle.dump(self, open(pickle_name, 'wb'))
+                    self.save_checkpoint()
 
-                    barrier()
+                    if not self.checkpoint_writer.store_async:
+                        barrier()
                     self.walltime_prev = time.time()
                     
                     #print 'Stored Checkpoint File '+pickle_name 
 
             # Pass control on to outer loop for more specific actions
             yield(t)
+
+        # Write out the timesteps still queued and close the sww file
+        if self.store is True:
+            self.writer.close()
+
+        # Write out the checkpoints still queued
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.close()
      
 
-    def initialise_storage(self):
+    def evolve_one_euler_step(self, yieldstep, finaltime):
+        """One Euler Time Step, see Generic_Domain.evolve_one_euler_step
+
+        Uses the fused C timestep if set_fused_evolve has been called.
+        """
+
+        if not self._use_fused_evolve(finaltime):
+            Generic_Domain.evolve_one_euler_step(self, yieldstep, finaltime)
+            return
+
+        from swDE1_domain_ext import evolve_one_euler_step as evolve_ext
+
+        self._evolve_one_fused_step(evolve_ext, yieldstep, finaltime)
+
+
+    def evolve_one_rk2_step(self, yieldstep, finaltime):
+        """One 2nd order RK timestep, see Generic_Domain.evolve_one_rk2_step
+
+        Uses the fused C timestep if set_fused_evolve has been called.
+        """
+
+        if not self._use_fused_evolve(finaltime):
+            Generic_Domain.evolve_one_rk2_step(self, yieldstep, finaltime)
+            return
+
+        from swDE1_domain_ext import evolve_one_rk2_step as evolve_ext
+
+        self._evolve_one_fused_step(evolve_ext, yieldstep, finaltime)
+
+
+    def evolve_one_rk3_step(self, yieldstep, finaltime):
+        """One 3rd order RK timestep, see Generic_Domain.evolve_one_rk3_step
+
+        Uses the fused C timestep if set_fused_evolve has been called.
+        """
+
+        if not self._use_fused_evolve(finaltime):
+            Generic_Domain.evolve_one_rk3_step(self, yieldstep, finaltime)
+            return
+
+        from swDE1_domain_ext import evolve_one_rk3_step as evolve_ext
+
+        self._evolve_one_fused_step(evolve_ext, yieldstep, finaltime)
+
+
+    def _overrides(self, name):
+        """Check whether method name has been overridden by a subclass
+        or an instance of this class.
+        """
+
+        if name in self.__dict__:
+            return True
+
+        return getattr(self.__class__, name).im_func is not \
+               getattr(Domain, name).im_func
+
+
+    def _use_fused_evolve(self, finaltime):
+        """Check that the fused C timestep can reproduce the python one.
+        """
+
+        if not self.fused_evolve or self.compute_fluxes_method != 'DE':
+            return False
+
+        if finaltime is None:
+            return False
+
+        default_quantities = ['stage', 'xmomentum', 'ymomentum']
+        if self.conserved_quantities != default_quantities or \
+           self.evolved_quantities != default_quantities:
+            return False
+
+        for name in ['distribute_to_vertices_and_edges',
+                     'protect_against_infinitesimal_and_negative_heights',
+                     'update_boundary',
+                     'compute_fluxes',
+                     'update_conserved_quantities',
+                     'backup_conserved_quantities',
+                     'saxpy_conserved_quantities',
+                     'set_time']:
+            if self._overrides(name):
+                return False
+
+        return True
+
+
+    def _evolve_one_fused_step(self, evolve_ext, yieldstep, finaltime):
+        """Call one of the fused C timesteps evolve_one_{euler,rk2,rk3}_step
+        """
+
+        boundaries = self.get_boundary_segments()
+
+        # Forcing terms: -1 call compute_forcing_terms, 0 none,
+        # 1 flat manning friction, 2 sloped manning friction
+        if self._overrides('compute_forcing_terms'):
+            forcing = -1
+        elif len(self.forcing_terms) == 0:
+            forcing = 0
+        elif self.forcing_terms == [manning_friction_implicit]:
+            if self.use_sloped_mannings:
+                forcing = 2
+            else:
+                forcing = 1
+        else:
+            forcing = -1
+
+        # Small timesteps are always passed back to update_timestep
+        c_timestep = not (self._overrides('update_timestep') or
+                          self.protect_against_isolated_degenerate_timesteps)
+
+        update_ghosts = self._overrides('update_ghosts') or \
+                        self.full_send_dict.has_key(self.processor)
+
+        t0 = time.time()
+        evolve_ext(self.get_c_domain(), boundaries,
+                   float(yieldstep), float(finaltime),
+                   forcing, int(c_timestep), int(update_ghosts))
+        self.kernel_walltime += time.time() - t0
+
+
+    def initialise_storage(self, mode='w'):
         """Create and initialise self.writer object for storing data.
         Also, save x,y and bed elevation
+
+        With mode 'a' carry on storing into an existing sww file, eg when
+        restarting from a checkpoint.
         """
         
         # Initialise writer
-        self.writer = SWW_file(self)
+        self.writer = SWW_file(self, mode=mode)
+        self.writer.set_async(self.store_async, self.store_async_queue_size)
 
         # Store vertices and connectivity
-        self.writer.store_connectivity()
+        if mode[0] == 'w':
+            self.writer.store_connectivity()
 
 
     def store_timestep(self):
@@ -2757,7 +3123,7 @@ class Domain(Generic_Domain):
         from swDE1_domain_ext import compute_flux_update_frequency \
                                   as compute_flux_update_frequency_ext
 
-        compute_flux_update_frequency_ext(self, self.timestep)
+        compute_flux_update_frequency_ext(self.get_c_domain(), self.timestep)
         
     def report_water_volume_statistics(self, verbose=True, returnStats=False):
         """
@@ -24,6 +24,13 @@
 // Shared code snippets
 #include "util_ext.h"
 #include "sw_domain.h"
+#include "sw_boundaries.h"
+
+#if defined(__APPLE__)
+   // clang doesn't have openmp
+#else
+   #include "omp.h"
+#endif
 
 
 const double pi = 3.14159265358979;
@@ -138,8 +145,8 @@ water model for two-dimensional dam-break type. Journal of Computational Physics
   double u_m, h_m, soundspeed_m, s_m;
   double denom, inverse_denominator;
   double uint, t1, t2, t3, min_speed, tmp;
-  // Workspace (allocate once, use many)
-  static double q_left_rotated[3], q_right_rotated[3], flux_right[3], flux_left[3];
+  // Workspace (not static, so that the function is thread safe)
+  double q_left_rotated[3], q_right_rotated[3], flux_right[3], flux_left[3];
 
 
   // Copy conserved quantities to protect from modification
@@ -316,8 +323,8 @@ int _flux_function_central(double *q_left, double *q_right,
   double s_min, s_max, soundspeed_left, soundspeed_right;
   double denom, inverse_denominator;
   double uint, t1, t2, t3, min_speed, tmp;
-  // Workspace (allocate once, use many)
-  static double q_left_rotated[3], q_right_rotated[3], flux_right[3], flux_left[3];
+  // Workspace (not static, so that the function is thread safe)
+  double q_left_rotated[3], q_right_rotated[3], flux_right[3], flux_left[3];
 
   if(h_left==0. && h_right==0.){
     // Quick exit
@@ -454,6 +461,72 @@ int _flux_function_central(double *q_left, double *q_right,
 
 ////////////////////////////////////////////////////////////////
 
+// Ghost exchange overlap
+//
+// halo_level[k] is the distance (in triangles) from triangle k to the
+// nearest ghost triangle, capped at HALO_LEVEL_INTERIOR. In phase 1 only the
+// triangles with halo_level >= level are processed, these do not depend on
+// the ghost values. Phase 2 processes the remaining triangles once the
+// ghosts have been received. Phase 0 processes all triangles.
+#define HALO_LEVEL_INTERIOR 4
+
+int _in_overlap_phase(struct domain *D, long k, long level){
+
+    if (D->overlap_phase == 0) return 1;
+
+    if (D->overlap_phase == 1) return (D->halo_level[k] >= level);
+
+    return (D->halo_level[k] < level);
+}
+
+
+// The fluxes also depend on the boundary values, which are only updated
+// after phase 1, so triangles with boundary edges are left to phase 2
+int _in_flux_overlap_phase(struct domain *D, long k){
+
+    long interior;
+
+    if (D->overlap_phase == 0) return 1;
+
+    interior = (D->halo_level[k] >= HALO_LEVEL_INTERIOR) &&
+               (D->number_of_boundaries[k] == 0);
+
+    if (D->overlap_phase == 1) return interior;
+
+    return !interior;
+}
+
+
+// Set the overlap phase from the optional (halo_level, phase) arguments
+// of the kernels
+int _set_overlap_phase(struct domain *D, PyObject *halo_level, long phase){
+
+    D->overlap_phase = 0;
+    D->halo_level = NULL;
+
+    if (phase == 0) return 0;
+
+    if (phase < 0 || phase > 2) {
+        report_python_error(AT, "overlap phase must be 0, 1 or 2");
+        return -1;
+    }
+
+    if (!PyArray_Check(halo_level) ||
+        PyArray_TYPE((PyArrayObject *) halo_level) != NPY_LONG ||
+        !PyArray_ISCARRAY((PyArrayObject *) halo_level) ||
+        PyArray_SIZE((PyArrayObject *) halo_level) != D->number_of_elements) {
+        report_python_error(AT, "halo_level must be a contiguous integer array with one entry per triangle");
+        return -1;
+    }
+
+    D->overlap_phase = phase;
+    D->halo_level = (long *) PyArray_DATA((PyArrayObject *) halo_level);
+
+    return 0;
+}
+
+////////////////////////////////////////////////////////////////
+
 int _compute_flux_update_frequency(struct domain *D, double timestep){
     // Compute the 'flux_update_frequency' for each edge.
     //
@@ -710,6 +783,17 @@ double adjust_edgeflux_with_weir(double *edgeflux,
 }
 
 // Computational function for flux computation
+//
+// The loop over triangles is threaded with OpenMP (D->omp_num_threads).
+// Each edge is computed by exactly one 'owner' triangle, which writes the
+// edge work arrays for both sides of the edge, so there are no write races.
+// The owner is the triangle which would have computed the edge first in
+// the serial loop, so results are identical to the serial computation.
+//
+// With the ghost exchange overlap the triangles are split between two
+// calls (see _in_flux_overlap_phase). Phase 1 resets the explicit updates
+// and computes the edges owned by its triangles, phase 2 computes the
+// remaining edges, sums the explicit updates and returns the timestep.
 double _compute_fluxes_central(struct domain *D, double timestep){
 
     // Local variables
@@ -725,9 +809,10 @@ double _compute_fluxes_central(struct domain *D, double timestep){
     double stage_edges[3];//Work array
     double bedslope_work;
     static double local_timestep;
+    double local_timestep_min;
     int neighbours_wet[3];//Work array
     long RiverWall_count, substep_count;
-    double hle, hre, zc, zc_n, Qfactor, s1, s2, h1, h2; 
+    double hle, hre, zc, zc_n, Qfactor, s1, s2, h1, h2;
     double stage_edge_lim, outgoing_mass_edges, pressure_flux, hc, hc_n, tmp, tmp2;
     double h_left_tmp, h_right_tmp;
     static long call = 0; // Static local variable flagging already computed flux
@@ -735,18 +820,20 @@ double _compute_fluxes_central(struct domain *D, double timestep){
     static long base_call = 1;
     double speed_max_last, vol, weir_height;
 
-    call++; // Flag 'id' of flux calculation for this timestep
+    if (D->overlap_phase != 2) {
+        call++; // Flag 'id' of flux calculation for this timestep
 
-    if (D->timestep_fluxcalls != timestep_fluxcalls) {
-    	timestep_fluxcalls = D->timestep_fluxcalls;
-    	base_call = call;
-    }
+        if (D->timestep_fluxcalls != timestep_fluxcalls) {
+            timestep_fluxcalls = D->timestep_fluxcalls;
+            base_call = call;
+        }
 
-    // Set explicit_update to zero for all conserved_quantities.
-    // This assumes compute_fluxes called before forcing terms
-    memset((char*) D->stage_explicit_update, 0, D->number_of_elements * sizeof (double));
-    memset((char*) D->xmom_explicit_update, 0, D->number_of_elements * sizeof (double));
-    memset((char*) D->ymom_explicit_update, 0, D->number_of_elements * sizeof (double));
+        // Set explicit_update to zero for all conserved_quantities.
+        // This assumes compute_fluxes called before forcing terms
+        memset((char*) D->stage_explicit_update, 0, D->number_of_elements * sizeof (double));
+        memset((char*) D->xmom_explicit_update, 0, D->number_of_elements * sizeof (double));
+        memset((char*) D->ymom_explicit_update, 0, D->number_of_elements * sizeof (double));
+    }
 
 
     // Counter for riverwall edges
@@ -758,30 +845,43 @@ double _compute_fluxes_central(struct domain *D, double timestep){
 
     // Fluxes are not updated every timestep,
     // but all fluxes ARE updated when the following condition holds
-    if(D->allow_timestep_increase[0]==1){
+    if((D->overlap_phase != 2) && (D->allow_timestep_increase[0]==1)){
         // We can only increase the timestep if all fluxes are allowed to be updated
         // If this is not done the timestep can't increase (since local_timestep is static)
         local_timestep=1.0e+100;
     }
+    local_timestep_min = local_timestep;
 
     // For all triangles
+    #pragma omp parallel for num_threads(D->omp_num_threads) schedule(static) \
+        reduction(min:local_timestep_min) \
+        private(k, i, ki, ki2, ki3, n, m, nm, nm3, ii, ql, qr, zl, zr, hc, zc, \
+                hle, hre, hc_n, zc_n, z_half, h_left, h_right, edgeflux, \
+                max_speed_local, pressure_flux, weir_height, h_left_tmp, \
+                h_right_tmp, Qfactor, s1, s2, h1, h2, length, bedslope_work, \
+                tmp, speed_max_last, RiverWall_count)
     for (k = 0; k < D->number_of_elements; k++) {
+        if (!_in_flux_overlap_phase(D, k)) continue;
+
         speed_max_last = 0.0;
 
         // Loop through neighbours and compute edge flux for each
         for (i = 0; i < 3; i++) {
             ki = k * 3 + i; // Linear index to edge i of triangle k
             ki2 = 2 * ki; //k*6 + i*2
-            ki3 = 3*ki; 
-
-            if ((D->already_computed_flux[ki] == call) || (D->update_next_flux[ki]!=1)) {
-                // We've already computed the flux across this edge
-                // Check if it is a riverwall
-                if(D->edge_flux_type[ki] == 1){
-                    // Update counter of riverwall edges == index of
-                    // riverwall_elevation + riverwall_rowIndex
-                    RiverWall_count += 1;
-                }
+            ki3 = 3*ki;
+
+            n = D->neighbours[ki];
+            if (n >= 0) {
+                m = D->neighbour_edges[ki];
+                nm = n * 3 + m; // Linear index (triangle n, edge m)
+            }
+
+            // Only the owner of the edge computes the flux. The owner is the
+            // lower numbered triangle, unless that triangle is not updating
+            // this flux and the higher numbered one is.
+            if ((D->update_next_flux[ki]!=1) ||
+                ((n >= 0) && (n < k) && (D->update_next_flux[nm]==1))) {
                 continue;
             }
 
@@ -796,7 +896,6 @@ double _compute_fluxes_central(struct domain *D, double timestep){
 
             // Get right hand side values either from neighbouring triangle
             // or from boundary array (Quantities at neighbour on nearest face).
-            n = D->neighbours[ki];
             hc_n = hc;
             zc_n = D->bed_centroid_values[k];
             if (n < 0) {
@@ -812,8 +911,6 @@ double _compute_fluxes_central(struct domain *D, double timestep){
                 // Neighbour is a real triangle
                 hc_n = D->height_centroid_values[n];
                 zc_n = D->bed_centroid_values[n];
-                m = D->neighbour_edges[ki];
-                nm = n * 3 + m; // Linear index (triangle n, edge m)
                 nm3 = nm*3;
 
                 qr[0] = D->stage_edge_values[nm];
@@ -831,10 +928,10 @@ double _compute_fluxes_central(struct domain *D, double timestep){
                 if( n>=0 && D->edge_flux_type[nm] != 1){
                     printf("Riverwall Error\n");
                 }
-                // Update counter of riverwall edges == index of
-                // riverwall_elevation + riverwall_rowIndex
-                RiverWall_count += 1;
-                
+                // Count of riverwall edges up to and including this one ==
+                // index of riverwall_elevation + riverwall_rowIndex + 1
+                RiverWall_count = D->edge_river_wall_counter[ki];
+
                 // Set central bed to riverwall elevation
                 z_half = max(D->riverwall_elevation[RiverWall_count-1], z_half) ;
 
@@ -974,11 +1071,11 @@ double _compute_fluxes_central(struct domain *D, double timestep){
                         // Apply CFL condition for triangles joining this edge (triangle k and triangle n)
 
                         // CFL for triangle k
-                        local_timestep = min(local_timestep, D->edge_timestep[ki]);
+                        local_timestep_min = min(local_timestep_min, D->edge_timestep[ki]);
 
                         if (n >= 0) {
                             // Apply CFL condition for neigbour n (which is on the ith edge of triangle k)
-                            local_timestep = min(local_timestep, D->edge_timestep[nm]);
+                            local_timestep_min = min(local_timestep_min, D->edge_timestep[nm]);
                         }
                     }
                 }
@@ -991,6 +1088,11 @@ double _compute_fluxes_central(struct domain *D, double timestep){
 
     } // End triangle k
 
+    local_timestep = local_timestep_min;
+
+    // The remaining edges and the explicit updates are computed in phase 2
+    if (D->overlap_phase == 1) return timestep;
+
     //// Limit edgefluxes, for mass conservation near wet/dry cells
     //// This doesn't seem to be needed anymore
     //for(k=0; k< number_of_elements; k++){
@@ -1046,32 +1148,23 @@ double _compute_fluxes_central(struct domain *D, double timestep){
     // }
 
     // Now add up stage, xmom, ymom explicit updates
+    #pragma omp parallel for num_threads(D->omp_num_threads) schedule(static) \
+        private(k, i, ki, ki2, ki3, inv_area)
     for(k=0; k < D->number_of_elements; k++){
-        hc = max(D->stage_centroid_values[k] - D->bed_centroid_values[k],0.);
 
         for(i=0;i<3;i++){
             // FIXME: Make use of neighbours to efficiently set things
-            ki=3*k+i;   
+            ki=3*k+i;
             ki2=ki*2;
             ki3 = ki*3;
-            n=D->neighbours[ki];
 
             D->stage_explicit_update[k] += D->edge_flux_work[ki3+0];
             D->xmom_explicit_update[k] += D->edge_flux_work[ki3+1];
             D->ymom_explicit_update[k] += D->edge_flux_work[ki3+2];
 
-            // If this cell is not a ghost, and the neighbour is a boundary
-            // condition OR a ghost cell, then add the flux to the
-            // boundary_flux_integral
-            if( (n<0 & D->tri_full_flag[k]==1) | ( n>=0 && (D->tri_full_flag[k]==1 & D->tri_full_flag[n]==0)) ){ 
-                // boundary_flux_sum is an array with length = timestep_fluxcalls
-                // For each sub-step, we put the boundary flux sum in.
-                D->boundary_flux_sum[substep_count] += D->edge_flux_work[ki3];
-            }
-    
             D->xmom_explicit_update[k] -= D->normals[ki2]*D->pressuregrad_work[ki];
             D->ymom_explicit_update[k] -= D->normals[ki2+1]*D->pressuregrad_work[ki];
-            
+
 
         } // end edge i
 
@@ -1081,11 +1174,27 @@ double _compute_fluxes_central(struct domain *D, double timestep){
         D->stage_explicit_update[k] *= inv_area;
         D->xmom_explicit_update[k] *= inv_area;
         D->ymom_explicit_update[k] *= inv_area;
-   
+
     }  // end cell k
 
+    // Sum the boundary fluxes. This is done serially (and in edge order) so
+    // that the result does not depend on the number of threads
+    for(ki=0; ki < 3*D->number_of_elements; ki++){
+        k = ki/3;
+        n = D->neighbours[ki];
+
+        // If this cell is not a ghost, and the neighbour is a boundary
+        // condition OR a ghost cell, then add the flux to the
+        // boundary_flux_integral
+        if( (n<0 & D->tri_full_flag[k]==1) | ( n>=0 && (D->tri_full_flag[k]==1 & D->tri_full_flag[n]==0)) ){
+            // boundary_flux_sum is an array with length = timestep_fluxcalls
+            // For each sub-step, we put the boundary flux sum in.
+            D->boundary_flux_sum[substep_count] += D->edge_flux_work[3*ki];
+        }
+    }
+
     // Ensure we only update the timestep on the first call within each rk2/rk3 step
-    if(substep_count == 0) timestep=local_timestep; 
+    if(substep_count == 0) timestep=local_timestep;
          
     return timestep;
 }
@@ -1154,12 +1263,16 @@ double  _protect(int N,
 }
 
 // Protect against the water elevation falling below the triangle bed
+//
+// The mass error is summed per thread and the partial sums are combined in
+// thread order, so the result is reproducible for a fixed number of threads
 double  _protect_new(struct domain *D) {
 
-  int k;
+  int k, t, nthreads;
   double hc, bmin, bmax;
   double u, v, reduced_speed;
   double mass_error = 0.;
+  double* mass_error_thread;
 
   double* wc;
   double* zc;
@@ -1183,15 +1296,26 @@ double  _protect_new(struct domain *D) {
   ymomc = D->ymom_centroid_values;
   areas = D->areas;
 
+  nthreads = max(D->omp_num_threads, 1);
+  mass_error_thread = (double*) calloc(nthreads, sizeof(double));
+
   // This acts like minimum_allowed height, but scales with the vertical
   // distance between the bed_centroid_value and the max bed_edge_value of
   // every triangle.
   //double minimum_relative_height=0.05;
-  int mass_added = 0;
 
   // Protect against inifintesimal and negative heights
   //if (maximum_allowed_speed < epsilon) {
+  #pragma omp parallel num_threads(nthreads) private(k, t, hc, bmin)
+  {
+    t = 0;
+#ifdef _OPENMP
+    t = omp_get_thread_num();
+#endif
+    #pragma omp for schedule(static)
     for (k=0; k<D->number_of_elements; k++) {
+      if (!_in_overlap_phase(D, k, 1)) continue;
+
       hc = wc[k] - zc[k];
       if (hc < minimum_allowed_height*1.0 ){
             // Set momentum to zero and ensure h is non negative
@@ -1203,8 +1327,7 @@ double  _protect_new(struct domain *D) {
 
              // WARNING: ADDING MASS if wc[k]<bmin
              if(wc[k] < bmin){
-                 mass_error += (bmin-wc[k])*areas[k];
-                 mass_added = 1; //Flag to warn of added mass
+                 mass_error_thread[t] += (bmin-wc[k])*areas[k];
 
                  wc[k] = bmin;
 
@@ -1219,8 +1342,14 @@ double  _protect_new(struct domain *D) {
         }
       }
     }
+  }
 
-  //if(mass_added == 1){
+  for (t=0; t<nthreads; t++) {
+    mass_error += mass_error_thread[t];
+  }
+  free(mass_error_thread);
+
+  //if(mass_error > 0.0){
   //  printf("Cumulative mass protection: %f m^3 \n", mass_error);
   //}
 
@@ -1331,10 +1460,17 @@ int _extrapolate_second_order_edge_sw(struct domain *D){
   double dqv[3], qmin, qmax, hmin, hmax, bedmax,bedmin, stagemin;
   double hc, h0, h1, h2, beta_tmp, hfactor, xtmp, ytmp, weight, tmp;
   double dk, dk_inv,dv0, dv1, dv2, de[3], demin, dcmax, r0scale, vel_norm, l1, l2, a_tmp, b_tmp, c_tmp,d_tmp;
-  
-
-  memset((char*) D->x_centroid_work, 0, D->number_of_elements * sizeof (double));
-  memset((char*) D->y_centroid_work, 0, D->number_of_elements * sizeof (double));
+  int internal_neighbour_not_found = 0;
+
+  // With the ghost exchange overlap (see _in_overlap_phase) each loop below
+  // is split between phases 1 and 2. A triangle's edge values depend on
+  // the centroid values up to two triangles away, so phase 1 extrapolates
+  // the triangles at least 3 triangles away from the ghosts. The momenta
+  // are converted back from velocities at the end of phase 2
+  if (D->overlap_phase != 2) {
+    memset((char*) D->x_centroid_work, 0, D->number_of_elements * sizeof (double));
+    memset((char*) D->y_centroid_work, 0, D->number_of_elements * sizeof (double));
+  }
  
   // Parameters used to control how the limiter is forced to first-order near
   // wet-dry regions 
@@ -1347,7 +1483,10 @@ int _extrapolate_second_order_edge_sw(struct domain *D){
 
       // Replace momentum centroid with velocity centroid to allow velocity
       // extrapolation This will be changed back at the end of the routine
+      #pragma omp parallel for num_threads(D->omp_num_threads) schedule(static) \
+          private(k, dk, dk_inv)
       for (k=0; k< D->number_of_elements; k++){
+          if (!_in_overlap_phase(D, k, 1)) continue;
           
           D->height_centroid_values[k] = max(D->stage_centroid_values[k] - D->bed_centroid_values[k], 0.);
 
@@ -1373,7 +1512,10 @@ int _extrapolate_second_order_edge_sw(struct domain *D){
   // condition) set its momentum to zero too. This prevents 'pits' of
   // of water being trapped and unable to lose momentum, which can occur in
   // some situations
+  #pragma omp parallel for num_threads(D->omp_num_threads) schedule(static) \
+      private(k, k0, k1, k2, k3)
   for (k=0; k< D->number_of_elements;k++){
+      if (!_in_overlap_phase(D, k, 2)) continue;
       
       k3=k*3;
       k0 = D->surrogate_neighbours[k3];
@@ -1395,8 +1537,15 @@ int _extrapolate_second_order_edge_sw(struct domain *D){
   }
 
   // Begin extrapolation routine
+  #pragma omp parallel for num_threads(D->omp_num_threads) schedule(static) \
+      private(k, k0, k1, k2, k3, k6, coord_index, i, a, b, x, y, x0, y0, \
+              x1, y1, x2, y2, xv0, yv0, xv1, yv1, xv2, yv2, dx1, dx2, dy1, \
+              dy2, dxv0, dxv1, dxv2, dyv0, dyv1, dyv2, dq0, dq1, dq2, area2, \
+              inv_area2, dqv, qmin, qmax, hmin, hmax, hc, h0, h1, h2, \
+              beta_tmp, hfactor, dk)
   for (k = 0; k < D->number_of_elements; k++) 
   {
+    if (!_in_overlap_phase(D, k, 3)) continue;
 
     // Don't update the extrapolation if the flux will not be computed on the
     // next timestep
@@ -1774,9 +1923,10 @@ int _extrapolate_second_order_edge_sw(struct domain *D){
       
       if ((k2 == k3 + 3)) 
       {
-        // If we didn't find an internal neighbour
-        report_python_error(AT, "Internal neighbour not found");
-        return -1;
+        // If we didn't find an internal neighbour. The error is reported
+        // after the (possibly threaded) loop
+        internal_neighbour_not_found = 1;
+        continue;
       }
       
       k1 = D->surrogate_neighbours[k2];
@@ -1952,14 +2102,24 @@ int _extrapolate_second_order_edge_sw(struct domain *D){
     } // else [number_of_boundaries==2]
   } // for k=0 to number_of_elements-1
 
+  if (internal_neighbour_not_found)
+  {
+    report_python_error(AT, "Internal neighbour not found");
+    return -1;
+  }
+
 
   // Compute vertex values of quantities
+  #pragma omp parallel for num_threads(D->omp_num_threads) schedule(static) \
+      private(k, k3, i, dk)
   for (k=0; k< D->number_of_elements; k++){
-      if(D->extrapolate_velocity_second_order==1){
+      if((D->extrapolate_velocity_second_order==1) && (D->overlap_phase != 1)){
           //Convert velocity back to momenta at centroids
           D->xmom_centroid_values[k] = D->x_centroid_work[k];
           D->ymom_centroid_values[k] = D->y_centroid_work[k];
       }
+
+      if (!_in_overlap_phase(D, k, 3)) continue;
      
       // Don't proceed if we didn't update the edge/vertex values
       if(D->update_extrapolation[k]==0){
@@ -2032,21 +2192,34 @@ PyObject *swde1_compute_fluxes_ext_central(PyObject *self, PyObject *args) {
     The maximal allowable speed computed by the flux_function for each volume
     is converted to a timestep that must not be exceeded. The minimum of
     those is computed as the next overall timestep.
+
+    The optional halo_level and phase arguments split the computation
+    around the ghost exchange (see _in_overlap_phase)
   */
-  struct domain D;
+  struct domain DS, *D;
   PyObject *domain;
+  PyObject *halo_level = Py_None;
+  long phase = 0;
 
    
   double timestep;
   
-  if (!PyArg_ParseTuple(args, "Od", &domain, &timestep)) {
+  if (!PyArg_ParseTuple(args, "Od|Ol", &domain, &timestep, &halo_level, &phase)) {
       report_python_error(AT, "could not parse input arguments");
       return NULL;
   }
     
-  get_python_domain(&D,domain);
+  // domain is either the python domain or its handle (see get_domain)
+  D = get_domain(&DS, domain);
+  if (D == NULL) {
+    return NULL;
+  }
 
-  timestep=_compute_fluxes_central(&D,timestep);
+  if (_set_overlap_phase(D, halo_level, phase) == -1) {
+    return NULL;
+  }
+
+  timestep=_compute_fluxes_central(D,timestep);
 
   // Return updated flux timestep
   return Py_BuildValue("d", timestep);
@@ -2182,7 +2355,7 @@ PyObject *swde1_compute_flux_update_frequency(PyObject *self, PyObject *args) {
 
   */
 
-  struct domain D;
+  struct domain DS, *D;
   PyObject *domain;
   
     
@@ -2193,9 +2366,12 @@ PyObject *swde1_compute_flux_update_frequency(PyObject *self, PyObject *args) {
       return NULL;
   }
     
-  get_python_domain(&D,domain);
+  D = get_domain(&DS, domain);
+  if (D == NULL) {
+    return NULL;
+  }
 
-  _compute_flux_update_frequency(&D, timestep);
+  _compute_flux_update_frequency(D, timestep);
 
   // Return 
   return Py_BuildValue("");
@@ -2213,21 +2389,30 @@ PyObject *swde1_extrapolate_second_order_edge_sw(PyObject *self, PyObject *args)
 
   */
  
-  struct domain D; 
+  struct domain DS, *D;
   PyObject *domain;
+  PyObject *halo_level = Py_None;
+  long phase = 0;
 
   int e;
   
-  if (!PyArg_ParseTuple(args, "O", &domain)) {
+  if (!PyArg_ParseTuple(args, "O|Ol", &domain, &halo_level, &phase)) {
       report_python_error(AT, "could not parse input arguments");
       return NULL;
   }
   
-  get_python_domain(&D, domain);
+  D = get_domain(&DS, domain);
+  if (D == NULL) {
+    return NULL;
+  }
+
+  if (_set_overlap_phase(D, halo_level, phase) == -1) {
+    return NULL;
+  }
 
   // Call underlying flux computation routine and update
   // the explicit update arrays
-  e = _extrapolate_second_order_edge_sw(&D);
+  e = _extrapolate_second_order_edge_sw(D);
 
   if (e == -1) {
     // Use error string set inside computational routine
@@ -2303,20 +2488,29 @@ PyObject *swde1_protect_new(PyObject *self, PyObject *args) {
   //
   //    protect(minimum_allowed_height, maximum_allowed_speed, wc, zc, xmomc, ymomc)
 
-	struct domain D;
+	struct domain DS, *D;
 	PyObject *domain;
+	PyObject *halo_level = Py_None;
+	long phase = 0;
 
 	double mass_error;
 
 	// Convert Python arguments to C
-	if (!PyArg_ParseTuple(args, "O", &domain)) {
+	if (!PyArg_ParseTuple(args, "O|Ol", &domain, &halo_level, &phase)) {
 		report_python_error(AT, "could not parse input arguments");
 		return NULL;
 	}
 
-	get_python_domain(&D, domain);
+	D = get_domain(&DS, domain);
+	if (D == NULL) {
+		return NULL;
+	}
+
+	if (_set_overlap_phase(D, halo_level, phase) == -1) {
+		return NULL;
+	}
 
-	mass_error = _protect_new(&D);
+	mass_error = _protect_new(D);
 
 	return Py_BuildValue("d", mass_error);
 }
@@ -2325,129 +2519,608 @@ PyObject *swde1_protect_new(PyObject *self, PyObject *args) {
 
 
 //========================================================================
-// swde1_evolve_one_euler_step
+// Fused evolve -- a complete euler, rk2 or rk3 timestep in a single call
+//
+// The python wrapper (Domain.evolve_one_*_step) passes a list of boundary
+// segments (code, segment_edges, boundary_object), which are evaluated
+// by the boundary kernels of sw_boundaries.h (code BOUNDARY_PYTHON calls
+// back to boundary_object.evaluate_segment).
+// Similarly the forcing terms are either manning friction (evaluated here)
+// or a callback to domain.compute_forcing_terms.
+//
+// The arrays are those of the domain handle (or obtained once per
+// timestep), so python callbacks must update arrays in place (as all the
+// boundary and forcing classes do).
 //========================================================================
 
-PyObject *swde1_evolve_one_euler_step(PyObject *self, PyObject *args) {
-  /*
-   * Implement one Euler step in C
-  */
-
+#define FUSED_FORCING_PYTHON        -1
+#define FUSED_FORCING_NONE           0
+#define FUSED_FORCING_MANNING_FLAT   1
+#define FUSED_FORCING_MANNING_SLOPED 2
 
-  PyObject* domain;
-  PyObject* arglist;
-  PyObject* result;
-
-  struct domain D;
+struct fused_step {
+  PyObject *domain;
+  PyObject *boundaries;
 
   double yieldstep;
   double finaltime;
-  double flux_timestep;
 
+  long forcing;
+  long c_timestep;
+  long update_ghosts;
+
+  long verbose;
+  long centroid_transmissive_bc;
+  long discontinuous_elevation;
+};
+
+
+int _fused_call_method(PyObject *domain, char *name) {
+
+  PyObject *result;
+
+  result = PyObject_CallMethod(domain, name, NULL);
+  if (result == NULL) {
+    return -1;
+  }
+  Py_DECREF(result);
+
+  return 0;
+}
+
+
+int _fused_set_double(PyObject *O, char *name, double x) {
+
+  PyObject *value;
+  int e;
+
+  value = PyFloat_FromDouble(x);
+  if (value == NULL) {
+    return -1;
+  }
+  e = PyObject_SetAttrString(O, name, value);
+  Py_DECREF(value);
+
+  return e;
+}
+
+
+int _fused_set_integer(PyObject *O, char *name, long x) {
+
+  PyObject *value;
   int e;
+
+  value = PyInt_FromLong(x);
+  if (value == NULL) {
+    return -1;
+  }
+  e = PyObject_SetAttrString(O, name, value);
+  Py_DECREF(value);
+
+  return e;
+}
+
+
+int _fused_distribute_to_vertices_and_edges(struct domain *D, struct fused_step *S) {
+
   double mass_error;
 
+  mass_error = _protect_new(D);
 
-  if (!PyArg_ParseTuple(args, "Odd", &domain, &yieldstep, &finaltime)) {
-      report_python_error(AT, "could not parse input arguments");
-      return NULL;
+  if (mass_error > 0.0 && S->verbose) {
+    printf("Cumulative mass protection: %.12g m^3 \n", mass_error);
   }
 
+  return _extrapolate_second_order_edge_sw(D);
+}
 
-  get_python_domain(&D, domain);
 
-  //printf("In C_evolve %f %f \n", yieldstep, finaltime);
+int _fused_update_boundary(struct domain *D, struct fused_step *S) {
 
+  return _update_boundary_segments(D, S->domain, S->boundaries,
+                                   S->centroid_transmissive_bc);
+}
 
-  // From centroid values calculate edge and vertex values
-  //printf("distribute_to_vertices_and_edges\n");
-//  result = PyObject_CallMethod(domain,"distribute_to_vertices_and_edges",NULL);
-//  if (result == NULL) {
-//     return NULL;
-//  }
-//  Py_DECREF(result);
 
-  mass_error = _protect_new(&D);
+void _fused_manning_friction(struct domain *D, long sloped) {
+  // Same as _manning_friction_flat and _manning_friction_sloped
+  // in shallow_water_ext.c but working directly on the domain struct
+
+  long k, k3, k6;
+  double S, h, z, z0, z1, z2, zs, zx, zy;
+  const double one_third = 1.0/3.0;
+  const double seven_thirds = 7.0/3.0;
+
+  double *x = D->vertex_coordinates;
+  double *w = D->stage_centroid_values;
+  double *zv = D->bed_vertex_values;
+  double *uh = D->xmom_centroid_values;
+  double *vh = D->ymom_centroid_values;
+  double *eta = D->friction_centroid_values;
+  double *xmom_update = D->xmom_semi_implicit_update;
+  double *ymom_update = D->ymom_semi_implicit_update;
+
+  #pragma omp parallel for num_threads(D->omp_num_threads) schedule(static) \
+      private(k3, k6, S, h, z, z0, z1, z2, zs, zx, zy)
+  for (k = 0; k < D->number_of_elements; k++) {
+    if (eta[k] > D->minimum_allowed_height) {
+      k3 = 3 * k;
+      // Get bathymetry
+      z0 = zv[k3 + 0];
+      z1 = zv[k3 + 1];
+      z2 = zv[k3 + 2];
+
+      zs = 1.0;
+      if (sloped) {
+        // Compute bed slope
+        k6 = 6 * k;
+        _gradient(x[k6 + 0], x[k6 + 1], x[k6 + 2], x[k6 + 3], x[k6 + 4], x[k6 + 5],
+                  z0, z1, z2, &zx, &zy);
+        zs = sqrt(1.0 + zx * zx + zy * zy);
+      }
 
-  e = _extrapolate_second_order_edge_sw(&D);
-  if (e == -1) {
-    // Use error string set inside computational routine
-    return NULL;
+      z = (z0 + z1 + z2) * one_third;
+      h = w[k] - z;
+      if (h >= D->minimum_allowed_height) {
+        if (sloped) {
+          S = -D->g * eta[k] * eta[k] * zs * sqrt((uh[k] * uh[k] + vh[k] * vh[k]));
+        } else {
+          S = -D->g * eta[k] * eta[k] * sqrt((uh[k] * uh[k] + vh[k] * vh[k]));
+        }
+        S /= pow(h, seven_thirds);
+
+        //Update momentum
+        xmom_update[k] += S * uh[k];
+        ymom_update[k] += S * vh[k];
+      }
+    }
   }
+}
 
 
-  // Apply boundary conditions
-  //printf("update_boundary\n");
-  result = PyObject_CallMethod(domain,"update_boundary",NULL);
-  if (result == NULL) {
-     return NULL;
+int _fused_compute_fluxes_and_forcing(struct domain *D, struct fused_step *S) {
+
+  double flux_timestep;
+
+  flux_timestep = _compute_fluxes_central(D, D->evolve_max_timestep);
+
+  if (_fused_set_double(S->domain, "flux_timestep", flux_timestep) == -1) {
+    return -1;
   }
-  Py_DECREF(result);
 
+  if (S->forcing == FUSED_FORCING_PYTHON) {
+    return _fused_call_method(S->domain, "compute_forcing_terms");
+  }
 
+  if (S->forcing == FUSED_FORCING_MANNING_FLAT) {
+    _fused_manning_friction(D, 0);
+  } else if (S->forcing == FUSED_FORCING_MANNING_SLOPED) {
+    _fused_manning_friction(D, 1);
+  }
 
-  //Compute fluxes across each element edge
-  //printf("compute_fluxes\n");
-//  result = PyObject_CallMethod(domain,"compute_fluxes",NULL);
-//  if (result == NULL) {
-//     return NULL;
-//  }
-//  Py_DECREF(result);
+  return 0;
+}
 
 
-  flux_timestep =_compute_fluxes_central(&D, D.evolve_max_timestep);
+int _fused_update_timestep(struct domain *D, struct fused_step *S, double *timestep) {
+  // Same as Generic_Domain.update_timestep. The rare cases (protection
+  // against degenerate timesteps, small timesteps) are passed back to python
 
+  PyObject *result;
+  double dt, flux_timestep, CFL, time, yieldtime;
+  double recorded_max_timestep, recorded_min_timestep;
+  long order;
 
-  result = PyFloat_FromDouble(flux_timestep);
-  if (result == NULL) {
-     return NULL;
+  flux_timestep = get_python_double(S->domain, "flux_timestep");
+  CFL = get_python_double(S->domain, "CFL");
+  if (PyErr_Occurred()) {
+    return -1;
   }
-  if (!PyFloat_Check(result)) {
-     return NULL;
+
+  dt = CFL*flux_timestep;
+  if (D->evolve_max_timestep < dt) {
+    dt = D->evolve_max_timestep;
   }
-  e = PyObject_SetAttrString(domain, "flux_timestep", result);
-  if (e == -1) {
-    // Use error string set inside computational routine
-    return NULL;
+
+  if (!S->c_timestep || dt < get_python_double(S->domain, "evolve_min_timestep")) {
+    result = PyObject_CallMethod(S->domain, "update_timestep", "dd", S->yieldstep, S->finaltime);
+    if (result == NULL) {
+      return -1;
+    }
+    Py_DECREF(result);
+
+    *timestep = get_python_double(S->domain, "timestep");
+    return PyErr_Occurred() ? -1 : 0;
   }
-  Py_DECREF(result);
 
+  // Record maximal and minimal values of timestep for reporting
+  recorded_max_timestep = get_python_double(S->domain, "recorded_max_timestep");
+  recorded_min_timestep = get_python_double(S->domain, "recorded_min_timestep");
+  if (PyErr_Occurred()) {
+    return -1;
+  }
 
+  if (dt > recorded_max_timestep) {
+    if (_fused_set_double(S->domain, "recorded_max_timestep", dt) == -1) return -1;
+  }
+  if (dt < recorded_min_timestep) {
+    if (_fused_set_double(S->domain, "recorded_min_timestep", dt) == -1) return -1;
+  }
 
+  if (_fused_set_integer(S->domain, "smallsteps", 0) == -1) return -1;
 
+  order = get_python_integer(S->domain, "_order_");
+  if (order == 1 && get_python_integer(S->domain, "default_order") == 2) {
+    if (_fused_set_integer(S->domain, "_order_", 2) == -1) return -1;
+  }
 
-  //Compute forcing terms
-  //printf("compute_forcing_terms\n");
-  result = PyObject_CallMethod(domain,"compute_forcing_terms",NULL);
-  if (result == NULL) {
-     return NULL;
+  // Ensure that final time is not exceeded and
+  // that model time is aligned with yieldsteps
+  time = get_python_double(S->domain, "time");
+  yieldtime = get_python_double(S->domain, "yieldtime");
+  if (PyErr_Occurred()) {
+    return -1;
   }
-  Py_DECREF(result);
 
-  //Update timestep to fit yieldstep and finaltime
-  //printf("update_timestep\n");
-  result = PyObject_CallMethod(domain,"update_timestep","dd",yieldstep,finaltime);
-  if (result == NULL) {
-     return NULL;
+  if (time + dt > S->finaltime) {
+    dt = S->finaltime - time;
+  }
+  if (time + dt > yieldtime) {
+    dt = yieldtime - time;
   }
-  Py_DECREF(result);
 
-  //if self.max_flux_update_frequency is not 1:
-  // Update flux_update_frequency using the new timestep
-  // self.compute_flux_update_frequency()
+  *timestep = dt;
 
-  // Update conserved quantities
-  //printf("update_conserved_quantities\n");
-  result = PyObject_CallMethod(domain,"update_conserved_quantities",NULL);
-  if (result == NULL) {
-     return NULL;
+  return _fused_set_double(S->domain, "timestep", dt);
+}
+
+
+int _fused_update_quantity(long N, long num_threads, double timestep,
+        double *centroid_values,
+        double *explicit_update,
+        double *semi_implicit_update) {
+  // Same as _update in quantity_ext.c
+
+  long k;
+  int err = 0;
+  double denominator, x;
+
+  #pragma omp parallel for num_threads(num_threads) schedule(static) \
+      private(denominator, x) reduction(|:err)
+  for (k = 0; k < N; k++) {
+    x = centroid_values[k];
+    if (x == 0.0) {
+      semi_implicit_update[k] = 0.0;
+    } else {
+      semi_implicit_update[k] /= x;
+    }
+
+    centroid_values[k] += timestep*explicit_update[k];
+
+    denominator = 1.0 - timestep*semi_implicit_update[k];
+    if (denominator <= 0.0) {
+      err = 1;
+    } else {
+      centroid_values[k] /= denominator;
+    }
+
+    semi_implicit_update[k] = 0.0;
   }
-  Py_DECREF(result);
+
+  return err ? -1 : 0;
+}
+
+
+int _fused_update_conserved_quantities(struct domain *D, struct fused_step *S, double timestep) {
+
+  long k, N, number_of_negative_cells;
+  int err = 0;
+
+  N = D->number_of_elements;
+
+  err |= _fused_update_quantity(N, D->omp_num_threads, timestep, D->stage_centroid_values,
+          D->stage_explicit_update, D->stage_semi_implicit_update);
+  err |= _fused_update_quantity(N, D->omp_num_threads, timestep, D->xmom_centroid_values,
+          D->xmom_explicit_update, D->xmom_semi_implicit_update);
+  err |= _fused_update_quantity(N, D->omp_num_threads, timestep, D->ymom_centroid_values,
+          D->ymom_explicit_update, D->ymom_semi_implicit_update);
+
+  if (err != 0) {
+    PyErr_SetString(PyExc_RuntimeError,
+        "swDE1_domain_ext.c: update, division by zero in semi implicit update");
+    return -1;
+  }
+
+  if (!S->discontinuous_elevation) {
+    return 0;
+  }
+
+  number_of_negative_cells = 0;
+  for (k = 0; k < N; k++) {
+    if ((D->stage_centroid_values[k] - D->bed_centroid_values[k]) < 0.0 && D->tri_full_flag[k] > 0) {
+      D->stage_centroid_values[k] = D->bed_centroid_values[k];
+      D->xmom_centroid_values[k] = 0.0;
+      D->ymom_centroid_values[k] = 0.0;
+      number_of_negative_cells++;
+    }
+  }
+
+  if (number_of_negative_cells > 0) {
+    return PyErr_WarnEx(PyExc_UserWarning,
+        "Negative cells being set to zero depth, possible loss of conservation. \n"
+        "Consider using domain.report_water_volume_statistics() to check the extent of the problem", 1);
+  }
+
+  return 0;
+}
+
+
+void _fused_backup_conserved_quantities(struct domain *D) {
+
+  long k;
+
+  for (k = 0; k < D->number_of_elements; k++) {
+    D->stage_backup_values[k] = D->stage_centroid_values[k];
+    D->xmom_backup_values[k] = D->xmom_centroid_values[k];
+    D->ymom_backup_values[k] = D->ymom_centroid_values[k];
+  }
+}
+
+
+void _fused_saxpy_conserved_quantities(struct domain *D, double a, double b) {
+
+  long k;
+
+  for (k = 0; k < D->number_of_elements; k++) {
+    D->stage_centroid_values[k] = a*D->stage_centroid_values[k] + b*D->stage_backup_values[k];
+    D->xmom_centroid_values[k] = a*D->xmom_centroid_values[k] + b*D->xmom_backup_values[k];
+    D->ymom_centroid_values[k] = a*D->ymom_centroid_values[k] + b*D->ymom_backup_values[k];
+  }
+}
+
+
+int _fused_euler_substep(struct domain *D, struct fused_step *S,
+        int first_substep, int flux_update_frequency, double *timestep) {
+  // distribute_to_vertices_and_edges, update_boundary, compute_fluxes,
+  // compute_forcing_terms, update_timestep (first substep only)
+  // and update_conserved_quantities
+
+  if (_fused_distribute_to_vertices_and_edges(D, S) == -1) return -1;
+
+  if (_fused_update_boundary(D, S) == -1) return -1;
+
+  if (_fused_compute_fluxes_and_forcing(D, S) == -1) return -1;
+
+  if (first_substep) {
+    if (_fused_update_timestep(D, S, timestep) == -1) return -1;
+  }
+
+  if (flux_update_frequency && D->max_flux_update_frequency != 1) {
+    if (_fused_call_method(S->domain, "compute_flux_update_frequency") == -1) return -1;
+  }
+
+  return _fused_update_conserved_quantities(D, S, *timestep);
+}
+
+
+int _fused_set_time_and_update_ghosts(struct fused_step *S, double time, int update_ghosts) {
+
+  if (_fused_set_double(S->domain, "time", time) == -1) return -1;
+
+  if (update_ghosts && S->update_ghosts) {
+    return _fused_call_method(S->domain, "update_ghosts");
+  }
+
+  return 0;
+}
+
+
+struct domain* _fused_parse_arguments(PyObject *args, struct domain *DS, struct fused_step *S) {
+  // The first argument is either the python domain or its handle
+
+  PyObject *domain;
+  struct domain *D;
+
+  if (!PyArg_ParseTuple(args, "OO!ddlll", &domain, &PyList_Type, &S->boundaries,
+          &S->yieldstep, &S->finaltime, &S->forcing, &S->c_timestep, &S->update_ghosts)) {
+    report_python_error(AT, "could not parse input arguments");
+    return NULL;
+  }
+
+  D = get_domain(DS, domain);
+  if (D == NULL) {
+    return NULL;
+  }
+
+  S->domain = get_domain_from_handle(domain);
+  S->verbose = get_python_integer(S->domain, "verbose");
+  S->centroid_transmissive_bc = get_python_integer(S->domain, "centroid_transmissive_bc");
+  S->discontinuous_elevation = get_python_integer(S->domain, "using_discontinuous_elevation");
+
+  return PyErr_Occurred() ? NULL : D;
+}
+
+
+//========================================================================
+// swde1_evolve_one_euler_step
+//========================================================================
+
+PyObject *swde1_evolve_one_euler_step(PyObject *self, PyObject *args) {
+  /*
+   * One Euler timestep, see Generic_Domain.evolve_one_euler_step
+   *
+   * evolve_one_euler_step(domain, boundaries, yieldstep, finaltime,
+   *                       forcing, c_timestep, update_ghosts)
+   */
+
+  struct domain DS, *D;
+  struct fused_step S;
+  double timestep;
+
+  D = _fused_parse_arguments(args, &DS, &S);
+  if (D == NULL) return NULL;
+
+  if (_fused_euler_substep(D, &S, 1, 1, &timestep) == -1) return NULL;
 
   Py_RETURN_NONE;
 
 }// swde1_evolve_one_euler_step
 
+
+//========================================================================
+// swde1_evolve_one_rk2_step
+//========================================================================
+
+PyObject *swde1_evolve_one_rk2_step(PyObject *self, PyObject *args) {
+  /*
+   * One 2nd order RK timestep, see Generic_Domain.evolve_one_rk2_step
+   */
+
+  struct domain DS, *D;
+  struct fused_step S;
+  double timestep, initial_time;
+  long ghost_layer_width;
+
+  D = _fused_parse_arguments(args, &DS, &S);
+  if (D == NULL) return NULL;
+
+  initial_time = get_python_double(S.domain, "time");
+  ghost_layer_width = get_python_integer(S.domain, "ghost_layer_width");
+  if (PyErr_Occurred()) return NULL;
+
+  // Save initial conserved quantities values
+  _fused_backup_conserved_quantities(D);
+
+  // First euler step
+  if (_fused_euler_substep(D, &S, 1, 0, &timestep) == -1) return NULL;
+
+  if (_fused_set_time_and_update_ghosts(&S, initial_time + timestep,
+          ghost_layer_width < 4) == -1) return NULL;
+
+  // Second euler step using the same timestep
+  if (_fused_euler_substep(D, &S, 0, 0, &timestep) == -1) return NULL;
+
+  // Combine initial and final values of conserved quantities
+  _fused_saxpy_conserved_quantities(D, 0.5, 0.5);
+
+  Py_RETURN_NONE;
+
+}// swde1_evolve_one_rk2_step
+
+
+//========================================================================
+// swde1_evolve_one_rk3_step
+//========================================================================
+
+PyObject *swde1_evolve_one_rk3_step(PyObject *self, PyObject *args) {
+  /*
+   * One 3rd order RK timestep, see Generic_Domain.evolve_one_rk3_step
+   */
+
+  struct domain DS, *D;
+  struct fused_step S;
+  double timestep, initial_time;
+  long k;
+
+  D = _fused_parse_arguments(args, &DS, &S);
+  if (D == NULL) return NULL;
+
+  initial_time = get_python_double(S.domain, "time");
+  if (PyErr_Occurred()) return NULL;
+
+  // Save initial conserved quantities values
+  _fused_backup_conserved_quantities(D);
+
+  // First euler step
+  if (_fused_euler_substep(D, &S, 1, 0, &timestep) == -1) return NULL;
+
+  if (_fused_set_time_and_update_ghosts(&S, initial_time + timestep, 1) == -1) return NULL;
+
+  // Second euler step using the same timestep
+  if (_fused_euler_substep(D, &S, 0, 0, &timestep) == -1) return NULL;
+
+  // Intermediate solution at time t^n + 0.5 h
+  _fused_saxpy_conserved_quantities(D, 0.25, 0.75);
+
+  if (_fused_set_time_and_update_ghosts(&S, initial_time + timestep*0.5, 1) == -1) return NULL;
+
+  // Third euler step
+  if (_fused_euler_substep(D, &S, 0, 0, &timestep) == -1) return NULL;
+
+  // Combine final and initial values (as 2/3 and 1/3 in two
+  // stages to avoid roundoff creating negative water heights)
+  _fused_saxpy_conserved_quantities(D, 2.0, 1.0);
+  for (k = 0; k < D->number_of_elements; k++) {
+    D->stage_centroid_values[k] = D->stage_centroid_values[k]/3.0;
+    D->xmom_centroid_values[k] = D->xmom_centroid_values[k]/3.0;
+    D->ymom_centroid_values[k] = D->ymom_centroid_values[k]/3.0;
+  }
+
+  if (_fused_set_time_and_update_ghosts(&S, initial_time + timestep, 0) == -1) return NULL;
+
+  Py_RETURN_NONE;
+
+}// swde1_evolve_one_rk3_step
+
+//========================================================================
+// domain_handle -- cached domain structure (see Domain.get_c_domain)
+//========================================================================
+
+PyObject *swde1_domain_handle(PyObject *self, PyObject *args) {
+
+  PyObject *domain;
+
+  if (!PyArg_ParseTuple(args, "O", &domain)) {
+      report_python_error(AT, "could not parse input arguments");
+      return NULL;
+  }
+
+  return new_domain_handle(domain);
+}
+
+//========================================================================
+// update_boundary -- evaluate the boundary segments of
+// Domain.get_boundary_segments with the kernels of sw_boundaries.h
+//========================================================================
+
+PyObject *swde1_update_boundary(PyObject *self, PyObject *args) {
+
+  struct domain DS, *D;
+  PyObject *domain, *boundaries;
+  long centroid_transmissive_bc;
+
+  if (!PyArg_ParseTuple(args, "OO!l", &domain, &PyList_Type, &boundaries,
+                        &centroid_transmissive_bc)) {
+      report_python_error(AT, "could not parse input arguments");
+      return NULL;
+  }
+
+  D = get_domain(&DS, domain);
+  if (D == NULL) {
+    return NULL;
+  }
+
+  if (_update_boundary_segments(D, get_domain_from_handle(domain), boundaries,
+                                centroid_transmissive_bc) == -1) {
+    return NULL;
+  }
+
+  return Py_BuildValue("");
+}
+
+//========================================================================
+// openmp_enabled -- was this module compiled with OpenMP support
+//========================================================================
+
+PyObject *swde1_openmp_enabled(PyObject *self, PyObject *args) {
+
+#ifdef _OPENMP
+  return Py_BuildValue("i", 1);
+#else
+  return Py_BuildValue("i", 0);
+#endif
+}
+
 //========================================================================
 // Method table for python module
 //========================================================================
@@ -2465,7 +3138,12 @@ static struct PyMethodDef MethodTable[] = {
   {"compute_flux_update_frequency", swde1_compute_flux_update_frequency, METH_VARARGS, "Print out"},
   {"protect",          swde1_protect, METH_VARARGS | METH_KEYWORDS, "Print out"},
   {"protect_new",      swde1_protect_new, METH_VARARGS | METH_KEYWORDS, "Print out"},
-  {"evolve_one_euler_step", swde1_evolve_one_euler_step, METH_VARARGS | METH_KEYWORDS, "Print out"},
+  {"evolve_one_euler_step", swde1_evolve_one_euler_step, METH_VARARGS, "Print out"},
+  {"evolve_one_rk2_step", swde1_evolve_one_rk2_step, METH_VARARGS, "Print out"},
+  {"evolve_one_rk3_step", swde1_evolve_one_rk3_step, METH_VARARGS, "Print out"},
+  {"domain_handle",    swde1_domain_handle, METH_VARARGS, "Print out"},
+  {"update_boundary",  swde1_update_boundary, METH_VARARGS, "Print out"},
+  {"openmp_enabled",   swde1_openmp_enabled, METH_VARARGS, "Print out"},
   {NULL, NULL, 0, NULL}
 };
 
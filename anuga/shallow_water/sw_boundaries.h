@@ -0,0 +1,474 @@
+// Boundary kernels of the shallow water domain
+//
+// Each kernel sets the boundary values of the edges ids[0..m-1] (indices
+// into boundary_cells and boundary_edges) in place, using the edge and
+// centroid values of the domain structure, the same way as the
+// evaluate_segment (or evaluate) method of the corresponding boundary
+// class. The time dependent values of a boundary (e.g. the stage of a
+// Transmissive_momentum_set_stage_boundary at the current time) are
+// passed in q, as returned by the get_kernel_values method of the boundary
+// (or, for the tabulated time boundaries, interpolated here from their
+// table without calling python).
+//
+// The codes are those of Domain.get_boundary_kernel_codes, code
+// BOUNDARY_PYTHON means call the evaluate_segment method of the boundary.
+
+
+
+#define BOUNDARY_PYTHON                          0
+#define BOUNDARY_REFLECTIVE                      1
+#define BOUNDARY_DIRICHLET                       2
+#define BOUNDARY_TRANSMISSIVE                    3
+#define BOUNDARY_TRANSMISSIVE_MOMENTUM_SET_STAGE 4
+#define BOUNDARY_TRANSMISSIVE_N_MOMENTUM_ZERO_T_MOMENTUM_SET_STAGE 5
+#define BOUNDARY_TRANSMISSIVE_STAGE_ZERO_MOMENTUM 6
+#define BOUNDARY_DIRICHLET_DISCHARGE             7
+#define BOUNDARY_INFLOW                          8
+#define BOUNDARY_FLATHER                         9
+#define BOUNDARY_TABULATED_TIME                  10
+
+#define NUMBER_OF_BOUNDARY_CODES                 11
+
+
+// Number of values (get_kernel_values) of each boundary code,
+// 0 if the boundary has none
+static const long boundary_kernel_values[NUMBER_OF_BOUNDARY_CODES] =
+    {0, 0, 3, 0, 1, 1, 0, 2, 2, 2, 0};
+
+
+void _boundary_reflective(struct domain *D, long *ids, long m) {
+  // Reflective_boundary: reflect momentum and velocity
+
+  long i, k, e, ki;
+  double n1, n2, q1, q2, r1, r2;
+
+  for (i = 0; i < m; i++) {
+    k = D->boundary_cells[ids[i]];
+    e = D->boundary_edges[ids[i]];
+    ki = 3*k + e;
+
+    n1 = D->normals[2*ki];
+    n2 = D->normals[2*ki + 1];
+
+    // Transfer these quantities to the boundary array
+    D->stage_boundary_values[ids[i]] = D->stage_edge_values[ki];
+    D->bed_boundary_values[ids[i]] = D->bed_edge_values[ki];
+    D->height_boundary_values[ids[i]] = D->height_edge_values[ki];
+
+    // Rotate and negate momentum
+    q1 = D->xmom_edge_values[ki];
+    q2 = D->ymom_edge_values[ki];
+
+    r1 = -q1*n1 - q2*n2;
+    r2 = -q1*n2 + q2*n1;
+
+    D->xmom_boundary_values[ids[i]] = n1*r1 - n2*r2;
+    D->ymom_boundary_values[ids[i]] = n2*r1 + n1*r2;
+
+    // Rotate and negate velocity
+    q1 = D->xvel_edge_values[ki];
+    q2 = D->yvel_edge_values[ki];
+
+    r1 = q1*n1 + q2*n2;
+    r2 = q1*n2 - q2*n1;
+
+    D->xvel_boundary_values[ids[i]] = n1*r1 - n2*r2;
+    D->yvel_boundary_values[ids[i]] = n2*r1 + n1*r2;
+  }
+}
+
+
+void _boundary_dirichlet(struct domain *D, long *ids, long m, double *q) {
+  // Dirichlet_boundary, Time_boundary, Time_stage_zero_momentum_boundary
+  // and the tabulated time boundaries: q = [stage, xmomentum, ymomentum]
+
+  long i;
+
+  for (i = 0; i < m; i++) {
+    D->stage_boundary_values[ids[i]] = q[0];
+    D->xmom_boundary_values[ids[i]] = q[1];
+    D->ymom_boundary_values[ids[i]] = q[2];
+  }
+}
+
+
+void _boundary_transmissive(struct domain *D, long *ids, long m,
+                            long centroid_transmissive_bc) {
+  // Transmissive_boundary: the edge (or centroid) values
+
+  long i, k, e, ki;
+
+  for (i = 0; i < m; i++) {
+    k = D->boundary_cells[ids[i]];
+    e = D->boundary_edges[ids[i]];
+    ki = 3*k + e;
+
+    if (centroid_transmissive_bc) {
+      D->stage_boundary_values[ids[i]] = D->stage_centroid_values[k];
+      D->xmom_boundary_values[ids[i]] = D->xmom_centroid_values[k];
+      D->ymom_boundary_values[ids[i]] = D->ymom_centroid_values[k];
+    } else {
+      D->stage_boundary_values[ids[i]] = D->stage_edge_values[ki];
+      D->xmom_boundary_values[ids[i]] = D->xmom_edge_values[ki];
+      D->ymom_boundary_values[ids[i]] = D->ymom_edge_values[ki];
+    }
+  }
+}
+
+
+void _boundary_transmissive_momentum_set_stage(struct domain *D, long *ids, long m, double *q) {
+  // Transmissive_momentum_set_stage_boundary: q = [stage]
+
+  long i, ki;
+
+  for (i = 0; i < m; i++) {
+    ki = 3*D->boundary_cells[ids[i]] + D->boundary_edges[ids[i]];
+
+    D->stage_boundary_values[ids[i]] = q[0];
+    D->xmom_boundary_values[ids[i]] = D->xmom_edge_values[ki];
+    D->ymom_boundary_values[ids[i]] = D->ymom_edge_values[ki];
+  }
+}
+
+
+void _boundary_transmissive_n_momentum_zero_t_momentum_set_stage(struct domain *D, long *ids, long m, double *q) {
+  // Transmissive_n_momentum_zero_t_momentum_set_stage_boundary: q = [stage]
+
+  long i, ki;
+  double n1, n2, ndotq;
+
+  for (i = 0; i < m; i++) {
+    ki = 3*D->boundary_cells[ids[i]] + D->boundary_edges[ids[i]];
+
+    n1 = D->normals[2*ki];
+    n2 = D->normals[2*ki + 1];
+
+    // Momentum normal to the edge
+    ndotq = n1*D->xmom_edge_values[ki] + n2*D->ymom_edge_values[ki];
+
+    D->stage_boundary_values[ids[i]] = q[0];
+    D->xmom_boundary_values[ids[i]] = ndotq*n1;
+    D->ymom_boundary_values[ids[i]] = ndotq*n2;
+  }
+}
+
+
+void _boundary_transmissive_stage_zero_momentum(struct domain *D, long *ids, long m) {
+  // Transmissive_stage_zero_momentum_boundary
+
+  long i, ki;
+
+  for (i = 0; i < m; i++) {
+    ki = 3*D->boundary_cells[ids[i]] + D->boundary_edges[ids[i]];
+
+    D->stage_boundary_values[ids[i]] = D->stage_edge_values[ki];
+    D->xmom_boundary_values[ids[i]] = 0.0;
+    D->ymom_boundary_values[ids[i]] = 0.0;
+  }
+}
+
+
+void _boundary_dirichlet_discharge(struct domain *D, long *ids, long m, double *q) {
+  // Dirichlet_discharge_boundary: q = [stage0, wh0], with the discharge
+  // wh0 in the inward normal direction
+
+  long i, ki;
+
+  for (i = 0; i < m; i++) {
+    ki = 3*D->boundary_cells[ids[i]] + D->boundary_edges[ids[i]];
+
+    D->stage_boundary_values[ids[i]] = q[0];
+    D->xmom_boundary_values[ids[i]] = -q[1]*D->normals[2*ki];
+    D->ymom_boundary_values[ids[i]] = -q[1]*D->normals[2*ki + 1];
+  }
+}
+
+
+void _boundary_inflow(struct domain *D, long *ids, long m, double *q) {
+  // Inflow_boundary: q = [average_momentum, depth], with the momentum
+  // in the inward normal direction
+
+  long i, ki;
+
+  for (i = 0; i < m; i++) {
+    ki = 3*D->boundary_cells[ids[i]] + D->boundary_edges[ids[i]];
+
+    D->stage_boundary_values[ids[i]] = D->bed_edge_values[ki] + q[1];
+    D->xmom_boundary_values[ids[i]] = -q[0]*D->normals[2*ki];
+    D->ymom_boundary_values[ids[i]] = -q[0]*D->normals[2*ki + 1];
+  }
+}
+
+
+void _boundary_flather(struct domain *D, long *ids, long m, double *q) {
+  // Flather_external_stage_zero_velocity_boundary: q = [stage_outside, g]
+  // (see the python class for the theory)
+
+  long i, k, ki;
+  double n1, n2, w, uh, vh, depth, sqrt_g_on_depth, ndotq, w1, w2, w3;
+  double qperp, qpar;
+  double stage_outside = q[0];
+  double g = q[1];
+
+  for (i = 0; i < m; i++) {
+    k = D->boundary_cells[ids[i]];
+    ki = 3*k + D->boundary_edges[ids[i]];
+
+    n1 = D->normals[2*ki];
+    n2 = D->normals[2*ki + 1];
+
+    w = D->stage_edge_values[ki];
+    uh = D->xmom_edge_values[ki];
+    vh = D->ymom_edge_values[ki];
+
+    D->bed_boundary_values[ids[i]] = D->bed_edge_values[ki];
+
+    depth = w - D->bed_centroid_values[k];
+    if (depth <= 0.0) {
+      D->stage_boundary_values[ids[i]] = stage_outside;
+      D->xmom_boundary_values[ids[i]] = 0.0;
+      D->ymom_boundary_values[ids[i]] = 0.0;
+      continue;
+    }
+
+    // Subcritical flow, the outside velocity is zero
+    sqrt_g_on_depth = sqrt(g/depth);
+    ndotq = n1*uh + n2*vh;
+
+    w1 = -sqrt_g_on_depth*stage_outside;
+    if (ndotq > 0.0) {
+      // Outflow, the tangential velocity from inside
+      w2 = (n2*uh - n1*vh)/depth;
+    } else {
+      // Inflow, the tangential velocity from outside
+      w2 = 0.0;
+    }
+    w3 = ndotq/depth + sqrt_g_on_depth*w;
+
+    qperp = (w3 + w1)/2.0*depth;
+    qpar = w2*depth;
+
+    D->stage_boundary_values[ids[i]] = (w3 - w1)/(2.0*sqrt_g_on_depth);
+    D->xmom_boundary_values[ids[i]] = qperp*n1 + qpar*n2;
+    D->ymom_boundary_values[ids[i]] = qperp*n2 - qpar*n1;
+  }
+}
+
+
+int _get_tabulated_time_values(PyObject *B, double t, double *q) {
+  // Values of the table (times, values) of a Tabulated_time_boundary B
+  // at time t, linearly interpolated as in Tabulated_time_boundary.function,
+  // starting from the cached interval B.index.
+  // Returns 1 with the values in q[0..2], 0 if t is outside the table
+  // (for python to raise or use the default boundary) or -1 on error.
+
+  PyArrayObject *times, *values, *index;
+  double *T, *V;
+  double ratio;
+  long i, j, n, found = 0;
+  long *I;
+
+  times = get_consecutive_array(B, "times");
+  values = get_consecutive_array(B, "values");
+  index = get_consecutive_array(B, "index");
+
+  if (times == NULL || values == NULL || index == NULL) {
+    Py_XDECREF(times);
+    Py_XDECREF(values);
+    Py_XDECREF(index);
+    return -1;
+  }
+
+  n = times->dimensions[0];
+  T = (double *) times->data;
+  V = (double *) values->data;
+  I = (long *) index->data;
+
+  if (n > 0 && values->nd == 2 && values->dimensions[0] == n &&
+      values->dimensions[1] == 3 && t >= T[0] && t <= T[n-1]) {
+
+    if (n == 1) {
+      for (j = 0; j < 3; j++) {
+        q[j] = V[j];
+      }
+    } else {
+      // Move from the last interval, as t usually changes a little
+      i = I[0];
+      if (i < 0 || i > n - 2) {
+        i = 0;
+      }
+      while (i < n - 2 && t > T[i+1]) {
+        i++;
+      }
+      while (i > 0 && t < T[i]) {
+        i--;
+      }
+      I[0] = i;
+
+      ratio = (t - T[i])/(T[i+1] - T[i]);
+      for (j = 0; j < 3; j++) {
+        q[j] = V[3*i + j] + ratio*(V[3*(i+1) + j] - V[3*i + j]);
+      }
+    }
+
+    found = 1;
+  }
+
+  Py_DECREF(times);
+  Py_DECREF(values);
+  Py_DECREF(index);
+
+  return found;
+}
+
+
+int _evaluate_boundary_kernel(struct domain *D, long code, long *ids, long m,
+                              double *q, long centroid_transmissive_bc) {
+
+  switch (code) {
+    case BOUNDARY_REFLECTIVE:
+      _boundary_reflective(D, ids, m);
+      break;
+    case BOUNDARY_DIRICHLET:
+      _boundary_dirichlet(D, ids, m, q);
+      break;
+    case BOUNDARY_TRANSMISSIVE:
+      _boundary_transmissive(D, ids, m, centroid_transmissive_bc);
+      break;
+    case BOUNDARY_TRANSMISSIVE_MOMENTUM_SET_STAGE:
+      _boundary_transmissive_momentum_set_stage(D, ids, m, q);
+      break;
+    case BOUNDARY_TRANSMISSIVE_N_MOMENTUM_ZERO_T_MOMENTUM_SET_STAGE:
+      _boundary_transmissive_n_momentum_zero_t_momentum_set_stage(D, ids, m, q);
+      break;
+    case BOUNDARY_TRANSMISSIVE_STAGE_ZERO_MOMENTUM:
+      _boundary_transmissive_stage_zero_momentum(D, ids, m);
+      break;
+    case BOUNDARY_DIRICHLET_DISCHARGE:
+      _boundary_dirichlet_discharge(D, ids, m, q);
+      break;
+    case BOUNDARY_INFLOW:
+      _boundary_inflow(D, ids, m, q);
+      break;
+    case BOUNDARY_FLATHER:
+      _boundary_flather(D, ids, m, q);
+      break;
+    case BOUNDARY_TABULATED_TIME:
+      _boundary_dirichlet(D, ids, m, q);
+      break;
+    default:
+      report_python_error(AT, "unknown boundary code");
+      return -1;
+  }
+
+  return 0;
+}
+
+
+int _update_boundary_segments(struct domain *D, PyObject *domain,
+                              PyObject *boundaries, long centroid_transmissive_bc) {
+  // Evaluate the list of boundary segments (code, segment_edges, boundary)
+  // of Domain.get_boundary_segments. The segment_edges of segments with
+  // code > 0 are integer arrays.
+
+  Py_ssize_t j, number_of_segments;
+  long code, m;
+  long *ids;
+  double *q;
+  double time = 0.0, table_values[3];
+  int have_time = 0, found;
+
+  PyObject *segment, *B, *values, *result;
+  PyArrayObject *segment_edges, *kernel_values;
+
+  number_of_segments = PyList_Size(boundaries);
+
+  for (j = 0; j < number_of_segments; j++) {
+
+    segment = PyList_GetItem(boundaries, j); // Borrowed reference
+
+    if (!PyArg_ParseTuple(segment, "lOO", &code, &segment_edges, &B)) {
+      return -1;
+    }
+
+    if (code < 0 || code >= NUMBER_OF_BOUNDARY_CODES) {
+      report_python_error(AT, "unknown boundary code");
+      return -1;
+    }
+
+    kernel_values = NULL;
+    q = NULL;
+
+    if (code != BOUNDARY_PYTHON && boundary_kernel_values[code] > 0) {
+      values = PyObject_CallMethod(B, "get_kernel_values", "OO", domain, segment_edges);
+      if (values == NULL) {
+        return -1;
+      }
+
+      if (values == Py_None) {
+        // The boundary cannot be evaluated by the kernel at this time
+        code = BOUNDARY_PYTHON;
+      } else {
+        kernel_values = (PyArrayObject *)
+            PyArray_ContiguousFromObject(values, PyArray_DOUBLE, 1, 1);
+        if (kernel_values == NULL) {
+          Py_DECREF(values);
+          return -1;
+        }
+
+        if (kernel_values->dimensions[0] == boundary_kernel_values[code]) {
+          q = (double *) kernel_values->data;
+        } else {
+          // Let python deal with the more general cases
+          // (e.g. a Dirichlet_boundary of all the evolved quantities)
+          code = BOUNDARY_PYTHON;
+        }
+      }
+      Py_DECREF(values);
+    }
+
+    if (code == BOUNDARY_TABULATED_TIME) {
+      if (!have_time) {
+        time = get_python_double(domain, "time");
+        if (PyErr_Occurred()) {
+          return -1;
+        }
+        have_time = 1;
+      }
+
+      found = _get_tabulated_time_values(B, time, table_values);
+      if (found == -1) {
+        return -1;
+      }
+
+      if (found) {
+        q = table_values;
+      } else {
+        code = BOUNDARY_PYTHON;
+      }
+    }
+
+    if (code == BOUNDARY_PYTHON) {
+      Py_XDECREF(kernel_values);
+
+      result = PyObject_CallMethod(B, "evaluate_segment", "OO", domain, segment_edges);
+      if (result == NULL) {
+        return -1;
+      }
+      Py_DECREF(result);
+      continue;
+    }
+
+    m = segment_edges->dimensions[0];
+    ids = (long *) segment_edges->data;
+
+    if (_evaluate_boundary_kernel(D, code, ids, m, q, centroid_transmissive_bc) == -1) {
+      Py_XDECREF(kernel_values);
+      return -1;
+    }
+
+    Py_XDECREF(kernel_values);
+  }
+
+  return 0;
+}
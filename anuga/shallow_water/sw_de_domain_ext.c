@@ -1940,7 +1940,7 @@ PyObject *swde1_compute_fluxes_ext_central(PyObject *self, PyObject *args) {
     is converted to a timestep that must not be exceeded. The minimum of
     those is computed as the next overall timestep.
   */
-  struct domain D;
+  struct domain DS, *D;
   PyObject *domain;
 
    
@@ -1951,9 +1951,12 @@ PyObject *swde1_compute_fluxes_ext_central(PyObject *self, PyObject *args) {
       return NULL;
   }
     
-  get_python_domain(&D,domain);
+  D = get_domain(&DS, domain);
+  if (D == NULL) {
+    return NULL;
+  }
 
-  timestep=_compute_fluxes_central(&D,timestep);
+  timestep=_compute_fluxes_central(D,timestep);
 
   // Return updated flux timestep
   return Py_BuildValue("d", timestep);
@@ -2089,7 +2092,7 @@ PyObject *swde1_compute_flux_update_frequency(PyObject *self, PyObject *args) {
 
   */
 
-  struct domain D;
+  struct domain DS, *D;
   PyObject *domain;
   
     
@@ -2100,9 +2103,12 @@ PyObject *swde1_compute_flux_update_frequency(PyObject *self, PyObject *args) {
       return NULL;
   }
     
-  get_python_domain(&D,domain);
+  D = get_domain(&DS, domain);
+  if (D == NULL) {
+    return NULL;
+  }
 
-  _compute_flux_update_frequency(&D, timestep);
+  _compute_flux_update_frequency(D, timestep);
 
   // Return 
   return Py_BuildValue("");
@@ -2120,7 +2126,7 @@ PyObject *swde1_extrapolate_second_order_edge_sw(PyObject *self, PyObject *args)
 
   */
  
-  struct domain D; 
+  struct domain DS, *D; 
   PyObject *domain;
 
   int e;
@@ -2130,11 +2136,14 @@ PyObject *swde1_extrapolate_second_order_edge_sw(PyObject *self, PyObject *args)
       return NULL;
   }
   
-  get_python_domain(&D, domain);
+  D = get_domain(&DS, domain);
+  if (D == NULL) {
+    return NULL;
+  }
 
   // Call underlying flux computation routine and update
   // the explicit update arrays
-  e = _extrapolate_second_order_edge_sw(&D);
+  e = _extrapolate_second_order_edge_sw(D);
 
   if (e == -1) {
     // Use error string set inside computational routine
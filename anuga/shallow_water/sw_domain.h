@@ -34,6 +34,14 @@ struct domain {
     long max_flux_update_frequency;
     long ncol_riverwall_hydraulic_properties;
 
+    long omp_num_threads;
+
+    // Ghost exchange overlap (see Parallel_domain.set_ghost_exchange_overlap).
+    // Phase 0 processes all triangles, phases 1 and 2 split them using the
+    // halo_level array, which is only set for phases 1 and 2
+    long overlap_phase;
+    long* halo_level;
+
     // Changing values in these arrays will change the values in the python object
     long*   neighbours;
     long*   neighbour_edges;
@@ -44,6 +52,7 @@ struct domain {
     double* areas;
 
     long* edge_flux_type;
+    long* edge_river_wall_counter;
 
     long*   tri_full_flag;
     long*   already_computed_flux;
@@ -77,11 +86,30 @@ struct domain {
     double* xmom_boundary_values;
     double* ymom_boundary_values;
     double* bed_boundary_values;
+    double* height_boundary_values;
+
+    double* xvel_edge_values;
+    double* yvel_edge_values;
+    double* xvel_boundary_values;
+    double* yvel_boundary_values;
 
     double* stage_explicit_update;
     double* xmom_explicit_update;
     double* ymom_explicit_update;
 
+    double* stage_semi_implicit_update;
+    double* xmom_semi_implicit_update;
+    double* ymom_semi_implicit_update;
+
+    double* stage_backup_values;
+    double* xmom_backup_values;
+    double* ymom_backup_values;
+
+    double* friction_centroid_values;
+
+    long*   boundary_cells;
+    long*   boundary_edges;
+
     long* flux_update_frequency;    
     long* update_next_flux;
     long* update_extrapolation;
@@ -168,39 +196,55 @@ void get_edge_data(struct edge *E, struct domain *D, int k, int i) {
 }
 
 
-struct domain* get_python_domain(struct domain *D, PyObject *domain) {
-    PyArrayObject
-            *neighbours,
-            *neighbour_edges,
-            *normals,
-            *edgelengths,
-            *radii,
-            *areas,
-            *edge_flux_type,
-            *tri_full_flag,
-            *already_computed_flux,
-            *vertex_coordinates,
-            *edge_coordinates,
-            *centroid_coordinates,
-            *number_of_boundaries,
-            *surrogate_neighbours,
-            *max_speed,
-            *flux_update_frequency,
-            *update_next_flux,
-            *update_extrapolation,
-            *allow_timestep_increase,
-            *edge_timestep,
-            *edge_flux_work,
-            *pressuregrad_work,
-            *x_centroid_work,
-            *y_centroid_work,
-            *boundary_flux_sum,
-            *riverwall_elevation,
-            *riverwall_rowIndex,
-            *riverwall_hydraulic_properties;
+void* get_python_array_data(PyObject *O, char *name, PyObject *references) {
+    // Data of the (consecutive) array attribute name of O. If references
+    // is not NULL the array is appended to it, which keeps the data valid
+    // for as long as references is kept.
 
-    PyObject *quantities;
-    PyObject *riverwallData;
+    PyArrayObject *A;
+    void *data;
+
+    if (PyErr_Occurred()) {
+        return NULL;
+    }
+
+    A = get_consecutive_array(O, name); // New Reference
+    if (!A) {
+        return NULL;
+    }
+
+    data = (void *) A->data;
+
+    if (references != NULL) {
+        PyList_Append(references, (PyObject *) A);
+    }
+    Py_DECREF(A);
+
+    return data;
+}
+
+
+double* get_python_quantity_data(PyObject *quantities, char *name, char *array, PyObject *references) {
+    // Data of array (e.g. edge_values) of quantity name
+
+    PyObject *Q;
+
+    if (PyErr_Occurred()) {
+        return NULL;
+    }
+
+    Q = PyDict_GetItemString(quantities, name); // Borrowed Reference
+    if (!Q) {
+        PyErr_Format(PyExc_RuntimeError, "sw_domain.h: domain has no quantity %s", name);
+        return NULL;
+    }
+
+    return (double *) get_python_array_data(Q, array, references);
+}
+
+
+struct domain* get_python_domain_parameters(struct domain *D, PyObject *domain) {
+    // Scalar parameters, which may change at any time
 
     D->number_of_elements   = get_python_integer(domain, "number_of_elements");
     D->epsilon              = get_python_double(domain, "epsilon");
@@ -223,157 +267,252 @@ struct domain* get_python_domain(struct domain *D, PyObject *domain) {
     D->beta_vh_dry = get_python_double(domain, "beta_vh_dry");
 
     D->max_flux_update_frequency = get_python_integer(domain,"max_flux_update_frequency");
-    
-    neighbours = get_consecutive_array(domain, "neighbours");
-    D->neighbours = (long *) neighbours->data;
 
-    surrogate_neighbours = get_consecutive_array(domain, "surrogate_neighbours");
-    D->surrogate_neighbours = (long *) surrogate_neighbours->data;
+    D->omp_num_threads = get_python_integer(domain, "omp_num_threads");
 
-    neighbour_edges = get_consecutive_array(domain, "neighbour_edges");
-    D->neighbour_edges = (long *) neighbour_edges->data;
+    D->overlap_phase = 0;
+    D->halo_level = NULL;
 
-    normals = get_consecutive_array(domain, "normals");
-    D->normals = (double *) normals->data;
+    return D;
+}
 
-    edgelengths = get_consecutive_array(domain, "edgelengths");
-    D->edgelengths = (double *) edgelengths->data;
 
-    radii = get_consecutive_array(domain, "radii");
-    D->radii = (double *) radii->data;
+struct domain* get_python_domain_arrays(struct domain *D, PyObject *domain, PyObject *references) {
+    // Arrays (and the riverwall table size), which only change if
+    // the arrays are replaced
 
-    areas = get_consecutive_array(domain, "areas");
-    D->areas = (double *) areas->data;
+    PyObject *quantities;
+    PyObject *riverwallData;
 
-    edge_flux_type = get_consecutive_array(domain, "edge_flux_type");
-    D->edge_flux_type = (long *) edge_flux_type->data;
+    D->neighbours            = (long *) get_python_array_data(domain, "neighbours", references);
+    D->surrogate_neighbours  = (long *) get_python_array_data(domain, "surrogate_neighbours", references);
+    D->neighbour_edges       = (long *) get_python_array_data(domain, "neighbour_edges", references);
+    D->normals               = (double *) get_python_array_data(domain, "normals", references);
+    D->edgelengths           = (double *) get_python_array_data(domain, "edgelengths", references);
+    D->radii                 = (double *) get_python_array_data(domain, "radii", references);
+    D->areas                 = (double *) get_python_array_data(domain, "areas", references);
+
+    D->edge_flux_type          = (long *) get_python_array_data(domain, "edge_flux_type", references);
+    D->edge_river_wall_counter = (long *) get_python_array_data(domain, "edge_river_wall_counter", references);
+
+    D->tri_full_flag         = (long *) get_python_array_data(domain, "tri_full_flag", references);
+    D->already_computed_flux = (long *) get_python_array_data(domain, "already_computed_flux", references);
+    D->boundary_cells        = (long *) get_python_array_data(domain, "boundary_cells", references);
+    D->boundary_edges        = (long *) get_python_array_data(domain, "boundary_edges", references);
+
+    D->vertex_coordinates    = (double *) get_python_array_data(domain, "vertex_coordinates", references);
+    D->edge_coordinates      = (double *) get_python_array_data(domain, "edge_coordinates", references);
+    D->centroid_coordinates  = (double *) get_python_array_data(domain, "centroid_coordinates", references);
+
+    D->max_speed             = (double *) get_python_array_data(domain, "max_speed", references);
+    D->number_of_boundaries  = (long *) get_python_array_data(domain, "number_of_boundaries", references);
+
+    D->flux_update_frequency   = (long *) get_python_array_data(domain, "flux_update_frequency", references);
+    D->update_next_flux        = (long *) get_python_array_data(domain, "update_next_flux", references);
+    D->update_extrapolation    = (long *) get_python_array_data(domain, "update_extrapolation", references);
+    D->allow_timestep_increase = (long *) get_python_array_data(domain, "allow_timestep_increase", references);
+    D->edge_timestep           = (double *) get_python_array_data(domain, "edge_timestep", references);
+    D->edge_flux_work          = (double *) get_python_array_data(domain, "edge_flux_work", references);
+    D->pressuregrad_work       = (double *) get_python_array_data(domain, "pressuregrad_work", references);
+    D->x_centroid_work         = (double *) get_python_array_data(domain, "x_centroid_work", references);
+    D->y_centroid_work         = (double *) get_python_array_data(domain, "y_centroid_work", references);
+    D->boundary_flux_sum       = (double *) get_python_array_data(domain, "boundary_flux_sum", references);
 
+    quantities = get_python_object(domain, "quantities");
+    if (!quantities) {
+        return NULL;
+    }
+
+    D->stage_edge_values     = get_python_quantity_data(quantities, "stage",     "edge_values", references);
+    D->xmom_edge_values      = get_python_quantity_data(quantities, "xmomentum", "edge_values", references);
+    D->ymom_edge_values      = get_python_quantity_data(quantities, "ymomentum", "edge_values", references);
+    D->bed_edge_values       = get_python_quantity_data(quantities, "elevation", "edge_values", references);
+    D->height_edge_values    = get_python_quantity_data(quantities, "height",    "edge_values", references);
+
+    D->stage_centroid_values = get_python_quantity_data(quantities, "stage",     "centroid_values", references);
+    D->xmom_centroid_values  = get_python_quantity_data(quantities, "xmomentum", "centroid_values", references);
+    D->ymom_centroid_values  = get_python_quantity_data(quantities, "ymomentum", "centroid_values", references);
+    D->bed_centroid_values   = get_python_quantity_data(quantities, "elevation", "centroid_values", references);
+    D->height_centroid_values = get_python_quantity_data(quantities, "height",   "centroid_values", references);
+
+    D->stage_vertex_values   = get_python_quantity_data(quantities, "stage",     "vertex_values", references);
+    D->xmom_vertex_values    = get_python_quantity_data(quantities, "xmomentum", "vertex_values", references);
+    D->ymom_vertex_values    = get_python_quantity_data(quantities, "ymomentum", "vertex_values", references);
+    D->bed_vertex_values     = get_python_quantity_data(quantities, "elevation", "vertex_values", references);
+    D->height_vertex_values  = get_python_quantity_data(quantities, "height",    "vertex_values", references);
+
+    D->stage_boundary_values = get_python_quantity_data(quantities, "stage",     "boundary_values", references);
+    D->xmom_boundary_values  = get_python_quantity_data(quantities, "xmomentum", "boundary_values", references);
+    D->ymom_boundary_values  = get_python_quantity_data(quantities, "ymomentum", "boundary_values", references);
+    D->bed_boundary_values   = get_python_quantity_data(quantities, "elevation", "boundary_values", references);
+    D->height_boundary_values = get_python_quantity_data(quantities, "height",   "boundary_values", references);
+
+    D->xvel_edge_values      = get_python_quantity_data(quantities, "xvelocity", "edge_values", references);
+    D->yvel_edge_values      = get_python_quantity_data(quantities, "yvelocity", "edge_values", references);
+    D->xvel_boundary_values  = get_python_quantity_data(quantities, "xvelocity", "boundary_values", references);
+    D->yvel_boundary_values  = get_python_quantity_data(quantities, "yvelocity", "boundary_values", references);
+
+    D->stage_explicit_update = get_python_quantity_data(quantities, "stage",     "explicit_update", references);
+    D->xmom_explicit_update  = get_python_quantity_data(quantities, "xmomentum", "explicit_update", references);
+    D->ymom_explicit_update  = get_python_quantity_data(quantities, "ymomentum", "explicit_update", references);
+
+    D->stage_semi_implicit_update = get_python_quantity_data(quantities, "stage",     "semi_implicit_update", references);
+    D->xmom_semi_implicit_update  = get_python_quantity_data(quantities, "xmomentum", "semi_implicit_update", references);
+    D->ymom_semi_implicit_update  = get_python_quantity_data(quantities, "ymomentum", "semi_implicit_update", references);
+
+    D->stage_backup_values   = get_python_quantity_data(quantities, "stage",     "centroid_backup_values", references);
+    D->xmom_backup_values    = get_python_quantity_data(quantities, "xmomentum", "centroid_backup_values", references);
+    D->ymom_backup_values    = get_python_quantity_data(quantities, "ymomentum", "centroid_backup_values", references);
+
+    D->friction_centroid_values = get_python_quantity_data(quantities, "friction", "centroid_values", references);
 
-    tri_full_flag = get_consecutive_array(domain, "tri_full_flag");
-    D->tri_full_flag = (long *) tri_full_flag->data;
+    Py_DECREF(quantities);
 
-    already_computed_flux = get_consecutive_array(domain, "already_computed_flux");
-    D->already_computed_flux = (long *) already_computed_flux->data;
+    riverwallData = get_python_object(domain,"riverwallData");
+    if (!riverwallData) {
+        return NULL;
+    }
 
-    vertex_coordinates = get_consecutive_array(domain, "vertex_coordinates");
-    D->vertex_coordinates = (double *) vertex_coordinates->data;
+    D->riverwall_elevation = (double *) get_python_array_data(riverwallData, "riverwall_elevation", references);
+    D->riverwall_rowIndex  = (long *) get_python_array_data(riverwallData, "hydraulic_properties_rowIndex", references);
+    D->riverwall_hydraulic_properties = (double *) get_python_array_data(riverwallData, "hydraulic_properties", references);
 
-    edge_coordinates = get_consecutive_array(domain, "edge_coordinates");
-    D->edge_coordinates = (double *) edge_coordinates->data;
+    D->ncol_riverwall_hydraulic_properties = get_python_integer(riverwallData, "ncol_hydraulic_properties");
 
+    Py_DECREF(riverwallData);
 
-    centroid_coordinates = get_consecutive_array(domain, "centroid_coordinates");
-    D->centroid_coordinates = (double *) centroid_coordinates->data;
-    
-    max_speed = get_consecutive_array(domain, "max_speed");
-    D->max_speed = (double *) max_speed->data;
+    if (PyErr_Occurred()) {
+        return NULL;
+    }
+
+    return D;
+}
 
-    number_of_boundaries = get_consecutive_array(domain, "number_of_boundaries");
-    D->number_of_boundaries = (long *) number_of_boundaries->data;
 
-    flux_update_frequency = get_consecutive_array(domain, "flux_update_frequency");
-    D->flux_update_frequency = (long*) flux_update_frequency->data;
-    
-    update_next_flux = get_consecutive_array(domain, "update_next_flux");
-    D->update_next_flux = (long*) update_next_flux->data;
-    
-    update_extrapolation = get_consecutive_array(domain, "update_extrapolation");
-    D->update_extrapolation = (long*) update_extrapolation->data;
-    
-    allow_timestep_increase = get_consecutive_array(domain, "allow_timestep_increase");
-    D->allow_timestep_increase = (long*) allow_timestep_increase->data;
+struct domain* get_python_domain(struct domain *D, PyObject *domain) {
 
-    edge_timestep = get_consecutive_array(domain, "edge_timestep");
-    D->edge_timestep = (double*) edge_timestep->data;
-    
-    edge_flux_work = get_consecutive_array(domain, "edge_flux_work");
-    D->edge_flux_work = (double*) edge_flux_work->data;
-    
-    pressuregrad_work = get_consecutive_array(domain, "pressuregrad_work");
-    D->pressuregrad_work = (double*) pressuregrad_work->data;
-    
-    x_centroid_work = get_consecutive_array(domain, "x_centroid_work");
-    D->x_centroid_work = (double*) x_centroid_work->data;
+    get_python_domain_parameters(D, domain);
 
-    y_centroid_work = get_consecutive_array(domain, "y_centroid_work");
-    D->y_centroid_work = (double*) y_centroid_work->data;
-    
-    boundary_flux_sum = get_consecutive_array(domain, "boundary_flux_sum");
-    D->boundary_flux_sum = (double*) boundary_flux_sum->data;
+    return get_python_domain_arrays(D, domain, NULL);
+}
 
-    quantities = get_python_object(domain, "quantities");
 
-    D->stage_edge_values     = get_python_array_data_from_dict(quantities, "stage",     "edge_values");
-    D->xmom_edge_values      = get_python_array_data_from_dict(quantities, "xmomentum", "edge_values");
-    D->ymom_edge_values      = get_python_array_data_from_dict(quantities, "ymomentum", "edge_values");
-    D->bed_edge_values       = get_python_array_data_from_dict(quantities, "elevation", "edge_values");
-    D->height_edge_values    = get_python_array_data_from_dict(quantities, "height", "edge_values");
+//=========================================================================
+// Domain handle
+//
+// get_python_domain looks up every attribute and array of the domain,
+// which is a noticeable overhead for the kernels that are called several
+// times each timestep. A domain handle (see Domain.get_c_domain) keeps the
+// array pointers, together with references to the arrays, and only
+// refreshes the scalar parameters when it is used. The handle must be
+// rebuilt whenever one of these arrays is replaced by a new array (see
+// Generic_Domain.invalidate_c_domain).
+//=========================================================================
+
+#define DOMAIN_HANDLE_NAME "anuga.shallow_water.domain_handle"
+
+struct domain_handle {
+    struct domain D;
+    PyObject *domain_ref;  // Weak reference to the python domain
+    PyObject *references;  // List of the arrays used by D
+};
 
-    D->stage_centroid_values     = get_python_array_data_from_dict(quantities, "stage",     "centroid_values");
-    D->xmom_centroid_values      = get_python_array_data_from_dict(quantities, "xmomentum", "centroid_values");
-    D->ymom_centroid_values      = get_python_array_data_from_dict(quantities, "ymomentum", "centroid_values");
-    D->bed_centroid_values       = get_python_array_data_from_dict(quantities, "elevation", "centroid_values");
-    D->height_centroid_values    = get_python_array_data_from_dict(quantities, "height", "centroid_values");
 
-    D->stage_vertex_values     = get_python_array_data_from_dict(quantities, "stage",     "vertex_values");
-    D->xmom_vertex_values      = get_python_array_data_from_dict(quantities, "xmomentum", "vertex_values");
-    D->ymom_vertex_values      = get_python_array_data_from_dict(quantities, "ymomentum", "vertex_values");
-    D->bed_vertex_values       = get_python_array_data_from_dict(quantities, "elevation", "vertex_values");
-    D->height_vertex_values       = get_python_array_data_from_dict(quantities, "height", "vertex_values");
+void delete_domain_handle(PyObject *capsule) {
 
-    D->stage_boundary_values = get_python_array_data_from_dict(quantities, "stage",     "boundary_values");
-    D->xmom_boundary_values  = get_python_array_data_from_dict(quantities, "xmomentum", "boundary_values");
-    D->ymom_boundary_values  = get_python_array_data_from_dict(quantities, "ymomentum", "boundary_values");
-    D->bed_boundary_values   = get_python_array_data_from_dict(quantities, "elevation", "boundary_values");
+    struct domain_handle *H;
 
-    D->stage_explicit_update = get_python_array_data_from_dict(quantities, "stage",     "explicit_update");
-    D->xmom_explicit_update  = get_python_array_data_from_dict(quantities, "xmomentum", "explicit_update");
-    D->ymom_explicit_update  = get_python_array_data_from_dict(quantities, "ymomentum", "explicit_update");
+    H = (struct domain_handle *) PyCapsule_GetPointer(capsule, DOMAIN_HANDLE_NAME);
 
+    Py_XDECREF(H->domain_ref);
+    Py_XDECREF(H->references);
+    free(H);
+}
 
-    riverwallData = get_python_object(domain,"riverwallData");
 
-    riverwall_elevation = get_consecutive_array(riverwallData, "riverwall_elevation");
-    D->riverwall_elevation = (double*) riverwall_elevation->data;
-    
-    riverwall_rowIndex = get_consecutive_array(riverwallData, "hydraulic_properties_rowIndex");
-    D->riverwall_rowIndex = (long*) riverwall_rowIndex->data;
+PyObject* new_domain_handle(PyObject *domain) {
 
-    D->ncol_riverwall_hydraulic_properties = get_python_integer(riverwallData, "ncol_hydraulic_properties");
+    struct domain_handle *H;
+    PyObject *capsule;
 
-    riverwall_hydraulic_properties = get_consecutive_array(riverwallData, "hydraulic_properties");
-    D->riverwall_hydraulic_properties = (double*) riverwall_hydraulic_properties->data;
+    H = (struct domain_handle *) calloc(1, sizeof(struct domain_handle));
+    if (H == NULL) {
+        return PyErr_NoMemory();
+    }
 
-    Py_DECREF(quantities);
-    Py_DECREF(riverwallData);
+    capsule = PyCapsule_New((void *) H, DOMAIN_HANDLE_NAME, delete_domain_handle);
+    if (capsule == NULL) {
+        free(H);
+        return NULL;
+    }
 
-    Py_DECREF(neighbours);
-    Py_DECREF(surrogate_neighbours);
-    Py_DECREF(neighbour_edges);
-    Py_DECREF(normals);
-    Py_DECREF(edgelengths);
-    Py_DECREF(radii);
-    Py_DECREF(areas);
-    Py_DECREF(edge_flux_type);
-    Py_DECREF(tri_full_flag);
-    Py_DECREF(already_computed_flux);
-    Py_DECREF(vertex_coordinates);
-    Py_DECREF(edge_coordinates);
-    Py_DECREF(centroid_coordinates);
-    Py_DECREF(max_speed);
-    Py_DECREF(number_of_boundaries);
-    Py_DECREF(flux_update_frequency);
-    Py_DECREF(update_next_flux);
-    Py_DECREF(update_extrapolation);
-    Py_DECREF(edge_timestep);
-    Py_DECREF(edge_flux_work);
-    Py_DECREF(pressuregrad_work);
-    Py_DECREF(x_centroid_work);
-    Py_DECREF(y_centroid_work);
-    Py_DECREF(boundary_flux_sum);
-    Py_DECREF(allow_timestep_increase);
+    H->domain_ref = PyWeakref_NewRef(domain, NULL);
+    H->references = PyList_New(0);
+    if (H->domain_ref == NULL || H->references == NULL) {
+        Py_DECREF(capsule);
+        return NULL;
+    }
 
-    return D;
+    if (get_python_domain_parameters(&H->D, domain) == NULL ||
+        get_python_domain_arrays(&H->D, domain, H->references) == NULL) {
+        Py_DECREF(capsule);
+        return NULL;
+    }
+
+    return capsule;
+}
+
+
+PyObject* get_domain_from_handle(PyObject *O) {
+    // Borrowed reference to the python domain of a domain handle
+    // (or O itself if it is not a domain handle)
+
+    struct domain_handle *H;
+    PyObject *domain;
+
+    if (!PyCapsule_CheckExact(O)) {
+        return O;
+    }
+
+    H = (struct domain_handle *) PyCapsule_GetPointer(O, DOMAIN_HANDLE_NAME);
+    if (H == NULL) {
+        return NULL;
+    }
+
+    domain = PyWeakref_GetObject(H->domain_ref);
+    if (domain == Py_None) {
+        PyErr_SetString(PyExc_RuntimeError, "sw_domain.h: domain of domain handle no longer exists");
+        return NULL;
+    }
+
+    return domain;
+}
+
+
+struct domain* get_domain(struct domain *D, PyObject *O) {
+    // Domain structure of either a domain handle or a python domain.
+    // In the latter case the structure is filled in D.
+
+    struct domain_handle *H;
+    PyObject *domain;
+
+    domain = get_domain_from_handle(O);
+    if (domain == NULL) {
+        return NULL;
+    }
+
+    if (domain == O) {
+        return get_python_domain(D, domain);
+    }
+
+    H = (struct domain_handle *) PyCapsule_GetPointer(O, DOMAIN_HANDLE_NAME);
+
+    get_python_domain_parameters(&H->D, domain);
+    if (PyErr_Occurred()) {
+        return NULL;
+    }
+
+    return &H->D;
 }
 
 
@@ -396,6 +535,7 @@ int print_domain_struct(struct domain *D) {
     printf("D->beta_uh_dry            %g \n", D->beta_uh_dry);
     printf("D->beta_vh                %g \n", D->beta_vh);
     printf("D->beta_vh_dry            %g \n", D->beta_vh_dry);
+    printf("D->omp_num_threads        %ld \n", D->omp_num_threads);
 
 
 
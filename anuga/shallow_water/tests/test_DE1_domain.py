@@ -103,7 +103,264 @@ class Test_DE1_domain(unittest.TestCase):
         assert num.all(vv<2.0e-02)
 
 
-            
+    def test_omp_num_threads(self):
+        """ Check that the threaded DE kernels reproduce the serial results
+        exactly (including riverwalls and boundary flux integrals)
+        """
+
+        def run(omp_num_threads):
+            domain = rectangular_cross_domain(20, 15, len1=200., len2=150.)
+            domain.set_flow_algorithm('DE1')
+            domain.set_store(False)
+            domain.set_omp_num_threads(omp_num_threads)
+
+            domain.set_quantity('elevation', lambda x,y: -x/100.)
+            domain.set_quantity('friction', 0.03)
+            domain.set_quantity('stage',
+                                lambda x,y: num.where(x < 75., 1.0, -x/100.))
+
+            riverwalls = {'wall': [[100., 25., 0.2], [100., 125., 0.2]]}
+            domain.riverwallData.create_riverwalls(riverwalls, verbose=False)
+
+            Br = Reflective_boundary(domain)
+            Bd = anuga.Dirichlet_boundary([-1.5, 0., 0.])
+            domain.set_boundary({'left': Br, 'right': Bd,
+                                 'top': Br, 'bottom': Br})
+
+            for t in domain.evolve(yieldstep=5.0, finaltime=10.0):
+                pass
+
+            return domain
+
+        domain_1 = run(1)
+        domain_4 = run(4)
+
+        assert domain_4.get_omp_num_threads() == 4
+
+        for name in ['stage', 'xmomentum', 'ymomentum']:
+            Q1 = domain_1.quantities[name]
+            Q4 = domain_4.quantities[name]
+            assert num.all(Q1.centroid_values == Q4.centroid_values)
+            assert num.all(Q1.edge_values == Q4.edge_values)
+
+        assert num.all(domain_1.max_speed == domain_4.max_speed)
+        assert domain_1.get_boundary_flux_integral() == \
+               domain_4.get_boundary_flux_integral()
+
+        msg = domain_4.timestepping_statistics()
+        assert '[4 threads,' in msg
+
+
+    def test_fused_evolve(self):
+        """ Check that the fused C timesteps (euler, rk2 and rk3) reproduce
+        the python timestepping, including python boundaries called back
+        from C and boundaries changed during the evolve
+        """
+
+        def run(flow_algorithm, fused):
+            domain = rectangular_cross_domain(20, 15, len1=200., len2=150.)
+            domain.set_flow_algorithm(flow_algorithm)
+            domain.set_store(False)
+            domain.set_fused_evolve(fused)
+
+            domain.set_quantity('elevation', lambda x,y: -x/100.)
+            domain.set_quantity('friction', 0.03)
+            domain.set_quantity('stage',
+                                lambda x,y: num.where(x < 75., 1.0, -x/100.))
+
+            riverwalls = {'wall': [[100., 25., 0.2], [100., 125., 0.2]]}
+            domain.riverwallData.create_riverwalls(riverwalls, verbose=False)
+
+            Br = Reflective_boundary(domain)
+            Bd = anuga.Dirichlet_boundary([-1.5, 0., 0.])
+            Bt = anuga.Transmissive_boundary(domain)
+            Btime = anuga.Time_boundary(domain,
+                                        function=lambda t: [1.0+0.01*t, 0., 0.])
+            domain.set_boundary({'left': Btime, 'right': Bd,
+                                 'top': Br, 'bottom': Bt})
+
+            for t in domain.evolve(yieldstep=5.0, finaltime=10.0):
+                if t == 5.0:
+                    domain.set_boundary({'left': Br})
+
+            return domain
+
+        for flow_algorithm in ['DE0', 'DE1', 'DE2']:
+            domain_0 = run(flow_algorithm, False)
+            domain_1 = run(flow_algorithm, True)
+
+            assert domain_1.get_fused_evolve()
+
+            for name in ['stage', 'xmomentum', 'ymomentum']:
+                Q0 = domain_0.quantities[name]
+                Q1 = domain_1.quantities[name]
+                assert num.all(Q0.centroid_values == Q1.centroid_values)
+                assert num.all(Q0.boundary_values == Q1.boundary_values)
+
+            assert domain_0.number_of_steps == domain_1.number_of_steps
+            assert domain_0.get_boundary_flux_integral() == \
+                   domain_1.get_boundary_flux_integral()
+
+
+    def test_c_domain_handle(self):
+        """ Check the cached C domain structure is reused and rebuilt
+        when arrays are replaced (max_speed at each yield)
+        """
+
+        import cPickle
+
+        domain = rectangular_cross_domain(10, 10, len1=100., len2=100.)
+        domain.set_flow_algorithm('DE1')
+        domain.set_store(False)
+
+        domain.set_quantity('elevation', lambda x,y: -x/100.)
+        domain.set_quantity('stage',
+                            lambda x,y: num.where(x < 50., 1.0, -x/100.))
+
+        Br = Reflective_boundary(domain)
+        domain.set_boundary({'left': Br, 'right': Br, 'top': Br, 'bottom': Br})
+
+        handle = domain.get_c_domain()
+        assert domain.get_c_domain() is handle
+
+        for t in domain.evolve(yieldstep=1.0, finaltime=3.0):
+            pass
+
+        # max_speed was replaced at the yields so the handle was rebuilt
+        # and the speeds are recorded in the new array
+        assert domain.get_c_domain() is not handle
+        assert num.max(domain.max_speed) > 0.0
+
+        # Passing the domain or its handle gives the same fluxes
+        from anuga.shallow_water.swDE1_domain_ext \
+             import compute_fluxes_ext_central
+
+        def compute_fluxes(D):
+            # Both rk2 substeps
+            timestep = domain.evolve_max_timestep
+            flux_timesteps = [compute_fluxes_ext_central(D, timestep),
+                              compute_fluxes_ext_central(D, timestep)]
+            explicit_update = domain.quantities['stage'].explicit_update.copy()
+            return flux_timesteps, explicit_update
+
+        flux_timesteps_1, explicit_update_1 = compute_fluxes(domain)
+        flux_timesteps_2, explicit_update_2 = compute_fluxes(domain.get_c_domain())
+
+        assert flux_timesteps_1 == flux_timesteps_2
+        assert num.all(explicit_update_1 == explicit_update_2)
+
+        # The handle is not pickled
+        domain_2 = cPickle.loads(cPickle.dumps(domain))
+        assert domain_2.c_domain is None
+        assert domain.c_domain is not None
+
+
+    def test_ghost_exchange_overlap_phases(self):
+        """ Check that splitting protect, extrapolation and flux kernels
+        into the phases before and after the ghost values arrive (as
+        used by Parallel_domain.set_ghost_exchange_overlap) gives the
+        same results as the unsplit kernels
+        """
+
+        from anuga.parallel.distribute_mesh import ghost_halo_levels
+        from anuga.shallow_water.swDE1_domain_ext import protect_new
+        from anuga.shallow_water.swDE1_domain_ext \
+             import extrapolate_second_order_edge_sw
+        from anuga.shallow_water.swDE1_domain_ext \
+             import compute_fluxes_ext_central
+
+        domain = rectangular_cross_domain(20, 15, len1=200., len2=150.)
+        domain.set_flow_algorithm('DE1')
+        domain.set_store(False)
+
+        domain.set_quantity('elevation', lambda x,y: -x/100.)
+        domain.set_quantity('friction', 0.03)
+        domain.set_quantity('stage',
+                            lambda x,y: num.where(x < 75., 1.0, -x/100.))
+
+        riverwalls = {'wall': [[100., 25., 0.2], [100., 125., 0.2]]}
+        domain.riverwallData.create_riverwalls(riverwalls, verbose=False)
+
+        Br = Reflective_boundary(domain)
+        Bd = anuga.Dirichlet_boundary([-1.5, 0., 0.])
+        domain.set_boundary({'left': Br, 'right': Bd, 'top': Br, 'bottom': Br})
+
+        for t in domain.evolve(yieldstep=5.0, finaltime=5.0):
+            pass
+
+        # Pretend the (wet) triangles on the left are ghosts
+        ghosts = domain.centroid_coordinates[:,0] < 50.
+        domain.tri_full_flag[ghosts] = 0
+        halo_level = ghost_halo_levels(domain.neighbours, domain.tri_full_flag)
+
+        assert num.all(halo_level[ghosts] == 0)
+        assert num.any(halo_level == 4)
+
+        names = ['stage', 'xmomentum', 'ymomentum']
+        initial = [domain.quantities[name].centroid_values.copy()
+                   for name in names]
+        received = [num.where(ghosts, 1.1*Q, Q) for Q in initial]
+
+        def set_centroid_values(values, mask):
+            for name, Q in zip(names, values):
+                Q_cv = domain.quantities[name].centroid_values
+                Q_cv[mask] = Q[mask]
+
+        def run(overlap):
+            D = domain.get_c_domain()
+            timestep = domain.evolve_max_timestep
+            results = []
+
+            # Both rk2 substeps
+            for substep in range(2):
+                # Start from the old ghost values and clear the results
+                set_centroid_values(initial, True)
+                for name in names + ['height']:
+                    domain.quantities[name].edge_values[:] = 1.0e+5
+                domain.max_speed[:] = -1.0
+
+                if overlap:
+                    protect_new(D, halo_level, 1)
+                    extrapolate_second_order_edge_sw(D, halo_level, 1)
+                    compute_fluxes_ext_central(D, timestep, halo_level, 1)
+                    set_centroid_values(received, ghosts)
+                    protect_new(D, halo_level, 2)
+                    extrapolate_second_order_edge_sw(D, halo_level, 2)
+                    domain.update_boundary()
+                    flux_timestep = compute_fluxes_ext_central(D, timestep,
+                                                               halo_level, 2)
+                else:
+                    set_centroid_values(received, ghosts)
+                    protect_new(D)
+                    extrapolate_second_order_edge_sw(D)
+                    domain.update_boundary()
+                    flux_timestep = compute_fluxes_ext_central(D, timestep)
+
+                result = [flux_timestep, domain.max_speed.copy()]
+                for name in names:
+                    Q = domain.quantities[name]
+                    result += [Q.centroid_values.copy(), Q.edge_values.copy(),
+                               Q.explicit_update.copy()]
+                results.append(result)
+
+            return results
+
+        results_0 = run(False)
+        results_1 = run(True)
+
+        for result_0, result_1 in zip(results_0, results_1):
+            for r0, r1 in zip(result_0, result_1):
+                assert num.all(r0 == r1)
+
+        # Phase 1 does not read the ghosts and phase 2 needs the halo levels
+        try:
+            compute_fluxes_ext_central(domain, 1.0, None, 1)
+        except Exception:
+            pass
+        else:
+            raise Exception('halo_level should be required')
+
+
 if __name__ == "__main__":
     suite = unittest.makeSuite(Test_DE1_domain, 'test')
     runner = unittest.TextTestRunner(verbosity=1)
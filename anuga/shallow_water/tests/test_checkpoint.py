@@ -0,0 +1,195 @@
+"""Test the binary checkpoint files of the shallow water domain
+"""
+
+import os
+import atexit
+import shutil
+import tempfile
+import unittest
+
+import numpy as num
+
+import anuga
+from anuga.file.netcdf import NetCDFFile
+from anuga.shallow_water.checkpoint import load_checkpoint_file
+from anuga.shallow_water.checkpoint import read_checkpoint_file
+from anuga.shallow_water.checkpoint import checkpoint_alignment
+
+
+def create_domain(name, datadir):
+
+    domain = anuga.rectangular_cross_domain(8, 6, len1=4.0, len2=3.0)
+    domain.set_name(name)
+    domain.set_datadir(datadir)
+
+    domain.set_quantity('elevation', lambda x, y: -x/4)
+    domain.set_quantity('friction', 0.01)
+    domain.set_quantity('stage', lambda x, y: num.where(x < 1.0, 0.5, -x/4))
+
+    Br = anuga.Reflective_boundary(domain)
+    Bt = anuga.Transmissive_boundary(domain)
+    domain.set_boundary({'left': Br, 'right': Bt, 'top': Br, 'bottom': Br})
+
+    # An operator with state
+    anuga.Rate_operator(domain, rate=lambda t: 0.1, factor=1.0)
+
+    return domain
+
+
+class Test_Checkpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.checkpoint_dir = os.path.join(self.datadir, 'CHECKPOINTS')
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def test_checkpoint_file(self):
+
+        domain = create_domain('test_checkpoint_file', self.datadir)
+        domain.set_store(False)
+        domain.set_checkpointing(checkpoint_dir=self.checkpoint_dir)
+
+        for t in domain.evolve(yieldstep=0.5, finaltime=0.5):
+            pass
+
+        filename = domain.save_checkpoint()
+        assert filename.endswith('test_checkpoint_file_0.5.checkpoint')
+
+        scalars, arrays = read_checkpoint_file(filename)
+
+        assert scalars['time'] == 0.5
+        assert scalars['evolved_called']
+
+        stage = domain.quantities['stage']
+        for location in ['centroid_values', 'vertex_values', 'edge_values']:
+            values = arrays['quantities/stage/%s' % location]
+            assert isinstance(values, num.memmap)
+            assert values.offset % checkpoint_alignment == 0
+            assert num.all(values == getattr(stage, location))
+
+        # The boundary flux integral operator is the first operator
+        assert num.all(arrays['operators/0/boundary_flux_integral'] ==
+                       domain.boundary_flux_integral.boundary_flux_integral)
+
+        del arrays
+
+        # The domain has to match the one that stored the checkpoint
+        small_domain = anuga.rectangular_cross_domain(2, 2)
+        small_domain.set_name('test_checkpoint_file')
+        self.assertRaises(Exception, load_checkpoint_file,
+                          'test_checkpoint_file', self.checkpoint_dir,
+                          domain=small_domain)
+
+    def test_restart(self):
+        """Evolve a domain with checkpoints, restart a new domain from a
+        checkpoint. The restarted run should match the original one.
+        """
+
+        domain = create_domain('test_restart', self.datadir)
+        domain.set_checkpointing(checkpoint_dir=self.checkpoint_dir,
+                                 checkpoint_step=2)
+
+        for t in domain.evolve(yieldstep=0.25, finaltime=2.0):
+            pass
+
+        times = [float(os.path.splitext(f)[0].rpartition('_')[-1])
+                 for f in os.listdir(self.checkpoint_dir)]
+        assert num.allclose(sorted(times), [0.0, 0.5, 1.0, 1.5, 2.0])
+
+        stage = domain.quantities['stage'].centroid_values.copy()
+        integral = domain.get_boundary_flux_integral()
+
+        r_domain = create_domain('test_restart', self.datadir)
+        r_domain = load_checkpoint_file('test_restart', self.checkpoint_dir,
+                                        time=1.0, domain=r_domain)
+
+        assert r_domain.get_time() == 1.0
+
+        for t in r_domain.evolve(yieldstep=0.25, finaltime=2.0):
+            pass
+
+        assert num.allclose(r_domain.quantities['stage'].centroid_values,
+                            stage)
+        assert num.allclose(r_domain.get_boundary_flux_integral(), integral)
+
+        # The restarted run carries on storing into the sww file
+        fid = NetCDFFile(os.path.join(self.datadir, 'test_restart.sww'))
+        assert num.allclose(fid.variables['time'][:],
+                            num.arange(0.0, 2.01, 0.25))
+        assert num.allclose(fid.variables['stage_c'][-1], stage)
+        fid.close()
+
+    def test_delta_checkpoints(self):
+        """Checkpoints at every yieldstep, written in the background,
+        every third one full and only the last four kept
+        """
+
+        domain = create_domain('test_delta', self.datadir)
+        domain.set_store(False)
+        domain.set_checkpointing(checkpoint_dir=self.checkpoint_dir,
+                                 checkpoint_step=1,
+                                 checkpoint_async=True,
+                                 checkpoint_full_step=3,
+                                 checkpoint_keep=4)
+
+        assert domain.checkpoint_writer.store_async
+
+        number_of_exithandlers = len(atexit._exithandlers)
+
+        for t in domain.evolve(yieldstep=0.25, finaltime=2.0):
+            pass
+
+        # The writer thread is restarted after each yieldstep, without
+        # registering more exit handlers
+        assert len(atexit._exithandlers) == number_of_exithandlers
+
+        # The last four checkpoints, and the full one the oldest of
+        # those is based on
+        filenames = sorted(os.listdir(self.checkpoint_dir))
+        assert filenames == ['test_delta_0.75.checkpoint',
+                             'test_delta_1.25.checkpoint',
+                             'test_delta_1.5.checkpoint',
+                             'test_delta_1.75.checkpoint',
+                             'test_delta_2.0.checkpoint']
+
+        def filename(time):
+            return os.path.join(self.checkpoint_dir,
+                                'test_delta_%s.checkpoint' % time)
+
+        # Mostly unchanged arrays compress well
+        assert os.path.getsize(filename(1.75)) < os.path.getsize(filename(1.5))/2
+
+        scalars, arrays = read_checkpoint_file(filename(2.0))
+        assert scalars['time'] == 2.0
+        for name in ['stage', 'xmomentum', 'elevation']:
+            Q = domain.quantities[name]
+            assert num.all(arrays['quantities/%s/centroid_values' % name] ==
+                           Q.centroid_values)
+            assert num.all(arrays['quantities/%s/vertex_values' % name] ==
+                           Q.vertex_values)
+
+        stage = domain.quantities['stage'].centroid_values.copy()
+
+        # Restart from a delta checkpoint
+        r_domain = create_domain('test_delta', self.datadir)
+        r_domain.set_store(False)
+        r_domain = load_checkpoint_file('test_delta', self.checkpoint_dir,
+                                        time=1.25, domain=r_domain)
+
+        assert r_domain.get_time() == 1.25
+
+        for t in r_domain.evolve(yieldstep=0.25, finaltime=2.0):
+            pass
+
+        assert num.allclose(r_domain.quantities['stage'].centroid_values,
+                            stage)
+
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(Test_Checkpoint, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -6390,6 +6390,268 @@ class Test_Shallow_Water(unittest.TestCase):
         # Cleanup
         os.remove(domain1.get_name() + '.sww')
 
+    def test_spatio_temporal_boundary_evaluate_segment(self):
+        """Test that the vectorised evaluate_segment of Field_boundary
+        sets the same boundary values as the boundary evaluated edge by
+        edge, also when the default boundary takes over
+        """
+
+        import time
+        from anuga.abstract_2d_finite_volumes.generic_boundary_conditions \
+                import Boundary
+        from anuga.abstract_2d_finite_volumes.mesh_factory import rectangular
+
+        # Create sww file of simple propagation from left to right
+        points, vertices, boundary = rectangular(3, 3)
+
+        domain1 = Domain(points, vertices, boundary)
+        domain1.reduction = mean
+        domain1.smooth = True
+        domain1.default_order = 2
+        domain1.store = True
+        domain1.set_datadir('.')
+        domain1.set_name('spatio_temporal_boundary_source' + str(time.time()))
+
+        domain1.set_quantity('elevation', 0)
+        domain1.set_quantity('friction', 0)
+
+        Br = Reflective_boundary(domain1)
+        Bd = Dirichlet_boundary([0.3, 0, 0])
+        domain1.set_boundary({'left': Bd, 'top': Bd, 'right': Br, 'bottom': Br})
+        domain1.set_quantity('stage', 0)
+
+        for t in domain1.evolve(yieldstep=1, finaltime=5):
+            pass
+
+        # Domain covering domain 1 with all boundaries from the file
+        points, vertices, boundary = rectangular(4, 5)
+        domain2 = Domain(points, vertices, boundary)
+        domain2.set_quantity('elevation', 0)
+        domain2.set_quantity('friction', 0)
+        domain2.set_quantity('stage', 0.1)
+
+        mean_stage = 1.5
+        Bf = Field_boundary(domain1.get_name() + '.sww', domain2,
+                            mean_stage=mean_stage,
+                            default_boundary=Dirichlet_boundary([0.2, 0, 0]),
+                            verbose=False)
+        domain2.set_boundary({'left': Bf, 'right': Bf, 'top': Bf,
+                              'bottom': Br})
+
+        ids = num.array(domain2.tag_boundary_cells['left'] +
+                        domain2.tag_boundary_cells['right'] +
+                        domain2.tag_boundary_cells['top'])
+
+        names = domain2.conserved_quantities
+        for t in [0.0, 1.0, 2.5, 4.75, 5.0, 7.0]:
+            domain2.time = t
+
+            Boundary.evaluate_segment(Bf, domain2, ids)
+            expected = [domain2.quantities[name].boundary_values[ids].copy()
+                        for name in names]
+
+            for name in names:
+                domain2.quantities[name].boundary_values[ids] = 0.0
+            Bf.evaluate_segment(domain2, ids)
+
+            for j, name in enumerate(names):
+                assert num.allclose(domain2.quantities[name].boundary_values[ids],
+                                    expected[j])
+
+        # Default boundary (adjusted by mean_stage) after the end of the file
+        assert Bf.file_boundary.default_boundary_invoked
+        assert num.allclose(domain2.quantities['stage'].boundary_values[ids],
+                            0.2 + mean_stage)
+
+        os.remove(domain1.get_name() + '.sww')
+
+    def test_boundary_kernels(self):
+        """Test that the C boundary kernels used by update_boundary set the
+        same boundary values as the python boundaries
+        """
+
+        from anuga.abstract_2d_finite_volumes.generic_boundary_conditions \
+                import Boundary
+        from anuga.shallow_water.boundaries import \
+            Transmissive_n_momentum_zero_t_momentum_set_stage_boundary, \
+            Time_stage_zero_momentum_boundary, Dirichlet_discharge_boundary, \
+            Inflow_boundary, Flather_external_stage_zero_velocity_boundary
+
+        points, vertices, boundary = rectangular_cross(4, 3, len1=4.0,
+                                                       len2=3.0)
+        domain = Domain(points, vertices, boundary)
+        domain.set_quantity('friction', 0.03)
+        domain.time = 2.5
+
+        names = ['stage', 'xmomentum', 'ymomentum', 'elevation', 'height',
+                 'xvelocity', 'yvelocity']
+
+        # Wet and dry edges
+        num.random.seed(11)
+        for name in names:
+            Q = domain.quantities[name]
+            Q.centroid_values[:] = num.random.uniform(-1, 1, Q.centroid_values.shape)
+            Q.edge_values[:] = num.random.uniform(-1, 1, Q.edge_values.shape)
+
+        f = lambda t: 0.1*t
+
+        boundaries = [Reflective_boundary(domain),
+                      Dirichlet_boundary([0.2, 0.1, -0.3]),
+                      Time_boundary(domain, function=lambda t: [t, 0.5, -t]),
+                      Time_stage_zero_momentum_boundary(domain, function=f),
+                      Transmissive_boundary(domain),
+                      Transmissive_momentum_set_stage_boundary(domain, f),
+                      Transmissive_n_momentum_zero_t_momentum_set_stage_boundary(domain, f),
+                      Transmissive_stage_zero_momentum_boundary(domain),
+                      Dirichlet_discharge_boundary(domain, 0.3, 1.5),
+                      Inflow_boundary(domain, 2.0),
+                      Flather_external_stage_zero_velocity_boundary(domain, f)]
+
+        for centroid_transmissive_bc in [False, True]:
+            domain.centroid_transmissive_bc = centroid_transmissive_bc
+
+            for B in boundaries:
+                domain.set_boundary({'left': B, 'right': B,
+                                     'top': B, 'bottom': Reflective_boundary(domain)})
+
+                for code, segment_edges, b in domain.get_boundary_segments():
+                    assert code > 0
+
+                # Python evaluation (Flather is evaluated with nans at
+                # the dry edges)
+                for name in names:
+                    domain.quantities[name].boundary_values[:] = 0.0
+                for tag, segment_edges in domain.tag_boundary_cells.items():
+                    b = domain.boundary_map[tag]
+                    with num.errstate(invalid='ignore', divide='ignore'):
+                        if b.__class__.__dict__.has_key('evaluate_segment'):
+                            b.evaluate_segment(domain, segment_edges)
+                        else:
+                            Boundary.evaluate_segment(b, domain, segment_edges)
+
+                expected = [domain.quantities[name].boundary_values.copy()
+                            for name in names]
+
+                # C kernels
+                for name in names:
+                    domain.quantities[name].boundary_values[:] = 0.0
+                domain.update_boundary()
+
+                for j, name in enumerate(names):
+                    assert num.allclose(domain.quantities[name].boundary_values,
+                                        expected[j]), (B, name)
+
+        # Boundaries that the kernel cannot evaluate at this time are
+        # evaluated by evaluate_segment
+        ids = domain.tag_boundary_cells['left']
+        Bd = Dirichlet_boundary([0.7, 0.0, 0.0])
+        Bt = Time_boundary(domain, function=lambda t: [t, 0, 0],
+                           default_boundary=Bd)
+        Bt.get_boundary_values = lambda t=None: Bd
+        Bt.evaluate_segment = lambda domain, segment_edges: \
+                              Bd.evaluate_segment(domain, segment_edges)
+        domain.set_boundary({'left': Bt})
+        domain.update_boundary()
+        assert num.allclose(domain.quantities['stage'].boundary_values[ids], 0.7)
+
+        B = Dirichlet_boundary([0.2, 0.1, -0.3, 0.4])
+        domain.set_boundary({'left': B})
+        domain.update_boundary()
+        assert num.allclose(domain.quantities['ymomentum'].boundary_values[ids], -0.3)
+
+    def test_tabulated_time_boundary(self):
+        """Test that the tabulated time boundaries, evaluated in python or
+        by the C boundary kernel, interpolate their table as Time_boundary
+        interpolates the same function
+        """
+
+        from anuga.abstract_2d_finite_volumes.generic_boundary_conditions \
+                import Tabulated_time_boundary
+        from anuga.shallow_water.boundaries import \
+                Tabulated_time_stage_zero_momentum_boundary
+        from anuga.fit_interpolate.interpolate import Modeltime_too_early
+
+        points, vertices, boundary = rectangular_cross(3, 3)
+        domain = Domain(points, vertices, boundary)
+
+        times = [1.0, 2.0, 4.0, 5.0]
+        values = [[0.5, 0.0, 0.1], [1.0, 0.2, 0.0],
+                  [0.0, -0.2, 0.0], [0.4, 0.0, 0.0]]
+
+        def f(t):
+            return [num.interp(t, times, [q[j] for q in values])
+                    for j in range(3)]
+
+        default = Dirichlet_boundary([0.7, 0.0, 0.0])
+        B = Tabulated_time_boundary(domain, times=times, values=values,
+                                    default_boundary=default)
+        Bf = Tabulated_time_boundary(domain, times=num.arange(1.0, 5.1, 0.5),
+                                     function=f, default_boundary=default)
+        Bs = Tabulated_time_stage_zero_momentum_boundary(domain, times=times,
+                                                         stages=[0.5, 1.0, 0.0, 0.4],
+                                                         default_boundary=default)
+
+        domain.set_boundary({'left': B, 'right': Bf, 'top': Bs,
+                             'bottom': Reflective_boundary(domain)})
+        for code, segment_edges, b in domain.get_boundary_segments():
+            assert code == {B: 10, Bf: 10, Bs: 10}.get(b, 1)
+
+        Stage = domain.quantities['stage']
+        Xmom = domain.quantities['xmomentum']
+        left = domain.tag_boundary_cells['left']
+        right = domain.tag_boundary_cells['right']
+        top = domain.tag_boundary_cells['top']
+
+        # Forwards and backwards in time, as rk2 and rk3 substeps
+        for t in [1.0, 1.5, 3.0, 2.5, 4.0, 4.25, 1.25, 5.0]:
+            domain.set_time(t)
+
+            assert num.allclose(B.evaluate(), f(t))
+            assert num.allclose(Bf.evaluate(), f(t))
+            assert num.allclose(Bs.evaluate(), [f(t)[0], 0, 0])
+
+            domain.update_boundary()
+
+            assert num.allclose(Stage.boundary_values[left], f(t)[0])
+            assert num.allclose(Xmom.boundary_values[left], f(t)[1])
+            assert num.allclose(Stage.boundary_values[right], f(t)[0])
+            assert num.allclose(Stage.boundary_values[top], f(t)[0])
+            assert num.allclose(Xmom.boundary_values[top], 0.0)
+
+        # Default boundary after the last time (by evaluate_segment)
+        domain.set_time(6.0)
+        domain.update_boundary()
+        assert B.default_boundary_invoked
+        assert num.allclose(B.evaluate(), [0.7, 0.0, 0.0])
+        assert num.allclose(Stage.boundary_values[left], 0.7)
+        assert num.allclose(Stage.boundary_values[right], 0.7)
+        assert num.allclose(Stage.boundary_values[top], 0.7)
+        assert num.allclose(Xmom.boundary_values[left], 0.0)
+
+        # and on evolving past the last time
+        domain.set_store(False)
+        domain.set_evolve_starttime(4.5)
+        for t in domain.evolve(yieldstep=0.5, finaltime=5.5):
+            pass
+        assert num.allclose(Stage.boundary_values[left], 0.7)
+
+        # Before the first time
+        domain.set_time(0.5)
+        try:
+            domain.update_boundary()
+        except Modeltime_too_early:
+            pass
+        else:
+            raise Exception('Time before the table should have raised')
+
+        try:
+            Tabulated_time_boundary(domain, times=[1.0, 0.5],
+                                    values=[[1, 0, 0], [2, 0, 0]])
+        except AssertionError:
+            pass
+        else:
+            raise Exception('Decreasing times should have raised')
+
     def test_spatio_temporal_boundary_outside(self):
         """Test that field_boundary catches if a point is outside the sww
         that defines it
@@ -387,6 +387,9 @@ class RiverWall:
         # etc
         #
         riverwallInds=(domain.edge_flux_type==1).nonzero()[0]
+        # Count of riverwall edges up to and including each edge
+        domain.edge_river_wall_counter=\
+            numpy.cumsum(domain.edge_flux_type==1).astype(int)
         # elevation
         self.riverwall_elevation=\
             riverwall_elevation[riverwallInds]
@@ -452,6 +455,9 @@ class RiverWall:
        
         # Define the hydraulic properties 
         self.hydraulic_properties=hydraulicTmp
+
+        # The riverwall arrays have been replaced
+        domain.invalidate_c_domain()
       
         # Check for riverwall 'connectedness' errors (e.g. theoretically possible
         # to miss an edge due to round-off)
@@ -276,6 +276,7 @@ class Sparse_CSR:
             self.row_ptr = row_ptr
             self.M       = A.M
             self.N       = A.N
+            self.shape   = (self.M, self.N)
         elif isinstance(data,num.ndarray) and isinstance(Colind,num.ndarray) and isinstance(rowptr,num.ndarray) and isinstance(m,int) and isinstance(n,int):
             msg = "Sparse_CSR: data is array of wrong dimensions"
             #assert len(data.shape) == 1, msg
@@ -292,6 +293,7 @@ class Sparse_CSR:
             self.row_ptr = rowptr
             self.M = m
             self.N = n
+            self.shape = (self.M, self.N)
         else:
             raise ValueError('Sparse_CSR(A) expects A == Sparse Matrix *or* data==array,colind==array,rowptr==array,m==int,n==int')
 
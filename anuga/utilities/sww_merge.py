@@ -19,7 +19,8 @@ def sww_merge(domain_global_name, np, verbose=False):
     _sww_merge(swwfiles, output, verbose)
 
 
-def sww_merge_parallel(domain_global_name, np, verbose=False, delete_old=False):
+def sww_merge_parallel(domain_global_name, np, verbose=False, delete_old=False,
+                       processes=1, frames_per_block=None):
 
     output = domain_global_name+".sww"
     swwfiles = [ domain_global_name+"_P"+str(np)+"_"+str(v)+".sww" for v in range(np)]
@@ -36,9 +37,11 @@ def sww_merge_parallel(domain_global_name, np, verbose=False, delete_old=False):
     fid.close()
 
     if 3*number_of_volumes == number_of_points:
-        _sww_merge_parallel_non_smooth(swwfiles, output, verbose, delete_old)
+        _sww_merge_parallel_non_smooth(swwfiles, output, verbose, delete_old,
+                                       processes, frames_per_block)
     else:
-        _sww_merge_parallel_smooth(swwfiles, output, verbose, delete_old)
+        _sww_merge_parallel_smooth(swwfiles, output, verbose, delete_old,
+                                   processes, frames_per_block)
         
 
 def _sww_merge(swwfiles, output, verbose=False):
@@ -198,7 +201,8 @@ def _sww_merge(swwfiles, output, verbose=False):
     fido.close()
 
 
-def _sww_merge_parallel_smooth(swwfiles, output,  verbose=False, delete_old=False):
+def _sww_merge_parallel_smooth(swwfiles, output,  verbose=False, delete_old=False,
+                               processes=1, frames_per_block=None):
     """
         Merge a list of sww files into a single file.
         
@@ -206,7 +210,7 @@ def _sww_merge_parallel_smooth(swwfiles, output,  verbose=False, delete_old=Fals
 
         The sww files to be merged must have exactly the same timesteps.
 
-        It is assumed that the separate sww files have been stored in non_smooth
+        It is assumed that the separate sww files have been stored in smooth
         format.
 
         Note that some advanced information and custom quantities may not be
@@ -215,327 +219,17 @@ def _sww_merge_parallel_smooth(swwfiles, output,  verbose=False, delete_old=Fals
         swwfiles is a list of .sww files to merge.
         output is the output filename, including .sww extension.
         verbose True to log output information
+        processes is the number of worker processes merging the
+        dynamic quantities (see _sww_merge_parallel_streaming)
+        frames_per_block is the number of timesteps merged at a time
     """
 
-    if verbose:
-        print "MERGING SWW Files"
-        
-    
-    first_file = True
-    tri_offset = 0
-    for filename in swwfiles:
-        if verbose:
-            print 'Reading file ', filename, ':'    
-    
-        fid = NetCDFFile(filename, netcdf_mode_r)
-         
-        if first_file:
-
-            times    = fid.variables['time'][:]
-            n_steps = len(times)
-            #number_of_timesteps = fid.dimensions['number_of_timesteps']
-            #print n_steps, number_of_timesteps
-            starttime = int(fid.starttime)
-            
-            out_s_quantities = {}
-            out_d_quantities = {}
-
-            out_s_c_quantities = {}
-            out_d_c_quantities = {}
-
-
-            xllcorner = fid.xllcorner
-            yllcorner = fid.yllcorner
-
-            number_of_global_triangles = int(fid.number_of_global_triangles)
-            number_of_global_nodes     = int(fid.number_of_global_nodes)
-
-            order      = fid.order
-            xllcorner  = fid.xllcorner;
-            yllcorner  = fid.yllcorner ;
-            zone       = fid.zone;
-            false_easting  = fid.false_easting;
-            false_northing = fid.false_northing;
-            datum      = fid.datum;
-            projection = fid.projection;
-
-            g_volumes = num.zeros((number_of_global_triangles,3),num.int)
-            g_x = num.zeros((number_of_global_nodes,),num.float32)
-            g_y = num.zeros((number_of_global_nodes,),num.float32)
-
-            g_points = num.zeros((number_of_global_nodes,2),num.float32)
-
-            #=====================================
-            # Deal with the vertex based variables
-            #=====================================
-            quantities = set(['elevation', 'friction', 'stage', 'xmomentum',
-                              'ymomentum', 'xvelocity', 'yvelocity', 'height'])
-            variables = set(fid.variables.keys())
-
-            quantities = list(quantities & variables)
-            
-            static_quantities = []
-            dynamic_quantities = []
-
-            for quantity in quantities:
-                # Test if quantity is static
-                if n_steps == fid.variables[quantity].shape[0]:
-                    dynamic_quantities.append(quantity)
-                else:
-                    static_quantities.append(quantity)
-                
-            for quantity in static_quantities:
-                out_s_quantities[quantity] = num.zeros((number_of_global_nodes,),num.float32)
-
-            # Quantities are stored as a 2D array of timesteps x data.
-            for quantity in dynamic_quantities:
-                out_d_quantities[quantity] = \
-                      num.zeros((n_steps,number_of_global_nodes),num.float32)
-
-            #=======================================
-            # Deal with the centroid based variables
-            #=======================================
-            quantities = set(['elevation_c', 'friction_c', 'stage_c', 'xmomentum_c',
-                              'ymomentum_c', 'xvelocity_c', 'yvelocity_c', 'height_c'])
-            variables = set(fid.variables.keys())
-
-            quantities = list(quantities & variables)
-            
-            static_c_quantities = []
-            dynamic_c_quantities = []
-
-            for quantity in quantities:
-                # Test if quantity is static
-                if n_steps == fid.variables[quantity].shape[0]:
-                    dynamic_c_quantities.append(quantity)
-                else:
-                    static_c_quantities.append(quantity)
-                
-            for quantity in static_c_quantities:
-                out_s_c_quantities[quantity] = num.zeros((number_of_global_triangles,),num.float32)
-
-            # Quantities are stored as a 2D array of timesteps x data.
-            for quantity in dynamic_c_quantities:
-                out_d_c_quantities[quantity] = \
-                      num.zeros((n_steps,number_of_global_triangles),num.float32)
-                 
-            description = 'merged:' + getattr(fid, 'description')          
-            first_file = False
-
-
-        # Read in from files and add to global arrays
-
-        tri_l2g  = fid.variables['tri_l2g'][:]
-        node_l2g = fid.variables['node_l2g'][:]
-        tri_full_flag = fid.variables['tri_full_flag'][:]
-        volumes = num.array(fid.variables['volumes'][:],dtype=num.int)
-        l_volumes = num.zeros_like(volumes)
-        l_old_volumes = num.zeros_like(volumes)
-
-
-        # Change the local node ids to global id in the
-        # volume array
-
-        # FIXME SR: Surely we can knock up a numpy way of doing this
-        #for i in range(len(l_volumes)):
-        #    g_n0 = node_l2g[volumes[i,0]]
-        #    g_n1 = node_l2g[volumes[i,1]]
-        #    g_n2 = node_l2g[volumes[i,2]]
-        #
-        #    l_old_volumes[i,:] = [g_n0,g_n1,g_n2]
-
-        g_n0 = node_l2g[volumes[:,0]].reshape(-1,1)
-        g_n1 = node_l2g[volumes[:,1]].reshape(-1,1)
-        g_n2 = node_l2g[volumes[:,2]].reshape(-1,1)
-
-        #print g_n0.shape
-        l_volumes = num.hstack((g_n0,g_n1,g_n2))
-
-        #assert num.allclose(l_volumes, l_old_volumes)
-
-        # Just pick out the full triangles
-        ftri_ids = num.where(tri_full_flag>0)
-        ftri_l2g = num.compress(tri_full_flag, tri_l2g)
-        
-        #f_ids = num.argwhere(tri_full_flag==1).reshape(-1,)
-        #f_gids = tri_l2g[f_ids]
-
-        #print l_volumes
-        #print tri_full_flag
-        #print tri_l2g
-        #print ftri_l2g
-        
-        f_volumes0 = num.compress(tri_full_flag,volumes[:,0])
-        f_volumes1 = num.compress(tri_full_flag,volumes[:,1])
-        f_volumes2 = num.compress(tri_full_flag,volumes[:,2])
-        
-        g_volumes[ftri_l2g,0] = node_l2g[f_volumes0]
-        g_volumes[ftri_l2g,1] = node_l2g[f_volumes1]
-        g_volumes[ftri_l2g,2] = node_l2g[f_volumes2]
-
-        #fg_volumes = num.compress(tri_full_flag,l_volumes,axis=0)
-        #g_volumes[ftri_l2g] = fg_volumes
-
-
-
-
-        #g_x[node_l2g] = fid.variables['x']
-        #g_y[node_l2g] = fid.variables['y']
-
-        g_points[node_l2g,0] = fid.variables['x'][:]
-        g_points[node_l2g,1] = fid.variables['y'][:]
-        
-
-        #print number_of_timesteps
-
-
-        # FIXME SR: It seems that some of the "ghost" node quantity values
-        # are being storded. We should only store those nodes which are associated with
-        # full triangles. So we need an index array of "full" nodes, ie those in
-        # full triangles
-
-        #use numpy.compress and numpy.unique to get "full nodes
-
-        f_volumes = num.compress(tri_full_flag,volumes,axis=0)
-        fl_nodes = num.unique(f_volumes)
-        f_node_l2g = node_l2g[fl_nodes]
-
-        #print len(node_l2g)
-        #print len(fl_nodes)
-
-        # Read in static quantities
-        for quantity in static_quantities:
-            #out_s_quantities[quantity][node_l2g] = \
-            #             num.array(fid.variables[quantity],dtype=num.float32)
-            q = fid.variables[quantity]
-            #print quantity, q.shape
-            out_s_quantities[quantity][f_node_l2g] = \
-                         num.array(q[:],dtype=num.float32)[fl_nodes]
-
-        
-        #Collate all dynamic quantities according to their timestep
-        for quantity in dynamic_quantities:
-            q = fid.variables[quantity]
-            #print q.shape
-            for i in range(n_steps):
-                #out_d_quantities[quantity][i][node_l2g] = \
-                #           num.array(q[i],dtype=num.float32)
-                out_d_quantities[quantity][i][f_node_l2g] = \
-                           num.array(q[i],dtype=num.float32)[fl_nodes]
-
-
-        # Read in static c quantities
-        for quantity in static_c_quantities:
-            #out_s_quantities[quantity][node_l2g] = \
-            #             num.array(fid.variables[quantity],dtype=num.float32)
-            q = fid.variables[quantity]
-            out_s_c_quantities[quantity][ftri_l2g] = \
-                         num.array(q).astype(num.float32)[ftri_ids]
-
-        
-        #Collate all dynamic c quantities according to their timestep
-        for quantity in dynamic_c_quantities:
-            q = fid.variables[quantity]
-            #print q.shape
-            for i in range(n_steps):
-                out_d_c_quantities[quantity][i][ftri_l2g] = \
-                           num.array(q[i]).astype(num.float32)[ftri_ids]
-
-
-        fid.close()
-
-
-    #---------------------------
-    # Write out the SWW file
-    #---------------------------
-    #print g_points.shape
-
-    #print number_of_global_triangles
-    #print number_of_global_nodes
-
-
-    if verbose:
-            print 'Writing file ', output, ':'
-    fido = NetCDFFile(output, netcdf_mode_w)
-
-    sww = Write_sww(static_quantities, dynamic_quantities, static_c_quantities, dynamic_c_quantities)
-    sww.store_header(fido, starttime,
-                             number_of_global_triangles,
-                             number_of_global_nodes,
-                             description=description,
-                             sww_precision=netcdf_float32)
-
-
-
-    from anuga.coordinate_transforms.geo_reference import Geo_reference
-    geo_reference = Geo_reference()
-    
-    sww.store_triangulation(fido, g_points, g_volumes, points_georeference=geo_reference)
-
-    fido.order      = order
-    fido.xllcorner  = xllcorner;
-    fido.yllcorner  = yllcorner ;
-    fido.zone       = zone;
-    fido.false_easting  = false_easting;
-    fido.false_northing = false_northing;
-    fido.datum      = datum;
-    fido.projection = projection;
-       
-    sww.store_static_quantities(fido, verbose=verbose, **out_s_quantities)
-    sww.store_static_quantities_centroid(fido, verbose=verbose, **out_s_c_quantities)
-
-    # Write out all the dynamic quantities for each timestep
+    _sww_merge_parallel_streaming(swwfiles, output, True, verbose, delete_old,
+                                  processes, frames_per_block)
 
-    for i in range(n_steps):
-        fido.variables['time'][i] = times[i]
 
-        
-    for q in dynamic_quantities:
-        q_values = out_d_quantities[q]
-        if verbose:
-            print '  Writing quantity: ',q
-            
-        for i in range(n_steps):
-            fido.variables[q][i] = q_values[i]
-        
-        # This updates the _range values
-        q_range = fido.variables[q + Write_sww.RANGE][:]
-        q_values_min = num.min(q_values)
-        if q_values_min < q_range[0]:
-            fido.variables[q + Write_sww.RANGE][0] = q_values_min
-        q_values_max = num.max(q_values)
-        if q_values_max > q_range[1]:
-            fido.variables[q + Write_sww.RANGE][1] = q_values_max        
-
-    for q in dynamic_c_quantities:
-        if verbose:
-            print '  Writing quantity: ',q
-            
-        q_values = out_d_c_quantities[q]
-        for i in range(n_steps):
-            fido.variables[q][i] = q_values[i]
-
-                                        
-    #print out_s_quantities
-    #print out_d_quantities
-    
-    #print g_x
-    #print g_y
-
-    #print g_volumes
-
-    fido.close()
-    
-    if delete_old:
-        import os
-        for filename in swwfiles:
-
-            if verbose:
-                print 'Deleting file ', filename, ':'
-            os.remove(filename)
-
-
-def _sww_merge_parallel_non_smooth(swwfiles, output,  verbose=False, delete_old=False):
+def _sww_merge_parallel_non_smooth(swwfiles, output,  verbose=False, delete_old=False,
+                                   processes=1, frames_per_block=None):
     """
         Merge a list of sww files into a single file.
 
@@ -552,156 +246,150 @@ def _sww_merge_parallel_non_smooth(swwfiles, output,  verbose=False, delete_old=
         swwfiles is a list of .sww files to merge.
         output is the output filename, including .sww extension.
         verbose True to log output information
+        processes is the number of worker processes merging the
+        dynamic quantities (see _sww_merge_parallel_streaming)
+        frames_per_block is the number of timesteps merged at a time
     """
 
-    if verbose:
-        print "MERGING SWW Files"
+    _sww_merge_parallel_streaming(swwfiles, output, False, verbose, delete_old,
+                                  processes, frames_per_block)
 
 
-    first_file = True
-    tri_offset = 0
-    for filename in swwfiles:
-        if verbose:
-            print 'Reading file ', filename, ':'
+# Number of values merged at a time when frames_per_block is not given
+merge_block_values = 1000000
 
-        fid = NetCDFFile(filename, netcdf_mode_r)
 
-        if first_file:
+def _sww_merge_parallel_streaming(swwfiles, output, smooth, verbose=False,
+                                  delete_old=False, processes=1,
+                                  frames_per_block=None):
+    """
+        Merge the sww files of a parallel run, a block of timesteps of
+        one quantity at a time, so that the memory needed does not
+        depend on the number of timesteps.
 
-            times    = fid.variables['time'][:]
-            n_steps = len(times)
-            number_of_timesteps = fid.dimensions['number_of_timesteps']
-            #print n_steps, number_of_timesteps
-            starttime = int(fid.starttime)
+        The blocks are merged by processes worker processes (in this
+        process if processes is 1) and written out in order.
+    """
 
-            out_s_quantities = {}
-            out_d_quantities = {}
+    if verbose:
+        print "MERGING SWW Files"
 
-            out_s_c_quantities = {}
-            out_d_c_quantities = {}
+    #---------------------------
+    # Read the header information
+    #---------------------------
+    fid = NetCDFFile(swwfiles[0], netcdf_mode_r)
 
+    times = fid.variables['time'][:]
+    n_steps = len(times)
+    starttime = int(fid.starttime)
 
-            xllcorner = fid.xllcorner
-            yllcorner = fid.yllcorner
+    number_of_global_triangles = int(fid.number_of_global_triangles)
+    number_of_global_nodes     = int(fid.number_of_global_nodes)
 
-            number_of_global_triangles = int(fid.number_of_global_triangles)
-            number_of_global_nodes     = int(fid.number_of_global_nodes)
-            number_of_global_triangle_vertices = 3*number_of_global_triangles
+    if smooth:
+        number_of_global_points = number_of_global_nodes
+    else:
+        number_of_global_points = 3*number_of_global_triangles
 
+    order      = fid.order
+    xllcorner  = fid.xllcorner;
+    yllcorner  = fid.yllcorner ;
+    zone       = fid.zone;
+    false_easting  = fid.false_easting;
+    false_northing = fid.false_northing;
+    datum      = fid.datum;
+    projection = fid.projection;
 
-            order      = fid.order
-            xllcorner  = fid.xllcorner;
-            yllcorner  = fid.yllcorner ;
-            zone       = fid.zone;
-            false_easting  = fid.false_easting;
-            false_northing = fid.false_northing;
-            datum      = fid.datum;
-            projection = fid.projection;
+    description = 'merged:' + getattr(fid, 'description')
 
-            g_volumes = num.arange(number_of_global_triangles*3).reshape(-1,3)
+    variables = set(fid.variables.keys())
 
+    def is_dynamic(quantity):
+        dimensions = fid.variables[quantity].dimensions
+        return len(dimensions) > 1 and dimensions[0] == 'number_of_timesteps'
 
+    # Vertex based variables
+    quantities = set(['elevation', 'friction', 'stage', 'xmomentum',
+                      'ymomentum', 'xvelocity', 'yvelocity', 'height'])
+    quantities = list(quantities & variables)
 
-            g_x = num.zeros((number_of_global_triangle_vertices,),num.float32)
-            g_y = num.zeros((number_of_global_triangle_vertices,),num.float32)
+    static_quantities = [q for q in quantities if not is_dynamic(q)]
+    dynamic_quantities = [q for q in quantities if is_dynamic(q)]
 
-            g_points = num.zeros((number_of_global_triangle_vertices,2),num.float32)
+    # Centroid based variables
+    quantities = set(['elevation_c', 'friction_c', 'stage_c', 'xmomentum_c',
+                      'ymomentum_c', 'xvelocity_c', 'yvelocity_c', 'height_c'])
+    quantities = list(quantities & variables)
 
-            #=======================================
-            # Deal with the vertex based variables
-            #=======================================
-            quantities = set(['elevation', 'friction', 'stage', 'xmomentum',
-                              'ymomentum', 'xvelocity', 'yvelocity', 'height'])
-            variables = set(fid.variables.keys())
+    static_c_quantities = [q for q in quantities if not is_dynamic(q)]
+    dynamic_c_quantities = [q for q in quantities if is_dynamic(q)]
 
-            quantities = list(quantities & variables)
-
-            static_quantities = []
-            dynamic_quantities = []
+    fid.close()
 
-            for quantity in quantities:
-                # Test if elevation is static
-                if n_steps == fid.variables[quantity].shape[0]:
-                    dynamic_quantities.append(quantity)
-                else:
-                    static_quantities.append(quantity)
+    #---------------------------
+    # Read the index information and the static data
+    #---------------------------
+    if smooth:
+        g_volumes = num.zeros((number_of_global_triangles,3),num.int)
+    else:
+        g_volumes = num.arange(number_of_global_points).reshape(-1,3)
 
-            # Static Quantities are stored as a 1D array
-            for quantity in static_quantities:
-                out_s_quantities[quantity] = num.zeros((3*number_of_global_triangles,),num.float32)
+    g_points = num.zeros((number_of_global_points,2),num.float32)
 
-            #=======================================
-            # Deal with the centroid based variables
-            #=======================================
-            quantities = set(['elevation_c', 'friction_c', 'stage_c', 'xmomentum_c',
-                              'ymomentum_c', 'xvelocity_c', 'yvelocity_c', 'height_c'])
-            variables = set(fid.variables.keys())
+    out_s_quantities = {}
+    for quantity in static_quantities:
+        out_s_quantities[quantity] = num.zeros((number_of_global_points,),num.float32)
 
-            quantities = list(quantities & variables)
-            
-            static_c_quantities = []
-            dynamic_c_quantities = []
-
-            for quantity in quantities:
-                # Test if quantity is static
-                if n_steps == fid.variables[quantity].shape[0]:
-                    dynamic_c_quantities.append(quantity)
-                else:
-                    static_c_quantities.append(quantity)
-                
-            for quantity in static_c_quantities:
-                out_s_c_quantities[quantity] = num.zeros((number_of_global_triangles,),num.float32)
-
-            description = 'merged:' + getattr(fid, 'description')
-            first_file = False
+    out_s_c_quantities = {}
+    for quantity in static_c_quantities:
+        out_s_c_quantities[quantity] = num.zeros((number_of_global_triangles,),num.float32)
 
+    indices = []
+    for filename in swwfiles:
+        if verbose:
+            print 'Reading file ', filename, ':'
 
-        # Read in from files and add to global arrays
+        fid = NetCDFFile(filename, netcdf_mode_r)
 
         tri_l2g  = fid.variables['tri_l2g'][:]
         node_l2g = fid.variables['node_l2g'][:]
         tri_full_flag = fid.variables['tri_full_flag'][:]
 
-        f_ids = num.argwhere(tri_full_flag==1).reshape(-1,)
+        # Just pick out the full triangles, and the vertices of the
+        # full triangles (some ghost node values are stored)
+        f_ids = num.flatnonzero(tri_full_flag == 1)
         f_gids = tri_l2g[f_ids]
 
-        g_vids = (3*f_gids.reshape(-1,1) + num.array([0,1,2])).reshape(-1,)
-        l_vids = (3*f_ids.reshape(-1,1) + num.array([0,1,2])).reshape(-1,)
+        if smooth:
+            volumes = num.array(fid.variables['volumes'][:],dtype=num.int)
+            f_volumes = volumes[f_ids]
+            g_volumes[f_gids] = node_l2g[f_volumes]
 
+            l_vids = num.unique(f_volumes)
+            g_vids = node_l2g[l_vids]
+        else:
+            offsets = num.array([0,1,2])
+            l_vids = (3*f_ids.reshape(-1,1) + offsets).reshape(-1,)
+            g_vids = (3*f_gids.reshape(-1,1) + offsets).reshape(-1,)
 
-        l_x = num.array(fid.variables['x'][:],dtype=num.float32)
-        l_y = num.array(fid.variables['y'][:],dtype=num.float32)
-
-        
-        g_x[g_vids] = l_x[l_vids]
-        g_y[g_vids] = l_y[l_vids]
-
-        g_points[g_vids,0] = g_x[g_vids]
-        g_points[g_vids,1] = g_y[g_vids]
-
+        g_points[g_vids,0] = num.array(fid.variables['x'][:],dtype=num.float32)[l_vids]
+        g_points[g_vids,1] = num.array(fid.variables['y'][:],dtype=num.float32)[l_vids]
 
-        ## Read in static quantities
         for quantity in static_quantities:
-            q = fid.variables[quantity]
             out_s_quantities[quantity][g_vids] = \
-                         num.array(q).astype(num.float32)[l_vids]
-                         #num.array(q,dtype=num.float32)[l_vids]
-
+                         num.array(fid.variables[quantity][:],dtype=num.float32)[l_vids]
 
-        # Read in static c quantities
         for quantity in static_c_quantities:
-            q = fid.variables[quantity]
             out_s_c_quantities[quantity][f_gids] = \
-                         num.array(q).astype(num.float32)[f_ids]
-                         #num.array(q,dtype=num.float32)[f_ids]
+                         num.array(fid.variables[quantity][:],dtype=num.float32)[f_ids]
+
+        indices.append((l_vids, g_vids, f_ids, f_gids))
 
-        
         fid.close()
 
     #---------------------------
-    # Write out the SWW file
+    # Write out the SWW file header and static data
     #---------------------------
-
     if verbose:
             print 'Writing file ', output, ':'
 
@@ -709,7 +397,7 @@ def _sww_merge_parallel_non_smooth(swwfiles, output,  verbose=False, delete_old=
     sww = Write_sww(static_quantities, dynamic_quantities, static_c_quantities, dynamic_c_quantities)
     sww.store_header(fido, starttime,
                              number_of_global_triangles,
-                             number_of_global_triangles*3,
+                             number_of_global_points,
                              description=description,
                              sww_precision=netcdf_float32)
 
@@ -730,60 +418,68 @@ def _sww_merge_parallel_non_smooth(swwfiles, output,  verbose=False, delete_old=
 
     sww.store_static_quantities(fido, verbose=verbose, **out_s_quantities)
     sww.store_static_quantities_centroid(fido, verbose=verbose, **out_s_c_quantities)
-    
-    # Write out all the dynamic quantities for each timestep
+
+    del g_points, g_volumes, out_s_quantities, out_s_c_quantities
 
     for i in range(n_steps):
         fido.variables['time'][i] = times[i]
 
+    #---------------------------
+    # Merge the dynamic quantities a block of timesteps at a time
+    #---------------------------
+    if frames_per_block is None:
+        frames_per_block = max(1, merge_block_values/max(1, number_of_global_points))
+
+    tasks = []
     for q in (dynamic_quantities + dynamic_c_quantities):
+        if q in dynamic_quantities:
+            n = number_of_global_points
+        else:
+            n = number_of_global_triangles
 
-        if verbose:
+        for i0 in range(0, n_steps, frames_per_block):
+            tasks.append((q, q in dynamic_quantities, n, i0,
+                          min(i0 + frames_per_block, n_steps)))
+
+    if processes > 1:
+        from multiprocessing import Pool
+
+        pool = Pool(processes, initializer=_init_merge_frames,
+                    initargs=(swwfiles, indices))
+        blocks = pool.imap(_merge_frames, tasks)
+    else:
+        pool = None
+        _init_merge_frames(swwfiles, indices)
+        blocks = (_merge_frames(task) for task in tasks)
+
+    # izip, so that only one block at a time is held here
+    from itertools import izip
+
+    q_ranges = {}
+    for (q, vertex_based, n, i0, i1), q_values in izip(tasks, blocks):
+        if verbose and i0 == 0:
             print '  Writing quantity: ',q
-                    
-        # Initialise q_values with zeros
-        if q in dynamic_quantities:
-            q_values = num.zeros((n_steps, 3*number_of_global_triangles), num.float32)
-        elif q in dynamic_c_quantities:
-            q_values = num.zeros((n_steps, number_of_global_triangles), num.float32)
 
+        fido.variables[q][i0:i1] = q_values
 
-        # Read the quantities one at a time, to reduce memory usage
-        for filename in swwfiles:
-            fid = NetCDFFile(filename, netcdf_mode_r)
-
-            # Index information
-            tri_l2g  = fid.variables['tri_l2g'][:]
-            node_l2g = fid.variables['node_l2g'][:]
-            tri_full_flag = fid.variables['tri_full_flag'][:]
-            f_ids = num.argwhere(tri_full_flag==1).reshape(-1,)
-            f_gids = tri_l2g[f_ids]
-            g_vids = (3*f_gids.reshape(-1,1) + num.array([0,1,2])).reshape(-1,)
-            l_vids = (3*f_ids.reshape(-1,1) + num.array([0,1,2])).reshape(-1,)
-            for i in range(n_steps):
-                # Different indices for vertex and centroid quantities
-                if q in dynamic_quantities:
-                    q_values[i][g_vids] = \
-                    num.array(fid.variables[q][i], dtype=num.float32)[l_vids]
-                elif q in dynamic_c_quantities:
-                    q_values[i][f_gids] = \
-                    num.array(fid.variables[q][i], dtype=num.float32)[f_ids]
-
-            fid.close()
-
-        # Write to the file
-        for i in range(n_steps):
-            fido.variables[q][i] = q_values[i]
+        if vertex_based and q_values.size > 0:
+            q_min, q_max = q_ranges.get(q, (num.inf, -num.inf))
+            q_ranges[q] = (min(q_min, num.min(q_values)),
+                           max(q_max, num.max(q_values)))
 
-        if q in dynamic_quantities:
-            # This updates the _range values
-            q_range = fido.variables[q + Write_sww.RANGE][:]
-            q_values_min = num.min(q_values)
-            if q_values_min < q_range[0]:
-                fido.variables[q + Write_sww.RANGE][0] = q_values_min
-            q_values_max = num.max(q_values)
-            if q_values_max > q_range[1]:
-                fido.variables[q + Write_sww.RANGE][1] = q_values_max
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    _init_merge_frames(None, None)
+
+    # This updates the _range values
+    for q, (q_values_min, q_values_max) in q_ranges.items():
+        q_range = fido.variables[q + Write_sww.RANGE][:]
+        if q_values_min < q_range[0]:
+            fido.variables[q + Write_sww.RANGE][0] = q_values_min
+        if q_values_max > q_range[1]:
+            fido.variables[q + Write_sww.RANGE][1] = q_values_max
 
     fido.close()
 
@@ -796,6 +492,41 @@ def _sww_merge_parallel_non_smooth(swwfiles, output,  verbose=False, delete_old=
             os.remove(filename)
 
 
+# Files and indices used by _merge_frames, set by _init_merge_frames
+# in each worker process
+_merge_swwfiles = None
+_merge_indices = None
+
+
+def _init_merge_frames(swwfiles, indices):
+
+    global _merge_swwfiles, _merge_indices
+
+    _merge_swwfiles = swwfiles
+    _merge_indices = indices
+
+
+def _merge_frames(task):
+    """Global values of quantity q for the timesteps i0 to i1, with n
+    global vertex (or centroid) values
+    """
+
+    q, vertex_based, n, i0, i1 = task
+
+    q_values = num.zeros((i1-i0, n), num.float32)
+
+    for filename, (l_vids, g_vids, f_ids, f_gids) in \
+            zip(_merge_swwfiles, _merge_indices):
+        fid = NetCDFFile(filename, netcdf_mode_r)
+        values = num.array(fid.variables[q][i0:i1], dtype=num.float32)
+        fid.close()
+
+        if vertex_based:
+            q_values[:, g_vids] = values[:, l_vids]
+        else:
+            q_values[:, f_gids] = values[:, f_ids]
+
+    return q_values
 
 
 
@@ -815,6 +546,10 @@ if __name__ == "__main__":
                    help='verbosity')
     parser.add_argument('-delete_old', nargs='?', type=bool, const=True, default=False,
                    help='Flag to delete the input files')
+    parser.add_argument('-processes', type=int, default = 1,
+                   help='number of processes merging the quantities')
+    parser.add_argument('-frames', type=int, default = None,
+                   help='number of timesteps merged at a time')
     args = parser.parse_args()
 
     np = args.np
@@ -824,7 +559,8 @@ if __name__ == "__main__":
 
 
     try:
-        sww_merge_parallel(domain_global_name, np, verbose, delete_old)
+        sww_merge_parallel(domain_global_name, np, verbose, delete_old,
+                           args.processes, args.frames)
     except:
         msg = 'ERROR: When merging sww files %s '% domain_global_name
         print msg
@@ -76,74 +76,78 @@ def wave(t):
     return sin(t/200) 
 
 #------------------------------------------------------------------------------ 
-# Use a try statement to read in previous checkpoint file and if not possible 
-# just go ahead as normal and produce domain as usual.
+# Produce the domain as usual. If a previous checkpoint file is available, 
+# the state of the domain is then read in from it.
 #
-# Though in the part of the code where you create the domain as normal, 
-# remember to turn on checkpointing via 
+# Remember to turn on checkpointing via 
 # domain.set_checkpointing(checkpoint_time = 5) (see code below) 
+#
+# Normal Setup of Domain on processor 0
+#------------------------------------------------------------------------------ 
+if myid == 0:
+    domain = create_domain_from_file(mesh_filename)
+    domain.set_quantity('stage', Set_Stage(x0, x1, 1.0))
+
+    domain.set_name(domain_name)
+    domain.set_store(True)
+
+    domain.set_store_vertices_smoothly(False)
+else:
+    domain = None
+
+#--------------------------------------------------------------------------
+# Distribute sequential domain on processor 0 to other processors
+#--------------------------------------------------------------------------
+
+if myid == 0 and verbose: print 'DISTRIBUTING DOMAIN'
+domain = distribute(domain, verbose=verbose)
+
+#--------------------------------------------------------------------------
+# On all processors, setup evolve parameters for domains on all processors
+# (all called "domain"
+#--------------------------------------------------------------------------
+
+domain.set_flow_algorithm('DE0')
+domain.set_store_centroids()
+
+domain.set_quantities_to_be_stored({'elevation':1,
+                                    'friction':1,
+                                    'stage':2,
+                                    'xmomentum':2,
+                                    'ymomentum':2})
+                                 
+#------------------------------------------------------------------------------
+# Setup boundary conditions
+# This must currently happen *after* domain has been distributed
+#------------------------------------------------------------------------------
+Br = Reflective_boundary(domain)      # Solid reflective wall
+
+Bts = Transmissive_n_momentum_zero_t_momentum_set_stage_boundary(domain, wave)
+
+domain.set_boundary({'outflow' :Br, 'inflow' :Br, 'inner' :Br, 
+                     'exterior' :Br, 'open' :Bts})
+
+
+#-----------------------------------------------------------------------------
+# Turn on checkpointing every 5 sec (just for testing, more reasonable to 
+# set to 15 minutes = 15*60 sec
+#-----------------------------------------------------------------------------
+if useCheckpointing:
+    domain.set_checkpointing(checkpoint_time = 5)
+
+
+#------------------------------------------------------------------------------ 
+# Use a try statement to read in the state from a previous checkpoint file, 
+# and if not possible just go ahead from the initial state
 #------------------------------------------------------------------------------ 
 try:
-        
     from anuga import load_checkpoint_file
     
     domain = load_checkpoint_file(domain_name = domain_name, 
-                                  checkpoint_dir = checkpoint_dir)
-
+                                  checkpoint_dir = checkpoint_dir,
+                                  domain = domain)
 except:
-    #--------------------------------------------------------------------------
-    # Normal Setup of Domain on processor 0
-    #--------------------------------------------------------------------------
-    if myid == 0:
-        domain = create_domain_from_file(mesh_filename)
-        domain.set_quantity('stage', Set_Stage(x0, x1, 1.0))
-
-        domain.set_name(domain_name)
-        domain.set_store(True)
-
-        domain.set_store_vertices_smoothly(False)
-    else:
-        domain = None
-    
-    #--------------------------------------------------------------------------
-    # Distribute sequential domain on processor 0 to other processors
-    #--------------------------------------------------------------------------
-    
-    if myid == 0 and verbose: print 'DISTRIBUTING DOMAIN'
-    domain = distribute(domain, verbose=verbose)
-    
-    #--------------------------------------------------------------------------
-    # On all processors, setup evolve parameters for domains on all processors
-    # (all called "domain"
-    #--------------------------------------------------------------------------
-    
-    domain.set_flow_algorithm('DE0')
-    domain.set_store_centroids()
-    
-    domain.set_quantities_to_be_stored({'elevation':1,
-                                        'friction':1,
-                                        'stage':2,
-                                        'xmomentum':2,
-                                        'ymomentum':2})
-                                     
-    #------------------------------------------------------------------------------
-    # Setup boundary conditions
-    # This must currently happen *after* domain has been distributed
-    #------------------------------------------------------------------------------
-    Br = Reflective_boundary(domain)      # Solid reflective wall
-    
-    Bts = Transmissive_n_momentum_zero_t_momentum_set_stage_boundary(domain, wave)
-    
-    domain.set_boundary({'outflow' :Br, 'inflow' :Br, 'inner' :Br, 
-                         'exterior' :Br, 'open' :Bts})
-    
-    
-    #-----------------------------------------------------------------------------
-    # Turn on checkpointing every 5 sec (just for testing, more reasonable to 
-    # set to 15 minutes = 15*60 sec
-    #-----------------------------------------------------------------------------
-    if useCheckpointing:
-        domain.set_checkpointing(checkpoint_time = 5)
+    pass
 
 
 
@@ -48,21 +48,22 @@ class Simulation(object):
         self.setup_rainfall = setup_rainfall
         self.setup_structures = setup_structures
         
+        self.initialize_simulation()
+
         if self.checkpoint:
-            # try to read in from checkpoint file
+            # try to read in the state from checkpoint file
             from anuga import load_checkpoint_file
             try:
                 if myid == 0 and self.verbose:
                     print 'TRYING TO OPEN CHECKPOINT FILES'
-                self.domain = load_checkpoint_file(domain_name = self.outname, checkpoint_dir = self.checkpoint_dir)
+                self.domain = load_checkpoint_file(domain_name = self.outname, checkpoint_dir = self.checkpoint_dir,
+                                                   domain = self.domain)
                 if myid == 0 and self.verbose:
                     print 'OPENNED CHECKPOINT FILE at time = {}'.format(self.domain.get_time())
             except:
-                self.initialize_simulation()
+                pass
             
             self.domain.set_checkpointing(checkpoint_time = self.checkpoint_time)
-        else:
-            self.initialize_simulation()
          
          
     def initialize_simulation(self):